@@ -37,6 +37,8 @@ import h5py
 from operator import itemgetter
 import re
 import posixpath
+import threading
+from collections import OrderedDict
 phynx = h5py
 
 if sys.version > '2.9':
@@ -46,6 +48,8 @@ from . import DataObject
 
 SOURCE_TYPE = "HDF5"
 DEBUG = 0
+# maximum number of file handles kept open by the file pool
+MAX_OPEN_FILES = 32
 
 #sorting method
 def h5py_sorting(object_list):
@@ -141,8 +145,221 @@ def get_family_pattern(filelist):
     return rootname
 
 
+class HDF5FilePool(object):
+    """
+    Bounded pool of read-only HDF5 file handles with a cache of their
+    top level entries.
+
+    A file is reopened only when its modification time or its size have
+    changed since it was opened. The sorting information of the entries
+    is kept across reopenings, so only the entries appended to a growing
+    file have to be read again.
+
+    The handles are shared and reference counted. Each getFile call has
+    to be paired with a releaseFile call, and the handle is closed on the
+    last release. A handle replaced by a newer one, or dropped because the
+    pool is full, is kept open until then for the sources still using it.
+    """
+    def __init__(self, maxfiles=None):
+        if maxfiles is None:
+            maxfiles = MAX_OPEN_FILES
+        self._maxFiles = max(1, maxfiles)
+        # the poller threads of the sources may access the pool
+        self._lock = threading.RLock()
+        self._itemDict = OrderedDict()
+        # handles not in the dictionnary anymore but still in use
+        self._retiredList = []
+        self._sortingDict = {}
+
+    def _getKey(self, name):
+        return os.path.abspath(name)
+
+    def getSignature(self, name):
+        """
+        Returns the (modification time, size) of the file
+        """
+        stat = os.stat(name)
+        return stat.st_mtime, stat.st_size
+
+    def getFile(self, name):
+        """
+        Returns an open read-only h5py.File instance for the given file name
+        reopening the file if it has been modified since last access.
+        The instance has to be given back calling releaseFile.
+        """
+        key = self._getKey(name)
+        signature = self.getSignature(name)
+        with self._lock:
+            item = self._itemDict.pop(key, None)
+            if (item is not None) and (item['signature'] != signature):
+                if DEBUG:
+                    print("Reopening modified file %s" % name)
+                self._retireItem(item)
+                item = None
+            if item is None:
+                item = {'file': phynx.File(name, 'r'),
+                        'signature': signature,
+                        'users': 0,
+                        'names': None,
+                        'index': None,
+                        'sorted': None}
+                while len(self._itemDict) >= self._maxFiles:
+                    # the least recently used one
+                    self._retireItem(self._itemDict.popitem(last=False)[1])
+            item['users'] += 1
+            self._itemDict[key] = item
+            return item['file']
+
+    def _retireItem(self, item):
+        # the handle is closed on its last release
+        if item['users'] > 0:
+            self._retiredList.append(item)
+        else:
+            self._closeItem(item)
+
+    def _closeItem(self, item):
+        try:
+            item['file'].close()
+        except:
+            pass
+
+    def _getItem(self, h5file):
+        # the pool item of an h5py.File instance (or a proxy to it) if any
+        try:
+            key = self._getKey(h5file.filename)
+            item = self._itemDict.get(key, None)
+            if (item is not None) and (item['file'].id == h5file.id):
+                return item
+            for item in self._retiredList:
+                if item['file'].id == h5file.id:
+                    return item
+        except:
+            pass
+        return None
+
+    def isPooled(self, h5file):
+        """
+        Returns True if the h5py.File instance is managed by the pool
+        """
+        with self._lock:
+            return self._getItem(h5file) is not None
+
+    def releaseFile(self, h5file):
+        """
+        Give back an h5py.File instance obtained calling getFile
+        """
+        with self._lock:
+            item = self._getItem(h5file)
+            if item is None:
+                return
+            item['users'] = max(0, item['users'] - 1)
+            if item['users'] > 0:
+                return
+            key = self._getKey(h5file.filename)
+            if self._itemDict.get(key, None) is item:
+                del self._itemDict[key]
+            else:
+                for i, retired in enumerate(self._retiredList):
+                    if retired is item:
+                        del self._retiredList[i]
+                        break
+            self._closeItem(item)
+
+    def clear(self):
+        """
+        Drop all the file handles and cached information
+        """
+        with self._lock:
+            self._itemDict.clear()
+            del self._retiredList[:]
+            self._sortingDict.clear()
+
+    def getEntryNames(self, h5file):
+        """
+        Returns the list of top level items of the h5py.File instance in
+        file order.
+        """
+        with self._lock:
+            item = self._getItem(h5file)
+            if item is None:
+                return list(h5file["/"].keys())
+            if item['names'] is None:
+                item['names'] = list(item['file']["/"].keys())
+            return item['names']
+
+    def getEntryIndex(self, h5file, entry):
+        """
+        Returns the index of the entry in the list of top level items
+        """
+        with self._lock:
+            item = self._getItem(h5file)
+            if item is None:
+                return list(h5file["/"].keys()).index(entry)
+            if item['index'] is None:
+                item['index'] = dict([(name, i) for i, name in \
+                                   enumerate(self.getEntryNames(h5file))])
+            if entry not in item['index']:
+                raise ValueError("Entry %s not in file" % entry)
+            return item['index'][entry]
+
+    def getSortedEntryNames(self, h5file):
+        """
+        Returns the list of top level items sorted by start time, end
+        time or by the numbers in their names as done by h5py_sorting.
+        Returns None if the h5py.File instance is not managed by the pool.
+        """
+        with self._lock:
+            item = self._getItem(h5file)
+            if item is None:
+                return None
+            if item['sorted'] is None:
+                names = self.getEntryNames(h5file)
+                item['sorted'] = self.__sortEntryNames(item['file'], names)
+            return item['sorted']
+
+    def __sortEntryNames(self, h5file, names):
+        if len(names) < 2:
+            return list(names)
+        sortingKey = 'name'
+        first = h5file[names[0]]
+        if isinstance(first, h5py.Group):
+            for key in ['start_time', 'end_time']:
+                if key in first:
+                    sortingKey = key
+                    break
+        fileKey = self._getKey(h5file.filename)
+        sorting = self._sortingDict.get(fileKey, None)
+        if (sorting is None) or (sorting['key'] != sortingKey):
+            sorting = {'key': sortingKey, 'values': {}}
+            self._sortingDict[fileKey] = sorting
+        values = sorting['values']
+        try:
+            # only the entries not seen before are read
+            for name in names:
+                if name not in values:
+                    if sortingKey == 'name':
+                        values[name] = _get_number_list("/" + name)
+                    else:
+                        values[name] = h5file[name][sortingKey][()]
+            return sorted(names, key=values.__getitem__)
+        except:
+            print("WARNING: Default ordering")
+            print("Probably all entries do not have the key %s" % sortingKey)
+            return list(names)
+
+_FILE_POOL = None
+
+def getFilePool():
+    """
+    Returns the file pool shared by all the NexusDataSource instances
+    """
+    global _FILE_POOL
+    if _FILE_POOL is None:
+        _FILE_POOL = HDF5FilePool()
+    return _FILE_POOL
+
 class NexusDataSource(object):
-    def __init__(self,nameInput):
+    def __init__(self, nameInput, pool=None):
         if type(nameInput) == type([]):
             nameList = nameInput
         else:
@@ -159,13 +376,32 @@ class NexusDataSource(object):
             self.sourceName.append(name)
         self.sourceType = SOURCE_TYPE
         self.__sourceNameList = self.sourceName
+        if pool is None:
+            pool = getFilePool()
+        self._pool = pool
         self._sourceObjectList=[]
         self.refresh()
         
     def refresh(self):
-        for instance in self._sourceObjectList:
-            instance.close()
+        """
+        Reopen the files modified since the last access. Unmodified files
+        keep their handles and their cached entries.
+        """
+        # the pooled handles are given back once the new ones are obtained
+        oldList = self._sourceObjectList
+        for instance in oldList:
+            if not self._pool.isPooled(instance):
+                instance.close()
         self._sourceObjectList=[]
+        try:
+            self.__openSources()
+        finally:
+            for instance in oldList:
+                if self._pool.isPooled(instance):
+                    self._pool.releaseFile(instance)
+        self.__lastKeyInfo = {}
+
+    def __openSources(self):
         FAMILY = False
         for name in self.__sourceNameList:
             if isinstance(name, phynx.File):
@@ -178,7 +414,7 @@ class NexusDataSource(object):
                 else:
                     raise IOError("File %s does not exists" % name)
             try:
-                phynxInstance = phynx.File(name, 'r')
+                phynxInstance = self._pool.getFile(name)
             except IOError:
                 if 'FAMILY DRIVER' in sys.exc_info()[1].args[0].upper():
                     FAMILY = True
@@ -186,7 +422,7 @@ class NexusDataSource(object):
                     raise
             except TypeError:
                 try:
-                    phynxInstance = phynx.File(name, 'r')
+                    phynxInstance = self._pool.getFile(name)
                 except IOError:
                     if 'FAMILY DRIVER' in sys.exc_info()[1].args[0].upper():
                         FAMILY = True
@@ -197,7 +433,7 @@ class NexusDataSource(object):
                 raise IOError(txt)
             elif FAMILY:
                 break
-            phynxInstance._sourceName = name
+            # the pooled instance may be shared, it is not tagged
             self._sourceObjectList.append(phynxInstance)
         if FAMILY:
             pattern = get_family_pattern(self.__sourceNameList)
@@ -210,7 +446,36 @@ class NexusDataSource(object):
             self.__sourceNameList = [pattern]
             self._sourceObjectList=[phynxInstance]
             phynxInstance._sourceName = pattern
-        self.__lastKeyInfo = {}
+
+    def close(self):
+        """
+        Release the files of this source.
+        """
+        for instance in self._sourceObjectList:
+            if self._pool.isPooled(instance):
+                self._pool.releaseFile(instance)
+            else:
+                instance.close()
+        self._sourceObjectList = []
+
+    def __del__(self):
+        # give back the pooled files of a source not explicitly closed
+        try:
+            for instance in self._sourceObjectList:
+                if self._pool.isPooled(instance):
+                    self._pool.releaseFile(instance)
+        except:
+            pass
+
+    def __getSourceIndex(self, filename):
+        # a pooled file may have been opened under another name
+        if filename in self.__sourceNameList:
+            return self.__sourceNameList.index(filename)
+        for i, name in enumerate(self.__sourceNameList):
+            if isinstance(name, basestring) and \
+               os.path.abspath(name) == os.path.abspath(filename):
+                return i
+        raise ValueError("%s is not a source of this instance" % filename)
 
     def getSourceInfo(self):
         """
@@ -228,7 +493,7 @@ class NexusDataSource(object):
         i = 0
         for sourceObject in self._sourceObjectList:
             i+=1
-            nEntries = len(sourceObject["/"].keys())
+            nEntries = len(self._pool.getEntryNames(sourceObject))
             for n in range(nEntries):
                 SourceInfo["KeyList"].append("%d.%d" % (i,n+1))
         SourceInfo["Size"]=len(SourceInfo["KeyList"])
@@ -274,18 +539,19 @@ class NexusDataSource(object):
             if 'sourcename' in selection:
                 filename  = selection['sourcename']
                 entry     = selection['entry']
-                fileIndex  = self.__sourceNameList.index(filename)
+                fileIndex  = self.__getSourceIndex(filename)
                 phynxFile =  self._sourceObjectList[fileIndex]
                 if entry == "/":
                     entryIndex = 0
                 else:
-                    entryIndex = list(phynxFile["/"].keys()).index(entry[1:])
+                    entryIndex = self._pool.getEntryIndex(phynxFile,
+                                                          entry[1:])
             else:
                 key_split = key.split(".")
                 fileIndex = int(key_split[0])-1
                 phynxFile =  self._sourceObjectList[fileIndex]
                 entryIndex = int(key_split[1])-1
-                entry = phynxFile["/"].keys()[entryIndex] 
+                entry = self._pool.getEntryNames(phynxFile)[entryIndex]
             actual_key = "%d.%d" % (fileIndex+1, entryIndex+1)
             if actual_key != key:
                 if entry != "/":
@@ -300,6 +566,8 @@ class NexusDataSource(object):
             if actual_key not in sourcekeys:
                 raise KeyError("Key %s not in source keys" % actual_key)
             raise NotImplemented("Direct NXdata plot not implemented yet")        
+        if actual_key not in self.__lastKeyInfo:
+            self.__lastKeyInfo[actual_key] = self.__getSignature(fileIndex)
         #create data object
         output = DataObject.DataObject()
         output.info = self.__getKeyInfo(actual_key)
@@ -417,13 +685,24 @@ class NexusDataSource(object):
         #sourceName is redundant?
         index, entry = key.split(".")
         index = int(index)-1
-        lastmodified = os.path.getmtime(self.__sourceNameList[index])
+        lastmodified = self.__getSignature(index)
+        if key not in self.__lastKeyInfo:
+            # nothing read yet
+            self.__lastKeyInfo[key] = lastmodified
+            return False
         if lastmodified != self.__lastKeyInfo[key]:
             self.__lastKeyInfo[key] = lastmodified
             return True
         else:
             return False
 
+    def __getSignature(self, index):
+        # segmented files do not exist under the name of their pattern
+        try:
+            return self._pool.getSignature(self.__sourceNameList[index])
+        except OSError:
+            return None
+
 source_types = { SOURCE_TYPE: NexusDataSource}
 
 def DataSource(name="", source_type=SOURCE_TYPE):
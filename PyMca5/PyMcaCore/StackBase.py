@@ -35,6 +35,8 @@ Base class to handle stacks.
 
 """
 from . import DataObject
+from . import StackROIImages
+from . import StackMaskedSum
 import numpy
 import time
 import os
@@ -65,6 +67,7 @@ class StackBase(object):
         self._stack.x = None
         self._stackImageData = None
         self._selectionMask = None
+        self._maskedSum = None
         self._finiteData = True
         self._ROIDict = {'name': "ICR",
                          'type': "CHANNEL",
@@ -316,6 +319,7 @@ class StackBase(object):
 
         #store the original spectrum
         self._mcaData0 = dataObject
+        self._maskedSum = None
 
         #add the original image
         self.showOriginalImage()
@@ -350,12 +354,12 @@ class StackBase(object):
     def handleNonFiniteData(self):
         pass
 
-    def updateROIImages(self, ddict=None):
-        if ddict is None:
-            updateROIDict = False
-            ddict = self._ROIDict
-        else:
-            updateROIDict = True
+    def _getROIIndices(self, ddict):
+        """
+        Return the first, last (not included) and middle channel indices
+        and the x axis associated to the ROI described by ddict or None
+        if the ROI does not contain any channel.
+        """
         xw = ddict['calibration'][0] + \
              ddict['calibration'][1] * self._mcaData0.x[0] + \
              ddict['calibration'][2] * (self._mcaData0.x[0] ** 2)
@@ -374,15 +378,15 @@ class StackBase(object):
                     i1 = min(i1)
                 else:
                     if DEBUG:
-                        print("updateROIImages: nothing to be made")
-                    return
+                        print("_getROIIndices: nothing to be made")
+                    return None
                 i2 = numpy.nonzero(xw <= ddict['to'])[0]
                 if len(i2):
                     i2 = max(i2) + 1
                 else:
                     if DEBUG:
-                        print("updateROIImages: nothing to be made")
-                    return
+                        print("_getROIIndices: nothing to be made")
+                    return None
                 pos = 0.5 * (ddict['from'] + ddict['to'])
                 imiddle = max(numpy.nonzero(xw <= pos)[0])
             else:
@@ -391,15 +395,15 @@ class StackBase(object):
                     i2 = max(i2)
                 else:
                     if DEBUG:
-                        print("updateROIImages: nothing to be made")
-                    return
+                        print("_getROIIndices: nothing to be made")
+                    return None
                 i1 = numpy.nonzero(xw <= ddict['to'])[0]
                 if len(i1):
                     i1 = min(i1) + 1
                 else:
                     if DEBUG:
-                        print("updateROIImages: nothing to be made")
-                    return
+                        print("_getROIIndices: nothing to be made")
+                    return None
                 pos = 0.5 * (ddict['from'] + ddict['to'])
                 imiddle = min(numpy.nonzero(xw <= pos)[0])
         else:
@@ -420,6 +424,19 @@ class StackBase(object):
             imiddle = max(numpy.nonzero(self._mcaData0.x[0] <= pos)[0])
             xw = self._mcaData0.x[0]
 
+        return i1, i2, imiddle, xw
+
+    def updateROIImages(self, ddict=None):
+        if ddict is None:
+            updateROIDict = False
+            ddict = self._ROIDict
+        else:
+            updateROIDict = True
+        indices = self._getROIIndices(ddict)
+        if indices is None:
+            return
+        i1, i2, imiddle, xw = indices
+
         self._ROIImageDict = self.calculateROIImages(i1, i2, imiddle, energy=xw)
         if updateROIDict:
             self._ROIDict.update(ddict)
@@ -534,160 +551,23 @@ class StackBase(object):
                 dataObject = self._mcaData0
             return dataObject
 
-        mcaData = numpy.zeros(self._mcaData0.y[0].shape, numpy.float)
-
-        n_nonselected = self._stackImageData.shape[0] *\
-                        self._stackImageData.shape[1] - npixels
-        if goodData:
-            if n_nonselected < npixels:
-                arrayMask = (actualSelectionMask == 0)
-            else:
-                arrayMask = (actualSelectionMask > 0)
-        else:
-                arrayMask = (actualSelectionMask > 0)
-
-        if DEBUG:
-            print("Reached MCA calculation")
-        cleanMask = numpy.nonzero(arrayMask)
         if DEBUG:
             print("self.fileIndex, self.mcaIndex = %d , %d" %\
                   (self.fileIndex, self.mcaIndex))
-        if DEBUG:
             t0 = time.time()
-        if len(cleanMask[0]) and len(cleanMask[1]):
-            if DEBUG:
-                print("USING MASK")
-            cleanMask = numpy.array(cleanMask).transpose()
-            if self.fileIndex == 2:
-                if self.mcaIndex == 0:
-                    if isinstance(self._stack.data, numpy.ndarray):
-                        if DEBUG:
-                            print("In memory case 0")
-                        for r, c in cleanMask:
-                            mcaData += self._stack.data[:, r, c]
-                    else:
-                        if DEBUG:
-                            print("Dynamic loading case 0")
-                        #no other choice than to read all images
-                        #for the time being, one by one
-                        rMin = cleanMask[0][0]
-                        rMax = cleanMask[-1][0]
-                        cMin = cleanMask[:, 1].min()
-                        cMax = cleanMask[:, 1].max()
-                        #rMin, cMin = cleanMask.min(axis=0)
-                        #rMax, cMax = cleanMask.max(axis=0)
-                        tmpMask = arrayMask[rMin:(rMax+1),cMin:(cMax+1)]
-                        tmpData = numpy.zeros((1, rMax-rMin+1,cMax-cMin+1))
-                        for i in range(self._stack.data.shape[0]):
-                            tmpData[0:1,:,:] = self._stack.data[i:i+1,rMin:(rMax+1),cMin:(cMax+1)]
-                            #multiplication is faster than selection
-                            mcaData[i] = (tmpData[0]*tmpMask).sum(dtype=numpy.float)
-                elif self.mcaIndex == 1:
-                    if isinstance(self._stack.data, numpy.ndarray):
-                        for r, c in cleanMask:
-                            mcaData += self._stack.data[r,:,c]
-                    else:
-                        raise IndexError("Dynamic loading case 1")
-                else:
-                    raise IndexError("Wrong combination of indices. Case 0")
-            elif self.fileIndex == 1:
-                if self.mcaIndex == 0:
-                    if isinstance(self._stack.data, numpy.ndarray):
-                        if DEBUG:
-                            print("In memory case 2")
-                        for r, c in cleanMask:
-                            mcaData += self._stack.data[:, r, c]
-                    else:
-                        if DEBUG:
-                            print("Dynamic loading case 2")
-                        #no other choice than to read all images
-                        #for the time being, one by one
-                        if 1:
-                            rMin = cleanMask[0][0]
-                            rMax = cleanMask[-1][0]
-                            cMin = cleanMask[:, 1].min()
-                            cMax = cleanMask[:, 1].max()
-                            #rMin, cMin = cleanMask.min(axis=0)
-                            #rMax, cMax = cleanMask.max(axis=0)
-                            tmpMask = arrayMask[rMin:(rMax + 1), cMin:(cMax + 1)]
-                            tmpData = numpy.zeros((1, rMax - rMin + 1, cMax - cMin + 1))
-                            for i in range(self._stack.data.shape[0]):
-                                tmpData[0:1, :, :] = self._stack.data[i:i + 1, rMin:(rMax + 1), cMin:(cMax + 1)]
-                                #multiplication is faster than selection
-                                mcaData[i] = (tmpData[0] * tmpMask).sum(dtype=numpy.float)
-                        if 0:
-                            tmpData = numpy.zeros((1, self._stack.data.shape[1], self._stack.data.shape[2]))
-                            for i in range(self._stack.data.shape[0]):
-                                tmpData[0:1, :, :] = self._stack.data[i:i + 1,:,:]
-                                #multiplication is faster than selection
-                                #tmpData[arrayMask].sum() in my machine
-                                mcaData[i] = (tmpData[0] * arrayMask).sum(dtype=numpy.float)
-                elif self.mcaIndex == 2:
-                    if isinstance(self._stack.data, numpy.ndarray):
-                        if DEBUG:
-                            print("In memory case 3")
-                        for r, c in cleanMask:
-                            mcaData += self._stack.data[r, c, :]
-                    else:
-                        if DEBUG:
-                            print("Dynamic loading case 3")
-                        #try to minimize access to the file
-                        row_list = []
-                        row_dict = {}
-                        for r, c in cleanMask:
-                            if r not in row_list:
-                                row_list.append(r)
-                                row_dict[r] = []
-                            row_dict[r].append(c)
-                        for r in row_list:
-                            tmpMcaData = self._stack.data[r:r + 1, row_dict[r], :]
-                            tmpMcaData.shape = -1, mcaData.shape[0]
-                            mcaData += numpy.sum(tmpMcaData, axis=0, dtype=numpy.float)
-                else:
-                    raise IndexError("Wrong combination of indices. Case 1")
-            elif self.fileIndex == 0:
-                if self.mcaIndex == 1:
-                    if isinstance(self._stack.data, numpy.ndarray):
-                        if DEBUG:
-                            print("In memory case 4")
-                        for r, c in cleanMask:
-                            mcaData += self._stack.data[r, :, c]
-                    else:
-                        raise IndexError("Dynamic loading case 4")
-                elif self.mcaIndex in [2, -1]:
-                    if isinstance(self._stack.data, numpy.ndarray):
-                        if DEBUG:
-                            print("In memory case 5")
-                        for r, c in cleanMask:
-                            mcaData += self._stack.data[r, c, :]
-                    else:
-                        if DEBUG:
-                            print("Dynamic loading case 5")
-                        #try to minimize access to the file
-                        row_list = []
-                        row_dict = {}
-                        for r, c in cleanMask:
-                            if r not in row_list:
-                                row_list.append(r)
-                                row_dict[r] = []
-                            row_dict[r].append(c)
-                        for r in row_list:
-                            tmpMcaData = self._stack.data[r:r + 1, row_dict[r], :]
-                            tmpMcaData.shape = -1, mcaData.shape[0]
-                            mcaData += tmpMcaData.sum(axis=0, dtype=numpy.float)
-                else:
-                    raise IndexError("Wrong combination of indices. Case 2")
-            else:
-                raise IndexError("File index undefined")
+        # only the spectra of the pixels changed since the previous
+        # selection are read
+        if (self._maskedSum is None) or \
+           (self._maskedSum.data is not self._stack.data):
+            self._maskedSum = StackMaskedSum.StackMaskedSum(self._stack.data,
+                                                    mcaindex=self.mcaIndex)
+        if goodData:
+            total = self._mcaData0.y[0]
         else:
-            if DEBUG:
-                print("NOT USING MASK !")
-
+            total = None
+        mcaData = self._maskedSum.getSum(actualSelectionMask > 0, total=total)
         if DEBUG:
             print("Mca sum elapsed = %f" % (time.time() - t0))
-        if goodData:
-            if n_nonselected < npixels:
-                mcaData = self._mcaData0.y[0] - mcaData
 
         if normalize:
             mcaData = mcaData / npixels
@@ -725,6 +605,24 @@ class StackBase(object):
             return imageDict
 
         isUsingSuppliedEnergyAxis = False
+        if not (self._tryNumpy and \
+                isinstance(self._stack.data, numpy.ndarray)):
+            # dynamically loaded stack, read it by blocks
+            if DEBUG:
+                t0 = time.time()
+            imageDict = StackROIImages.calculateROIImages(self._stack.data,
+                                                [(i1, i2, imiddle)],
+                                                mcaindex=self.mcaIndex)[0]
+            imageDict['Maximum'] = energy[imageDict['Maximum']]
+            imageDict['Minimum'] = energy[imageDict['Minimum']]
+            self.__ROIImageCalculationIsUsingSuppliedEnergyAxis = True
+            if DEBUG:
+                print("Dynamic ROI image calculation elapsed = %f" %\
+                      (time.time() - t0))
+            return imageDict
+
+        if DEBUG:
+            t0 = time.time()
         if self.fileIndex == 0:
             if self.mcaIndex == 1:
                 leftImage = self._stack.data[:, i1, :]
@@ -737,153 +635,49 @@ class StackBase(object):
                 minImage = energy[(numpy.argmin(dataImage, axis=1) + i1)]
                 isUsingSuppliedEnergyAxis = True
             else:
+                leftImage = self._stack.data[:, :, i1]
+                middleImage = self._stack.data[:, :, imiddle]
+                rightImage = self._stack.data[:, :, i2 - 1]
+                dataImage = self._stack.data[:, :, i1:i2]
+                background = 0.5 * (i2 - i1) * (leftImage + rightImage)
+                roiImage = numpy.sum(dataImage, axis=2, dtype=numpy.float)
+                maxImage = energy[numpy.argmax(dataImage, axis=2) + i1]
+                minImage = energy[numpy.argmin(dataImage, axis=2) + i1]
+                isUsingSuppliedEnergyAxis = True
                 if DEBUG:
-                    t0 = time.time()
-                if self._tryNumpy and\
-                   isinstance(self._stack.data, numpy.ndarray):
-                    leftImage = self._stack.data[:, :, i1]
-                    middleImage = self._stack.data[:, :, imiddle]
-                    rightImage = self._stack.data[:, :, i2 - 1]
-                    dataImage = self._stack.data[:, :, i1:i2]
-                    background = 0.5 * (i2 - i1) * (leftImage + rightImage)
-                    roiImage = numpy.sum(dataImage, axis=2, dtype=numpy.float)
-                    maxImage = energy[numpy.argmax(dataImage, axis=2) + i1]
-                    minImage = energy[numpy.argmin(dataImage, axis=2) + i1]
-                    isUsingSuppliedEnergyAxis = True
-                    if DEBUG:
-                        print("1 ROI image calculation elapsed = %f " %\
-                              (time.time() - t0))
-                else:
-                    shape = self._stack.data.shape
-                    roiImage = numpy.zeros(self._stackImageData.shape,
-                                           numpy.float)
-                    background = roiImage * 1
-                    leftImage = roiImage * 1
-                    middleImage = roiImage * 1
-                    rightImage = roiImage * 1
-                    maxImage = roiImage * 1
-                    minImage = roiImage * 1
-                    step = 1
-                    for i in range(shape[0]):
-                        tmpData = self._stack.data[i:i+step,:, i1:i2] * 1
-                        numpy.add(roiImage[i:i+step,:],
-                              numpy.sum(tmpData, axis=2,dtype=numpy.float),
-                              roiImage[i:i+step,:])
-                        numpy.add(minImage[i:i+step,:],
-                                  numpy.min(tmpData, axis=2),
-                                  minImage[i:i + step, :])
-                        numpy.add(maxImage[i:i + step, :],
-                                  numpy.max(tmpData, axis=2),
-                                  maxImage[i:i + step, :])
-                        leftImage[i:i + step, :] += tmpData[:, :, 0]
-                        middleImage[i:i + step, :] += tmpData[:, :, imiddle - i1]
-                        rightImage[i:i + step, :] += tmpData[:, :, -1]
-                    background = 0.5 * (i2 - i1) * (leftImage + rightImage)
-                    if DEBUG:
-                        print("2 Dynamic ROI image calculation elapsed = %f " %\
-                              (time.time() - t0))
+                    print("1 ROI image calculation elapsed = %f " %\
+                          (time.time() - t0))
         elif self.fileIndex == 1:
             if self.mcaIndex == 0:
+                leftImage = self._stack.data[i1, :, :]
+                middleImage= self._stack.data[imiddle, :, :]
+                rightImage = self._stack.data[i2 - 1, :, :]
+                dataImage = self._stack.data[i1:i2, :, :]
+                # this calculation is very slow but it is extremely useful
+                # for XANES studies
+                maxImage = energy[numpy.argmax(dataImage, axis=0) + i1]
+                minImage = energy[numpy.argmin(dataImage, axis=0) + i1]
+                isUsingSuppliedEnergyAxis = True
+                background = 0.5 * (i2 - i1) * (leftImage + rightImage)
+                roiImage = numpy.sum(dataImage, axis=0, dtype=numpy.float)
                 if DEBUG:
-                    t0 = time.time()
-                if isinstance(self._stack.data, numpy.ndarray) and\
-                   self._tryNumpy:
-                    leftImage = self._stack.data[i1, :, :]
-                    middleImage= self._stack.data[imiddle, :, :]
-                    rightImage = self._stack.data[i2 - 1, :, :]
-                    dataImage = self._stack.data[i1:i2, :, :]
-                    # this calculation is very slow but it is extremely useful
-                    # for XANES studies
-                    maxImage = energy[numpy.argmax(dataImage, axis=0) + i1]
-                    minImage = energy[numpy.argmin(dataImage, axis=0) + i1]
-                    isUsingSuppliedEnergyAxis = True
-                    background = 0.5 * (i2 - i1) * (leftImage + rightImage)
-                    roiImage = numpy.sum(dataImage, axis=0, dtype=numpy.float)
-                    if DEBUG:
-                        print("3 ROI image calculation elapsed = %f " %\
-                              (time.time() - t0))
-                else:
-                    shape = self._stack.data.shape
-                    roiImage = numpy.zeros(self._stackImageData.shape,
-                                           numpy.float)
-                    background = roiImage * 1
-                    leftImage = roiImage * 1
-                    middleImage = roiImage * 1
-                    rightImage = roiImage * 1
-                    maxImage = roiImage * 1
-                    minImage = roiImage * 1
-                    istep = 1
-                    for i in range(i1, i2):
-                        tmpData = self._stack.data[i:i + istep]
-                        tmpData.shape = roiImage.shape
-                        numpy.add(roiImage, tmpData, roiImage)
-                        if i == i1:
-                            minImage = tmpData * 1
-                            maxImage = tmpData * 1
-                        else:
-                            minImage = numpy.minimum(minImage, tmpData, minImage)
-                            maxImage = numpy.maximum(maxImage, tmpData, minImage)
-                        if (i == i1):
-                            leftImage = tmpData
-                        elif (i == imiddle):
-                            middleImage = tmpData
-                        elif i == (i2 - 1):
-                            rightImage = tmpData
-                    if i2 > i1:
-                        background = (leftImage + rightImage) * 0.5 * (i2 - i1)
-                    if DEBUG:
-                        print("4 Dynamic ROI elapsed = %f" %\
-                              (time.time() - t0))
+                    print("3 ROI image calculation elapsed = %f " %\
+                          (time.time() - t0))
             else:
+                leftImage = self._stack.data[:, :, i1]
+                middleImage = self._stack.data[:, :, imiddle]
+                rightImage = self._stack.data[:, :, i2 - 1]
+                dataImage = self._stack.data[:, :, i1:i2]
+                background = 0.5 * (i2 - i1) * (leftImage + rightImage)
+                roiImage = numpy.sum(dataImage, axis=2, dtype=numpy.float)
+                maxImage = energy[numpy.argmax(dataImage, axis=2) + i1]
+                minImage = energy[numpy.argmin(dataImage, axis=2) + i1]
+                isUsingSuppliedEnergyAxis = True
                 if DEBUG:
-                    t0 = time.time()
-                if self._tryNumpy and\
-                   isinstance(self._stack.data, numpy.ndarray):
-                    leftImage = self._stack.data[:, :, i1]
-                    middleImage = self._stack.data[:, :, imiddle]
-                    rightImage = self._stack.data[:, :, i2 - 1]
-                    dataImage = self._stack.data[:, :, i1:i2]
-                    background = 0.5 * (i2 - i1) * (leftImage + rightImage)
-                    roiImage = numpy.sum(dataImage, axis=2, dtype=numpy.float)
-                    maxImage = energy[numpy.argmax(dataImage, axis=2) + i1]
-                    minImage = energy[numpy.argmin(dataImage, axis=2) + i1]
-                    isUsingSuppliedEnergyAxis = True
-                    if DEBUG:
-                        print("5 ROI Image elapsed = %f" %\
-                              (time.time() - t0))
-                else:
-                    shape = self._stack.data.shape
-                    roiImage = numpy.zeros(self._stackImageData.shape,
-                                           numpy.float)
-                    background = roiImage * 1
-                    leftImage = roiImage * 1
-                    middleImage = roiImage * 1
-                    rightImage = roiImage * 1
-                    maxImage = roiImage * 1
-                    minImage = roiImage * 1
-                    step = 1
-                    for i in range(shape[0]):
-                        tmpData = self._stack.data[i:i+step,:, i1:i2] * 1
-                        numpy.add(roiImage[i:i+step,:],
-                              numpy.sum(tmpData, axis=2, dtype=numpy.float),
-                              roiImage[i:i+step,:])
-                        numpy.add(minImage[i:i+step,:],
-                                  numpy.min(tmpData, 2),
-                                  minImage[i:i+step,:])
-                        numpy.add(maxImage[i:i+step,:],
-                                  numpy.max(tmpData, 2),
-                                  maxImage[i:i+step,:])                            
-                        leftImage[i:i+step, :]   += tmpData[:, :, 0]
-                        middleImage[i:i+step, :] += tmpData[:, :, imiddle-i1]
-                        rightImage[i:i+step, :]  += tmpData[:, :,-1]
-                    background = 0.5*(i2-i1)*(leftImage+rightImage)
-                    if DEBUG:
-                        print("6 Dynamic ROI image calculation elapsed = %f" %\
-                                          (time.time() - t0))
+                    print("5 ROI Image elapsed = %f" %\
+                          (time.time() - t0))
         else:
             #self.fileIndex = 2
-            if DEBUG:
-                t0 = time.time()
             if self.mcaIndex == 0:
                 leftImage = self._stack.data[i1]
                 middleImage = self._stack.data[imiddle]
@@ -923,6 +717,59 @@ class StackBase(object):
             print("ROI images calculated")
         return imageDict
 
+    def calculateMultipleROIImages(self, roilist, sumonly=False):
+        """
+        Calculate the images of several ROIs in a single pass over the stack.
+
+        Each ROI is either a dictionary with the keys used by updateROIImages
+        ('name', 'type', 'from', 'to' and 'calibration') or a sequence with
+        the first and last (not included) channel indices.
+        It returns a list with the image dictionary of each ROI or None
+        if the ROI does not contain any channel. Only the 'ROI' image is
+        calculated if sumonly is True.
+        """
+        rois = []
+        energies = []
+        indices = []
+        for roi in roilist:
+            if hasattr(roi, "keys"):
+                roiIndices = self._getROIIndices(roi)
+                if roiIndices is None:
+                    i1 = i2 = 0
+                else:
+                    i1, i2, imiddle, energy = roiIndices
+            else:
+                i1 = min(roi[0], roi[1])
+                i2 = max(roi[0], roi[1])
+                imiddle = None
+                energy = self._mcaData0.x[0]
+            if i2 > i1:
+                indices.append(len(rois))
+                rois.append((i1, i2, imiddle))
+                energies.append(energy)
+            else:
+                indices.append(None)
+        if DEBUG:
+            t0 = time.time()
+        imageDictList = StackROIImages.calculateROIImages(self._stack.data,
+                                                          rois,
+                                                   mcaindex=self.mcaIndex,
+                                                   sumonly=sumonly)
+        if DEBUG:
+            print("%d ROI images calculation elapsed = %f" %\
+                  (len(rois), time.time() - t0))
+        if not sumonly:
+            for imageDict, energy in zip(imageDictList, energies):
+                imageDict['Maximum'] = energy[imageDict['Maximum']]
+                imageDict['Minimum'] = energy[imageDict['Minimum']]
+        output = []
+        for i in indices:
+            if i is None:
+                output.append(None)
+            else:
+                output.append(imageDictList[i])
+        return output
+
     def setSelectionMask(self, mask):
         if DEBUG:
             print("setSelectionMask called")
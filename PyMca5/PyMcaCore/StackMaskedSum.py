@@ -0,0 +1,194 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V.A. Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+"""
+Incremental calculation of the sum of the spectra of the selected pixels
+of a stack.
+
+The sum associated to the last selection mask is kept. When the mask is
+modified (i.e. by a brush stroke), only the spectra of the pixels added to
+or removed from the selection are read and the sum is updated accordingly.
+The sum is calculated from scratch when that is cheaper.
+"""
+import numpy
+from PyMca5.PyMcaCore import StackROIImages
+
+DEBUG = 0
+
+
+class StackMaskedSum(object):
+    def __init__(self, data, mcaindex=-1, blocksize=None):
+        """
+        Parameters:
+        -----------
+        data : 3D array like object
+            The stack
+        mcaindex : int
+            Index of the spectra axis. The two other axes are the image axes.
+        blocksize : int
+            Approximate number of bytes to be read at once.
+            Default StackROIImages.BLOCK_SIZE.
+        """
+        if len(data.shape) != 3:
+            raise ValueError("A 3D stack is required")
+        if mcaindex < 0:
+            mcaindex = 3 + mcaindex
+        if mcaindex not in [0, 1, 2]:
+            raise ValueError("Invalid spectra axis %d" % mcaindex)
+        self.data = data
+        self.mcaIndex = mcaindex
+        if blocksize is None:
+            blocksize = StackROIImages.BLOCK_SIZE
+        self.blockSize = blocksize
+        shape = list(data.shape)
+        self.nChannels = shape.pop(mcaindex)
+        self.imageShape = tuple(shape)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the last selection. The next sum will be calculated from
+        scratch.
+        """
+        self._mask = None
+        self._sum = None
+
+    def getSum(self, mask, total=None):
+        """
+        Sum of the spectra of the selected pixels.
+
+        Parameters:
+        -----------
+        mask : 2D array
+            Selection mask with the shape of the stack images. The pixels
+            with non zero values are selected.
+        total : 1D array
+            Optional sum of all the spectra of the stack. If given, the sum
+            can be obtained subtracting the spectra of the non selected
+            pixels when there are less of them.
+
+        Returns:
+        --------
+        A 1D float64 array with the sum of the selected spectra.
+        """
+        mask = numpy.asarray(mask) != 0
+        if mask.shape != self.imageShape:
+            raise ValueError("Mask shape %s does not match image shape %s" % \
+                             (mask.shape, self.imageShape))
+        nSelected = int(mask.sum())
+        nCost = nSelected
+        complement = False
+        if total is not None:
+            if (mask.size - nSelected) < nSelected:
+                nCost = mask.size - nSelected
+                complement = True
+        if self._mask is not None:
+            added = mask & ~self._mask
+            removed = self._mask & ~mask
+            nChanged = int(added.sum()) + int(removed.sum())
+        else:
+            nChanged = None
+        if (nChanged is not None) and (nChanged <= nCost):
+            if DEBUG:
+                print("Updating sum with %d pixels" % nChanged)
+            result = self._sum.copy()
+            if nChanged:
+                result += self._sumPixels(added)
+                result -= self._sumPixels(removed)
+        elif complement:
+            if DEBUG:
+                print("Calculating sum of %d non selected pixels" % nCost)
+            result = numpy.array(total, dtype=numpy.float64) - \
+                     self._sumPixels(~mask)
+        else:
+            if DEBUG:
+                print("Calculating sum of %d selected pixels" % nCost)
+            result = self._sumPixels(mask)
+        self._mask = mask
+        self._sum = result
+        return result.copy()
+
+    def _sumPixels(self, mask):
+        """
+        Sum of the spectra of the pixels set in the boolean mask.
+        """
+        result = numpy.zeros((self.nChannels,), numpy.float64)
+        rows, cols = numpy.nonzero(mask)
+        if not len(rows):
+            return result
+        if isinstance(self.data, numpy.ndarray):
+            self.__sumArrayPixels(rows, cols, result)
+        else:
+            self.__sumDatasetPixels(mask, rows, cols, result)
+        return result
+
+    def __sumArrayPixels(self, rows, cols, result):
+        # in memory data: only the selected spectra are accessed
+        data = self.data
+        npixels = max(1, int(self.blockSize // \
+                             max(1, self.nChannels * data.itemsize)))
+        for start in range(0, len(rows), npixels):
+            r = rows[start:start + npixels]
+            c = cols[start:start + npixels]
+            if self.mcaIndex == 0:
+                result += data[:, r, c].sum(axis=1, dtype=numpy.float64)
+            elif self.mcaIndex == 1:
+                result += data[r, :, c].sum(axis=0, dtype=numpy.float64)
+            else:
+                result += data[r, c, :].sum(axis=0, dtype=numpy.float64)
+
+    def __sumDatasetPixels(self, mask, rows, cols, result):
+        # dynamically loaded data: the bounding box of the selected pixels
+        # is read by blocks of image rows
+        data = self.data
+        rMin, rMax = rows.min(), rows.max() + 1
+        cMin, cMax = cols.min(), cols.max() + 1
+        itemsize = numpy.dtype(data.dtype).itemsize
+        rowAxis = 1 if self.mcaIndex == 0 else 0
+        nrows = StackROIImages.getBlockLength(data, rowAxis,
+                                    self.nChannels * (cMax - cMin) * itemsize,
+                                    blocksize=self.blockSize)
+        for r0 in range(rMin, rMax, nrows):
+            r1 = min(r0 + nrows, rMax)
+            blockMask = mask[r0:r1, cMin:cMax]
+            if not blockMask.any():
+                continue
+            if self.mcaIndex == 0:
+                block = numpy.asarray(data[:, r0:r1, cMin:cMax])
+                result += block[:, blockMask].sum(axis=1, dtype=numpy.float64)
+            elif self.mcaIndex == 1:
+                block = numpy.asarray(data[r0:r1, :, cMin:cMax])
+                block = block.transpose(0, 2, 1)
+                result += block[blockMask].sum(axis=0, dtype=numpy.float64)
+            else:
+                block = numpy.asarray(data[r0:r1, cMin:cMax, :])
+                result += block[blockMask].sum(axis=0, dtype=numpy.float64)
@@ -84,6 +84,13 @@ class StackPluginBase(object):
     def getStackROIImagesAndNames(self):
         return self._stackWindow.getStackROIImagesAndNames()
 
+    def getStackMcaROIDictList(self):
+        return self._stackWindow.getMcaROIDictList()
+
+    def calculateStackMultipleROIImages(self, roilist, sumonly=False):
+        return self._stackWindow.calculateMultipleROIImages(roilist,
+                                                            sumonly=sumonly)
+
     def getStackDataObject(self):
         return self._stackWindow.getStackDataObject()
 
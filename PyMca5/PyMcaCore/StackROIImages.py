@@ -0,0 +1,279 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V.A. Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+"""
+Calculation of stack ROI images reading the stack by blocks.
+
+The stack is read along its first dimension in blocks sized according to
+the dataset chunks or to a memory budget and all the requested ROIs are
+calculated in a single pass over the data. Any array like object supporting
+slicing can be used (numpy arrays, HDF5 datasets, dynamically loaded stacks).
+"""
+import numpy
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+DEBUG = 0
+# approximate number of bytes to be read in each block
+BLOCK_SIZE = 64 * 1024 * 1024
+
+ROI_KEYS = ['ROI', 'Maximum', 'Minimum', 'Left', 'Middle', 'Right',
+            'Background']
+
+
+def getBlockLength(data, axis, bytesPerItem, blocksize=None):
+    """
+    Number of elements along axis to be read in one go.
+
+    It is a multiple of the dataset chunk size along that axis when the
+    dataset is chunked.
+    """
+    if blocksize is None:
+        blocksize = BLOCK_SIZE
+    n = max(1, int(blocksize // max(1, bytesPerItem)))
+    chunks = getattr(data, "chunks", None)
+    if chunks:
+        chunk = chunks[axis]
+        n = max(chunk, chunk * int(n // chunk))
+    return int(min(n, data.shape[axis]))
+
+
+def calculateROIImages(data, rois, mcaindex=-1, blocksize=None, nthreads=None,
+                       sumonly=False):
+    """
+    Calculate the images associated to a list of ROIs in a single pass.
+
+    Parameters:
+    -----------
+    data : 3D array like object
+        The stack
+    rois : list
+        Sequence of (first, last, middle) channel indices. The last channel
+        is not included in the ROI.
+    mcaindex : int
+        Index of the spectra axis
+    blocksize : int
+        Approximate number of bytes to be read at once. Default BLOCK_SIZE.
+    nthreads : int
+        Number of threads used to reduce the data. None means one and
+        a value smaller than one means the number of CPUs.
+    sumonly : boolean
+        If True only the ROI sums are calculated.
+
+    Returns:
+    --------
+    A list with one dictionary per ROI with keys 'ROI', 'Maximum',
+    'Minimum', 'Left', 'Middle', 'Right' and 'Background'. The 'Maximum'
+    and 'Minimum' images contain the channel index at which the extreme
+    is found. Only the 'ROI' key is present if sumonly is True.
+    """
+    shape = data.shape
+    ndim = len(shape)
+    if mcaindex < 0:
+        mcaindex = ndim + mcaindex
+    roiList = []
+    for roi in rois:
+        i1, i2 = int(roi[0]), int(roi[1])
+        if len(roi) > 2 and roi[2] is not None:
+            imiddle = int(roi[2])
+        else:
+            imiddle = int(0.5 * (i1 + i2))
+        if (i1 < 0) or (i2 > shape[mcaindex]) or (i2 <= i1):
+            raise ValueError("Invalid ROI limits %d, %d" % (i1, i2))
+        if sumonly:
+            imiddle = i1
+        roiList.append((i1, i2, imiddle))
+    if not len(roiList):
+        return []
+    first = min([min(roi[0], roi[2]) for roi in roiList])
+    last = max([max(roi[1], roi[2] + 1) for roi in roiList])
+
+    # the sums of all the ROIs are obtained as a product with this matrix
+    roiMatrix = numpy.zeros((last - first, len(roiList)), numpy.float64)
+    for i in range(len(roiList)):
+        i1, i2, imiddle = roiList[i]
+        roiMatrix[(i1 - first):(i2 - first), i] = 1.0
+
+    imageShape = [shape[i] for i in range(ndim) if i != mcaindex]
+    output = []
+    for roi in roiList:
+        ddict = {}
+        ddict['ROI'] = numpy.zeros(imageShape, numpy.float64)
+        if not sumonly:
+            for key in ['Left', 'Middle', 'Right']:
+                ddict[key] = numpy.zeros(imageShape, numpy.float64)
+            for key in ['Maximum', 'Minimum']:
+                ddict[key] = numpy.zeros(imageShape, numpy.int64)
+        output.append(ddict)
+
+    if nthreads is None:
+        nthreads = 1
+    elif nthreads < 1:
+        nthreads = multiprocessing.cpu_count()
+    pool = None
+    if nthreads > 1:
+        pool = ThreadPool(nthreads)
+    try:
+        if mcaindex == 0:
+            _calculateAlongChannels(data, roiList, roiMatrix, output,
+                                    first, last, blocksize, pool, sumonly)
+        else:
+            _calculateAlongFirstAxis(data, roiList, roiMatrix, output,
+                                     mcaindex, first, last, blocksize, pool,
+                                     sumonly)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if not sumonly:
+        for i in range(len(roiList)):
+            i1, i2, imiddle = roiList[i]
+            ddict = output[i]
+            ddict['Background'] = 0.5 * (i2 - i1) * \
+                                  (ddict['Left'] + ddict['Right'])
+    return output
+
+
+def _getItemSize(data):
+    dtype = getattr(data, "dtype", numpy.float64)
+    return numpy.dtype(dtype).itemsize
+
+
+def _calculateAlongFirstAxis(data, roiList, roiMatrix, output, mcaindex,
+                             first, last, blocksize, pool, sumonly):
+    # the first dimension is not the spectra one, each block gives
+    # complete spectra of a subset of pixels
+    shape = data.shape
+    ndim = len(shape)
+    bytesPerItem = _getItemSize(data) * (last - first)
+    for i in range(1, ndim):
+        if i != mcaindex:
+            bytesPerItem *= shape[i]
+    n = getBlockLength(data, 0, bytesPerItem, blocksize)
+
+    def processBlock(start):
+        end = min(start + n, shape[0])
+        selection = [slice(start, end)] + [slice(None)] * (ndim - 1)
+        selection[mcaindex] = slice(first, last)
+        block = numpy.asarray(data[tuple(selection)])
+        if mcaindex != (ndim - 1):
+            block = numpy.rollaxis(block, mcaindex, ndim)
+        sums = numpy.dot(block.reshape(-1, last - first), roiMatrix)
+        sums.shape = block.shape[:-1] + (len(roiList),)
+        for i in range(len(roiList)):
+            ddict = output[i]
+            ddict['ROI'][start:end] = sums[..., i]
+            if sumonly:
+                continue
+            i1, i2, imiddle = roiList[i]
+            roiData = block[..., (i1 - first):(i2 - first)]
+            ddict['Maximum'][start:end] = roiData.argmax(axis=-1) + i1
+            ddict['Minimum'][start:end] = roiData.argmin(axis=-1) + i1
+            ddict['Left'][start:end] = block[..., i1 - first]
+            ddict['Middle'][start:end] = block[..., imiddle - first]
+            ddict['Right'][start:end] = block[..., i2 - 1 - first]
+        return end
+
+    starts = list(range(0, shape[0], n))
+    if DEBUG:
+        print("Reading %d blocks of %d elements" % (len(starts), n))
+    if pool is None:
+        for start in starts:
+            processBlock(start)
+    else:
+        # output slices of different blocks do not overlap
+        pool.map(processBlock, starts)
+
+
+def _calculateAlongChannels(data, roiList, roiMatrix, output, first, last,
+                            blocksize, pool, sumonly):
+    # the first dimension is the spectra one, each block gives a set of
+    # complete channel images
+    shape = data.shape
+    bytesPerItem = _getItemSize(data)
+    for i in range(1, len(shape)):
+        bytesPerItem *= shape[i]
+    n = getBlockLength(data, 0, bytesPerItem, blocksize)
+    extremes = [[None, None] for roi in roiList]
+
+    def processROI(args):
+        block, start, end, i = args
+        i1, i2, imiddle = roiList[i]
+        ddict = output[i]
+        if start <= i1 < end:
+            ddict['Left'][:] = block[i1 - start]
+        if start <= imiddle < end:
+            ddict['Middle'][:] = block[imiddle - start]
+        if start <= (i2 - 1) < end:
+            ddict['Right'][:] = block[i2 - 1 - start]
+        a = max(i1, start)
+        b = min(i2, end)
+        if a >= b:
+            return
+        roiData = block[(a - start):(b - start)]
+        for key, j, reduce, arg, better in \
+                [('Maximum', 0, numpy.max, numpy.argmax, numpy.greater),
+                 ('Minimum', 1, numpy.min, numpy.argmin, numpy.less)]:
+            value = reduce(roiData, axis=0)
+            index = arg(roiData, axis=0) + a
+            if extremes[i][j] is None:
+                extremes[i][j] = value
+                ddict[key][:] = index
+            else:
+                # keep the first occurrence as numpy does
+                mask = better(value, extremes[i][j])
+                extremes[i][j][mask] = value[mask]
+                ddict[key][mask] = index[mask]
+
+    # keep the blocks aligned with the dataset chunks
+    origin = first
+    chunks = getattr(data, "chunks", None)
+    if chunks:
+        origin = first - (first % chunks[0])
+    for blockStart in range(origin, last, n):
+        start = max(blockStart, first)
+        end = min(blockStart + n, last)
+        block = numpy.asarray(data[start:end])
+        sums = numpy.dot(roiMatrix[(start - first):(end - first)].T,
+                         block.reshape(end - start, -1))
+        for i in range(len(roiList)):
+            output[i]['ROI'] += sums[i].reshape(output[i]['ROI'].shape)
+        if sumonly:
+            continue
+        tasks = [(block, start, end, i) for i in range(len(roiList))]
+        if pool is None:
+            for task in tasks:
+                processROI(task)
+        else:
+            # each task updates the images of a different ROI
+            pool.map(processROI, tasks)
@@ -31,6 +31,18 @@ from . import XiaEdf
 import sys
 import os
 import time
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    import h5py
+    HDF5SUPPORT = True
+except ImportError:
+    HDF5SUPPORT = False
 
 __version__="$Revision: 1.11 $"
 
@@ -120,10 +132,206 @@ def parseFiles(filelist, verbose=0, keep_sum=0, log_cb=None, done_cb=None, error
         return None
 
     
+class XiaOutputWriter(object):
+    """
+    Single thread saving the corrected data while the next files are
+    being corrected. The data are written as EDF files or, if an HDF5
+    file name is given, as datasets of that file named after the EDF
+    file they replace, with the EDF header as attributes.
+    """
+    def __init__(self, h5name=None, force=0, maxqueue=8):
+        self.force= force
+        self.errors= []
+        self._h5= None
+        if h5name is not None:
+            if not HDF5SUPPORT:
+                raise XiaEdf.XiaEdfError("HDF5 output needs h5py")
+            XiaEdf.checkEdfForWrite(h5name, force)
+            self._h5= h5py.File(h5name, "w")
+        # bounded to limit the memory used by the pending data
+        self._queue= queue.Queue(maxqueue)
+        self._thread= threading.Thread(target=self.__run)
+        self._thread.daemon= True
+        self._thread.start()
+
+    def write(self, filename, header, data):
+        self._queue.put((filename, header, data))
+
+    def close(self):
+        """
+        Wait for all the data to be written and return the list of errors
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._h5 is not None:
+            self._h5.close()
+            self._h5= None
+        return self.errors
+
+    def __run(self):
+        while True:
+            item= self._queue.get()
+            if item is None:
+                break
+            filename, header, data= item
+            try:
+                if self._h5 is None:
+                    edf= XiaEdf.openEdf(filename, write=1, force=self.force)
+                    edf.WriteImage(header, data)
+                else:
+                    name= os.path.splitext(os.path.basename(filename))[0]
+                    dataset= self._h5.create_dataset(name, data=data)
+                    for key in header:
+                        dataset.attrs[key]= str(header[key])
+            except:
+                self.errors.append("Cannot save <%s>: %s"%(filename, sys.exc_info()[1]))
+
+def correctGroup(group, writer, deadtime=1, livetime=0, sums=None, avgflag=0,
+                 outdir=None, outname="corr", verbose=0):
+    """
+    Correct a group of xia files as returned by parseFiles and queue the
+    results to the writer.
+
+    Returns:
+    --------
+        The list of (callback, arguments) to be logged, and the number of
+        queued files and of errors.
+    """
+    logs= []
+    saved= 0
+    errors= 0
+    if not group[0].isScan():
+        file= group[0]
+        name= file.get()
+        logs.append(("log", ("Working on %s"%name, 1, verbose)))
+
+        try:
+            xia= XiaEdf.XiaEdfCountFile(name)
+            file.setDirectory(outdir)
+            file.appendPrefix(outname)
+            name= file.get()
+
+            if sums is not None:
+                err= xia.sum(sums, deadtime, livetime, avgflag)
+                file.setType("sum", -1)
+            else:
+                err= xia.correct(deadtime, livetime)
+            if len(err):
+                logs.append(("error", (" - WARNING: in %s"%name,)))
+                for msg in err:
+                    logs.append(("error", ("     * " + msg,)))
+
+            logs.append(("log", (" - Saving %s"%name,)))
+            writer.write(name, xia.header, xia.data)
+            saved += 1
+
+        except XiaEdf.XiaEdfError:
+            errors += 1
+            logs.append(("log", (sys.exc_info()[1],)))
+        return logs, saved, errors
+
+    groupfiles= [ file.get() for file in group ]
+    name= groupfiles[-1]
+    logs.append(("log", ("Reading %s"%name, 1, verbose)))
+
+    try:
+        xia= XiaEdf.XiaEdfScanFile(name, groupfiles[:-1])
+    except XiaEdf.XiaEdfError:
+        errors += 1
+        logs.append(("error", (sys.exc_info()[1],)))
+        return logs, saved, errors
+
+    for file in group:
+        file.setDirectory(outdir)
+        file.appendPrefix(outname)
+
+    if sums is None:
+        # all the detectors corrected at once
+        files= []
+        detectors= []
+        for file in group[:-1]:
+            det= file.getDetector()
+            if det is not None:
+                logs.append(("log", ("Working on detector #%02d"%det, 1, verbose)))
+                try:
+                    xia.checkCorrection(det, deadtime, livetime)
+                    files.append(file)
+                    detectors.append(det)
+                except XiaEdf.XiaEdfError:
+                    errors += 1
+                    logs.append(("error", (sys.exc_info()[1],)))
+        if len(detectors):
+            try:
+                data, headers, err= xia.correctArray(detectors, deadtime, livetime)
+            except XiaEdf.XiaEdfError:
+                errors += 1
+                logs.append(("error", (sys.exc_info()[1],)))
+                return logs, saved, errors
+            if len(err):
+                logs.append(("error", (" - WARNING: in %s"%name,)))
+                for msg in err:
+                    logs.append(("error", ("     * " + msg,)))
+            for i in range(len(detectors)):
+                name= files[i].get()
+                logs.append(("log", (" - Saving %s"%name,)))
+                writer.write(name, headers[i], data[i])
+                saved += 1
+    else:
+        logs.append(("log", ("Working on group %s"%name, 1, verbose)))
+        file= group[-1]
+        # a sum with a detector already corrected is skipped alone
+        valid= []
+        for isum in range(len(sums)):
+            try:
+                if deadtime or livetime:
+                    sumdet= sums[isum]
+                    if not len(sumdet):
+                        sumdet= xia.detList
+                    for det in sumdet:
+                        if det in xia.detList:
+                            xia.checkCorrection(det, deadtime, livetime)
+                valid.append(isum)
+            except XiaEdf.XiaEdfError:
+                errors += 1
+                logs.append(("error", (sys.exc_info()[1],)))
+        if not len(valid):
+            return logs, saved, errors
+        try:
+            data, headers, err= xia.sumArray([sums[isum] for isum in valid],
+                                             deadtime, livetime, avgflag)
+        except XiaEdf.XiaEdfError:
+            errors += len(valid)
+            logs.append(("error", (sys.exc_info()[1],)))
+            return logs, saved, errors
+        if len(err):
+            logs.append(("error", (" - WARNING: in %s"%name,)))
+            for msg in err:
+                logs.append(("error", ("     * " + msg,)))
+        for i in range(len(valid)):
+            isum= valid[i]
+            file.setType("sum", isum+1)
+            name= file.get()
+            logs.append(("log", (" - Saving %s"%name,)))
+            writer.write(name, headers[i], data[i])
+            saved += 1
+    return logs, saved, errors
+
 def correctFiles(xiafiles, deadtime=1, livetime=0, sums=None, avgflag=0, outdir=None, outname="corr", force=0, \
-		    verbose=0, log_cb=None, done_cb=None, error_cb=None):
+		    verbose=0, log_cb=None, done_cb=None, error_cb=None, nworkers=None, h5name=None):
+    """
+    Correct the groups of xia files returned by parseFiles.
+
+    The groups are corrected by nworkers threads (None means 1, less than
+    1 means one per CPU) and a single writer saves the results as EDF
+    files or, if h5name is given, into that HDF5 file.
+    """
     (log_cb, done_cb, error_cb)= checkCB(log_cb, done_cb, error_cb)
 
+    if nworkers is None:
+        nworkers= 1
+    elif nworkers < 1:
+        nworkers= multiprocessing.cpu_count()
+
     processed= 0
     saved= 0
     total= 0
@@ -135,102 +343,44 @@ def correctFiles(xiafiles, deadtime=1, livetime=0, sums=None, avgflag=0, outdir=
 
     log_cb("Correcting xia files ...")
 
-    for group in xiafiles:
-        if not group[0].isScan():
-            file= group[0]
-            name= file.get()
-            log_cb("Working on %s"%name, 1, verbose)
+    try:
+        writer= XiaOutputWriter(h5name, force)
+    except XiaEdf.XiaEdfError:
+        error_cb(sys.exc_info()[1])
+        return
+
+    def correct(group):
+        return correctGroup(group, writer, deadtime, livetime, sums, avgflag,
+                            outdir, outname, verbose)
+
+    pool= None
+    if (nworkers > 1) and (len(xiafiles) > 1):
+        pool= ThreadPool(min(nworkers, len(xiafiles)))
+        results= pool.imap(correct, xiafiles)
+    else:
+        results= (correct(group) for group in xiafiles)
 
-            try:
-                xia= XiaEdf.XiaEdfCountFile(name)
-                file.setDirectory(outdir)
-                file.appendPrefix(outname)
-                name= file.get()
-
-                if sums is not None:
-                    err= xia.sum(sums, deadtime, livetime, avgflag)
-                    file.setType("sum", -1)
+    try:
+        # the callbacks are only called from this thread
+        for logs, nsaved, nerrors in results:
+            for callback, args in logs:
+                if callback == "log":
+                    log_cb(*args)
                 else:
-                    err= xia.correct(deadtime, livetime)
-                if len(err):
-                    error_cb(" - WARNING: in %s"%name)
-                    for msg in err:
-                        error_cb("     * " + msg)
-
-                log_cb(" - Saving %s"%name)
-                xia.save(name, force)
-                saved += 1
-
-            except XiaEdf.XiaEdfError:
-                errors += 1
-                log_cb(sys.exc_info()[1])
-                
-        else:
-            groupfiles= [ file.get() for file in group ]
-            name= groupfiles[-1]
-            log_cb("Reading %s"%name, 1, verbose)
-
-            try:
-                xia= XiaEdf.XiaEdfScanFile(name, groupfiles[:-1])
-            except XiaEdf.XiaEdfError:
-                xia= None
-                errors += 1
-                error_cb(sys.exc_info()[1])
+                    error_cb(*args)
+            saved += nsaved
+            errors += nerrors
+            processed += 1
+            done_cb(processed, total)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        for msg in writer.close():
+            error_cb(msg)
+            saved -= 1
+            errors += 1
 
-            if xia is not None:
-                for file in group:
-                    file.setDirectory(outdir)
-                    file.appendPrefix(outname)
-
-                if sums is None:
-                    for file in group[:-1]:
-                        det= file.getDetector()
-                    
-                        if det is not None:
-                            log_cb("Working on detector #%02d"%det, 1, verbose)
-                            try:
-                                err= xia.correct(det, deadtime, livetime)
-                                name= file.get()
-
-                                if len(err):
-                                    error_cb(" - WARNING: in %s"%name)
-                                    for msg in err:
-                                        error_cb("     * " + msg)
-
-                                log_cb(" - Saving %s"%name)
-                                xia.save(name, force)
-
-                                saved += 1
-
-                            except XiaEdf.XiaEdfError:
-                                errors += 1
-                                error_cb(sys.exc_info()[1])
-                else:
-                    log_cb("Working on group %s"%name, 1, verbose)
-                    file= group[-1]
-                    for isum in range(len(sums)):
-                        try:
-                            err= xia.sum(sums[isum], deadtime, livetime, avgflag)
-                        
-                            file.setType("sum", isum+1)
-                            name= file.get()
-
-                            if len(err):
-                                error_cb(" - WARNING: in %s"%name)
-                                for msg in err:
-                                    error_cb("     * " + msg)
-
-                            log_cb(" - Saving %s"%name)
-                            xia.save(name, force)
-
-                            saved += 1
-                        except XiaEdf.XiaEdfError:
-                            errors += 1
-                            error_cb(sys.exc_info()[1])
-
-        processed += 1
-        done_cb(processed, total)
-                    
     done_cb(total, total)
     log_cb("\n* %d groups processed and %d files saved in %.2f sec"%(processed, saved, time.time()-tps))
     if not errors:
@@ -245,8 +395,8 @@ def parseArguments():
 
     prog= os.path.basename(sys.argv[0])
 
-    long = ["help", "input=", "output=", "force", "verbose", "deadtime", "livetime", "sum=", "avg", "name=", "parsing"]
-    short= ["h",    "i:",     "o:",      "f",     "v",       "d",        "l",        "s:",   "a",   "n:",    "p"]
+    long = ["help", "input=", "output=", "force", "verbose", "deadtime", "livetime", "sum=", "avg", "name=", "parsing", "jobs=", "hdf5="]
+    short= ["h",    "i:",     "o:",      "f",     "v",       "d",        "l",        "s:",   "a",   "n:",    "p",       "j:"]
 
     try:
         opts, args= getopt.getopt(sys.argv[1:], " ".join(short), long)
@@ -257,7 +407,8 @@ def parseArguments():
 
     parsing= 0
     options= {"input": [], "files": [], "output": None, "force": 0, "name": "corr",
-		"verbose": 0, "deadtime": 0, "livetime": 0, "sums": None, "avgflag": 0, "parsing": 0}
+		"verbose": 0, "deadtime": 0, "livetime": 0, "sums": None, "avgflag": 0, "parsing": 0,
+		"nworkers": None, "hdf5": None}
 
     for opt, arg in opts:
         if opt in ("-h", "--help"):
@@ -293,6 +444,15 @@ def parseArguments():
             options["avgflag"]= 1
         if opt in ("-p", "--parsing"):
             options["parsing"]= 1
+        if opt in ("-j", "--jobs"):
+            try:
+                options["nworkers"]= int(arg)
+            except:
+                print("XiaCorrect ERROR: Cannot parse number of jobs")
+                print("\t%s"%arg)
+                sys.exit(0)
+        if opt in ("--hdf5",):
+            options["hdf5"]= os.path.normpath(arg)
                 
     
     for iinput in options["input"]:
@@ -330,7 +490,7 @@ def printHelp():
     prog= os.path.basename(sys.argv[0])
     msg= """
 
-%s [-h] [-v] [-f] [-d] [-l] [-a] [-s <detlist>] [-i <directory>] [-o <directory>] [<files ...>]
+%s [-h] [-v] [-f] [-d] [-l] [-a] [-s <detlist>] [-j <jobs>] [--hdf5 <file>] [-i <directory>] [-o <directory>] [<files ...>]
 
 Options:
     [-h]/[--help]
@@ -365,6 +525,12 @@ Options:
     [-n]/[--name]
 	    String to be appended to prefix for output filename.
 	    Default is \"corr\".
+    [-j]/[--jobs] <number>
+            Number of files corrected in parallel. Default is 1,
+            0 means one per CPU.
+    [--hdf5] <file>
+            Save all the corrected data into the given HDF5 file
+            instead of EDF files.
     [<files ...>]
             Specify one or several input files. Wildcards can be used:
                 %s -l file1.edf file2.edf /tmp/test*.edf
@@ -388,7 +554,8 @@ def mainCommandLine():
                     print(" - ", file.get())
         else:
             correctFiles(files, options["deadtime"], options["livetime"], options["sums"], options["avgflag"], \
-                 options["output"], options["name"], options["force"], options["verbose"])
+                 options["output"], options["name"], options["force"], options["verbose"], \
+                 nworkers=options["nworkers"], h5name=options["hdf5"])
 
 def mainGUI(app=None):
     from PyMca5.PyMcaGui import PyMcaQt as qt
@@ -69,6 +69,31 @@ def openEdf(filename, read=0, write=0, force=0):
         raise XiaEdfError("Cannot open EDF file <%s>"%filename)
     return edf
 
+def _fillNullPoints(values, good, default):
+    """
+    Replace the values of the points not flagged as good by the average
+    of their neighbours along the last axis, by the good neighbour when
+    only one is good, or by the default value otherwise.
+    """
+    prevGood = numpy.zeros(good.shape, bool)
+    prevGood[..., 1:] = good[..., :-1]
+    nextGood = numpy.zeros(good.shape, bool)
+    nextGood[..., :-1] = good[..., 1:]
+    prevValues = numpy.zeros(values.shape, numpy.float64)
+    prevValues[..., 1:] = values[..., :-1]
+    nextValues = numpy.zeros(values.shape, numpy.float64)
+    nextValues[..., :-1] = values[..., 1:]
+    bad = numpy.logical_not(good)
+    output = numpy.array(values, numpy.float64)
+    both = bad & prevGood & nextGood
+    output[both] = 0.5 * (prevValues[both] + nextValues[both])
+    onlyPrev = bad & prevGood & numpy.logical_not(nextGood)
+    output[onlyPrev] = prevValues[onlyPrev]
+    onlyNext = bad & nextGood & numpy.logical_not(prevGood)
+    output[onlyNext] = nextValues[onlyNext]
+    output[bad & numpy.logical_not(prevGood | nextGood)] = default
+    return output
+
 def checkEdfForWrite(filename, force=0):
     if os.path.isfile(filename):
         if not force:
@@ -109,12 +134,12 @@ class XiaEdfCountFile:
             self.statArray= None
             return self.nbDet
 
-        self.detList= range(self.nbDet)
+        self.detList= list(range(self.nbDet))
         det= self.header.get("xdet", None)
         if det is not None:
             dets= det.split()
             if len(dets)==self.nbDet:
-                self.detList= map(int, dets)
+                self.detList= [int(x) for x in dets]
 
         self.statArray = numpy.zeros(XiaStatNb*self.nbDet, numpy.int)
         idx= 0
@@ -269,6 +294,11 @@ class XiaEdfScanFile:
         self.data= None
         self.header= None
 
+        # all the detectors read at once
+        self.arrayDetList= None
+        self.dataArray= None
+        self.headerList= None
+
         checkEdfForRead(self.statfile)
         for file in self.detfiles:
             checkEdfForRead(file)
@@ -288,12 +318,12 @@ class XiaEdfScanFile:
             self.statArray= None
             return self.nbDet
 
-        self.detList= range(self.nbDet)
+        self.detList= list(range(self.nbDet))
         det= header.get("xdet", None)
         if det is not None:
             dets= det.split()
             if len(dets)==self.nbDet:
-                self.detList= map(int, dets)
+                self.detList= [int(x) for x in dets]
 
         self.statArray= edf.GetData(0)
 
@@ -335,6 +365,54 @@ class XiaEdfScanFile:
             if self.data is None:
                 raise XiaEdfError("Cannot read data on det #%02d"%detector)
 
+    def __readAllData(self):
+        if self.dataArray is not None:
+            return
+        headers= []
+        xdets= []
+        for file in self.detfiles:
+            edf= openEdf(file)
+            header= edf.GetHeader(0)
+            headers.append(header)
+            xdets.append(int(header.get("xdet", -1)))
+
+        # the same association between detectors and files as __readData
+        fileIndices= []
+        detList= []
+        for idx in range(len(self.detList)):
+            detector= self.detList[idx]
+            if idx < len(self.detfiles) and xdets[idx] in [-1, detector]:
+                fileIndices.append(idx)
+            elif detector in xdets:
+                fileIndices.append(xdets.index(detector))
+            else:
+                continue
+            detList.append(detector)
+
+        dataArray= None
+        headerList= []
+        for i in range(len(detList)):
+            file= self.detfiles[fileIndices[i]]
+            try:
+                data= openEdf(file).GetData(0)
+            except:
+                raise XiaEdfError("Cannot read data on det #%02d in <%s>"%(detList[i], file))
+            if dataArray is None:
+                dataArray= numpy.zeros((len(detList),)+data.shape, numpy.float64)
+            elif data.shape!=dataArray.shape[1:]:
+                raise XiaEdfError("Inconsistent data shape on det #%02d in <%s>"%(detList[i], file))
+            dataArray[i]= data
+            headerList.append(headers[fileIndices[i]])
+
+        self.arrayDetList= detList
+        self.dataArray= dataArray
+        self.headerList= headerList
+
+    def __getArrayIndex(self, detector):
+        if detector not in self.arrayDetList:
+            raise XiaEdfError("Cannot read data on det #%02d"%detector)
+        return self.arrayDetList.index(detector)
+
     def getDetList(self):
         return self.detList
 
@@ -342,6 +420,185 @@ class XiaEdfScanFile:
         self.__readData(detector)
         return self.data
 
+    def getDataArray(self):
+        """
+        Read the spectra of all the detectors at once.
+
+        Returns:
+        --------
+            The list of detectors found in the detector files and the
+            (detectors, points, channels) array with their spectra.
+        """
+        self.__readAllData()
+        return self.arrayDetList, self.dataArray
+
+    def checkCorrection(self, detector, deadtime=1, livetime=0):
+        """
+        Raise an XiaEdfError if the requested correction has already been
+        applied to the detector.
+        """
+        self.__readAllData()
+        header= self.headerList[self.__getArrayIndex(detector)]
+        corrflag= int(header.get("xcorr", 0))
+        if livetime and corrflag&2:
+            raise XiaEdfError("det #%02d seems already livetime corrected"%detector)
+
+        if deadtime and corrflag&1:
+            raise XiaEdfError("det #%02d seems already deadtime corrected"%detector)
+
+    def getCorrectionFactors(self, detectors=None, deadtime=1, livetime=0):
+        """
+        Calculate the deadtime and/or livetime correction of all the points
+        of the given detectors (default all) at once.
+
+        Returns:
+        --------
+            The (detectors, points) array of factors to be applied to the
+            spectra and the list of warning messages.
+        """
+        if detectors is None:
+            detectors= self.detList
+        idx= numpy.array([self.detList.index(det) for det in detectors],
+                         numpy.int64)
+        pts= self.statArray.shape[0]
+        factors= numpy.ones((len(detectors), pts), numpy.float64)
+        messages= [[] for det in detectors]
+        if not len(detectors):
+            return factors, []
+
+        if livetime:
+            lvt= self.statArray[:, (XiaStatNb*idx)+XiaStatIndex["lt"]].T / 1000.0
+            good= numpy.greater(lvt, 0.)
+            lvt= _fillNullPoints(lvt, good, 1.)
+            for i in numpy.nonzero(numpy.logical_not(good.all(axis=1)))[0]:
+                perr= list(numpy.nonzero(numpy.logical_not(good[i]))[0])
+                messages[i].append("Null livetime on det #%02d points %s"%(detectors[i], self.__pointRange(perr)))
+            factors /= lvt
+
+        if deadtime:
+            ocr= self.statArray[:, (XiaStatNb*idx)+XiaStatIndex["ocr"]].T
+            icr= self.statArray[:, (XiaStatNb*idx)+XiaStatIndex["icr"]].T
+            good= numpy.greater(ocr, 0.) & numpy.greater(icr, 0.)
+            ocr= _fillNullPoints(ocr, good, -1.)
+            icr= _fillNullPoints(icr, good, -1.)
+            valid= numpy.greater(ocr, 0.) & numpy.greater(icr, 0.)
+            rate= numpy.ones(factors.shape, numpy.float64)
+            rate[valid]= icr[valid] / ocr[valid]
+            for i in range(len(detectors)):
+                if not good[i].all():
+                    perr= list(numpy.nonzero(numpy.logical_not(good[i]))[0])
+                    messages[i].append("Null ICR|OCR on det #%02d points %s"%(detectors[i], self.__pointRange(perr)))
+                if not valid[i].all():
+                    perr= list(numpy.nonzero(numpy.logical_not(valid[i]))[0])
+                    messages[i].append("No DeadTime correction perfomed on det #%02d points %s"%(detectors[i], self.__pointRange(perr)))
+            factors *= rate
+
+        return factors, [msg for detmsg in messages for msg in detmsg]
+
+    def correctArray(self, detectors=None, deadtime=1, livetime=0):
+        """
+        Apply the deadtime and/or livetime correction to the spectra of the
+        given detectors (default all the detectors with data) at once.
+
+        Returns:
+        --------
+            The (detectors, points, channels) array of corrected spectra,
+            the list of their updated headers and the warning messages.
+        """
+        self.__readAllData()
+        if detectors is None:
+            detectors= self.arrayDetList
+        for det in detectors:
+            self.checkCorrection(det, deadtime, livetime)
+        idx= [self.__getArrayIndex(det) for det in detectors]
+
+        factors, message= self.getCorrectionFactors(detectors, deadtime, livetime)
+        data= self.dataArray[idx]
+        data *= factors[:, :, numpy.newaxis]
+
+        headers= []
+        for i in idx:
+            header= dict(self.headerList[i])
+            corrflag= int(header.get("xcorr", 0))
+            if livetime:
+                corrflag |= 2
+            if deadtime:
+                corrflag |= 1
+            header["xcorr"]= corrflag
+            headers.append(header)
+        return data, headers, message
+
+    def sumArray(self, sums, deadtime=0, livetime=0, average=0):
+        """
+        Calculate several sums of (corrected) detectors at once.
+
+        Parameters:
+        -----------
+            sums : List of lists of detectors. An empty list means all the
+                   detectors.
+            deadtime, livetime : Correction to be applied before summing
+            average : If true, the sums are divided by their number of
+                      detectors.
+
+        Returns:
+        --------
+            The (sums, points, channels) array, the list of their headers
+            and the warning messages.
+        """
+        self.__readAllData()
+        sumdets= []
+        used= []
+        for detectors in sums:
+            if not len(detectors):
+                sumdet= list(self.detList)
+            else:
+                sumdet= [ det for det in detectors if det in self.detList ]
+            for det in sumdet:
+                if det not in used:
+                    if deadtime or livetime:
+                        self.checkCorrection(det, deadtime, livetime)
+                    used.append(det)
+            sumdets.append(sumdet)
+        idx= [self.__getArrayIndex(det) for det in used]
+
+        if deadtime or livetime:
+            factors, message= self.getCorrectionFactors(used, deadtime, livetime)
+        else:
+            factors= numpy.ones((len(used), self.statArray.shape[0]), numpy.float64)
+            message= []
+
+        # weights of every (sum, detector, point) applied by a single product
+        weights= numpy.zeros((len(sums), len(used)), numpy.float64)
+        for isum in range(len(sumdets)):
+            for det in sumdets[isum]:
+                weights[isum, used.index(det)]= 1.
+            if average and len(sumdets[isum]):
+                weights[isum] /= len(sumdets[isum])
+        weights= weights[:, :, numpy.newaxis] * factors[numpy.newaxis]
+        data= numpy.matmul(weights.transpose(2, 0, 1),
+                           self.dataArray[idx].transpose(1, 0, 2))
+        data= numpy.ascontiguousarray(data.transpose(1, 0, 2))
+
+        headers= []
+        for sumdet in sumdets:
+            if len(sumdet):
+                header= dict(self.headerList[self.__getArrayIndex(sumdet[-1])])
+            else:
+                header= {}
+            if deadtime or livetime:
+                corrflag= int(header.get("xcorr", 0))
+                if livetime:
+                    corrflag |= 2
+                if deadtime:
+                    corrflag |= 1
+                header["xcorr"]= corrflag
+            dataflag= int(header.get("xdata", 0))
+            header["xdata"]= dataflag | (1<<2)
+            header["xnb"]= 1
+            header["xdet"]= " ".join([str(det) for det in sumdet])
+            headers.append(header)
+        return data, headers, message
+
     def getStat(self, detector=-1):
         if detector==-1:
             return self.statArray
@@ -612,7 +869,7 @@ class XiaFilename:
         else:
             self.prefix= "_".join(filelist[0:xiaidx])
             try:
-                self.index= map(int, filelist[xiaidx+1:])
+                self.index= [int(x) for x in filelist[xiaidx+1:]]
             except:
                 self.suffix= "_".join(filelist[xiaidx+1:])
 
@@ -83,3 +83,8 @@ if not os.path.exists(PYMCA_DOC_DIR):
         PYMCA_DOC_DIR = os.path.join(tmp_dir, "PyMca", basename)
 if not os.path.exists(PYMCA_DOC_DIR):
     raise IOError('%s directory not found' % basename)
+
+# user writable directory where binary versions of the data files are cached
+PYMCA_CACHE_DIR = os.getenv("PYMCA_CACHE_DIR")
+if not PYMCA_CACHE_DIR:
+    PYMCA_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".pymca", "cache")
@@ -46,6 +46,7 @@ else:
 import h5py
 phynx = h5py
 import weakref
+from PyMca5.PyMcaCore import NexusDataSource
 
 DEBUG = 0
 
@@ -181,7 +182,17 @@ class H5NodeProxy(object):
                     doit = False
                 try:
                     # better handling of external links
-                    finalList = h5py_sorting(items)
+                    finalList = None
+                    if self.name == "/":
+                        # the file pool keeps the sorted entries
+                        pool = NexusDataSource.getFilePool()
+                        sortedNames = pool.getSortedEntryNames(self.file)
+                        if sortedNames is not None:
+                            itemDict = dict(items)
+                            finalList = [(name, itemDict[name])
+                                         for name in sortedNames]
+                    if finalList is None:
+                        finalList = h5py_sorting(items)
                     for i in range(len(finalList)):
                         finalList[i][1]._posixPath = posixpath.join(self.name,
                                                                finalList[i][0])
@@ -477,7 +488,7 @@ class FileModel(qt.QAbstractItemModel):
         if hasattr(phynxFile, "_sourceName"):
             name = phynxFile._sourceName
         else:
-            name = phynxFile.name
+            name = phynxFile.filename
         gc.collect()
         present = False
         for child in self.rootItem:
@@ -49,7 +49,7 @@ class NNMAParametersDialog(qt.QDialog):
         self.methodOptions = qt.QGroupBox(self)
         self.methodOptions.setTitle('NNMA Method to use')
         self.methods = ['RRI', 'NNSC', 'NMF', 'SNMF', 'NMFKL',
-                        'FNMAI', 'ALS', 'FastHALS', 'GDCLS']
+                        'FNMAI', 'ALS', 'FastHALS', 'GDCLS', 'MiniBatch']
         self.methodOptions.mainLayout = qt.QGridLayout(self.methodOptions)
         self.methodOptions.mainLayout.setContentsMargins(0, 0, 0, 0)
         self.methodOptions.mainLayout.setSpacing(2)
@@ -59,7 +59,7 @@ class NNMAParametersDialog(qt.QDialog):
             rButton = qt.QRadioButton(self.methodOptions)
             self.methodOptions.mainLayout.addWidget(rButton, 0, i)
             #self.l.setAlignment(rButton, qt.Qt.AlignHCenter)
-            if i == 1:
+            if item == 'FNMAI':
                 rButton.setChecked(True)
             rButton.setText(item)
             self.buttonGroup.addButton(rButton)
@@ -188,7 +188,8 @@ class NNMAParametersDialog(qt.QDialog):
         ddict['binning'] =  int(self.binningCombo.currentText())
         ddict['npc']     = self.nPC.value()
         ddict['kw']   = {'eps':eps,
-                         'maxcount':maxcount}
+                         'maxcount':maxcount,
+                         'function':self.methods[i]}
         return ddict
 
 class NNMAWindow(PCAWindow.PCAWindow):
@@ -61,10 +61,11 @@ class PCAParametersDialog(qt.QDialog):
         self.methodOptions = qt.QGroupBox(self)
         self.methodOptions.setTitle('PCA Method to use')
         self.methods = ['Covariance', 'Expectation Max.',
-                        'Cov. Multiple Arrays']
+                        'Cov. Multiple Arrays', 'Randomized (float32)']
         self.functions = [PCAModule.numpyPCA,
                           PCAModule.expectationMaximizationPCA,
-                          PCAModule.multipleArrayPCA]
+                          PCAModule.multipleArrayPCA,
+                          PCAModule.randomizedPCAFloat32]
         self.methodOptions.mainLayout = qt.QGridLayout(self.methodOptions)
         self.methodOptions.mainLayout.setContentsMargins(0, 0, 0, 0)
         self.methodOptions.mainLayout.setSpacing(2)
@@ -205,7 +206,7 @@ class PCAParametersDialog(qt.QDialog):
         else:
             self.binningCombo.setEnabled(False)
         if self.__regions:
-            if index < 3:
+            if index < 4:
                 self.regionsWidget.setEnabled(False)
             else:
                 self.regionsWidget.setEnabled(True)
@@ -776,6 +776,21 @@ class McaWindow(ScanWindow.ScanWindow):
     def emitCurrentROISignal(self):
         if self.currentROI is None:
             return
+        key = self.currentROI
+        roiList, roiDict = self.roiWidget.getROIListAndDict()
+        ddict = self.__getROISignalDict(key, roiDict[key])
+        self.sigROISignal.emit(ddict)
+
+    def getROISignalDictList(self):
+        """
+        Return a list with the dictionaries that would be emitted by the
+        ROI signal for each of the ROIs in the ROI table.
+        """
+        roiList, roiDict = self.roiWidget.getROIListAndDict()
+        return [self.__getROISignalDict(key, roiDict[key]) \
+                for key in roiList]
+
+    def __getROISignalDict(self, key, roi):
         #I have to get the current calibration
         if self.getGraphXLabel().upper() != "CHANNEL":
             #I have to get the energy
@@ -795,18 +810,14 @@ class McaWindow(ScanWindow.ScanWindow):
             B = 1.0
             C = 0.0
             order = 1
-        key = self.currentROI        
-        roiList, roiDict = self.roiWidget.getROIListAndDict()
-        fromdata = roiDict[key]['from' ]
-        todata   = roiDict[key]['to']
         ddict = {}
         ddict['event'] = "ROISignal"
         ddict['name'] = key
-        ddict['from'] = fromdata
-        ddict['to']   = todata
-        ddict['type'] = roiDict[self.currentROI]["type"]
+        ddict['from'] = roi['from']
+        ddict['to']   = roi['to']
+        ddict['type'] = roi["type"]
         ddict['calibration']= [A, B, C, order]
-        self.sigROISignal.emit(ddict)
+        return ddict
 
     def setDispatcher(self, w):
         w.sigAddSelection.connect(self._addSelection)
@@ -32,6 +32,7 @@ import sys
 import os
 import time
 import subprocess
+import multiprocessing
 
 from PyMca5.PyMcaGui import PyMcaQt as qt
 
@@ -54,7 +55,6 @@ from PyMca5.PyMcaGui.pymca import McaCustomEvent
 from PyMca5.PyMcaGui.pymca import EdfFileSimpleViewer
 from PyMca5.PyMcaCore import HtmlIndex
 from PyMca5.PyMcaCore import PyMcaDirs
-from PyMca5.PyMcaCore import PyMcaBatchBuildOutput
 
 ROIWIDTH = 100.
 DEBUG = 0
@@ -76,8 +76,6 @@ class McaBatchGUI(qt.QWidget):
         self._layout.setContentsMargins(0, 0, 0, 0)
         self._layout.setSpacing(0)
         self._edfSimpleViewer = None
-        self._timer = None
-        self._processList = []
         self._selection = None
         self.__build(actions)               
         if filelist is None: filelist = []
@@ -797,25 +795,6 @@ class McaBatchGUI(qt.QWidget):
                     else:
                         self.raise_()
                     return
-            if len(self.fileList) == 1:
-                if int(qt.safe_str(self.__splitSpin.text())) > 1:
-                    allowSingleFileSplitProcesses = False
-                    if HDF5SUPPORT:
-                        if h5py.is_hdf5(self.fileList[0]):
-                            if DEBUG:
-                                print("Disallow single HDF5 process split")
-                                print("due to problems with concurrent access")
-                            #allowSingleFileSplitProcesses = True
-                            allowSingleFileSplitProcesses = False
-                    if not allowSingleFileSplitProcesses:
-                        text = "Multiple processes can only be used with multiple input files."
-                        qt.QMessageBox.critical(self, "ERROR",text)
-                        if QTVERSION < '4.0.0':
-                            self.raiseW()
-                        else:
-                            self.raise_()
-                        return
-                    
         if (self.configFile is None) or (not self.__goodConfigFile(self.configFile)):
             qt.QMessageBox.critical(self, "ERROR",'Invalid fit configuration file')
             if QTVERSION < '4.0.0':
@@ -872,11 +851,13 @@ class McaBatchGUI(qt.QWidget):
             overwrite= 1
             filestep = 1
             mcastep = 1
-            if len(self.fileList) == 1:
-                if self.__splitBox.isChecked():
-                    nbatches = int(qt.safe_str(self.__splitSpin.text()))
-                    mcastep = nbatches
-                
+        if self.__splitBox.isChecked():
+            # the spectra are distributed among the processes of a pool
+            # owned by the batch itself
+            nworkers = int(qt.safe_str(self.__splitSpin.text()))
+        else:
+            nworkers = None
+
         fitfiles = self.__fitBox.isChecked()
         selection = self._selection
         if selection is None:
@@ -915,14 +896,14 @@ class McaBatchGUI(qt.QWidget):
             self.__b      = b
             window.show()
             b.start()
-        elif (sys.platform == 'darwin') and\
-             ((".app" in os.path.dirname(__file__)) or (not self.__splitBox.isChecked())):
+        elif (sys.platform == 'darwin') or self.__splitBox.isChecked():
             #almost identical to batch
             window =  McaBatchWindow(name="ROI"+name,actions=1,outputdir=self.outputDir,
                                      html=html,htmlindex=htmlindex, table = table)
             b = McaBatch(window,self.configFile,self.fileList,self.outputDir,roifit=roifit,
                          roiwidth=roiwidth,overwrite=overwrite,filestep=filestep,
-                         mcastep=mcastep, concentrations=concentrations, fitfiles=fitfiles, selection=selection)
+                         mcastep=mcastep, concentrations=concentrations, fitfiles=fitfiles, selection=selection,
+                         nworkers=nworkers)
             def cleanup():
                 b.pleasePause = 0
                 b.pleaseBreak = 1
@@ -1025,59 +1006,17 @@ class McaBatchGUI(qt.QWidget):
             qApp.processEvents()
             if DEBUG:
                 print("cmd = %s" % cmd)
-            if self.__splitBox.isChecked():
-                nbatches = int(qt.safe_str(self.__splitSpin.text()))
-                if len(self.fileList) > 1:
-                    filechunk = int(len(self.fileList)/nbatches)
-                    processList = []
-                    for i in range(nbatches):
-                        beginoffset = filechunk * i
-                        endoffset   = len(self.fileList) - filechunk * (i+1)
-                        if (i+1) == nbatches:endoffset = 0
-                        cmd1        = cmd + " --filebeginoffset=%d --fileendoffset=%d --chunk=%d" % \
-                                              (beginoffset, endoffset, i)
-                        try:
-                            processList.append(subprocess.Popen(cmd1,
-                                                            cwd=os.getcwd()))
-                        except UnicodeEncodeError:
-                            processList.append(\
-                                subprocess.Popen(cmd1.encode(sys.getfilesystemencoding()),
-                                                 cwd=os.getcwd()))
-                            
-                        if DEBUG:
-                            print("cmd = %s" % cmd1)
-                else:
-                    #f = open("CMD", 'wb')                        
-                    processList = []
-                    for i in range(nbatches):
-                        #the mcastep has been dealt with above
-                        cmd1        = cmd + " --mcaoffset=%d --chunk=%d" % (i, i)
-                        processList.append(subprocess.Popen(cmd1, cwd=os.getcwd()))
-                        if DEBUG:
-                            print("CMD = %s" % cmd1)
-                        #f.write(cmd1+"\n")
-                    #f.close()
-                self._processList = processList
-                if self._timer is None:
-                    self._timer = qt.QTimer(self)
-                    self._timer.timeout[()].connect(self._pollProcessList)
-                if not self._timer.isActive():
-                    self._timer.start(1000)
-                else:
-                    print("timer was already active")
-                return
-            else:
+            try:
+                subprocess.call(cmd)
+            except UnicodeEncodeError:
                 try:
-                    subprocess.call(cmd)
-                except UnicodeEncodeError:
+                    subprocess.call(cmd.encode(sys.getfilesystemencoding()))
+                except:
+                    # be ready for any weird error like missing that encoding
                     try:
-                        subprocess.call(cmd.encode(sys.getfilesystemencoding()))
-                    except:
-                        # be ready for any weird error like missing that encoding
-                        try:
-                            subprocess.call(cmd.encode('utf-8'))
-                        except UnicodeEncodeError:
-                            subprocess.call(cmd.encode('latin-1'))
+                        subprocess.call(cmd.encode('utf-8'))
+                    except UnicodeEncodeError:
+                        subprocess.call(cmd.encode('latin-1'))
             self.show()
         else:
             listfile = os.path.join(self.outputDir, "tmpfile")
@@ -1137,50 +1076,16 @@ class McaBatchGUI(qt.QWidget):
                                                     listfile, concentrations, table, fitfiles, selectionFlag)
             if DEBUG:
                 print("cmd = %s" % cmd)
-            if self.__splitBox.isChecked():
-                qApp = qt.QApplication.instance()
-                qApp.processEvents()
-                nbatches = int(qt.safe_str(self.__splitSpin.text()))
-                filechunk = int(len(self.fileList)/nbatches)
-                processList = []
-                for i in range(nbatches):
-                    beginoffset = filechunk * i
-                    endoffset   = len(self.fileList) - filechunk * (i+1)
-                    if (i+1) == nbatches:endoffset = 0
-                    cmd1 = cmd.replace("&", "") + \
-                           " --filebeginoffset=%d --fileendoffset=%d --chunk=%d" % \
-                            (beginoffset, endoffset, i)
-                    # unfortunately I have to set shell = True
-                    # otherways I get a file not found error in the
-                    # chold process
-                    processList.append(\
-                        subprocess.Popen(cmd1,
-                                         cwd=os.getcwd(),
-                                         shell=True,
-                                         close_fds=True))
-                self._processList = processList
-                self.hide()
-                self._pollProcessList()
-                if self._timer is None:
-                    self._timer = qt.QTimer(self)
-                    self._timer.timeout[()].connect( \
-                                       self._pollProcessList)
-                if not self._timer.isActive():
-                    self._timer.start(1000)
-                else:
-                    print("timer was already active")
-                return
+            os.system(cmd)
+            msg = qt.QMessageBox(self)
+            msg.setIcon(qt.QMessageBox.Information)
+            text = "Your batch has been started as an independent process."
+            msg.setText(text)
+            if QTVERSION < '4.0.0':
+                msg.exec_loop()
             else:
-                os.system(cmd)
-                msg = qt.QMessageBox(self)
-                msg.setIcon(qt.QMessageBox.Information)
-                text = "Your batch has been started as an independent process."
-                msg.setText(text)
-                if QTVERSION < '4.0.0':
-                    msg.exec_loop()
-                else:
-                    msg.exec_()
-            
+                msg.exec_()
+
     def genListFile(self, listfile, config=None):
         if os.path.exists(listfile):
             try:
@@ -1209,49 +1114,6 @@ class McaBatchGUI(qt.QWidget):
             fd.write(('%s\n' % filename).encode(sys.getfilesystemencoding()))
         fd.close()
 
-    def _pollProcessList(self):
-        processList = self._processList
-        rgb         = self._rgb
-        if QTVERSION < '4.0.0':rgb = None
-        n = 0
-        for process in processList:
-            if process.poll() is None:
-                n += 1
-        if n > 0: return
-        self._timer.stop()
-        self.show()
-        if QTVERSION < '4.0.0':
-            self.raiseW()
-        else:
-            self.raise_()
-
-        work = PyMcaBatchBuildOutput.PyMcaBatchBuildOutput(os.path.join(self.outputDir, "IMAGES"))
-        if DEBUG:
-            a, b, c = work.buildOutput(delete=False)
-        else:
-            a, b, c = work.buildOutput(delete=True)
-        if len(a):
-            if self._edfSimpleViewer is None:
-                self._edfSimpleViewer = EdfFileSimpleViewer.EdfFileSimpleViewer()
-            self._edfSimpleViewer.setFileList(a)
-            self._edfSimpleViewer.show()
-        if rgb is not None:
-            if len(b):
-                if sys.platform == "win32":
-                    try:
-                        subprocess.Popen('%s "%s"' % (rgb, b[0]),
-                                         cwd = os.getcwd())
-                    except UnicodeEncodeError:
-                        subprocess.Popen(('%s "%s"' % (rgb, b[0])).encode(sys.getfilesystemencoding()),
-                                         cwd = os.getcwd())
-                else:
-                    os.system("%s %s &" % (rgb, b[0]))
-        work = PyMcaBatchBuildOutput.PyMcaBatchBuildOutput(self.outputDir)
-        if DEBUG:
-            work.buildOutput(delete=False)
-        else:
-            work.buildOutput(delete=True)
-
 
 class McaBatch(qt.QThread,McaAdvancedFitBatch.McaAdvancedFitBatch):
     def __init__(self, parent, configfile, filelist=None, outputdir = None,
@@ -1259,7 +1121,8 @@ class McaBatch(qt.QThread,McaAdvancedFitBatch.McaAdvancedFitBatch):
                      filestep=1, mcastep=1, concentrations=0,
                      fitfiles=0, filebeginoffset=0, fileendoffset=0,
                      mcaoffset=0, chunk=None,
-                     selection=None, lock=None):
+                     selection=None, lock=None, nworkers=None,
+                     hdf5output=0, hdf5compression=None):
         McaAdvancedFitBatch.McaAdvancedFitBatch.__init__(self, configfile, filelist, outputdir,
                                                          roifit=roifit, roiwidth=roiwidth,
                                                          overwrite=overwrite, filestep=filestep,
@@ -1271,7 +1134,10 @@ class McaBatch(qt.QThread,McaAdvancedFitBatch.McaAdvancedFitBatch):
                                                          mcaoffset  = mcaoffset,
                                                          chunk=chunk,
                                                          selection=selection,
-                                                         lock=lock) 
+                                                         lock=lock,
+                                                         nworkers=nworkers,
+                                                         hdf5output=hdf5output,
+                                                         hdf5compression=hdf5compression)
         qt.QThread.__init__(self)
         self.parent = parent
         self.pleasePause = 0
@@ -1656,7 +1522,8 @@ class McaBatchWindow(qt.QWidget):
             self.abortButton.setText("OK")
         if self.chunk is None:
             if 'savedimages' in dict:
-                self.plotImages(dict['savedimages'])
+                if len(dict['savedimages']):
+                    self.plotImages(dict['savedimages'])
         if self.html:
             if not self.__writingReport:
                 directory = os.path.join(self.outputdir,"HTML")
@@ -1739,7 +1606,8 @@ def main():
                    'overwrite=', 'filestep=', 'mcastep=', 'html=','htmlindex=',
                    'listfile=','cfglistfile=', 'concentrations=', 'table=', 'fitfiles=',
                    'filebeginoffset=','fileendoffset=','mcaoffset=', 'chunk=',
-                   'nativefiledialogs=','selection=']
+                   'nativefiledialogs=','selection=', 'nworkers=',
+                   'hdf5=', 'hdf5compression=']
     filelist = None
     outdir   = None
     cfg      = None
@@ -1760,6 +1628,9 @@ def main():
     fileendoffset = 0
     mcaoffset = 0
     chunk = None
+    nworkers = None
+    hdf5output = 0
+    hdf5compression = None
     opts, args = getopt.getopt(
                     sys.argv[1:],
                     options,
@@ -1801,6 +1672,12 @@ def main():
             mcaoffset  = int(arg)
         elif opt in ('--chunk'):
             chunk  = int(arg)
+        elif opt in ('--nworkers'):
+            nworkers = int(arg)
+        elif opt in ('--hdf5'):
+            hdf5output = int(arg)
+        elif opt in ('--hdf5compression'):
+            hdf5compression = arg
         elif opt in ('--selection'):
             selection  = int(arg)
             if selection:
@@ -1861,7 +1738,9 @@ def main():
                      overwrite = overwrite, filestep=filestep, mcastep=mcastep,
                       concentrations=concentrations, fitfiles=fitfiles,
                       filebeginoffset=filebeginoffset,fileendoffset=fileendoffset,
-                      mcaoffset=mcaoffset, chunk=chunk, selection=selection)
+                      mcaoffset=mcaoffset, chunk=chunk, selection=selection,
+                      nworkers=nworkers, hdf5output=hdf5output,
+                      hdf5compression=hdf5compression)
         except:
             msg = qt.QMessageBox()
             msg.setIcon(qt.QMessageBox.Critical)
@@ -1896,6 +1775,7 @@ def main():
         app.exec_()
  
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
  
  
@@ -239,6 +239,9 @@ class QDispatcher(qt.QWidget):
                 return
             sourceType = source.sourceType
             del self.sourceList[self.sourceList.index(source)]
+            if hasattr(source, "close"):
+                # release the resources kept by the source
+                source.close()
             for source in self.sourceList:
                 if sourceType == source.sourceType:
                     self.selectorWidget[sourceType].setDataSource(source)
@@ -37,7 +37,9 @@ class QHDF5Stack1D(HDF5Stack1D.HDF5Stack1D):
     def __init__(self, filelist=None,
                        selection=None,
                        scanlist=None,
-                       dtype=None):
+                       dtype=None,
+                       virtual=False,
+                       nworkers=None):
         if (filelist is None) or (selection is None):
             wizard = QHDF5StackWizard.QHDF5StackWizard()
             if filelist is not None:
@@ -49,7 +51,9 @@ class QHDF5Stack1D(HDF5Stack1D.HDF5Stack1D):
             filelist, selection, scanlist = wizard.getParameters()
         HDF5Stack1D.HDF5Stack1D.__init__(self, filelist, selection,
                                 scanlist=scanlist,
-                                dtype=dtype)
+                                dtype=dtype,
+                                virtual=virtual,
+                                nworkers=nworkers)
 
     def onBegin(self, nfiles):
         self.bars =qt.QWidget()
@@ -1021,6 +1021,9 @@ class QStackWidget(StackBase.StackBase,
 
     def getGraphXLimits(self):
         return self.mcaWidget.getGraphXLimits()
+
+    def getMcaROIDictList(self):
+        return self.mcaWidget.getROISignalDictList()
         
     def getGraphYLimits(self):
         return self.mcaWidget.getGraphYLimits()
@@ -94,7 +94,8 @@ class StackSelector(object):
                 f.close()
             omnicfile = False
             if filefilter.upper().startswith('HDF5'):
-                stack = QHDF5Stack1D.QHDF5Stack1D(filelist)
+                # the files are read by as many processes as CPUs
+                stack = QHDF5Stack1D.QHDF5Stack1D(filelist, nworkers=0)
                 omnicfile = True
             elif filefilter.upper().startswith('OPUS-DPT'):
                 stack = OpusDPTMap.OpusDPTMap(filelist[0])
@@ -256,7 +257,7 @@ class StackSelector(object):
             if not HDF5:
                 raise IOError(\
                     "No HDF5 support while trying to read an HDF5 file")
-            stack = QHDF5Stack1D.QHDF5Stack1D(args)
+            stack = QHDF5Stack1D.QHDF5Stack1D(args, nworkers=0)
         elif args[0].upper().endswith("RAW.GZ")or\
              args[0].upper().endswith("EDF.GZ")or\
              args[0].upper().endswith("CCD.GZ")or\
@@ -269,7 +270,7 @@ class StackSelector(object):
         else:
             if HDF5:
                 if h5py.is_hdf5(args[0]):
-                    stack = QHDF5Stack1D.QHDF5Stack1D(args)
+                    stack = QHDF5Stack1D.QHDF5Stack1D(args, nworkers=0)
                 else:
                     stack = QSpecFileStack()
                     specfile = True
@@ -244,7 +244,8 @@ def getHDF5FileInstanceAndBuffer(filename, shape,
                                  buffername="data",
                                  dtype=numpy.float32,
                                  interpretation=None,
-                                 compression=None):
+                                 compression=None,
+                                 chunks=None):
     if not HDF5:
         raise IOError('h5py does not seem to be installed in your system')
 
@@ -271,7 +272,15 @@ def getHDF5FileInstanceAndBuffer(filename, shape,
     elif nxData.attrs['NX_class'] == 'NXdata'.encode('utf-8'):
         #should I raise an error?
         pass
-    if compression:
+    if chunks is not None:
+        if DEBUG:
+            print("Saving chunked dataset")
+        data = nxData.require_dataset(buffername,
+                           shape=shape,
+                           dtype=dtype,
+                           chunks=chunks,
+                           compression=compression)
+    elif compression:
         if DEBUG:
             print("Saving compressed and chunked dataset")
         chunk1 = int(shape[1] / 10)
@@ -235,6 +235,56 @@ class ConfigDict(dict):
             self.__write(fp, ddict[key], key, newsecthead)
 
 
+class LazyConfigDict(ConfigDict):
+    """
+    ConfigDict reading its files on first access instead of on creation.
+    Used by modules exposing large read only data files as dictionaries.
+    """
+    def __init__(self, filelist):
+        ConfigDict.__init__(self)
+        self._pendingFileList = filelist
+
+    def _load(self):
+        if self._pendingFileList is not None:
+            filelist = self._pendingFileList
+            self._pendingFileList = None
+            ConfigDict.read(self, filelist)
+
+    def clear(self):
+        # the pending files must not be read afterwards
+        self._pendingFileList = None
+        ConfigDict.clear(self)
+
+    def read(self, filelist, sections=None):
+        # keep the order in which the files are read
+        self._load()
+        ConfigDict.read(self, filelist, sections=sections)
+
+    def getfiles(self):
+        self._load()
+        return ConfigDict.getfiles(self)
+
+    def getlastfile(self):
+        self._load()
+        return ConfigDict.getlastfile(self)
+
+def _lazyMethod(name):
+    method = getattr(dict, name)
+    def wrapper(self, *var, **kw):
+        self._load()
+        return method(self, *var, **kw)
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ['__getitem__', '__setitem__', '__delitem__', '__contains__',
+              '__iter__', '__len__', '__eq__', '__ne__', '__repr__',
+              'get', 'keys', 'values', 'items', 'pop', 'popitem',
+              'setdefault', 'update', 'copy', 'has_key',
+              'iterkeys', 'itervalues', 'iteritems']:
+    if hasattr(dict, _name):
+        setattr(LazyConfigDict, _name, _lazyMethod(_name))
+
+
 def prtdict(ddict, lvl=0):
     for key in ddict.keys():
         if hasattr(ddict[key], 'keys'):
@@ -87,11 +87,22 @@ class EDFStack(DataObject.DataObject):
         tempEdf=EdfFileDataSource.EdfFileDataSource(filelist[0])
         keylist = tempEdf.getSourceInfo()['KeyList']
         nImages = len(keylist)
-        dataObject = tempEdf.getDataObject(keylist[0])
-        self.info.update(dataObject.info)
-        if len(dataObject.data.shape) == 3:
+        keyInfo = tempEdf.getKeyInfo(keylist[0])
+        if 'Dim_3' in keyInfo:
+            #a stack does not need to be read, it can be mapped
+            self.info.update(keyInfo)
+            arrRet = EdfFile.EdfFile(filelist[0], 'rb',
+                                     memmap=True).GetData(0)
+            if not arrRet.dtype.isnative:
+                #the stack operations expect the native byte order
+                arrRet = arrRet.astype(arrRet.dtype.newbyteorder('='))
+        else:
+            dataObject = tempEdf.getDataObject(keylist[0])
+            self.info.update(dataObject.info)
+            arrRet = dataObject.data
+        if len(arrRet.shape) == 3:
             #this is already a stack
-            self.data = dataObject.data
+            self.data = arrRet
             self.__nFiles         = 1
             self.__nImagesPerFile = nImages
             shape = self.data.shape
@@ -104,7 +115,6 @@ class EDFStack(DataObject.DataObject):
             self.info["NumberOfFiles"] = 1
             self.info["FileIndex"] = fileindex
             return
-        arrRet = dataObject.data
         if self.__dtype is None:
             self.__dtype = arrRet.dtype
 
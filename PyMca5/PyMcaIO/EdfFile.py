@@ -174,7 +174,7 @@ class  EdfFile(object):
     """
     ############################################################################
     #Interface
-    def __init__(self, FileName, access=None, fastedf=None):
+    def __init__(self, FileName, access=None, fastedf=None, memmap=None):
         """ Constructor
         
         @param  FileName:   Name of the file (either existing or to be created)
@@ -184,6 +184,9 @@ class  EdfFile(object):
         @type access: string
         @type fastedf= True to use the fastedf module
         @param fastedf= boolean
+        @type memmap= True to get the data of uncompressed files as
+                      numpy.memmap views instead of reading them
+        @param memmap= boolean
         """
         self.Images = []
         self.NumImages = 0
@@ -192,6 +195,9 @@ class  EdfFile(object):
         if fastedf is None:
             fastedf = 0
         self.fastedf = fastedf
+        if memmap is None:
+            memmap = False
+        self.memmap = memmap
         self.ADSC = False
         self.MARCCD = False
         self.TIFF = False
@@ -613,6 +619,10 @@ class  EdfFile(object):
                             (x,y,z) if ommited, is the distance from Pos to the end.
 
             If Pos and Size not mentioned, returns the whole data.                         
+
+            If the file was opened with memmap set, uncompressed data are
+            returned as (copy on write) numpy.memmap views keeping the byte
+            order of the file.
         """
         fastedf = self.fastedf
         if Index < 0 or Index >= self.NumImages:
@@ -625,6 +635,12 @@ class  EdfFile(object):
                 data = self._wrappedInstance.getData(Index)
                 return data
             else:
+                if self.memmap:
+                    Data = self._GetMemmap(Index)
+                    if Data is not None:
+                        if DataType != "":
+                            Data = self.__SetDataType__ (Data, DataType)
+                        return Data
                 self.File.seek(self.Images[Index].DataPosition, 0)
                 datatype = self.__GetDefaultNumpyType__(self.Images[Index].DataType, index=Index)
                 try:
@@ -705,6 +721,13 @@ class  EdfFile(object):
                 print("I could not use fast routines")
             type = self.__GetDefaultNumpyType__(self.Images[Index].DataType, index=Index)
             size_pixel = self.__GetSizeNumpyType__(type)
+            if self.memmap:
+                # a strided view of the mapped file instead of a seek per line
+                Data = self.__GetMappedRegion(Index, Pos, Size)
+                if Data is not None:
+                    if DataType != "":
+                        Data = self.__SetDataType__ (Data, DataType)
+                    return Data
             Data = numpy.array([], type)
             if self.Images[Index].NumDim == 1:
                 if Pos == None: Pos = (0,)
@@ -757,6 +780,53 @@ class  EdfFile(object):
 
 
 
+    def _GetMemmap(self, Index):
+        """ Returns a copy on write numpy.memmap of the image data with the
+            byte order of the file or None if the data cannot be mapped
+            (compressed files, file objects or other formats)
+        """
+        if (not self.__ownedOpen) or self.ADSC or self.MARCCD or\
+           self.TIFF or self.PILATUS_CBF or self.SPE:
+            return None
+        image = self.Images[Index]
+        datatype = numpy.dtype(self.__GetDefaultNumpyType__(image.DataType,
+                                                             index=Index))
+        if image.ByteOrder.upper() == "HIGHBYTEFIRST":
+            datatype = datatype.newbyteorder(">")
+        else:
+            datatype = datatype.newbyteorder("<")
+        if image.NumDim == 3:
+            shape = (image.Dim3, image.Dim2, image.Dim1)
+        elif image.NumDim == 2:
+            shape = (image.Dim2, image.Dim1)
+        else:
+            shape = (image.Dim1,)
+        try:
+            return numpy.memmap(self.FileName, dtype=datatype, mode='c',
+                                offset=image.DataPosition, shape=shape)
+        except (ValueError, EnvironmentError):
+            # truncated file or no mmap support
+            return None
+
+    def __GetMappedRegion(self, Index, Pos, Size):
+        """ Internal method: returns the region defined by Pos and Size
+            as a view of the mapped data or None
+        """
+        mappedData = self._GetMemmap(Index)
+        if mappedData is None:
+            return None
+        nDim = self.Images[Index].NumDim
+        if Pos is None: Pos = (0,) * nDim
+        if Size is None: Size = (0,) * nDim
+        # Pos and Size are given as (x), (x,y) or (x,y,z)
+        shape = mappedData.shape[::-1]
+        region = []
+        for i in range(nDim):
+            size = Size[i]
+            if size == 0:size = shape[i] - Pos[i]
+            region.insert(0, slice(Pos[i], Pos[i] + size))
+        return mappedData[tuple(region)]
+
     def GetPixel(self, Index, Position):
         """ Returns double value of the pixel, regardless the format of the array
             Index:      The zero-based index of the image in the file
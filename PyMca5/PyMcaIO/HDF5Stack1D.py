@@ -31,6 +31,7 @@ __contact__ = "sole@esrf.fr"
 __license__ = "MIT"
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 import posixpath
+import multiprocessing
 import numpy
 import h5py
 try:
@@ -48,11 +49,239 @@ except ImportError:
 
 DEBUG = 0
 SOURCE_TYPE = "HDF5Stack1D"
+# approximate number of bytes read from the file in a single access
+BLOCK_SIZE = 64 * 1024 * 1024
+
+def getNumberOfSpectra(shape, mcaDim):
+    """
+    Number of spectra contained in a dataset of the given shape having the
+    channels along its last dimension.
+    """
+    n = 1
+    for dim in shape:
+        n *= dim
+    return int(n / mcaDim)
+
+def getMonitorData(mData, nSpectra, mcaDim):
+    """
+    Returns the monitor reshaped as (nSpectra, ) when there is one value
+    per spectrum or as (nSpectra, mcaDim) when there is one value per
+    channel of each spectrum.
+    """
+    mData = numpy.asarray(mData)
+    if mData.size == nSpectra:
+        return mData.reshape(nSpectra)
+    elif mData.size == (nSpectra * mcaDim):
+        return mData.reshape(nSpectra, mcaDim)
+    raise ValueError("I do not know how to handle this monitor data")
+
+def readSpectra(yDataset, mcaDim, monitor=None, output=None,
+                dtype=numpy.float64, blocksize=None):
+    """
+    Read all the spectra of a dataset having the channels along its last
+    dimension.
+
+    Parameters:
+    -----------
+        yDataset : HDF5 dataset or array
+        mcaDim : Number of channels
+        monitor : Array as returned by getMonitorData or None
+        output : Array of shape (nSpectra, mcaDim) to be filled or None
+        dtype : Data type of the output array when not supplied
+        blocksize : Approximate number of bytes per read (default BLOCK_SIZE)
+
+    Returns:
+    --------
+        The output array of shape (nSpectra, mcaDim)
+
+    The dataset is read by hyperslabs spanning complete rows of its first
+    dimension, aligned to the chunk shape when the dataset is chunked, and
+    the monitor normalization is applied to each complete hyperslab.
+    """
+    if blocksize is None:
+        blocksize = BLOCK_SIZE
+    shape = yDataset.shape
+    nSpectra = getNumberOfSpectra(shape, mcaDim)
+    if output is None:
+        output = numpy.zeros((nSpectra, mcaDim), dtype)
+    if len(shape) < 2:
+        yData = numpy.asarray(yDataset[()]).reshape(1, mcaDim)
+        if monitor is None:
+            output[:] = yData
+        elif monitor.ndim == 1:
+            output[:] = yData / monitor[:, None]
+        else:
+            output[:] = yData / monitor
+        return output
+    spectraPerRow = int(nSpectra / shape[0])
+    rowBytes = spectraPerRow * mcaDim * yDataset.dtype.itemsize
+    nRows = max(1, int(blocksize / max(1, rowBytes)))
+    chunks = getattr(yDataset, "chunks", None)
+    if chunks:
+        # whole chunks along the first dimension
+        nRows = max(chunks[0], chunks[0] * int(nRows / chunks[0]))
+    for row in range(0, shape[0], nRows):
+        last = min(row + nRows, shape[0])
+        yData = numpy.asarray(yDataset[row:last]).reshape(-1, mcaDim)
+        first = row * spectraPerRow
+        end = last * spectraPerRow
+        if monitor is None:
+            output[first:end] = yData
+        elif monitor.ndim == 1:
+            output[first:end] = yData / monitor[first:end, None]
+        else:
+            output[first:end] = yData / monitor[first:end]
+    return output
+
+# state of the worker processes used to read the spectra
+_WORKER_STATE = {}
+
+def _getContext():
+    # The stack can be read from the GUI process. Forking a process with
+    # running threads and open HDF5 files is unsafe, therefore the workers
+    # are started from scratch whenever the platform allows it.
+    if hasattr(multiprocessing, "get_context"):
+        return multiprocessing.get_context("spawn")
+    return multiprocessing
+
+def _initReadWorker(buffer, dtype, shape):
+    _WORKER_STATE.clear()
+    _WORKER_STATE['output'] = numpy.frombuffer(buffer, dtype=dtype,
+                                    count=shape[0] * shape[1]).reshape(shape)
+
+def _readSpectraWorker(args):
+    # the spectra are written into the shared output array
+    filename, ypath, mpath, first, nSpectra = args
+    output = _WORKER_STATE['output']
+    mcaDim = output.shape[1]
+    h5 = h5py.File(filename, "r")
+    try:
+        yDataset = h5[ypath]
+        monitor = None
+        if mpath is not None:
+            monitor = getMonitorData(h5[mpath][()], nSpectra, mcaDim)
+        readSpectra(yDataset, mcaDim, monitor=monitor,
+                    output=output[first:first + nSpectra])
+    finally:
+        h5.close()
+    return first, nSpectra
+
+class HDF5VirtualStack(object):
+    """
+    Read-only array like object presenting a set of HDF5 datasets with
+    the spectra along their last dimension as a (dim0, dim1, mcaDim)
+    stack.
+
+    Only an index of the datasets is kept in memory. The requested spectra
+    are read from the files, and normalized by the monitor, on access.
+    """
+    def __init__(self, segments, shape, dtype, reference=None):
+        """
+        Parameters:
+        -----------
+            segments : List of (dataset, monitor) tuples in stack order.
+                       The monitor is None or as returned by getMonitorData
+            shape : Shape (dim0, dim1, mcaDim) of the stack
+            dtype : Data type of the returned arrays
+            reference : Object to be kept alive while in use (the source)
+        """
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype)
+        self.ndim = len(self.shape)
+        self.size = self.shape[0] * self.shape[1] * self.shape[2]
+        self._reference = reference
+        self._segments = []
+        n = 0
+        for dataset, monitor in segments:
+            nSpectra = getNumberOfSpectra(dataset.shape, self.shape[2])
+            self._segments.append((dataset, monitor, n, nSpectra))
+            n += nSpectra
+        if n > (self.shape[0] * self.shape[1]):
+            raise ValueError("Stack shape too small for the data")
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        ellipsis = [k is Ellipsis for k in key]
+        if True in ellipsis:
+            i = ellipsis.index(True)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + \
+                  key[i+1:]
+        if len(key) > self.ndim:
+            raise IndexError("Too many indices")
+        key = key + (slice(None),) * (self.ndim - len(key))
+        indices = []
+        squeeze = []
+        for axis in range(self.ndim):
+            k = key[axis]
+            n = self.shape[axis]
+            if isinstance(k, slice):
+                idx = numpy.arange(*k.indices(n))
+            elif isinstance(k, (int, numpy.integer)):
+                if k < 0:
+                    k += n
+                if (k < 0) or (k >= n):
+                    raise IndexError("Index %d out of range" % key[axis])
+                idx = numpy.array([k])
+                squeeze.append(axis)
+            else:
+                idx = numpy.asarray(k)
+                if idx.dtype == numpy.bool_:
+                    idx = numpy.nonzero(idx)[0]
+                idx = idx.astype(numpy.int64).ravel()
+                idx[idx < 0] += n
+            indices.append(idx)
+        rows, cols, channels = indices
+        flat = (rows[:, None] * self.shape[1] + cols[None, :]).ravel()
+        output = numpy.zeros((flat.size, channels.size), self.dtype)
+        if flat.size and channels.size:
+            c0 = int(channels.min())
+            c1 = int(channels.max()) + 1
+            for dataset, monitor, first, nSpectra in self._segments:
+                selected = (flat >= first) & (flat < (first + nSpectra))
+                if not selected.any():
+                    continue
+                spectra = self.__readSpectra(dataset, monitor, nSpectra,
+                                             flat[selected] - first, c0, c1)
+                output[selected] = spectra[:, channels - c0]
+        output.shape = rows.size, cols.size, channels.size
+        if squeeze:
+            output = output[tuple([0 if axis in squeeze else slice(None)
+                                   for axis in range(self.ndim)])]
+        return output
+
+    def __readSpectra(self, dataset, monitor, nSpectra, local, c0, c1):
+        # read the smallest hyperslab of complete rows containing them
+        shape = dataset.shape
+        first = int(local.min())
+        last = int(local.max()) + 1
+        if len(shape) < 2:
+            slab = numpy.asarray(dataset[c0:c1]).reshape(1, -1)
+            offset = 0
+        else:
+            spectraPerRow = int(nSpectra / shape[0])
+            r0 = first // spectraPerRow
+            r1 = (last - 1) // spectraPerRow + 1
+            slab = numpy.asarray(dataset[r0:r1, ..., c0:c1])
+            slab = slab.reshape(-1, c1 - c0)
+            offset = r0 * spectraPerRow
+        spectra = slab[local - offset]
+        if monitor is not None:
+            if monitor.ndim == 1:
+                spectra = spectra / monitor[local, None]
+            else:
+                spectra = spectra / monitor[local, c0:c1]
+        return spectra
 
 class HDF5Stack1D(DataObject.DataObject):
     def __init__(self, filelist, selection,
                        scanlist=None,
-                       dtype=None):
+                       dtype=None,
+                       virtual=False,
+                       nworkers=None):
         DataObject.DataObject.__init__(self)
 
         #the data type of the generated stack
@@ -61,9 +290,11 @@ class HDF5Stack1D(DataObject.DataObject):
 
         if filelist is not None:
             if selection is not None:
-                self.loadFileList(filelist, selection, scanlist)
+                self.loadFileList(filelist, selection, scanlist,
+                                  virtual=virtual, nworkers=nworkers)
 
-    def loadFileList(self, filelist, selection, scanlist=None):
+    def loadFileList(self, filelist, selection, scanlist=None,
+                     virtual=False, nworkers=None):
         """
         loadFileList(self, filelist, y, scanlist=None, monitor=None, x=None)
         filelist is the list of file names belonging to the stack
@@ -79,7 +310,17 @@ class HDF5Stack1D(DataObject.DataObject):
                  /whatever1/whatever2/counts
                  That means scanlist = ["/whatever1"]
                  and               selection['y'] = "/whatever2/counts"
+        virtual  if True, the spectra are not loaded into memory. The stack
+                 data is an HDF5VirtualStack reading them on access.
+                 It is also the fallback when a stack of spectra spread
+                 over several files does not fit into memory.
+        nworkers is the number of processes reading the files in parallel.
+                 None means 1 and a value below 1 means one per CPU.
         """
+        if nworkers is None:
+            nworkers = 1
+        elif nworkers < 1:
+            nworkers = multiprocessing.cpu_count()
         if DEBUG:
             print("filelist = ", filelist)
             print("selection = ", selection)
@@ -273,6 +514,8 @@ class HDF5Stack1D(DataObject.DataObject):
                         raise MemoryError("Force dynamic loading")
                 else:
                     raise MemoryError("Force dynamic loading")
+            if virtual and (mcaIndex != 0):
+                raise MemoryError("Virtual stack requested")
             if (mcaIndex == 0) and ( nFiles == 1) and (nScans == 1):
                 #keep the original arrangement but in memory
                 self.data = numpy.zeros(yDataset.shape, self.__dtype)
@@ -283,7 +526,32 @@ class HDF5Stack1D(DataObject.DataObject):
             DONE = False
         except (MemoryError, ValueError):
             #some versions report ValueError instead of MemoryError
-            if (nFiles == 1) and (len(shape) == 3):
+            if (mcaIndex != 0) and (virtual or (nFiles > 1) or \
+                                    (len(shape) != 3)):
+                # only build an index of the spectra in the files
+                datasets = self.__getSpectraPaths(hdfStack, scanlist,
+                                                  JUST_KEYS, ySelection,
+                                                  mSelection, xSelection)
+                segments = []
+                for hdf, ypath, mpath, xpath in datasets:
+                    yDataset = hdf[ypath]
+                    monitor = None
+                    if mpath is not None:
+                        monitor = getMonitorData(hdf[mpath][()],
+                                    getNumberOfSpectra(yDataset.shape,
+                                                       mcaDim),
+                                    mcaDim)
+                    segments.append((yDataset, monitor))
+                    if xpath is not None:
+                        xDataset = hdf[xpath][()]
+                self.data = HDF5VirtualStack(segments,
+                                             (dim0, dim1, mcaDim),
+                                             self.__dtype,
+                                             reference=hdfStack)
+                self.info["McaIndex"] = 2
+                mcaIndex = 2
+                DONE = True
+            elif (nFiles == 1) and (len(shape) == 3):
                 print("Attempting dynamic loading")
                 self.data = yDataset
                 if mSelection is not None:
@@ -292,16 +560,31 @@ class HDF5Stack1D(DataObject.DataObject):
                 if xSelection is not None:
                     xDataset = tmpHdf[xpath].value
                     self.x = [xDataset]
-                if h5py.version.version < '2.0':
-                    #prevent automatic closing keeping a reference
-                    #to the open file
-                    self._fileReference = hdfStack
+                #prevent the release of the file keeping a reference
+                #to the source
+                self._fileReference = hdfStack
                 DONE = True
             else:
                 #what to do if the number of dimensions is only 2?
                 raise
         
-        if (not DONE) and (not considerAsImages):
+        if (not DONE) and (not considerAsImages) and (mcaIndex != 0):
+            self.info["McaIndex"] = 2
+            datasets = self.__getSpectraPaths(hdfStack, scanlist, JUST_KEYS,
+                                              ySelection, mSelection,
+                                              xSelection)
+            if dim0 == 1:
+                self.onBegin(dim1)
+            else:
+                self.onBegin(dim0)
+            self.incrProgressBar=0
+            self.__readSpectraPaths(datasets, mcaDim, dim0, dim1,
+                                    nworkers=nworkers)
+            if xSelection is not None:
+                hdf, ypath, mpath, xpath = datasets[-1]
+                xDataset = hdf[xpath][()]
+            self.onEnd()
+        elif (not DONE) and (not considerAsImages):
             self.info["McaIndex"] = 2
             n = 0
 
@@ -355,133 +638,74 @@ class HDF5Stack1D(DataObject.DataObject):
                     for dim in yDataset.shape:
                         nMcaInYDataset *= dim
                     nMcaInYDataset = int(nMcaInYDataset/mcaDim)
-                    if mcaIndex != 0:
-                        if IN_MEMORY:
-                            yDataset.shape = -1, mcaDim
-                        if mSelection is not None:
-                            case = -1
-                            nMonitorData = 1
-                            for  v in mDataset.shape:
-                                nMonitorData *= v
-                            if nMonitorData == nMcaInYDataset:
-                                mDataset.shape = nMcaInYDataset
-                                case = 0
-                            elif nMonitorData == (nMcaInYDataset * mcaDim):
-                                case = 1
-                                mDataset.shape = nMcaInYDataset, mcaDim
-                            if case == -1:
-                                raise ValueError(\
-                                    "I do not know how to handle this monitor data")
-                        if (len(yDataset.shape) == 3) and\
-                           (dim1 == yDataset.shape[1]):
-                            mca = 0
-                            deltaI = int(yDataset.shape[1]/dim1)
-                            for ii in range(yDataset.shape[0]):
-                                i = int(n/dim1)
-                                yData = yDataset[ii:(ii+1)]
-                                yData.shape = -1, mcaDim
-                                if mSelection is not None:
-                                    if case == 0:
-                                        mData = numpy.outer(mDataset[mca:(mca+dim1)],
-                                                            numpy.ones((mcaDim)))
-                                        self.data[i, :, :] = yData/mData
-                                    elif case == 1:
-                                        mData = mDataset[mca:(mca+dim1), :]
-                                        mData.shape = -1, mcaDim
-                                        self.data[i, :, :]  = yData/mData
-                                else:
-                                    self.data[i:(i+deltaI), :] = yData
-                                n += yDataset.shape[1]
-                                mca += dim1
-                        else:
-                            for mca in range(nMcaInYDataset):
+                    if mSelection is not None:
+                        case = -1
+                        nMonitorData = 1
+                        for  v in mDataset.shape:
+                            nMonitorData *= v
+                        if nMonitorData == yDataset.shape[0]:
+                            case = 3
+                            mDataset.shape = yDataset.shape[0]
+                        elif nMonitorData == nMcaInYDataset:
+                            mDataset.shape = nMcaInYDataset
+                            case = 0
+                        #elif nMonitorData == (yDataset.shape[1] * yDataset.shape[2]):
+                        #    case = 1
+                        #    mDataset.shape = yDataset.shape[1], yDataset.shape[2]
+                        if case == -1:
+                            raise ValueError(\
+                                "I do not know how to handle this monitor data")
+                    if IN_MEMORY:
+                        yDataset.shape = mcaDim, -1
+                    if len(yDataset.shape) != 3:
+                        for mca in range(nMcaInYDataset):
+                            i = int(n/dim1)
+                            j = n % dim1
+                            if len(yDataset.shape) == 3:
+                                ii = int(mca/yDataset.shape[2])
+                                jj = mca % yDataset.shape[2]
+                                yData = yDataset[:, ii, jj]
+                            elif len(yDataset.shape) == 2:
+                                yData = yDataset[:, mca]
+                            elif len(yDataset.shape) == 1:
+                                yData = yDataset[:]                            
+                            if mSelection is not None:
+                                if case == 0:
+                                    self.data[i, j, :] = yData/mDataset[mca]
+                                elif case == 1:
+                                    self.data[i, j, :]  = yData/mDataset[:, mca]
+                                elif case == 3:
+                                    self.data[i, j, :]  = yData/mDataset
+                            else:
+                                self.data[i, j, :] = yData
+                            n += 1
+                    else:
+                        #stack of images to be read as MCA
+                        for nImage in range(yDataset.shape[0]):
+                            tmp = yDataset[nImage:(nImage+1)]
+                            if len(tmp.shape) == 3:
                                 i = int(n/dim1)
                                 j = n % dim1
-                                if len(yDataset.shape) == 3:
-                                    ii = int(mca/yDataset.shape[1])
-                                    jj = mca % yDataset.shape[1]
-                                    yData = yDataset[ii, jj]
-                                elif len(yDataset.shape) == 2:
-                                    yData = yDataset[mca,:]
-                                elif len(yDataset.shape) == 1:
-                                    yData = yDataset
-                                if mSelection is not None:
-                                    if case == 0:
-                                        self.data[i, j, :] = yData/mDataset[mca]
-                                    elif case == 1:
-                                        self.data[i, j, :]  = yData/mDataset[mca, :]
+                                if 0:
+                                    #this loop is extremely SLOW!!!(and useless)
+                                    for ii in range(tmp.shape[1]):
+                                        for jj in range(tmp.shape[2]):
+                                            self.data[i+ii, j+jj, nImage] = tmp[0, ii, jj]
                                 else:
-                                    self.data[i, j, :] = yData
-                                n += 1
-                    else:
+                                    self.data[i:i+tmp.shape[1],
+                                              j:j+tmp.shape[2], nImage] = tmp[0]
                         if mSelection is not None:
-                            case = -1
-                            nMonitorData = 1
-                            for  v in mDataset.shape:
-                                nMonitorData *= v
-                            if nMonitorData == yDataset.shape[0]:
-                                case = 3
-                                mDataset.shape = yDataset.shape[0]
-                            elif nMonitorData == nMcaInYDataset:
-                                mDataset.shape = nMcaInYDataset
-                                case = 0
-                            #elif nMonitorData == (yDataset.shape[1] * yDataset.shape[2]):
-                            #    case = 1
-                            #    mDataset.shape = yDataset.shape[1], yDataset.shape[2]
-                            if case == -1:
-                                raise ValueError(\
-                                    "I do not know how to handle this monitor data")
-                        if IN_MEMORY:
-                            yDataset.shape = mcaDim, -1
-                        if len(yDataset.shape) != 3:
-                            for mca in range(nMcaInYDataset):
+                            for mca in range(yDataset.shape[0]):
                                 i = int(n/dim1)
                                 j = n % dim1
-                                if len(yDataset.shape) == 3:
-                                    ii = int(mca/yDataset.shape[2])
-                                    jj = mca % yDataset.shape[2]
-                                    yData = yDataset[:, ii, jj]
-                                elif len(yDataset.shape) == 2:
-                                    yData = yDataset[:, mca]
-                                elif len(yDataset.shape) == 1:
-                                    yData = yDataset[:]                            
-                                if mSelection is not None:
-                                    if case == 0:
-                                        self.data[i, j, :] = yData/mDataset[mca]
-                                    elif case == 1:
-                                        self.data[i, j, :]  = yData/mDataset[:, mca]
-                                    elif case == 3:
-                                        self.data[i, j, :]  = yData/mDataset
-                                else:
-                                    self.data[i, j, :] = yData
+                                yData = self.data[i, j, :]
+                                if case == 0:
+                                    self.data[i, j, :] = yData/mDataset[mca]
+                                elif case == 1:
+                                    self.data[i, j, :]  = yData/mDataset[:, mca]
                                 n += 1
                         else:
-                            #stack of images to be read as MCA
-                            for nImage in range(yDataset.shape[0]):
-                                tmp = yDataset[nImage:(nImage+1)]
-                                if len(tmp.shape) == 3:
-                                    i = int(n/dim1)
-                                    j = n % dim1
-                                    if 0:
-                                        #this loop is extremely SLOW!!!(and useless)
-                                        for ii in range(tmp.shape[1]):
-                                            for jj in range(tmp.shape[2]):
-                                                self.data[i+ii, j+jj, nImage] = tmp[0, ii, jj]
-                                    else:
-                                        self.data[i:i+tmp.shape[1],
-                                                  j:j+tmp.shape[2], nImage] = tmp[0]
-                            if mSelection is not None:
-                                for mca in range(yDataset.shape[0]):
-                                    i = int(n/dim1)
-                                    j = n % dim1
-                                    yData = self.data[i, j, :]
-                                    if case == 0:
-                                        self.data[i, j, :] = yData/mDataset[mca]
-                                    elif case == 1:
-                                        self.data[i, j, :]  = yData/mDataset[:, mca]
-                                    n += 1
-                            else:
-                                n += tmp.shape[1] * tmp.shape[2]
+                            n += tmp.shape[1] * tmp.shape[2]
                     if dim0 == 1:
                         self.onProgress(j)
                 if dim0 != 1:
@@ -557,7 +781,95 @@ class HDF5Stack1D(DataObject.DataObject):
                 self.x = [xDataset.reshape(-1)]
             else:
                 print("Ignoring xSelection")
+        if not isinstance(self.data, (HDF5VirtualStack, h5py.Dataset)):
+            # the data are in memory, give back the files
+            hdfStack.close()
+
 
+    def __getSpectraPaths(self, hdfStack, scanlist, JUST_KEYS,
+                          ySelection, mSelection, xSelection):
+        """
+        Returns a list of (hdf, ypath, mpath, xpath) in stack order, with
+        mpath and xpath set to None when there is no such selection.
+        """
+        datasets = []
+        for hdf in hdfStack._sourceObjectList:
+            entryNames = list(hdf["/"].keys())
+            goodEntryNames = []
+            for entry in entryNames:
+                tmpPath = "/" + entry
+                if hasattr(hdf[tmpPath], "keys"):
+                    goodEntryNames.append(entry)
+            for scan in scanlist:
+                if JUST_KEYS:
+                    root = goodEntryNames[int(scan.split(".")[-1])-1]
+                else:
+                    root = scan
+                mpath = None
+                xpath = None
+                if mSelection is not None:
+                    mpath = root + mSelection
+                if xSelection is not None:
+                    xpath = root + xSelection
+                datasets.append((hdf, root + ySelection, mpath, xpath))
+        return datasets
+
+    def __readSpectraPaths(self, datasets, mcaDim, dim0, dim1, nworkers=1):
+        # all the spectra in stack order
+        output = self.data.reshape(-1, mcaDim)
+        tasks = []
+        n = 0
+        for hdf, ypath, mpath, xpath in datasets:
+            nSpectra = getNumberOfSpectra(hdf[ypath].shape, mcaDim)
+            if (n + nSpectra) > output.shape[0]:
+                raise ValueError("Stack shape too small for the data")
+            tasks.append((hdf, ypath, mpath, n, nSpectra))
+            n += nSpectra
+        usePool = (nworkers > 1) and (len(tasks) > 1)
+        if usePool:
+            # the files have to be reopened by the workers
+            for task in tasks:
+                if task[0].driver not in [None, "sec2"]:
+                    usePool = False
+                    break
+        if usePool:
+            # the workers fill the stack data placed into shared memory
+            context = _getContext()
+            dtype = self.data.dtype
+            buffer = context.RawArray('b', max(1, self.data.size * \
+                                                  dtype.itemsize))
+            self.data = numpy.frombuffer(buffer, dtype=dtype,
+                            count=self.data.size).reshape(self.data.shape)
+            output = self.data.reshape(-1, mcaDim)
+            pool = context.Pool(min(nworkers, len(tasks)),
+                                initializer=_initReadWorker,
+                                initargs=(buffer, dtype.str, output.shape))
+            try:
+                args = [(task[0].filename, task[1], task[2], task[3],
+                         task[4]) for task in tasks]
+                for first, nSpectra in pool.imap(_readSpectraWorker, args):
+                    self.__spectraProgress(first + nSpectra, dim0, dim1)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+            return
+        for hdf, ypath, mpath, first, nSpectra in tasks:
+            yDataset = hdf[ypath]
+            monitor = None
+            if mpath is not None:
+                monitor = getMonitorData(hdf[mpath][()], nSpectra, mcaDim)
+            readSpectra(yDataset, mcaDim, monitor=monitor,
+                        output=output[first:first + nSpectra])
+            self.__spectraProgress(first + nSpectra, dim0, dim1)
+
+    def __spectraProgress(self, n, dim0, dim1):
+        if dim0 == 1:
+            self.onProgress(n - 1)
+        else:
+            self.onProgress(int((n - 1) / dim1))
 
     def getDimensions(self, nFiles, nScans, shape, index=None):
         #some body may want to overwrite this
@@ -39,42 +39,53 @@ import numpy
 from PyMca5.PyMcaCore import DataObject
 
 SOURCE_TYPE = "EdfFileStack"
+NUMBER = re.compile('(-?[0-9]+\.?[0-9]*)')
+NOT_A_NUMBER = re.compile('[^0-9eE.+\-\s]')
+
+def parseNumbers(text):
+    """
+    Return the numbers found in text as a double precision array
+    """
+    if NOT_A_NUMBER.search(text) is None:
+        # only numbers and blanks, numpy can parse it directly
+        return numpy.fromstring(text, dtype=numpy.float64, sep=" ")
+    return numpy.array(NUMBER.findall(text), dtype=numpy.float64)
 
 
 class LuciaMap(DataObject.DataObject):
     def __init__(self, filename, infofile=None):
         DataObject.DataObject.__init__(self)
 
+        # read the file line by line keeping only the parsed spectra
+        header = []
+        spectra = []
         with open(filename, 'r') as f:
-            data = f.read()
-
-        data.replace("\r\n", "\n")
+            for line in f:
+                if not len(line.strip()):
+                    break
+                header.append(line)
+            block = []
+            for line in f:
+                text = line.strip()
+                if len(text) and (text.strip('-') == ''):
+                    #the '----' lines are the separators
+                    self.__appendSpectrum(spectra, block)
+                    block = []
+                else:
+                    block.append(line)
+            self.__appendSpectrum(spectra, block)
+        if not len(spectra):
+            raise IOError("No spectrum found in file %s" % filename)
+        header = "".join(header)
+        if header.endswith("\n"):
+            header = header[:-1]
         self.sourceName = [filename]
-        firstByte = data.index("\n\n")
-
-        header = data[0:firstByte]
-        #get rid of the date
-        data = data[firstByte:]
-
-        #leave only the '----' as separator
-        data.replace("\r", "")
-        data.replace("\n", "")
-        sep = '-'
-        while sep in data:
-            sep = sep + '-'
-        sep = sep[1:]
-        data = data.split(sep)
-        if len(data[0]) != len(data[-1]):
-            if len(data[0]) > 1:
-                del data[-1]
-            else:
-                del data[0]
 
         #get the number of channels
-        exp = re.compile('(-?[0-9]+\.?[0-9]*)')
-        spectrum = [float(x) for x in exp.findall(data[0])]
-        self.nChannels = len(spectrum)
-        self.nSpectra = len(data)
+        if len(spectra[0]) != len(spectra[-1]):
+            del spectra[-1]
+        self.nChannels = len(spectra[0])
+        self.nSpectra = len(spectra)
         self.nRows = self.nSpectra
 
         #try to get the information
@@ -108,19 +119,17 @@ class LuciaMap(DataObject.DataObject):
         self.__nImagesPerFile = 1
 
         #self.nRows = 41
-        self.nCols = self.nSpectra / self.nRows
+        self.nCols = int(self.nSpectra / self.nRows)
 
         self.data = numpy.zeros((self.nRows,
                                  self.nCols,
                                  self.nChannels),
                                  numpy.float32)
-        n = 0
-        for i in range(self.nRows):
-            for j in range(self.nCols):
-                s = data[n]
-                spectrum = numpy.array([float(x) for x in exp.findall(s)])
-                self.data[i, j, :] = spectrum[:]
-                n = n + 1
+        view = self.data.reshape(-1, self.nChannels)
+        for n in range(self.nRows * self.nCols):
+            view[n, :] = spectra[n]
+            spectra[n] = None
+        view = None
 
         shape = self.data.shape
         for i in range(len(shape)):
@@ -135,6 +144,11 @@ class LuciaMap(DataObject.DataObject):
         self.info["McaCalib"] = [0.0, 1.0, 0.0]
         self.info["Channel0"] = 0.0
 
+    def __appendSpectrum(self, spectra, lines):
+        spectrum = parseNumbers("".join(lines))
+        if spectrum.size:
+            spectra.append(spectrum.astype(numpy.float32))
+
     def _getInfo(self, filename):
         '''
         This dictionnary is to be internally normalized for the time
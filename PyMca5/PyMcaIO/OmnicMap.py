@@ -33,6 +33,7 @@ __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 import os
 import sys
 import re
+import mmap
 import struct
 import numpy
 import copy
@@ -59,13 +60,33 @@ class OmnicMap(DataObject.DataObject):
             It is expected to work with OMNIC versions 7.x and 8.x
         '''
         DataObject.DataObject.__init__(self)
-        if sys.platform == 'win32':
-            fid = open(filename, 'rb')
-        else:
-            fid = open(filename, 'r')
-        data = fid.read()
+        fid = open(filename, 'rb')
+        try:
+            # the file contents are accessed as a string without reading them
+            data = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            # empty file or mapping not supported
+            data = fid.read()
         fid.close()
+        try:
+            self._readMapData(filename, data)
+        finally:
+            if hasattr(data, "close"):
+                try:
+                    data.close()
+                except BufferError:
+                    # a view of the mapping is kept by a traceback, the
+                    # mapping is released with it
+                    pass
 
+    def _readMapData(self, filename, data):
+        '''
+        Parameters:
+        -----------
+        filename : str
+            Name of the .map file.
+        data : The contents of the .map file
+        '''
         try:
             omnicInfo = self._getOmnicInfo(data)
         except:
@@ -75,7 +96,9 @@ class OmnicMap(DataObject.DataObject):
             searchedChain = "Spectrum "
         else:
             searchedChain = bytes("Spectrum ", 'utf-8')
-        firstByte = data.index(searchedChain)
+        firstByte = data.find(searchedChain)
+        if firstByte < 0:
+            raise ValueError("No spectrum found in file %s" % filename)
         s = data[firstByte:(firstByte + 100 - 16)]
         if sys.version >= '3.0':
             s = str(s)
@@ -99,8 +122,9 @@ class OmnicMap(DataObject.DataObject):
             chain = "Spectrum"
         else:
             chain = bytes("Spectrum", 'utf-8')
-        secondByte = data[(firstByte + 1):].index(chain)
-        secondByte += firstByte + 1
+        secondByte = data.find(chain, firstByte + 1)
+        if secondByte < 0:
+            raise ValueError("Cannot deduce the number of channels")
         if DEBUG:
             print("secondByte = ", secondByte)
         self.nChannels = int((secondByte - firstByte - 100) / 4)
@@ -144,17 +168,23 @@ class OmnicMap(DataObject.DataObject):
         self.__nImagesPerFile = 1
         offset = firstByte - 16 + 100  # starting position of the data
         delta = 100 + self.nChannels * 4
-        fmt = "%df" % self.nChannels
-        for i in range(self.__nFiles):
-            for j in range(self.nRows):
-                # this approach is inneficient when compared to a direct
-                # data readout, but it allows to deal with nan at the source
-                tmpData = numpy.zeros((self.nChannels,), dtype=numpy.float32)
-                tmpData[:] = struct.unpack(fmt,\
-                                data[offset:(offset + delta - 100)])
-                finiteData = numpy.isfinite(tmpData)
-                self.data[i, j, finiteData] = tmpData[finiteData]
-                offset = int(offset + delta)
+        nSpectra = self.__nFiles * self.nRows
+        # spectra are at fixed distance from each other, access the
+        # channels through a strided view of the mapped file
+        spectra = numpy.ndarray((nSpectra, self.nChannels),
+                                dtype=numpy.float32,
+                                buffer=data,
+                                offset=offset,
+                                strides=(delta, 4))
+        view = self.data.reshape(nSpectra, self.nChannels)
+        # copy by blocks of about 16 Mbytes dealing with nan at the source
+        step = max(1, int((16 * 1024 * 1024) / delta))
+        for i in range(0, nSpectra, step):
+            tmpData = view[i:(i + step)]
+            tmpData[:] = spectra[i:(i + step)]
+            tmpData[~numpy.isfinite(tmpData)] = 0.0
+        spectra = None
+        view = None
         shape = self.data.shape
         for i in range(len(shape)):
             key = 'Dim_%d' % (i + 1,)
@@ -236,19 +266,18 @@ class OmnicMap(DataObject.DataObject):
             chain = 'Position'
         else:
             chain = bytes('Position', 'utf-8')
-        offset = data.index(chain)
+        offset = data.find(chain)
+        if offset < 0:
+            raise ValueError("Position information not found")
+        # only the first two occurrences are needed
         positions = [offset]
-        while True:
-            try:
-                a = data[(offset + 1):].index(chain)
-                offset = a + offset + 1
-                positions.append(offset)
-            except ValueError:
-                break
+        offset = data.find(chain, offset + 1)
+        if offset >= 0:
+            positions.append(offset)
 
         ddict = {}
         #map description position
-        if (positions[1] - positions[0]) == 66:  # reverse engineered magic number :-)
+        if (len(positions) > 1) and ((positions[1] - positions[0]) == 66):  # reverse engineered magic number :-)
             mapDescriptionOffset = positions[0] - 90
             mapDescription = struct.unpack('6f', data[mapDescriptionOffset:mapDescriptionOffset + 24])
             y0, y1, deltaY, x0, x1, deltaX = mapDescription
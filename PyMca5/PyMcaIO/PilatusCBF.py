@@ -48,6 +48,11 @@ if sys.version < '3':
 else:
     import io
     _fileClass = io.IOBase
+try:
+    from PyMca5.PyMcaIO import PyMcaIOHelper
+    HELPER = True
+except ImportError:
+    HELPER = False
 
 DEBUG = False
 
@@ -165,7 +170,7 @@ class PilatusCBF(object):
                 # encoding with utf-8 does not work
                 key16 = "\x80".encode('latin-1')
                 key32 = "\x00\x80".encode('latin-1')
-                key64 = "\x00\x040\x00\x80".encode('latin-1')
+                key64 = "\x00\x00\x00\x80".encode('latin-1')
 #            idx = 0
             shift = 1
 #            position = 0
@@ -206,6 +211,9 @@ class PilatusCBF(object):
             starter = "\x0c\x1a\x04\xd5".encode('latin-1')
         startPos = inStream.find(starter) + 4
         data = inStream[ startPos: startPos + int(self.__header["X-Binary-Size"])]
+        if HELPER and ((sys.version < '3.0') or not isinstance(data, str)):
+            # single pass decoding into an int32 array without holding the GIL
+            return PyMcaIOHelper.decodeByteOffset(data, self.dim1 * self.dim2)
         myData = np.hstack(analyse(data)).cumsum()
 
         assert len(myData) == self.dim1 * self.dim2
@@ -241,7 +249,10 @@ class PilatusCBF(object):
             logging.warning("Defaulting type to int32")
 
         if self.__header["conversions"] == "x-CBF_BYTE_OFFSET":
-            self.__data = self._readbinary_byte_offset(self.cif["_array_data.data"]).astype(bytecode).reshape((self.dim2, self.dim1))
+            self.__data = self._readbinary_byte_offset(self.cif["_array_data.data"])
+            if self.__data.dtype != bytecode:
+                self.__data = self.__data.astype(bytecode)
+            self.__data.shape = self.dim2, self.dim1
         else:
             raise Exception(IOError, "Compression scheme not yet supported, please contact FABIO development team")
         self.__info = self.__header
@@ -33,6 +33,7 @@
 
 #include <./numpy/arrayobject.h>
 #include <stdio.h>
+#include <string.h>
 
 struct module_state {
     PyObject *error;
@@ -49,6 +50,8 @@ static struct module_state _state;
 
 static PyObject *PyMcaIOHelper_fillSupaVisio(PyObject *dummy, PyObject *args);
 static PyObject *PyMcaIOHelper_readAifira(PyObject *dummy, PyObject *args);
+static PyObject *PyMcaIOHelper_decodeByteOffset(PyObject *dummy, PyObject *args);
+static PyObject *PyMcaIOHelper_decodePackBits(PyObject *dummy, PyObject *args);
 
 /* Functions */
 
@@ -189,11 +192,206 @@ PyMcaIOHelper_readAifira(PyObject *self, PyObject *args)
     return PyArray_Return(outputArray);
 }
 
+/* CBF byte-offset decompression.
+   Each pixel is stored as the difference with respect to the previous one.
+   The difference is a signed byte unless it is the escape value 0x80, in
+   which case a little endian 16-bit integer follows. The escape value of
+   the 16-bit integer (-32768) announces a 32-bit integer and the escape
+   value of the 32-bit integer announces a 64-bit one. */
+static PyObject *
+PyMcaIOHelper_decodeByteOffset(PyObject *self, PyObject *args)
+{
+    Py_buffer input;
+    Py_ssize_t nPixels;
+    PyArrayObject *outputArray;
+    npy_intp dimensions[1];
+    const unsigned char *p, *end;
+    npy_int32 *outputPointer;
+    npy_int64 value, delta;
+    npy_uint64 raw;
+    Py_ssize_t n;
+    int i, truncated;
+    struct module_state *st = GETSTATE(self);
+
+#if PY_MAJOR_VERSION >= 3
+    if (!PyArg_ParseTuple(args, "y*n", &input, &nPixels))
+#else
+    if (!PyArg_ParseTuple(args, "s*n", &input, &nPixels))
+#endif
+        return NULL;
+    if (nPixels < 0)
+    {
+        PyBuffer_Release(&input);
+        PyErr_SetString(st->error, "Number of pixels cannot be negative");
+        return NULL;
+    }
+    dimensions[0] = nPixels;
+    outputArray = (PyArrayObject *) PyArray_SimpleNew(1, dimensions, NPY_INT32);
+    if (outputArray == NULL)
+    {
+        PyBuffer_Release(&input);
+        return NULL;
+    }
+
+    /* Do the job */
+    outputPointer = (npy_int32 *) PyArray_DATA(outputArray);
+    p = (const unsigned char *) input.buf;
+    end = p + input.len;
+    value = 0;
+    n = 0;
+    truncated = 0;
+    Py_BEGIN_ALLOW_THREADS
+    while ((n < nPixels) && (p < end))
+    {
+        if (*p != 0x80)
+        {
+            delta = (signed char) *p;
+            p += 1;
+        }
+        else
+        {
+            if ((end - p) < 3)
+            {
+                truncated = 1;
+                break;
+            }
+            delta = (npy_int16) (p[1] | (p[2] << 8));
+            p += 3;
+            if (delta == -32768)
+            {
+                if ((end - p) < 4)
+                {
+                    truncated = 1;
+                    break;
+                }
+                raw = 0;
+                for (i = 3; i >= 0; i--)
+                    raw = (raw << 8) | p[i];
+                delta = (npy_int32) raw;
+                p += 4;
+                if (delta == NPY_MIN_INT32)
+                {
+                    if ((end - p) < 8)
+                    {
+                        truncated = 1;
+                        break;
+                    }
+                    raw = 0;
+                    for (i = 7; i >= 0; i--)
+                        raw = (raw << 8) | p[i];
+                    delta = (npy_int64) raw;
+                    p += 8;
+                }
+            }
+        }
+        value += delta;
+        outputPointer[n++] = (npy_int32) value;
+    }
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&input);
+
+    if (truncated || (n < nPixels))
+    {
+        Py_DECREF(outputArray);
+        PyErr_SetString(st->error, "Byte offset stream too short for the requested number of pixels");
+        return NULL;
+    }
+    return PyArray_Return(outputArray);
+}
+
+/* PackBits decompression as used by TIFF files.
+   A header byte n in [0, 127] is followed by n + 1 literal bytes, a header
+   byte n in [-127, -1] is followed by one byte to be repeated 1 - n times
+   and -128 is a no operation. The output is written into the supplied
+   writable buffer and the number of written bytes is returned. */
+static PyObject *
+PyMcaIOHelper_decodePackBits(PyObject *self, PyObject *args)
+{
+    Py_buffer input, output;
+    const unsigned char *p, *end;
+    unsigned char *q, *outputEnd;
+    Py_ssize_t count;
+    int n, overflow, truncated;
+    struct module_state *st = GETSTATE(self);
+
+#if PY_MAJOR_VERSION >= 3
+    if (!PyArg_ParseTuple(args, "y*w*", &input, &output))
+#else
+    if (!PyArg_ParseTuple(args, "s*w*", &input, &output))
+#endif
+        return NULL;
+
+    /* Do the job */
+    p = (const unsigned char *) input.buf;
+    end = p + input.len;
+    q = (unsigned char *) output.buf;
+    outputEnd = q + output.len;
+    overflow = 0;
+    truncated = 0;
+    Py_BEGIN_ALLOW_THREADS
+    while ((p < end) && (q < outputEnd))
+    {
+        n = (signed char) *p++;
+        if (n >= 0)
+        {
+            count = n + 1;
+            if ((end - p) < count)
+            {
+                truncated = 1;
+                break;
+            }
+            if ((outputEnd - q) < count)
+            {
+                overflow = 1;
+                break;
+            }
+            memcpy(q, p, count);
+            p += count;
+            q += count;
+        }
+        else if (n > -128)
+        {
+            count = 1 - n;
+            if (p >= end)
+            {
+                truncated = 1;
+                break;
+            }
+            if ((outputEnd - q) < count)
+            {
+                overflow = 1;
+                break;
+            }
+            memset(q, *p, count);
+            p += 1;
+            q += count;
+        }
+    }
+    Py_END_ALLOW_THREADS
+    count = q - (unsigned char *) output.buf;
+    PyBuffer_Release(&input);
+    PyBuffer_Release(&output);
+
+    if (truncated)
+    {
+        PyErr_SetString(st->error, "Truncated PackBits stream");
+        return NULL;
+    }
+    if (overflow)
+    {
+        PyErr_SetString(st->error, "PackBits stream exceeds output buffer size");
+        return NULL;
+    }
+    return PyLong_FromSsize_t(count);
+}
+
 /* Module methods */
 
 static PyMethodDef PyMcaIOHelper_methods[] = {
     {"fillSupaVisio", PyMcaIOHelper_fillSupaVisio, METH_VARARGS},
     {"readAifira", PyMcaIOHelper_readAifira, METH_VARARGS},
+    {"decodeByteOffset", PyMcaIOHelper_decodeByteOffset, METH_VARARGS},
+    {"decodePackBits", PyMcaIOHelper_decodePackBits, METH_VARARGS},
 	{NULL, NULL}
 };
 
@@ -255,6 +453,8 @@ initPyMcaIOHelper(void)
         Py_DECREF(module);
         INITERROR;
     }
+    Py_INCREF(st->error);
+    PyModule_AddObject(module, "Error", st->error);
     import_array();
 
 #if PY_MAJOR_VERSION >= 3
@@ -39,6 +39,40 @@ import numpy
 DEBUG = 0
 ALLOW_MULTIPLE_STRIPS = False
 
+try:
+    from PyMca5.PyMcaIO.PyMcaIOHelper import decodePackBits
+except ImportError:
+    def decodePackBits(data, output):
+        """
+        Decode the PackBits compressed data into the output buffer.
+
+        Pure python fallback of PyMcaIOHelper.decodePackBits returning
+        the number of bytes written.
+        """
+        data = numpy.frombuffer(data, numpy.uint8)
+        chunks = []
+        readBytes = 0
+        nBytes = data.size
+        while readBytes < nBytes:
+            n = int(data[readBytes])
+            if n > 127:
+                n -= 256
+            readBytes += 1
+            if n >= 0:
+                chunks.append(data[readBytes:readBytes + n + 1])
+                readBytes += n + 1
+            elif n > -128:
+                chunks.append(numpy.repeat(data[readBytes:readBytes + 1], 1 - n))
+                readBytes += 1
+        if len(chunks):
+            decoded = numpy.concatenate(chunks)
+        else:
+            decoded = numpy.zeros((0,), numpy.uint8)
+        if decoded.size > len(output):
+            raise IOError("PackBits stream exceeds output buffer size")
+        output[:decoded.size] = decoded
+        return decoded.size
+
 TAG_ID  = { 256:"NumberOfColumns",           # S or L ImageWidth
             257:"NumberOfRows",              # S or L ImageHeight
             258:"BitsPerSample",             # S Number of bits per component
@@ -105,7 +139,8 @@ SAMPLE_FORMAT_COMPLEXIEEEFP = 6
 
 
 class TiffIO(object):
-    def __init__(self, filename, mode=None, cache_length=20, mono_output=False):
+    def __init__(self, filename, mode=None, cache_length=20, mono_output=False,
+                 memmap=False):
         if mode is None:
             mode = 'rb'
         if 'b' not in mode:
@@ -128,6 +163,7 @@ class TiffIO(object):
         self._initInternalVariables(fd)
         self._maxImageCacheLength = cache_length
         self._forceMonoOutput = mono_output
+        self._memmap = memmap
 
     def _initInternalVariables(self, fd=None):
         if fd is None:
@@ -626,6 +662,12 @@ class TiffIO(object):
                 raise ValueError("Unsupported number of bits for signed int: %s" % (nBits,))
         else:
             raise ValueError("Unsupported combination. Bits = %s  Format = %d" % (nBits, sampleFormat))
+        if self._memmap and (rowMin == 0) and (rowMax == (nRows - 1)):
+            image = self._getMemmap(info, dtype)
+            if image is not None:
+                if close:
+                    self.__makeSureFileIsClosed()
+                return image
         if hasattr(nBits, 'index'):
             image = numpy.zeros((nRows, nColumns, len(nBits)), dtype=dtype)
         elif colormap is not None:
@@ -640,8 +682,7 @@ class TiffIO(object):
         rowsPerStrip = info["rowsPerStrip"]
         stripByteCounts = info["stripByteCounts"] #bytes in strip since I do not support compression
 
-        rowStart = 0
-        if len(stripOffsets) == 1:
+        if (len(stripOffsets) == 1) and (compression_type != 32773):
             bytesPerRow = int(stripByteCounts[0]/rowsPerStrip)
             fd.seek(stripOffsets[0] + rowMin * bytesPerRow)
             nBytes = (rowMax-rowMin+1) * bytesPerRow
@@ -657,85 +698,34 @@ class TiffIO(object):
                 readout.shape = -1, nColumns
             image[rowMin:rowMax+1, :] = readout
         else:
-            for i in range(len(stripOffsets)):
-                #the amount of rows
-                nRowsToRead = rowsPerStrip
-                rowEnd = int(min(rowStart+nRowsToRead, nRows))
-                if rowEnd < rowMin:
-                    rowStart += nRowsToRead
-                    continue
-                if (rowStart > rowMax):
-                    break
-                #we are in position
-                fd.seek(stripOffsets[i])
-                #the amount of bytes to read
-                nBytes = stripByteCounts[i]
-                if compression_type == 32773:
-                    try:
-                        bufferBytes = bytes()
-                    except:
-                        #python 2.5 ...
-                        bufferBytes = ""
-                    #packBits
-                    readBytes = 0
-                    #intermediate buffer
-                    tmpBuffer = fd.read(nBytes)
-                    while readBytes < nBytes:
-                        n = struct.unpack('b', tmpBuffer[readBytes:(readBytes+1)])[0]
-                        readBytes += 1
-                        if n >= 0:
-                            #should I prevent reading more than the
-                            #length of the chain? Let's python raise
-                            #the exception...
-                            bufferBytes +=  tmpBuffer[readBytes:\
-                                                      readBytes+(n+1)]
-                            readBytes += (n+1)
-                        elif n > -128:
-                            bufferBytes += (-n+1) * tmpBuffer[readBytes:(readBytes+1)]
-                            readBytes += 1
-                        else:
-                            #if read -128 ignore the byte
-                            continue
-                    if self._swap:
-                        readout = numpy.fromstring(bufferBytes, dtype).byteswap()
-                    else:
-                        readout = numpy.fromstring(bufferBytes, dtype)
-                    if hasattr(nBits, 'index'):
-                        readout.shape = -1, nColumns, len(nBits)
-                    elif info['colormap'] is not None:
-                        readout = colormap[readout]
-                        readout.shape = -1, nColumns, 3
-                    else:
-                        readout.shape = -1, nColumns
-                    image[rowStart:rowEnd, :] = readout
-                else:
-                    if 1:
-                        #use numpy
-                        if self._swap:
-                            readout = numpy.fromstring(fd.read(nBytes), dtype).byteswap()
-                        else:
-                            readout = numpy.fromstring(fd.read(nBytes), dtype)
-                        if hasattr(nBits, 'index'):
-                            readout.shape = -1, nColumns, len(nBits)
-                        elif colormap is not None:
-                            readout = colormap[readout]
-                            readout.shape = -1, nColumns, 3
-                        else:
-                            readout.shape = -1, nColumns
-                        image[rowStart:rowEnd, :] = readout
-                    else:
-                        #using struct
-                        readout = numpy.array(struct.unpack(st+"%df" % int(nBytes/4), fd.read(nBytes)),
-                                              dtype=dtype)
-                        if hasattr(nBits, 'index'):
-                            readout.shape = -1, nColumns, len(nBits)
-                        elif colormap is not None:
-                            readout = colormap[readout]
-                            readout.shape = -1, nColumns, 3
-                        else:
-                            readout.shape = -1, nColumns
-                        image[rowStart:rowEnd, :] = readout
-                rowStart += nRowsToRead
+            # gather all the strips containing the requested rows into
+            # a single buffer and convert them in one go
+            rowsPerStrip = int(min(rowsPerStrip, nRows))
+            firstStrip = int(rowMin // rowsPerStrip)
+            lastStrip = int(min(rowMax // rowsPerStrip, len(stripOffsets) - 1))
+            rowStart = firstStrip * rowsPerStrip
+            rowEnd = int(min((lastStrip + 1) * rowsPerStrip, nRows))
+            bytesPerRow = nColumns * numpy.dtype(dtype).itemsize
+            if hasattr(nBits, 'index'):
+                bytesPerRow *= len(nBits)
+            buffer = numpy.empty(((rowEnd - rowStart) * bytesPerRow,),
+                                 dtype=numpy.uint8)
+            self._readStrips(fd, buffer,
+                             stripOffsets[firstStrip:lastStrip + 1],
+                             stripByteCounts[firstStrip:lastStrip + 1],
+                             rowsPerStrip * bytesPerRow,
+                             packBits=(compression_type == 32773))
+            readout = buffer.view(dtype)
+            if self._swap:
+                readout = readout.byteswap()
+            if hasattr(nBits, 'index'):
+                readout.shape = -1, nColumns, len(nBits)
+            elif colormap is not None:
+                readout = colormap[readout]
+                readout.shape = -1, nColumns, 3
+            else:
+                readout.shape = -1, nColumns
+            image[rowStart:rowEnd, :] = readout
         if close:
             self.__makeSureFileIsClosed()
 
@@ -756,6 +746,79 @@ class TiffIO(object):
 
         return image
 
+    def _getMemmap(self, info, dtype):
+        """
+        Map an uncompressed image stored in contiguous strips.
+
+        Returns None if the image cannot be mapped.
+        """
+        if (self._access is None) or ('+' in self._access):
+            return None
+        if info['compression'] or (info['colormap'] is not None):
+            return None
+        nBits = info["nBits"]
+        shape = [info["nRows"], info["nColumns"]]
+        if hasattr(nBits, 'index'):
+            if self._forceMonoOutput:
+                return None
+            shape.append(len(nBits))
+        dtype = numpy.dtype(dtype)
+        if self._swap:
+            dtype = dtype.newbyteorder()
+        stripOffsets = info["stripOffsets"]
+        stripByteCounts = info["stripByteCounts"]
+        nBytes = dtype.itemsize
+        for n in shape:
+            nBytes *= n
+        if sum(stripByteCounts) < nBytes:
+            return None
+        for i in range(len(stripOffsets) - 1):
+            if stripOffsets[i + 1] != (stripOffsets[i] + stripByteCounts[i]):
+                return None
+        try:
+            return numpy.memmap(self.fd.name, dtype=dtype, mode='c',
+                                offset=stripOffsets[0], shape=tuple(shape))
+        except (ValueError, EnvironmentError):
+            return None
+
+    def _readStrips(self, fd, buffer, stripOffsets, stripByteCounts,
+                    bytesPerStrip, packBits=False):
+        """
+        Read consecutive strips into the supplied uint8 buffer.
+
+        Each strip is expected to hold bytesPerStrip bytes once decoded,
+        except the last one that fills the remaining of the buffer.
+        """
+        nStrips = len(stripOffsets)
+        if packBits:
+            for i in range(nStrips):
+                fd.seek(stripOffsets[i])
+                start = i * bytesPerStrip
+                end = min(start + bytesPerStrip, buffer.size)
+                n = decodePackBits(fd.read(stripByteCounts[i]),
+                                   buffer[start:end])
+                if n != (end - start):
+                    raise IOError("Unexpected PackBits strip length")
+            return
+        contiguous = True
+        for i in range(nStrips - 1):
+            if (stripByteCounts[i] != bytesPerStrip) or \
+               (stripOffsets[i + 1] != (stripOffsets[i] + bytesPerStrip)):
+                contiguous = False
+                break
+        if contiguous:
+            # a single read for all the strips
+            fd.seek(stripOffsets[0])
+            if fd.readinto(buffer) != buffer.size:
+                raise IOError("Unexpected end of file reading strips")
+            return
+        for i in range(nStrips):
+            fd.seek(stripOffsets[i])
+            start = i * bytesPerStrip
+            end = min(start + bytesPerStrip, buffer.size)
+            if fd.readinto(buffer[start:end]) != (end - start):
+                raise IOError("Unexpected end of file reading strips")
+
     def writeImage(self, image0, info=None, software=None, date=None):
         if software is None:
             software = 'PyMca.TiffIO'
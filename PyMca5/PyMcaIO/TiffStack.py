@@ -32,142 +32,185 @@ __license__ = "MIT"
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 import sys
 import os
+import threading
 import numpy
+from collections import OrderedDict
 from PyMca5 import DataObject
 from PyMca5.PyMcaIO import TiffIO
 if sys.version > '2.9':
     long = int
 
 SOURCE_TYPE = "TiffStack"
+# memory used to keep frames of dynamically loaded stacks
+CACHE_SIZE = 256 * 1024 * 1024
+# number of frames read in advance around the accessed ones
+PREFETCH_FRAMES = 4
 
 class TiffArray(object):
-    def __init__(self, filelist, shape, dtype, imagestack=True):
+    """
+    Lazy array view of a set of TIFF images.
+
+    Frames are read on demand and kept in a least recently used cache
+    limited to cache_size bytes. The frames next to the accessed ones
+    are read in a background thread. When only some rows of frames not
+    in the cache are requested, just those rows are read and nothing is
+    cached. Indices along the frame axis are applied independently of the
+    indices applied to the images.
+    """
+    def __init__(self, filelist, shape, dtype, imagestack=True,
+                 cache_size=None, prefetch=PREFETCH_FRAMES):
         self.__fileList    = filelist
         self.__shape       = shape
         self.__dtype       = dtype
         self.__imageStack  = imagestack
         if imagestack:
-            self.__nImagesPerFile = int(shape[0]/len(filelist))
+            self.__frameAxis = 0
         else:
-            self.__nImagesPerFile = int(shape[-1]/len(filelist))
+            self.__frameAxis = len(shape) - 1
+        self.__nFrames = shape[self.__frameAxis]
+        self.__nImagesPerFile = int(self.__nFrames/len(filelist))
         self.__oldFileNumber = -1
+        self.__tmpInstance = None
+        if cache_size is None:
+            cache_size = CACHE_SIZE
+        frameSize = numpy.dtype(dtype).itemsize
+        for i in range(len(shape)):
+            if i != self.__frameAxis:
+                frameSize *= shape[i]
+        self.__maxCachedFrames = max(1, int(cache_size // max(1, frameSize)))
+        self.__prefetch = min(prefetch, self.__maxCachedFrames // 2)
+        self.__cache = OrderedDict()
+        self.__cacheLock = threading.Lock()
+        self.__readLock = threading.Lock()
+        self.__prefetchThread = None
 
     def __getitem__(self, args0):
-        standardSlice = True
-        indices = []
-        outputShape = []
-        scalarArgs = []
-        args = []
-        if not hasattr(args0, "__len__"):
-            args0 = [args0]
-        for i in range(len(self.__shape)):
-            if i < len(args0):
-                args.append(args0[i])
-            else:
-                args.append(slice(None, None, None))
-        for i in range(len(args)):
-            if isinstance(args[i], slice):
-                start = args[i].start
-                stop  = args[i].stop
-                step  = args[i].step
-                if start is None:
-                    start = 0
-                if stop is None:
-                    stop = self.__shape[i]
-                if step is None:
-                    step = 1
-                if step < 1:
-                    raise ValueError("Step must be >= 1 (got %d)" % step)
-                if start is None:
-                    start = 0
-                if start < 0:
-                    start = self.__shape[i]-start
-                if stop < 0:
-                    stop = self.__shape[i]-stop
-                if stop == start:
-                    raise ValueError("Zero-length selections are not allowed")
-                indices.append(list(range(start, stop, step)))
-            elif type(args[i]) == type([]):
-                if len(args[i]):
-                    indices.append([int(x) for x in args[i]])
-                else:
-                    standardSlice = False
-            elif type(args[i]) in [type(1), type(long(1))]:
-                start = args[i]
-                if start < 0:
-                    start = self.__shape[i] - start
-                stop = start + 1
-                step = 1
-                start = args[i]
-                args[i] = slice(start, stop, step)
-                indices.append(list(range(start, stop, step)))
-                scalarArgs.append(i)
+        if not isinstance(args0, tuple):
+            args0 = (args0,)
+        ellipsis = [i for i in range(len(args0)) if args0[i] is Ellipsis]
+        if len(ellipsis):
+            i = ellipsis[0]
+            fill = (slice(None, None, None),) * \
+                   (len(self.__shape) - len(args0) + 1)
+            args0 = args0[:i] + fill + args0[i + 1:]
+        if len(args0) > len(self.__shape):
+            raise IndexError("Too many indices for a %dD array" % \
+                             len(self.__shape))
+        args = list(args0) + [slice(None, None, None)] * \
+               (len(self.__shape) - len(args0))
+        frameArg = args.pop(self.__frameAxis)
+        frameIndices = numpy.arange(self.__nFrames)[frameArg]
+        scalar = (frameIndices.ndim == 0)
+        frameIndices = numpy.atleast_1d(frameIndices)
+        args = tuple(args)
+        # the range of image rows to read if not all of them are needed
+        nRows = self.__shape[1] if self.__imageStack else self.__shape[0]
+        rowIndices = numpy.atleast_1d(numpy.arange(nRows)[args[0]])
+        rows = None
+        if len(rowIndices):
+            rows = int(rowIndices.min()), int(rowIndices.max())
+            if rows == (0, nRows - 1):
+                rows = None
+        frames = []
+        for imageIndex in frameIndices:
+            frames.append(self._getFrame(int(imageIndex), rows=rows)[args])
+        if len(frameIndices) and (rows is None):
+            self.__startPrefetch(int(frameIndices.min()),
+                                 int(frameIndices.max()))
+        if scalar:
+            # do not hand out a view of the cached frame
+            return frames[0].copy()
+        if len(frames):
+            if self.__imageStack:
+                return numpy.array(frames, dtype=self.__dtype)
+            axis = frames[0].ndim
+            return numpy.concatenate([frame[..., numpy.newaxis] \
+                                      for frame in frames], axis=axis)
+        # empty selection, get the output shape without allocating the stack
+        dummy = numpy.lib.stride_tricks.as_strided(\
+                    numpy.zeros((1,), dtype=self.__dtype),
+                    shape=self.__shape,
+                    strides=(0,) * len(self.__shape))
+        return numpy.array(dummy[args0])
+
+    def _getFrame(self, imageIndex, rows=None):
+        """
+        Return the image at imageIndex reading it only if not cached.
+
+        If rows is a (first, last) tuple and the image is not cached, only
+        those rows are read and the image is not cached. The other rows
+        of the returned image are not meaningful.
+        """
+        with self.__cacheLock:
+            if imageIndex in self.__cache:
+                frame = self.__cache.pop(imageIndex)
+                self.__cache[imageIndex] = frame
+                return frame
+        frame = self.__readFrame(imageIndex, rows=rows)
+        if rows is None:
+            self.__storeFrame(imageIndex, frame)
+        return frame
+
+    def __readFrame(self, imageIndex, rows=None):
+        fileNumber = int(imageIndex/self.__nImagesPerFile)
+        imageNumber = imageIndex % self.__nImagesPerFile
+        with self.__readLock:
+            if fileNumber != self.__oldFileNumber:
+                self.__tmpInstance = TiffIO.TiffIO(self.__fileList[fileNumber],
+                                                   cache_length=0)
+                self.__oldFileNumber = fileNumber
+            if rows is None:
+                frame = self.__tmpInstance.getImage(imageNumber)
             else:
-                standardSlice = False
-
-        if not standardSlice:
-            print("args = ", args)
-            raise NotImplemented("__getitem__(self, args) only works on slices")
-
-        if len(indices) < 3:
-            print("input args = ", args0)
-            print("working args = ", args)
-            print("indices = ", indices)
-            raise NotImplemented("__getitem__(self, args) only works on slices")
-        outputShape = [len(indices[0]), len(indices[1]), len(indices[2])]
-        outputArray = numpy.zeros(outputShape, dtype=self.__dtype)
-        # nbFiles = len(self.__fileList)
-        nImagesPerFile = self.__nImagesPerFile
-
-        if self.__imageStack:
-            i = 0
-            rowMin = min(indices[1])
-            rowMax = max(indices[1])
-            for imageIndex in indices[0]:
-                fileNumber = int(imageIndex/nImagesPerFile)
-                if fileNumber != self.__oldFileNumber:
-                    self.__tmpInstance = TiffIO.TiffIO(self.__fileList[fileNumber],
-                                                       mode='rb+')
-                    self.__oldFileNumber = fileNumber
-                imageNumber = imageIndex % nImagesPerFile
-                imageData = self.__tmpInstance.getData(imageNumber,
-                                                       rowMin=rowMin,
-                                                       rowMax=rowMax)
-                try:
-                    outputArray[i,:,:] = imageData[args[1],args[2]]
-                except:
-                    print("outputArray[i,:,:].shape =",outputArray[i,:,:].shape)
-                    print("imageData[args[1],args[2]].shape = " , imageData[args[1],args[2]].shape)
-                    print("input args = ", args0)
-                    print("working args = ", args)
-                    print("indices = ", indices)
-                    print("scalarArgs = ", scalarArgs)
-                    raise
-                i += 1
-        else:
-            i = 0
-            rowMin = min(indices[0])
-            rowMax = max(indices[0])
-            for imageIndex in indices[-1]:
-                fileNumber = int(imageIndex/nImagesPerFile)
-                if fileNumber != self.__oldFileNumber:
-                    self.__tmpInstance = TiffIO.TiffIO(self.__fileList[fileNumber],
-                                                       mode='rb+')
-                    self.__oldFileNumber = fileNumber
-                imageNumber = imageIndex % nImagesPerFile
-                imageData = self.__tmpInstance.getData(imageNumber,
-                                                       rowMin=rowMin,
-                                                       rowMax=rowMax)
-                outputArray[:,:, i] = imageData[args[0],args[1]]
-                i += 1
-        if len(scalarArgs):
-            finalShape = []
-            for i in range(len(outputShape)):
-                if i in scalarArgs:
+                frame = self.__tmpInstance.getData(imageNumber,
+                                                   rowMin=rows[0],
+                                                   rowMax=rows[1])
+        if frame.dtype != self.__dtype:
+            frame = frame.astype(self.__dtype)
+        return frame
+
+    def __storeFrame(self, imageIndex, frame):
+        with self.__cacheLock:
+            self.__cache[imageIndex] = frame
+            while len(self.__cache) > self.__maxCachedFrames:
+                self.__cache.popitem(last=False)
+
+    def __startPrefetch(self, first, last):
+        if self.__prefetch < 1:
+            return
+        if self.__prefetchThread is not None:
+            if self.__prefetchThread.is_alive():
+                return
+        indices = []
+        for i in range(1, self.__prefetch + 1):
+            if (last + i) < self.__nFrames:
+                indices.append(last + i)
+            if (first - i) >= 0:
+                indices.append(first - i)
+        with self.__cacheLock:
+            indices = [i for i in indices if i not in self.__cache]
+        if not len(indices):
+            return
+        self.__prefetchThread = threading.Thread(target=self.__prefetchFrames,
+                                                 args=(indices,))
+        self.__prefetchThread.daemon = True
+        self.__prefetchThread.start()
+
+    def __prefetchFrames(self, indices):
+        for imageIndex in indices:
+            with self.__cacheLock:
+                if imageIndex in self.__cache:
                     continue
-                finalShape.append(outputShape[i])
-            outputArray.shape = finalShape
-        return outputArray
+            try:
+                frame = self.__readFrame(imageIndex)
+            except:
+                # the error will be reported if the frame is requested
+                return
+            with self.__cacheLock:
+                # do not push out of the cache recently used frames
+                if len(self.__cache) >= self.__maxCachedFrames:
+                    return
+            self.__storeFrame(imageIndex, frame)
 
     def getShape(self):
         return self.__shape
@@ -36,6 +36,9 @@ from PyMca5 import SpecfitFuns
 snip1d = SpecfitFuns.snip1d
 snip2d = SpecfitFuns.snip2d
 
+# number of spectra stripped by each call to the compiled SNIP function
+SPECTRA_PER_CALL = 1000
+
 
 def getSpectrumBackground(spectrum, width, roi_min=None, roi_max=None, smoothing=1):
     if roi_min is None:
@@ -49,10 +52,6 @@ def getSpectrumBackground(spectrum, width, roi_min=None, roi_max=None, smoothing
 getSnip1DBackground = getSpectrumBackground
 
 def subtractSnip1DBackgroundFromStack(stack, width, roi_min=None, roi_max=None,  smoothing=1):
-    if roi_min is None:
-        roi_min = 0
-    if roi_max is None:
-        roi_max = len(spectrum)
     mcaIndex = -1
     if hasattr(stack, "info") and hasattr(stack, "data"):
         data = stack.data
@@ -62,32 +61,34 @@ def subtractSnip1DBackgroundFromStack(stack, width, roi_min=None, roi_max=None,
     if not isinstance(data, numpy.ndarray):
         raise TypeError("This Plugin only supports numpy arrays")
     oldShape = data.shape
+    if roi_min is None:
+        roi_min = 0
+    if roi_max is None:
+        roi_max = oldShape[mcaIndex]
     if mcaIndex in [-1, len(data.shape)-1]:
         data.shape = -1, oldShape[-1]
         if roi_min > 0:
             data[:, 0:roi_min] = 0
         if roi_max < oldShape[-1]:
             data[:, roi_max:] = 0
-        for i in range(data.shape[0]):
-            data[i,roi_min:roi_max] -= snip1d(data[i,roi_min:roi_max],
-                                              width, smoothing)
+        for i in range(0, data.shape[0], SPECTRA_PER_CALL):
+            j = min(i + SPECTRA_PER_CALL, data.shape[0])
+            data[i:j, roi_min:roi_max] -= snip1d(data[i:j, roi_min:roi_max],
+                                                 width, smoothing)
         data.shape = oldShape
 
     elif mcaIndex == 0:
         data.shape = oldShape[0], -1
-        for i in range(data.shape[-1]):
-            data[roi_min:roi_max, i] -= snip1d(data[roi_min:roi_max, i],
-                                               width, smoothing)
+        for i in range(0, data.shape[-1], SPECTRA_PER_CALL):
+            j = min(i + SPECTRA_PER_CALL, data.shape[-1])
+            data[roi_min:roi_max, i:j] -= snip1d(data[roi_min:roi_max, i:j].T,
+                                                 width, smoothing).T
         data.shape = oldShape
     else:
         raise ValueError("Invalid 1D index %d" % mcaIndex)
     return
 
 def replaceStackWithSnip1DBackground(stack, width, roi_min=None, roi_max=None,  smoothing=1):
-    if roi_min is None:
-        roi_min = 0
-    if roi_max is None:
-        roi_max = len(spectrum)
     mcaIndex = -1
     if hasattr(stack, "info") and hasattr(stack, "data"):
         data = stack.data
@@ -97,22 +98,28 @@ def replaceStackWithSnip1DBackground(stack, width, roi_min=None, roi_max=None,
     if not isinstance(data, numpy.ndarray):
         raise TypeError("This Plugin only supports numpy arrays")
     oldShape = data.shape
+    if roi_min is None:
+        roi_min = 0
+    if roi_max is None:
+        roi_max = oldShape[mcaIndex]
     if mcaIndex in [-1, len(data.shape)-1]:
         data.shape = -1, oldShape[-1]
         if roi_min > 0:
             data[:, 0:roi_min] = 0
         if roi_max < oldShape[-1]:
             data[:, roi_max:] = 0
-        for i in range(data.shape[0]):
-            data[i,roi_min:roi_max] = snip1d(data[i,roi_min:roi_max],
-                                              width, smoothing)
+        for i in range(0, data.shape[0], SPECTRA_PER_CALL):
+            j = min(i + SPECTRA_PER_CALL, data.shape[0])
+            data[i:j, roi_min:roi_max] = snip1d(data[i:j, roi_min:roi_max],
+                                                width, smoothing)
         data.shape = oldShape
 
     elif mcaIndex == 0:
         data.shape = oldShape[0], -1
-        for i in range(data.shape[-1]):
-            data[roi_min:roi_max, i] = snip1d(data[roi_min:roi_max, i],
-                                               width, smoothing)
+        for i in range(0, data.shape[-1], SPECTRA_PER_CALL):
+            j = min(i + SPECTRA_PER_CALL, data.shape[-1])
+            data[roi_min:roi_max, i:j] = snip1d(data[roi_min:roi_max, i:j].T,
+                                                width, smoothing).T
         data.shape = oldShape
     else:
         raise ValueError("Invalid 1D index %d" % mcaIndex)
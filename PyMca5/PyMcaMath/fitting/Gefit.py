@@ -259,17 +259,15 @@ def LinearLeastSquaresFit(model0,parameters0,data0,maxiter,
         nr, nc = alpha0.shape
         fittedpar = numpy.dot(beta, inv(alpha0))
         #check respect of constraints (only positive is handled -force parameter to 0 and fix it-)
-        error = 0
-        for i in range(n_free):
-            if constrains [0] [free_index[i]] == CPOSITIVE:
-                if fittedpar[0,i] < 0:
-                    #fix parameter to 0.0 and re-start the fit
-                    newpar[free_index[i]] = 0.0
-                    constrains[0][free_index[i]] = CFIXED
-                    error = 1
-        if error:continue
-        for i in range(n_free):
-            newpar[free_index[i]] = fittedpar[0,i]
+        positive = numpy.take(constrains[0], free_index) == CPOSITIVE
+        negative = numpy.nonzero(positive & (fittedpar[0] < 0))[0]
+        if len(negative):
+            for i in negative:
+                #fix parameter to 0.0 and re-start the fit
+                newpar[free_index[i]] = 0.0
+                constrains[0][free_index[i]] = CFIXED
+            continue
+        newpar[free_index] = fittedpar[0]
         newpar=numpy.array(getparameters(newpar,constrains))
         iiter=-1
     yfit = model(newpar,x)
@@ -389,6 +387,8 @@ def RestreinedLeastSquaresFit(model0,parameters0,data0,maxiter,
                                                  model,fittedpar,
                                                  x,y,weight,constrains,model_deriv=model_deriv)
         nr, nc = alpha0.shape
+        quotedFree = [i for i in range(n_free) \
+                      if constrains[0][free_index[i]] == CQUOTED]
         flag = 0
         lastdeltachi = chisq0
         while flag == 0:
@@ -410,32 +410,28 @@ def RestreinedLeastSquaresFit(model0,parameters0,data0,maxiter,
                     for j in range(npar):
                         narray[i,j] = narray[i,j]/(alphadiag[i]*alphadiag[j])
                 deltapar = numpy.dot(beta, narray)
-            pwork = numpy.zeros(deltapar.shape, numpy.float)
-            for i in range(n_free):
-                if constrains [0] [free_index[i]] == CFREE:
-                    pwork [0] [i] = fitparam [i] + deltapar [0] [i]
-                elif constrains [0] [free_index[i]] == CPOSITIVE:
-                    #abs method
-                    pwork [0] [i] = fitparam [i] + deltapar [0] [i]
-                    #square method
-                    #pwork [0] [i] = (numpy.sqrt(fitparam [i]) + deltapar [0] [i]) * \
-                    #                (numpy.sqrt(fitparam [i]) + deltapar [0] [i])
-                elif constrains [0] [free_index[i]] == CQUOTED:
-                    pmax=max(constrains[1] [free_index[i]],
-                            constrains[2] [free_index[i]])
-                    pmin=min(constrains[1] [free_index[i]],
-                            constrains[2] [free_index[i]])
-                    A = 0.5 * (pmax + pmin)
-                    B = 0.5 * (pmax - pmin)
-                    if (B != 0):
-                        pwork [0] [i] = A + \
-                                    B * numpy.sin(numpy.arcsin((fitparam[i] - A)/B)+ \
-                                    deltapar [0] [i])
-                    else:
-                        print("Error processing constrained fit")
-                        print("Parameter limits are",pmin,' and ',pmax)
-                        print("A = ",A,"B = ",B)
-                newpar [free_index[i]] = pwork [0] [i]
+            #free and positive parameters (abs method)
+            pwork = fitparam + deltapar [0]
+            #square method
+            #pwork [0] [i] = (numpy.sqrt(fitparam [i]) + deltapar [0] [i]) * \
+            #                (numpy.sqrt(fitparam [i]) + deltapar [0] [i])
+            for i in quotedFree:
+                pmax=max(constrains[1] [free_index[i]],
+                        constrains[2] [free_index[i]])
+                pmin=min(constrains[1] [free_index[i]],
+                        constrains[2] [free_index[i]])
+                A = 0.5 * (pmax + pmin)
+                B = 0.5 * (pmax - pmin)
+                if (B != 0):
+                    pwork [i] = A + \
+                                B * numpy.sin(numpy.arcsin((fitparam[i] - A)/B)+ \
+                                deltapar [0] [i])
+                else:
+                    pwork [i] = 0.0
+                    print("Error processing constrained fit")
+                    print("Parameter limits are",pmin,' and ',pmax)
+                    print("A = ",A,"B = ",B)
+            newpar [free_index] = pwork
             newpar=numpy.array(getparameters(newpar,constrains))
             workpar = numpy.take(newpar,noigno)
             #yfit = model(workpar.tolist(), x)
@@ -468,148 +464,87 @@ def ChisqAlphaBeta(model0, parameters, x,y,weight, constrains,model_deriv=None,l
     model = model0
     #nr0, nc = data.shape
     n_param = len(parameters)
-    n_free = 0
-    fitparam=[]
-    free_index=[]
-    noigno = []
-    derivfactor = []
-    for i in range(n_param):
-        if constrains[0] [i] != CIGNORED:
-            noigno.append(i)
-        if constrains[0] [i] == CFREE:
-            fitparam.append(parameters [i])
-            derivfactor.append(1.0)
-            free_index.append(i)
-            n_free += 1
-        elif constrains[0] [i] == CPOSITIVE:
-            fitparam.append(abs(parameters[i]))
-            derivfactor.append(1.0)
-            #fitparam.append(numpy.sqrt(abs(parameters[i])))
-            #derivfactor.append(2.0*numpy.sqrt(abs(parameters[i])))
-            free_index.append(i)
-            n_free += 1
-        elif constrains[0] [i] == CQUOTED:
-            pmax=max(constrains[1] [i],constrains[2] [i])
-            pmin=min(constrains[1] [i],constrains[2] [i])
-            if ((pmax-pmin) > 0) & \
-               (parameters[i] <= pmax) & \
-               (parameters[i] >= pmin):
-                A = 0.5 * (pmax + pmin)
-                B = 0.5 * (pmax - pmin)
-                if 1:
-                    fitparam.append(parameters[i])
-                    derivfactor.append(B*numpy.cos(numpy.arcsin((parameters[i] - A)/B)))
-                else:
-                    help0 = numpy.arcsin((parameters[i] - A)/B)
-                    fitparam.append(help0)
-                    derivfactor.append(B*numpy.cos(help0))
-                free_index.append(i)
-                n_free += 1
-            elif (pmax-pmin) > 0:
-                print("WARNING: Quoted parameter outside boundaries")
-                print("Initial value = %f" % parameters[i])
-                print("Limits are %f and %f" % (pmax, pmin))
-                print("Parameter will be kept at its starting value")
-    fitparam = numpy.array(fitparam, numpy.float)
-    alpha = numpy.zeros((n_free, n_free),numpy.float)
-    beta = numpy.zeros((1,n_free),numpy.float)
+    codes = numpy.array(constrains[0])
+    noigno = numpy.nonzero(codes != CIGNORED)[0].tolist()
+    free = (codes == CFREE) | (codes == CPOSITIVE)
+    derivfactor = numpy.ones((n_param,), numpy.float)
+    for i in numpy.nonzero(codes == CQUOTED)[0]:
+        pmax=max(constrains[1] [i],constrains[2] [i])
+        pmin=min(constrains[1] [i],constrains[2] [i])
+        if ((pmax-pmin) > 0) & \
+           (parameters[i] <= pmax) & \
+           (parameters[i] >= pmin):
+            A = 0.5 * (pmax + pmin)
+            B = 0.5 * (pmax - pmin)
+            derivfactor[i] = B*numpy.cos(numpy.arcsin((parameters[i] - A)/B))
+            free[i] = True
+        elif (pmax-pmin) > 0:
+            print("WARNING: Quoted parameter outside boundaries")
+            print("Initial value = %f" % parameters[i])
+            print("Limits are %f and %f" % (pmax, pmin))
+            print("Parameter will be kept at its starting value")
+    free_index = numpy.nonzero(free)[0]
+    n_free = len(free_index)
+    if n_free == 0:
+        raise ValueError("No free parameters to fit")
+    fitparam = numpy.array(numpy.take(parameters, free_index), numpy.float)
+    positive = numpy.take(codes, free_index) == CPOSITIVE
+    fitparam[positive] = abs(fitparam[positive])
+    #fitparam.append(numpy.sqrt(abs(parameters[i])))
+    #derivfactor.append(2.0*numpy.sqrt(abs(parameters[i])))
+    derivfactor = numpy.take(derivfactor, free_index)
+    free_index = free_index.tolist()
     delta = (fitparam + numpy.equal(fitparam,0.0)) * 0.00001
     nr  = x.shape[0]
     ##############
     # Prior to each call to the function one has to re-calculate the
     # parameters
     pwork = parameters.__copy__()
-    for i in range(n_free):
-        pwork [free_index[i]] = fitparam [i]
-    newpar = getparameters(pwork.tolist(),constrains)
+    pwork[free_index] = fitparam
+    newpar = getparameters(pwork,constrains)
     newpar = numpy.take(newpar,noigno)
-    if n_free == 0:
-        raise ValueError("No free parameters to fit")
+    # the jacobian is filled in place, one row per free parameter
+    deriv = numpy.zeros((n_free, nr), numpy.float)
     for i in range(n_free):
         if model_deriv is None:
-            #pwork = parameters.__copy__()
             pwork [free_index[i]] = fitparam [i] + delta [i]
-            newpar = getparameters(pwork.tolist(),constrains)
-            newpar=numpy.take(newpar,noigno)
-            f1 = model(newpar, x)
+            f1 = model(numpy.take(getparameters(pwork,constrains),noigno), x)
             pwork [free_index[i]] = fitparam [i] - delta [i]
-            newpar = getparameters(pwork.tolist(),constrains)
-            newpar=numpy.take(newpar,noigno)
-            f2 = model(newpar, x)
-            help0 = (f1-f2) / (2.0 * delta [i])
-            help0 = help0 * derivfactor[i]
+            f2 = model(numpy.take(getparameters(pwork,constrains),noigno), x)
             pwork [free_index[i]] = fitparam [i]
-            #removed I resize outside the loop:
-            #help0 = numpy.resize(help0,(1,nr))
-        else:
-            newpar = getparameters(pwork.tolist(),constrains)
-            help0=model_deriv(pwork,free_index[i],x)
-            help0 = help0 * derivfactor[i]
-
-        if i == 0 :
-            deriv = help0
+            help0 = (f1-f2) / (2.0 * delta [i])
         else:
-            deriv = numpy.concatenate((deriv,help0), 0)
-    #line added to resize outside the loop
-    deriv=numpy.resize(deriv,(n_free,nr))
+            help0 = model_deriv(pwork,free_index[i],x)
+        deriv[i, :] = numpy.ravel(help0) * derivfactor[i]
+    weight = numpy.ravel(weight)
     if linear:
-        pseudobetahelp = weight * y
+        #chisq not used
+        chisq = 0.0
+        beta = numpy.dot(deriv, weight * numpy.ravel(y))
     else:
         yfit = model(newpar, x)
-        deltay = y - yfit
+        deltay = numpy.ravel(y - yfit)
         help0 = weight * deltay
-    for i in range(n_free):
-        derivi = numpy.resize(deriv [i,:], (1,nr))
-        if linear:
-            if i==0:
-                beta = numpy.resize(numpy.sum((pseudobetahelp * derivi),1),(1,1))
-            else:
-                beta = numpy.concatenate((beta, numpy.resize(numpy.sum((pseudobetahelp * derivi),1),(1,1))), 1)
-        else:
-            help1 = numpy.resize(numpy.sum((help0 * derivi),1),(1,1))
-            if i == 0:
-                beta = help1
-            else:
-                beta = numpy.concatenate((beta, help1), 1)
-        help1 = numpy.inner(deriv,weight*derivi)
-        if i == 0:
-            alpha = help1
-        else:
-            alpha = numpy.concatenate((alpha, help1),1)
-    if linear:
-        #not used
-        chisq = 0.0
-    else:
+        beta = numpy.dot(deriv, help0)
         chisq = (help0 * deltay).sum()
+    beta.shape = 1, n_free
+    alpha = numpy.dot(deriv * weight, deriv.T)
     return chisq, alpha, beta, \
            n_free, free_index, noigno, fitparam, derivfactor
 
 def getparameters(parameters,constrains):
     # 0 = Free       1 = Positive     2 = Quoted
     # 3 = Fixed      4 = Factor       5 = Delta
-    newparam=[]
+    codes = numpy.array(constrains[0])
+    newparam = numpy.array(parameters, numpy.float)
     #first I make the free parameters
     #because the quoted ones put troubles
-    for i in range(len(constrains [0])):
-        if constrains[0][i] == CFREE:
-            newparam.append(parameters[i])
-        elif constrains[0][i] == CPOSITIVE:
-            #newparam.append(parameters[i] * parameters[i])
-            newparam.append(abs(parameters[i]))
-        elif constrains[0][i] == CQUOTED:
-            if 1:
-                newparam.append(parameters[i])
-            else:
-                pmax=max(constrains[1] [i],constrains[2] [i])
-                pmin=min(constrains[1] [i],constrains[2] [i])
-                A = 0.5 * (pmax + pmin)
-                B = 0.5 * (pmax - pmin)
-                newparam.append(A + B * numpy.sin(parameters[i]))
-        elif abs(constrains[0][i]) == CFIXED:
-            newparam.append(parameters[i])
-        else:
-            newparam.append(parameters[i])
-    for i in range(len(constrains [0])):
+    positive = codes == CPOSITIVE
+    newparam[positive] = abs(newparam[positive])
+    #the parameters depending on other parameters are set in order
+    dependent = (codes == CFACTOR) | (codes == CDELTA) | \
+                (codes == CIGNORED) | (codes == CSUM)
+    for i in numpy.nonzero(dependent)[0]:
         if constrains[0][i] == CFACTOR:
             newparam[i] = constrains[2][i]*newparam[int(constrains[1][i])]
         elif constrains[0][i] == CDELTA:
@@ -623,29 +558,32 @@ def getparameters(parameters,constrains):
 def getsigmaparameters(parameters,sigma0,constrains):
     # 0 = Free       1 = Positive     2 = Quoted
     # 3 = Fixed      4 = Factor       5 = Delta
-    n_free = 0
+    parameters = numpy.array(parameters, numpy.float, copy=False)
+    codes = numpy.array(constrains[0])
     sigma_par = numpy.zeros(parameters.shape,numpy.float)
-    for i in range(len(constrains [0])):
-        if constrains[0][i] == CFREE:
-            sigma_par [i] = sigma0[n_free]
-            n_free += 1
-        elif constrains[0][i] == CPOSITIVE:
-            #sigma_par [i] = 2.0 * sigma0[n_free]
-            sigma_par [i] = sigma0[n_free]
-            n_free += 1
-        elif constrains[0][i] == CQUOTED:
-            pmax = max(constrains [1] [i], constrains [2] [i])
-            pmin = min(constrains [1] [i], constrains [2] [i])
-            # A = 0.5 * (pmax + pmin)
-            B = 0.5 * (pmax - pmin)
-            if (B > 0) & (parameters [i] < pmax) & (parameters [i] > pmin):
-                sigma_par [i] = abs(B * numpy.cos(parameters[i]) * sigma0[n_free])
-                n_free += 1
-            else:
-                sigma_par [i] = parameters[i]
-        elif abs(constrains[0][i]) == CFIXED:
-            sigma_par[i] = parameters[i]
-    for i in range(len(constrains [0])):
+    quoted = numpy.nonzero(codes == CQUOTED)[0]
+    pmax = numpy.maximum(numpy.take(constrains[1], quoted),
+                         numpy.take(constrains[2], quoted))
+    pmin = numpy.minimum(numpy.take(constrains[1], quoted),
+                         numpy.take(constrains[2], quoted))
+    # A = 0.5 * (pmax + pmin)
+    B = 0.5 * (pmax - pmin)
+    quotedParameters = numpy.take(parameters, quoted)
+    quotedFree = (B > 0) & (quotedParameters < pmax) & \
+                 (quotedParameters > pmin)
+    free = (codes == CFREE) | (codes == CPOSITIVE)
+    free[quoted[quotedFree]] = True
+    free_index = numpy.nonzero(free)[0]
+    sigma_par[free_index] = sigma0[:len(free_index)]
+    #sigma_par [i] = 2.0 * sigma0[n_free] for positive with square method
+    sigma_par[quoted] = numpy.where(quotedFree,
+                                    abs(B * numpy.cos(quotedParameters) * \
+                                        sigma_par[quoted]),
+                                    quotedParameters)
+    fixed = abs(codes) == CFIXED
+    sigma_par[fixed] = parameters[fixed]
+    dependent = (codes == CFACTOR) | (codes == CDELTA) | (codes == CSUM)
+    for i in numpy.nonzero(dependent)[0]:
         if constrains[0][i] == CFACTOR:
             sigma_par [i] = constrains[2][i]*sigma_par[int(constrains[1][i])]
         elif constrains[0][i] == CDELTA:
@@ -36,6 +36,12 @@
 #ifndef NPY_ARRAY_ENSURECOPY
 #define NPY_ARRAY_ENSURECOPY NPY_ENSURECOPY
 #endif
+#ifndef NPY_ARRAY_FORCECAST
+#define NPY_ARRAY_FORCECAST NPY_FORCECAST
+#endif
+#ifndef NPY_ARRAY_DEFAULT
+#define NPY_ARRAY_DEFAULT NPY_DEFAULT
+#endif
 
 struct module_state {
     PyObject *error;
@@ -82,14 +88,20 @@ static PyObject *
 SpecfitFuns_snip1d(PyObject *self, PyObject *args)
 {
     PyObject *input;
+    PyObject *anchorsInput = NULL;
     double width0 = 50.;
     int smooth_iterations = 0;
     int llsflag = 0;
     PyArrayObject   *ret;
+    PyArrayObject   *anchorsArray = NULL;
+    int *anchors = NULL;
     double *doublePointer;
-    int i, n, n_channels, n_spectra, width;
+    int i, k, n, n_channels, n_spectra, width;
+    int n_anchors = 0;
+    int anchor, lastAnchor, segment;
 
-    if (!PyArg_ParseTuple(args, "Od|ii", &input, &width0, &smooth_iterations, &llsflag))
+    if (!PyArg_ParseTuple(args, "Od|iiO", &input, &width0, &smooth_iterations,
+                                          &llsflag, &anchorsInput))
         return NULL;
 
     ret = (PyArrayObject *)
@@ -100,6 +112,20 @@ SpecfitFuns_snip1d(PyObject *self, PyObject *args)
         return NULL;
     }
 
+    if ((anchorsInput != NULL) && (anchorsInput != Py_None))
+    {
+        anchorsArray = (PyArrayObject *)
+             PyArray_FROMANY(anchorsInput, NPY_INT, 1, 1,
+                             NPY_ARRAY_ENSURECOPY | NPY_ARRAY_FORCECAST);
+        if (anchorsArray == NULL){
+            printf("Cannot create 1D anchors array from input\n");
+            Py_DECREF(ret);
+            return NULL;
+        }
+        n_anchors = (int) (PyArray_DIMS(anchorsArray)[0]);
+        anchors = (int *) PyArray_DATA(anchorsArray);
+    }
+
     if(PyArray_NDIM(ret) == 1)
     {
         n_spectra = 1;
@@ -113,32 +139,76 @@ SpecfitFuns_snip1d(PyObject *self, PyObject *args)
 
     width = (int )width0;
 
-    for (n = 0; n < n_spectra; n++)
+    Py_BEGIN_ALLOW_THREADS
+    if (n_anchors == 0)
     {
-        for (i=0; i<smooth_iterations; i++)
+        doublePointer = (double *) PyArray_DATA(ret);
+        for (n = 0; n < n_spectra; n++)
         {
-            doublePointer = (double *) PyArray_DATA(ret);
-            smooth1d(&(doublePointer[n*n_channels]), n_channels);
+            for (i=0; i<smooth_iterations; i++)
+            {
+                smooth1d(&(doublePointer[n*n_channels]), n_channels);
+            }
+            if (llsflag)
+            {
+                lls(&(doublePointer[n*n_channels]), n_channels);
+            }
         }
-        if (llsflag)
+
+        snip1d_multiple(doublePointer, n_channels, width, n_spectra);
+
+        for (n = 0; n < n_spectra; n++)
         {
-            doublePointer = (double *) PyArray_DATA(ret);
-            lls(&(doublePointer[n*n_channels]), n_channels);
+            if (llsflag)
+            {
+                lls_inv(&(doublePointer[n*n_channels]), n_channels);
+            }
         }
     }
-
-
-    snip1d_multiple((double *) PyArray_DATA(ret), n_channels, width, n_spectra);
-
-    for (n = 0; n < n_spectra; n++)
+    else
     {
-        if (llsflag)
+        /* every segment delimited by the anchors is treated as an
+           independent spectrum */
+        for (n = 0; n < n_spectra; n++)
         {
-            doublePointer = (double *) PyArray_DATA(ret);
-            lls_inv(&(doublePointer[n*n_channels]), n_channels);
+            lastAnchor = 0;
+            for (k = 0; k <= n_anchors; k++)
+            {
+                if (k < n_anchors)
+                {
+                    anchor = anchors[k];
+                    if ((anchor <= lastAnchor) || (anchor >= n_channels))
+                        continue;
+                }
+                else
+                {
+                    if (lastAnchor >= n_channels)
+                        break;
+                    anchor = n_channels;
+                }
+                doublePointer = ((double *) PyArray_DATA(ret)) + \
+                                n * n_channels + lastAnchor;
+                segment = anchor - lastAnchor;
+                for (i=0; i<smooth_iterations; i++)
+                {
+                    smooth1d(doublePointer, segment);
+                }
+                if (llsflag)
+                {
+                    lls(doublePointer, segment);
+                }
+                snip1d_multiple(doublePointer, segment, width, 1);
+                if (llsflag)
+                {
+                    lls_inv(doublePointer, segment);
+                }
+                lastAnchor = anchor;
+            }
         }
     }
+    Py_END_ALLOW_THREADS
 
+    Py_XDECREF(anchorsArray);
     return PyArray_Return(ret);
 }
 
@@ -3151,6 +3221,341 @@ printf("LT_Area=%f,LT_Slope=%f\n",phyper[i].lt_area_r,phyper[i].lt_slope_r);
 
 
 
+/* Evaluation of many peaks at once, accumulating each peak into the column
+ * of the output matrix given by its group index. Used to build the matrix of
+ * peak group contributions of the fluorescence fit in a single call.
+ */
+static int
+get_peak_groups(PyObject *input, int npeaks, int ngroups, PyArrayObject **groups)
+{
+    int i;
+    int *pgroups;
+
+    *groups = (PyArrayObject *)
+             PyArray_FROMANY(input, NPY_INT, 1, 1, NPY_ARRAY_DEFAULT | NPY_ARRAY_FORCECAST);
+    if (*groups == NULL)
+        return -1;
+    if (PyArray_DIMS(*groups)[0] != npeaks){
+        PyErr_SetString(PyExc_ValueError,
+                        "Number of group indices does not match number of peaks");
+        Py_DECREF(*groups);
+        return -1;
+    }
+    pgroups = (int *) PyArray_DATA(*groups);
+    for (i=0; i<npeaks; i++){
+        if ((pgroups[i] < 0) || (pgroups[i] >= ngroups)){
+            PyErr_SetString(PyExc_ValueError, "Group index out of range");
+            Py_DECREF(*groups);
+            return -1;
+        }
+    }
+    return 0;
+}
+
+static PyObject *
+SpecfitFuns_ahypermetmatrix(PyObject *self, PyObject *args)
+{
+    double erfc(double);
+    PyObject *input1, *input2, *input3;
+    int ngroups;
+    int tails=15;
+    int fast=0;
+    int g_term_flag, st_term_flag, lt_term_flag, step_term_flag;
+    int error = 0;
+    PyArrayObject   *param, *x, *groups;
+    PyArrayObject   *ret;
+    npy_intp dim_ret[2];
+    int i, j, k, npeaks;
+    int *pgroups;
+    double  dhelp, log2, sqrt2PI,tosigma;
+    double x1, x2, x3, x4, x5, x6, x7, x8;
+    double z0, z1, z2;
+    double  *px, *pret;
+    typedef struct {
+        double  area;
+        double  position;
+        double  fwhm;
+        double  st_area_r;
+        double  st_slope_r;
+        double  lt_area_r;
+        double  lt_slope_r;
+        double  step_height_r;
+    } hypermet;
+    hypermet *phyper;
+
+    /** statements **/
+    if (!PyArg_ParseTuple(args, "OOOi|ii", &input1, &input2, &input3,
+                          &ngroups, &tails, &fast))
+        return NULL;
+    if (ngroups < 0){
+        PyErr_SetString(PyExc_ValueError, "Number of groups must be positive");
+        return NULL;
+    }
+
+    param = (PyArrayObject *)
+             PyArray_FROMANY(input1, NPY_DOUBLE, 1, 2, NPY_ARRAY_DEFAULT | NPY_ARRAY_FORCECAST);
+    if (param == NULL)
+        return NULL;
+    if ((PyArray_SIZE(param) % 8) != 0){
+        PyErr_SetString(PyExc_ValueError, "Incorrect number of parameters");
+        Py_DECREF(param);
+        return NULL;
+    }
+    npeaks = (int) (PyArray_SIZE(param) / 8);
+    x = (PyArrayObject *)
+             PyArray_FROMANY(input2, NPY_DOUBLE, 1, 1, NPY_ARRAY_DEFAULT | NPY_ARRAY_FORCECAST);
+    if (x == NULL){
+        Py_DECREF(param);
+        return NULL;
+    }
+    if (get_peak_groups(input3, npeaks, ngroups, &groups) < 0){
+        Py_DECREF(param);
+        Py_DECREF(x);
+        return NULL;
+    }
+
+    /* Create the output array */
+    k = (int) PyArray_DIMS(x)[0];
+    dim_ret[0] = k;
+    dim_ret[1] = ngroups;
+    ret = (PyArrayObject *) PyArray_SimpleNew(2, dim_ret, NPY_DOUBLE);
+    if (ret == NULL){
+        Py_DECREF(param);
+        Py_DECREF(x);
+        Py_DECREF(groups);
+        return NULL;
+    }
+    PyArray_FILLWBYTE(ret, 0);
+    if ((tails <= 0) || (k == 0)){
+        Py_DECREF(param);
+        Py_DECREF(x);
+        Py_DECREF(groups);
+        return PyArray_Return(ret);
+    }
+    g_term_flag    = tails & 1;
+    st_term_flag   = (tails>>1) & 1;
+    lt_term_flag   = (tails>>2) & 1;
+    step_term_flag = (tails>>3) & 1;
+
+    log2 = 0.69314718055994529;
+    sqrt2PI= sqrt(2.0*M_PI);
+    tosigma=1.0/(2.0*sqrt(2.0*log2));
+
+    /* make sure the exponential table is initialized before releasing the GIL */
+    fastexp(-1.0);
+
+    phyper = (hypermet *) PyArray_DATA(param);
+    pgroups = (int *) PyArray_DATA(groups);
+    Py_BEGIN_ALLOW_THREADS
+    for (i=0; i<npeaks; i++){
+        x1 = phyper[i].area;
+        x2 = phyper[i].position;
+        x3 = phyper[i].fwhm * tosigma;
+        x4 = phyper[i].st_area_r;
+        x5 = phyper[i].st_slope_r;
+        x6 = phyper[i].lt_area_r;
+        x7 = phyper[i].lt_slope_r;
+        x8 = phyper[i].step_height_r;
+        z1 = x3 * 1.4142135623730950488;
+        if (x3 == 0){
+            error = 1;
+            break;
+        }
+        px = (double *) PyArray_DATA(x);
+        pret = (double *) PyArray_DATA(ret) + pgroups[i];
+        for (j=0; j<k; j++){
+            z0 = *px - x2;
+            z2 = (0.5 * z0 * z0) / (x3 * x3);
+            if (fast){
+                /* same approximations as fastahypermet */
+                if (z2 < 100){
+                    if (g_term_flag){
+                        *pret += fastexp (-z2) * (x1/(x3*sqrt2PI));
+                    }
+                }
+                if (st_term_flag){
+                    if ((x5 != 0) && (x4 != 0)){
+                        dhelp = (z0/z1) + 0.5 * z1/x5;
+                        if (dhelp < 10){
+                            dhelp = x4 * 0.5 * erfc(dhelp);
+                            if (dhelp > 0){
+                            if (fabs(z0/x5) <= 612){
+                  *pret += ((x1 * dhelp)/x5) * fastexp(0.5 * (x3/x5) * (x3/x5) + (z0/x5));
+                            }
+                            }
+                        }
+                    }
+                }
+                if (lt_term_flag){
+                    if ((x7 != 0) && (x6 != 0)){
+                        dhelp = (z0/z1) + 0.5 * z1/x7;
+                        if (dhelp < 10){
+                            dhelp = x6 * 0.5 * erfc(dhelp);
+                            if (dhelp > 0){
+                            if (fabs(z0/x7) <= 612){
+                  *pret += ((x1 * dhelp)/x7) * fastexp(0.5 * (x3/x7) * (x3/x7) + (z0/x7));
+                            }
+                            }
+                        }
+                    }
+                }
+            }else{
+                /* same calculation as ahypermet */
+                if (g_term_flag){
+                    if (z2 < 612) {
+                        *pret += exp (-z2) * (x1/(x3*sqrt2PI));
+                    }
+                }
+                if (st_term_flag){
+                    if ((x5 != 0) && (x4 != 0)){
+                        dhelp = x4 * 0.5 * erfc((z0/z1) + 0.5 * z1/x5);
+                        if (dhelp != 0){
+                        if (fabs(z0/x5) <= 612){
+                  *pret += ((x1 * dhelp)/x5) * exp(0.5 * (x3/x5) * (x3/x5) + (z0/x5));
+                        }
+                        }
+                    }
+                }
+                if (lt_term_flag){
+                    if ((x7 != 0) && (x6 != 0)){
+                        dhelp = x6 * 0.5 * erfc((z0/z1) + 0.5 * z1/x7);
+                        if (fabs(z0/x7) <= 612){
+                  *pret += ((x1 * dhelp)/x7) * exp(0.5 * (x3/x7) * (x3/x7) + (z0/x7));
+                        }
+                    }
+                }
+            }
+            if (step_term_flag){
+                if (x8 != 0){
+                *pret +=  x8 * (x1/(x3*sqrt2PI)) * 0.5 * erfc(z0/z1);
+                }
+            }
+            pret += ngroups;
+            px++;
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    Py_DECREF(param);
+    Py_DECREF(x);
+    Py_DECREF(groups);
+    if (error){
+        PyErr_SetString(PyExc_ValueError,
+                        "Linear Algebra Error: Division by zero (null FWHM)");
+        Py_DECREF(ret);
+        return NULL;
+    }
+    return PyArray_Return(ret);
+}
+
+static PyObject *
+SpecfitFuns_apvoigtmatrix(PyObject *self, PyObject *args)
+{
+    PyObject *input1, *input2, *input3;
+    int ngroups;
+    PyArrayObject   *param, *x, *groups;
+    PyArrayObject   *ret;
+    npy_intp dim_ret[2];
+    int i, j, k, npeaks;
+    int *pgroups;
+    double  dhelp, log2, sqrt2PI,sigma,tosigma;
+    double  *px, *pret;
+    typedef struct {
+        double  area;
+        double  centroid;
+        double  fwhm;
+        double  eta;
+    } pvoigtian;
+    pvoigtian *ppvoigt;
+
+    /** statements **/
+    if (!PyArg_ParseTuple(args, "OOOi", &input1, &input2, &input3, &ngroups))
+        return NULL;
+    if (ngroups < 0){
+        PyErr_SetString(PyExc_ValueError, "Number of groups must be positive");
+        return NULL;
+    }
+
+    param = (PyArrayObject *)
+             PyArray_FROMANY(input1, NPY_DOUBLE, 1, 2, NPY_ARRAY_DEFAULT | NPY_ARRAY_FORCECAST);
+    if (param == NULL)
+        return NULL;
+    if ((PyArray_SIZE(param) % 4) != 0){
+        PyErr_SetString(PyExc_ValueError, "Incorrect number of parameters");
+        Py_DECREF(param);
+        return NULL;
+    }
+    npeaks = (int) (PyArray_SIZE(param) / 4);
+    x = (PyArrayObject *)
+             PyArray_FROMANY(input2, NPY_DOUBLE, 1, 1, NPY_ARRAY_DEFAULT | NPY_ARRAY_FORCECAST);
+    if (x == NULL){
+        Py_DECREF(param);
+        return NULL;
+    }
+    if (get_peak_groups(input3, npeaks, ngroups, &groups) < 0){
+        Py_DECREF(param);
+        Py_DECREF(x);
+        return NULL;
+    }
+
+    /* Create the output array */
+    k = (int) PyArray_DIMS(x)[0];
+    dim_ret[0] = k;
+    dim_ret[1] = ngroups;
+    ret = (PyArrayObject *) PyArray_SimpleNew(2, dim_ret, NPY_DOUBLE);
+    if (ret == NULL){
+        Py_DECREF(param);
+        Py_DECREF(x);
+        Py_DECREF(groups);
+        return NULL;
+    }
+    PyArray_FILLWBYTE(ret, 0);
+
+    log2 = 0.69314718055994529;
+    sqrt2PI= sqrt(2.0*M_PI);
+    tosigma=1.0/(2.0*sqrt(2.0*log2));
+
+    ppvoigt = (pvoigtian *) PyArray_DATA(param);
+    pgroups = (int *) PyArray_DATA(groups);
+    Py_BEGIN_ALLOW_THREADS
+    /* as in apvoigt, all the lorentzian terms are added first */
+    for (i=0; i<npeaks; i++){
+        px = (double *) PyArray_DATA(x);
+        pret = (double *) PyArray_DATA(ret) + pgroups[i];
+        for (j=0; j<k; j++){
+            dhelp = (*px - ppvoigt[i].centroid) / (0.5 * ppvoigt[i].fwhm);
+            dhelp = 1.0 + (dhelp * dhelp);
+            *pret += ppvoigt[i].eta * \
+                (ppvoigt[i].area / (0.5 * M_PI * ppvoigt[i].fwhm * dhelp));
+            pret += ngroups;
+            px++;
+        }
+    }
+    /* and then the gaussian terms */
+    for (i=0; i<npeaks; i++){
+        px = (double *) PyArray_DATA(x);
+        pret = (double *) PyArray_DATA(ret) + pgroups[i];
+        sigma = ppvoigt[i].fwhm * tosigma;
+        for (j=0; j<k; j++){
+            dhelp = (*px - ppvoigt[i].centroid)/sigma;
+            if (dhelp <= 35) {
+                *pret += (1.0 - ppvoigt[i].eta) * \
+                    (ppvoigt[i].area/(sigma*sqrt2PI)) \
+                    * exp (-0.5 * dhelp * dhelp);
+            }
+            pret += ngroups;
+            px++;
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    Py_DECREF(param);
+    Py_DECREF(x);
+    Py_DECREF(groups);
+    return PyArray_Return(ret);
+}
+
+
 static PyObject *
 SpecfitFuns_seek(PyObject *self, PyObject *args)
 {
@@ -4077,24 +4482,61 @@ SpecfitFuns_pileup(PyObject *self, PyObject *args)
 }
 
 
+static void
+savitsky_golay_1d(double *output, double *data, int n, int npoints,
+                  double *coeff, double den)
+{
+    int i, j, m;
+    double dhelp;
+
+    m = (int) (npoints/2);
+
+    /* simple smoothing at the beginning */
+    for (j=0; j<=(int)(npoints/3); j++)
+    {
+        smooth1d(output, m);
+    }
+
+    /* simple smoothing at the end */
+    for (j=0; j<=(int)(npoints/3); j++)
+    {
+        smooth1d((output+n-m-1), m);
+    }
+
+    /*one does not need the whole spectrum buffer, but code is clearer */
+    memcpy(data, output, n * sizeof(double));
+
+    /* the actual SG smoothing in the middle */
+    for (i=m; i<(n-m); i++){
+        dhelp = 0;
+        for (j=-m;j<=m;j++) {
+            dhelp += coeff[m+j] * (*(data+i+j));
+        }
+        if(dhelp > 0.0){
+            *(output+i) = dhelp / den;
+        }
+    }
+}
+
 static PyObject *
 SpecfitFuns_SavitskyGolay(PyObject *self, PyObject *args)
 {
     PyObject *input;
     PyArrayObject *ret;
-    int n, npoints;
+    int n, npoints, n_spectra;
     double dpoints = 5.;
     double coeff[MAX_SAVITSKY_GOLAY_WIDTH];
-    int i, j, m;
-    double  dhelp, den;
+    int i, m;
+    double  den;
     double  *data;
     double  *output;
 
     if (!PyArg_ParseTuple(args, "O|d", &input, &dpoints))
         return NULL;
 
+    /* a 2D input is treated as a set of spectra, one per row */
     ret = (PyArrayObject *)
-             PyArray_FROMANY(input, NPY_DOUBLE, 1, 1, NPY_ARRAY_ENSURECOPY);
+             PyArray_FROMANY(input, NPY_DOUBLE, 1, 2, NPY_ARRAY_ENSURECOPY);
 
     if (ret == NULL){
         printf("Cannot create 1D array from input\n");
@@ -4103,9 +4545,19 @@ SpecfitFuns_SavitskyGolay(PyObject *self, PyObject *args)
     npoints = (int )  dpoints;
     if (!(npoints % 2)) npoints +=1;
 
-    n = (int) PyArray_DIMS(ret)[0];
+    if(PyArray_NDIM(ret) == 1)
+    {
+        n_spectra = 1;
+        n = (int) PyArray_DIMS(ret)[0];
+    }
+    else
+    {
+        n_spectra = (int) PyArray_DIMS(ret)[0];
+        n = (int) PyArray_DIMS(ret)[1];
+    }
 
-    if((npoints < MIN_SAVITSKY_GOLAY_WIDTH) ||  (n < npoints))
+    if((npoints < MIN_SAVITSKY_GOLAY_WIDTH) ||  (n < npoints) ||
+       (npoints > MAX_SAVITSKY_GOLAY_WIDTH))
     {
         /* do not smooth data */
         return PyArray_Return(ret);
@@ -4121,33 +4573,17 @@ SpecfitFuns_SavitskyGolay(PyObject *self, PyObject *args)
 
     /* do the job */
     output = (double *) PyArray_DATA(ret);
-
-    /* simple smoothing at the beginning */
-    for (j=0; j<=(int)(npoints/3); j++)
-    {
-        smooth1d(output, m);
+    data = (double *) malloc(n * sizeof(double));
+    if (data == NULL){
+        Py_DECREF(ret);
+        return PyErr_NoMemory();
     }
-
-    /* simple smoothing at the end */
-    for (j=0; j<=(int)(npoints/3); j++)
+    Py_BEGIN_ALLOW_THREADS
+    for (i=0; i<n_spectra; i++)
     {
-        smooth1d((output+n-m-1), m);
-    }
-
-    /*one does not need the whole spectrum buffer, but code is clearer */
-    data = (double *) malloc(n * sizeof(double));
-    memcpy(data, output, n * sizeof(double));
-
-    /* the actual SG smoothing in the middle */
-    for (i=m; i<(n-m); i++){
-        dhelp = 0;
-        for (j=-m;j<=m;j++) {
-            dhelp += coeff[m+j] * (*(data+i+j));
-        }
-        if(dhelp > 0.0){
-            *(output+i) = dhelp / den;
-        }
+        savitsky_golay_1d(output + i * n, data, n, npoints, coeff, den);
     }
+    Py_END_ALLOW_THREADS
     free(data);
     return PyArray_Return(ret);
 
@@ -4174,6 +4610,8 @@ static PyMethodDef SpecfitFuns_methods[] = {
     {"slit",        SpecfitFuns_slit,       METH_VARARGS},
     {"ahypermet",   SpecfitFuns_ahypermet,  METH_VARARGS},
     {"fastahypermet",   SpecfitFuns_fastahypermet,  METH_VARARGS},
+    {"ahypermetmatrix", SpecfitFuns_ahypermetmatrix,  METH_VARARGS},
+    {"apvoigtmatrix",   SpecfitFuns_apvoigtmatrix,  METH_VARARGS},
     {"erfc",        SpecfitFuns_erfc,       METH_VARARGS},
     {"erf",         SpecfitFuns_erf,        METH_VARARGS},
     {"seek",        SpecfitFuns_seek,       METH_VARARGS},
@@ -220,8 +220,8 @@ def lstsq(a, b, rcond=None, sigma_b=None, weight=False,
         # it could be made by the calling routine, because it is equivalent to supplying a
         # different model and different independent values ...
         # That way one could avoid calculating U, s, V each time
-        A = a / weight
-        b = b / weight
+        A = a / w.reshape(-1, 1)
+        b = b / w.reshape(-1, 1)
         # get the SVD decomposition of the A matrix
         if last_svd is not None:
             U, s, V = last_svd
@@ -346,6 +346,114 @@ def lstsq(a, b, rcond=None, sigma_b=None, weight=False,
         return result
         
 
+class LstsqSolver(object):
+    """
+    Least-squares solver for repeated fits with the same model matrix.
+
+    The (weighted) model matrix is decomposed once at construction time and
+    the pseudo-inverse is kept, so that solving `a x = b` for any number of
+    `b` columns reduces to a single matrix product. Since the data weights
+    are fixed at construction time, the uncertainties on the parameters do
+    not depend on the data and are calculated only once.
+
+    Parameters
+    ----------
+    a : array_like, shape (M, N)
+        "Model" matrix.
+    sigma_b : None or array_like, shape (M,) or (M, 1)
+        Uncertainties on the b values, common to all the fitted columns.
+        If None, all the uncertainties are assumed to be 1 (unweighted fit).
+    rcond : Cut-off ratio for small singular values of `a`. The same
+            default as in `lstsq` is used if None.
+    """
+    def __init__(self, a, sigma_b=None, rcond=None):
+        a = numpy.array(a, dtype=numpy.float, copy=False)
+        if len(a.shape) != 2:
+            raise ValueError("Model matrix must be two dimensional")
+        m, n = a.shape
+        if sigma_b is None:
+            w = None
+            A = a
+        else:
+            w = numpy.abs(numpy.array(sigma_b, dtype=numpy.float, copy=False))
+            if w.size != m:
+                raise ValueError("Uncertainties must be common to all data")
+            w = w.reshape(-1, 1)
+            w = w + numpy.equal(w, 0)
+            A = a / w
+        U, s, V = numpy.linalg.svd(A, full_matrices=False)
+        if rcond is None:
+            s_cutoff = n * numpy.finfo(numpy.float).eps
+        else:
+            s_cutoff = rcond * s[0]
+        s[s < s_cutoff] = numpy.inf
+        dummy = V.T * (1. / s)
+        self._covariance = numpy.dot(dummy, dummy.T)
+        self._uncertainties = numpy.sqrt(numpy.diag(self._covariance))
+        # parameters = dot(V.T/s, dot(U.T, b / w))
+        if w is None:
+            self._pseudoInverse = numpy.dot(dummy, U.T)
+        else:
+            self._pseudoInverse = numpy.dot(dummy, U.T) / w.T
+        self._shape = (m, n)
+
+    def getShape(self):
+        """
+        Return the shape of the model matrix
+        """
+        return self._shape
+
+    def getPseudoInverse(self):
+        """
+        Return the (N, M) matrix converting data into parameters
+        """
+        return self._pseudoInverse
+
+    def getCovarianceMatrix(self):
+        """
+        Return the (N, N) covariance matrix of the fitted parameters
+        """
+        return self._covariance
+
+    def getUncertainties(self):
+        """
+        Return the (N,) uncertainties of the fitted parameters
+        """
+        return self._uncertainties
+
+    def solve(self, b, uncertainties=False, digested_output=False):
+        """
+        Return the least-squares solution x of `a x = b`.
+
+        b : array_like, shape (M,) or (M, K)
+
+        If uncertainties is True, the uncertainties on the parameters are
+        returned too, with the same shape as x. The returned values follow
+        the same conventions as the `lstsq` function.
+        """
+        b = numpy.array(b, dtype=numpy.float, copy=False)
+        if b.shape[0] != self._shape[0]:
+            raise ValueError('Incompatible dimensions between A and b matrices')
+        parameters = numpy.dot(self._pseudoInverse, b)
+        if uncertainties:
+            if len(b.shape) == 1:
+                sigmapar = self._uncertainties.copy()
+            else:
+                sigmapar = numpy.outer(self._uncertainties,
+                                       numpy.ones(b.shape[1:]))
+                sigmapar.shape = parameters.shape
+            result = [parameters, sigmapar]
+        else:
+            result = [parameters]
+        if digested_output:
+            ddict = {}
+            ddict['parameters'] = result[0]
+            if uncertainties:
+                ddict['uncertainties'] = result[1]
+            return ddict
+        else:
+            return result
+
 def getModelMatrixFromFunction(model_function, dummy_parameters, xdata, derivative=None):
     nPoints = xdata.size
     nParameters = len(dummy_parameters)
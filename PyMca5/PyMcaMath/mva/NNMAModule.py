@@ -164,9 +164,10 @@ except:
     MDP = False
 
 from . import py_nnma
+from . import PCATools
 DEBUG = 0
 
-function_list = ['FNMAI', 'ALS', 'FastHALS', 'GDCLS']
+function_list = ['FNMAI', 'ALS', 'FastHALS', 'GDCLS', 'MiniBatch']
 function_dict = {"NNSC": py_nnma.NNSC,
                  "FNMAI_SPARSE": py_nnma.FNMAI_SPARSE,
                  "FNMAI": py_nnma.FNMAI,
@@ -179,18 +180,203 @@ function_dict = {"NNSC": py_nnma.NNSC,
                  "FastHALS": py_nnma.FastHALS,
                  "SNMF": py_nnma.SNMF,
                  }
+def iterateBinnedBlocks(data, binning=1, blocksize=None, dtype=numpy.float64):
+    """
+    Generator returning (first, block) tuples with the spectra of the stack
+    summed over groups of binning channels as (nSpectra, nChannels) blocks.
+    first is the index of the first spectrum of the block.
+    """
+    N = int(data.shape[-1] / binning)
+    for first, block in PCATools.iterateSpectraBlocks(data,
+                                                      index=-1,
+                                                      binning=1,
+                                                      blocksize=blocksize,
+                                                      dtype=dtype):
+        if binning > 1:
+            block = block[:, :N * binning].reshape(-1, N, binning)
+            block = block.sum(axis=-1)
+        yield first, block
+
+def miniBatchNNMA(data, ncomponents, binning=None, eps=5e-5, maxcount=1000,
+                  verbose=DEBUG, blocksize=None, batchsize=1000, nsample=2000,
+                  inner=10, dtype=numpy.float64):
+    """
+    Online multiplicative update NNMA reading the stack by mini-batches.
+
+    The data Y (nPixels, N) are approximated by A X with A (nPixels, k) and
+    X (k, N) non-negative. For each mini-batch the coefficients of its
+    pixels are updated with the current spectra X and the spectra are then
+    updated from running statistics of the previous mini-batches. Only the
+    coefficients A and a random sample of the spectra are kept in memory.
+    The iterations stop when the relative change of the objective function
+    evaluated on the sample is below eps.
+
+    Parameters:
+    -----------
+    data : 2D or 3D array like object
+        The stack with the spectra along the last axis
+    ncomponents : int
+        Number of components
+    binning : int
+        Number of channels summed together
+    eps : float
+        Termination tolerance
+    maxcount : int
+        Maximum number of passes over the data
+    blocksize : int
+        Approximate number of bytes to be read at once.
+        Default PCATools.BLOCK_SIZE.
+    batchsize : int
+        Number of spectra in each mini-batch
+    nsample : int
+        Number of spectra used to evaluate the objective function
+    inner : int
+        Number of updates of the coefficients of each mini-batch
+    dtype : numpy data type
+        Data type used in the calculation
+
+    Returns:
+    --------
+    A, X, obj, count, converged, intensity with intensity being the sum of
+    all the data.
+    """
+    if binning is None:
+        binning = 1
+    shape = data.shape
+    nPixels = 1
+    for dim in shape[:-1]:
+        nPixels *= dim
+    N = int(shape[-1] / binning)
+    k = ncomponents
+    tiny = numpy.finfo(dtype).tiny
+
+    def blocks():
+        return iterateBinnedBlocks(data, binning=binning,
+                                   blocksize=blocksize, dtype=dtype)
+
+    # first pass: total intensity and a sample of the spectra
+    step = max(1, int(nPixels / nsample))
+    sample = []
+    intensity = 0.0
+    for first, block in blocks():
+        intensity += block.sum(dtype=numpy.float64)
+        offset = (-first) % step
+        sample.append(block[offset::step].copy())
+    sample = numpy.concatenate(sample)
+    sampleNorm = max(numpy.sum(sample * sample), tiny)
+
+    # start with the spectra of randomly chosen sample pixels
+    random = numpy.random.RandomState(0)
+    X = sample[random.randint(0, sample.shape[0], k)] + \
+        (sample.mean() + tiny) * random.random_sample((k, N))
+    X = X.astype(dtype)
+    A = numpy.ones((nPixels, k), dtype)
+    sampleA = numpy.ones((sample.shape[0], k), dtype)
+
+    # work buffers
+    XXt = numpy.zeros((k, k), dtype)
+    AtA = numpy.zeros((k, k), dtype)
+    AtY = numpy.zeros((k, N), dtype)
+    PX = numpy.zeros((k, N), dtype)
+    P = numpy.zeros((k, k), dtype)
+    Q = numpy.zeros((k, N), dtype)
+    batchsize = max(1, min(batchsize, nPixels))
+    nbuffer = max(batchsize, sample.shape[0])
+    YXt = numpy.zeros((nbuffer, k), dtype)
+    AXXt = numpy.zeros((nbuffer, k), dtype)
+
+    def updateCoefficients(Y, A):
+        # multiplicative updates of A for fixed X
+        n = Y.shape[0]
+        numpy.dot(Y, X.T, out=YXt[:n])
+        for i in range(inner):
+            numpy.dot(A, XXt, out=AXXt[:n])
+            AXXt[:n] += tiny
+            A *= YXt[:n]
+            A /= AXXt[:n]
+
+    def objective():
+        numpy.dot(X, X.T, out=XXt)
+        updateCoefficients(sample, sampleA)
+        residual = sample - numpy.dot(sampleA, X)
+        return numpy.sum(residual * residual) / sampleNorm
+
+    obj = objective()
+    converged = False
+    count = 0
+    while (count < maxcount) and not converged:
+        for first, block in blocks():
+            for i in range(0, block.shape[0], batchsize):
+                Y = block[i:i + batchsize]
+                n = Y.shape[0]
+                Ab = A[first + i:first + i + n]
+                numpy.dot(X, X.T, out=XXt)
+                updateCoefficients(Y, Ab)
+                # running statistics covering about one pass over the data
+                rho = max(0.0, 1.0 - n / float(nPixels))
+                numpy.dot(Ab.T, Ab, out=AtA)
+                numpy.dot(Ab.T, Y, out=AtY)
+                P *= rho
+                P += AtA
+                Q *= rho
+                Q += AtY
+                # multiplicative updates of X
+                for j in range(inner):
+                    numpy.dot(P, X, out=PX)
+                    PX += tiny
+                    X *= Q
+                    X /= PX
+        count += 1
+        oldObj = obj
+        obj = objective()
+        if verbose:
+            print("Pass %d objective = %g" % (count, obj))
+        if abs(oldObj - obj) <= eps * max(oldObj, tiny):
+            converged = True
+
+    # coefficients consistent with the final spectra
+    numpy.dot(X, X.T, out=XXt)
+    for first, block in blocks():
+        for i in range(0, block.shape[0], batchsize):
+            Y = block[i:i + batchsize]
+            updateCoefficients(Y, A[first + i:first + i + Y.shape[0]])
+    return A, X, obj, count, converged, intensity
+
 def nnma(stack, ncomponents, binning=None,
-         function=None, eps=5e-5, verbose=DEBUG, maxcount=1000, kmeans=False):
+         function=None, eps=5e-5, verbose=DEBUG, maxcount=1000, kmeans=False,
+         **kw):
     if kmeans and (not MDP):
         raise ValueError("K Means not supported")
     #I take the defaults for the other parameters
     param = dict(alpha=.1, tau=2, regul=1e-2, sparse_par=1e-1, psi=1e-3)
     if function is None:
         function = 'FNMAI'
-    nnma_function = function_dict[function]
     if binning is None:
         binning = 1
 
+    if function == 'MiniBatch':
+        # the data are streamed, no full copy is made
+        if hasattr(stack, "info") and hasattr(stack, "data"):
+            data = stack.data
+        else:
+            data = stack
+        if len(data.shape) == 3:
+            r, c = data.shape[:2]
+        else:
+            r, c = data.shape[0], 1
+        A, X, obj, count, converged, original_intensity = \
+                            miniBatchNNMA(data, ncomponents,
+                                          binning=binning,
+                                          eps=eps,
+                                          maxcount=maxcount,
+                                          verbose=verbose,
+                                          **kw)
+        if not converged:
+            print("WARNING: Possible problems converging")
+        return _sortNNMAResult(A, X, r, c, original_intensity,
+                               kmeans=kmeans, data=data, binning=binning)
+
+    nnma_function = function_dict[function]
     if hasattr(stack, "info") and hasattr(stack, "data"):
         data = stack.data[:]
     else:
@@ -273,6 +459,14 @@ def nnma(stack, ncomponents, binning=None,
     #if binning > 1:
     #    numpy.add(data, mindata-1, data)
     #data.shape = oldShape
+    #original data intensity
+    original_intensity = numpy.sum(data)
+    return _sortNNMAResult(A, X, r, c, original_intensity,
+                           kmeans=kmeans, data=data)
+
+def _sortNNMAResult(A, X, r, c, original_intensity, kmeans=False,
+                    data=None, binning=1):
+    ncomponents = X.shape[0]
     images = A.T
     if 0:
         images.shape = ncomponents, r, c
@@ -295,9 +489,6 @@ def nnma(stack, ncomponents, binning=None,
     sorted_idx = [item[1] for item in sorted(total_nnma_intensity)]
     sorted_idx.reverse()
 
-    #original data intensity
-    original_intensity = numpy.sum(data)
-
     #final values
     if kmeans:
         n_more = 1
@@ -324,12 +515,12 @@ def nnma(stack, ncomponents, binning=None,
         classifier = mdp.nodes.KMeansClassifier(ncomponents)
         for i in range(ncomponents):
             classifier.train(new_vectors[i:i+1])
-        k = 0
-        for i in range(r):
-            for j in range(c):
-                spectrum = data[k:k+1,:]
-                new_images[-1, i,j] = classifier.label(spectrum)[0]
-                k += 1
+        labels = new_images[-1]
+        labels.shape = -1
+        # the spectra are labelled by blocks whatever the stack shape
+        for first, block in iterateBinnedBlocks(data, binning=binning):
+            labels[first:first + block.shape[0]] = classifier.label(block)
+        labels.shape = r, c
     return new_images, values, new_vectors        
 
 if __name__ == "__main__":
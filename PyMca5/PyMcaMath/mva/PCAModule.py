@@ -399,6 +399,166 @@ def expectationMaximizationPCA(stack, ncomponents=10, binning=None, **kw):
     return images, eigenvalues, eigenvectors
 
 
+def randomizedPCA(stack, ncomponents=10, binning=None, mask=None, index=-1,
+                  dtype=numpy.float64, blocksize=None, oversampling=10,
+                  niter=2, **kw):
+    """
+    Randomized PCA reading the stack by blocks.
+
+    The principal components are obtained from the projection of the
+    covariance matrix into a random subspace refined by niter power
+    iterations. The stack is read niter + 2 times and neither the full
+    data nor the covariance matrix are kept in memory, therefore it can
+    be used on dynamically loaded stacks (HDF5, TIFF, EDF, ...).
+    Stacks of images (spectra axis first) are read by complete images,
+    twice per iteration, accumulating the products by channel.
+
+    Parameters:
+    -----------
+    stack : DataObject or 2D or 3D array like object
+        The stack. The spectra axis is taken from stack.info['McaIndex']
+        if present.
+    ncomponents : int
+        Number of principal components
+    binning : int
+        Spectral sampling. Only one channel out of binning is used.
+    mask : 2D array
+        Optional spatial mask. Only the pixels with non zero values are used.
+    index : int
+        Index of the spectra axis. It must be 0 or the last one.
+    dtype : numpy data type
+        Data type used to read the data and to accumulate the products.
+        numpy.float32 halves the memory and speeds up the calculation.
+    blocksize : int
+        Approximate number of bytes to be read at once.
+        Default PCATools.BLOCK_SIZE.
+    oversampling : int
+        Number of additional random vectors used to improve the accuracy
+    niter : int
+        Number of power iterations
+
+    Returns:
+    --------
+    images, eigenvalues, eigenvectors
+    """
+    if DEBUG:
+        print("randomizedPCA")
+    if binning is None:
+        binning = 1
+    if hasattr(stack, "info") and hasattr(stack, "data"):
+        data = stack.data
+        index = stack.info.get('McaIndex', index)
+    else:
+        data = stack
+    shape = data.shape
+    if index < 0:
+        index = len(shape) + index
+    if index not in [0, len(shape) - 1]:
+        raise IndexError("1D index must be one of 0, -1 or %d, got %d" %\
+                         (len(shape) - 1, index))
+    N = int(shape[index] / binning)
+    if ncomponents > N:
+        raise ValueError("Number of components too high.")
+    imageShape = [shape[i] for i in range(len(shape)) if i != index]
+    nPixels = 1
+    for dim in imageShape:
+        nPixels *= dim
+
+    if mask is not None:
+        badMask = numpy.ravel(numpy.array(mask)) < 1
+        if badMask.size != nPixels:
+            raise ValueError("Mask size does not match the number of pixels")
+        usedPixels = nPixels - int(badMask.sum())
+    else:
+        badMask = None
+        usedPixels = nPixels
+    if usedPixels < 2:
+        raise ValueError("Not enough pixels to calculate a covariance")
+
+    def blocks():
+        for first, block in PCATools.iterateSpectraBlocks(data,
+                                                          index=index,
+                                                          binning=binning,
+                                                          blocksize=blocksize,
+                                                          dtype=dtype):
+            if badMask is not None:
+                block[badMask[first:first + block.shape[0]]] = 0
+            yield first, block
+
+    def imageBlocks():
+        # slicing all the images by rows would read every image once
+        # per block of rows
+        for first, block in PCATools.iterateImageBlocks(data,
+                                                        binning=binning,
+                                                        blocksize=blocksize,
+                                                        dtype=dtype):
+            if badMask is not None:
+                block[:, badMask] = 0
+            yield first, block
+
+    # orthonormal random starting subspace
+    nvectors = min(N, ncomponents + oversampling)
+    random = numpy.random.RandomState(0)
+    q = numpy.linalg.qr(random.standard_normal((N, nvectors)))[0]
+    q = q.astype(dtype)
+    sumSpectrum = numpy.zeros((N,), numpy.float64)
+    for i in range(niter + 1):
+        if DEBUG:
+            t0 = time.time()
+        # y = covariance * q using covariance = (X.T X - S S.T / n) / (n - 1)
+        y = numpy.zeros((N, nvectors), dtype)
+        if index == 0:
+            # X.T q accumulated by channel and then X (X.T q)
+            z = numpy.zeros((nPixels, nvectors), dtype)
+            for first, block in imageBlocks():
+                last = first + block.shape[0]
+                if i == 0:
+                    sumSpectrum[first:last] = block.sum(axis=1,
+                                                        dtype=numpy.float64)
+                z += dotblas.dot(block.T, q[first:last])
+            for first, block in imageBlocks():
+                y[first:first + block.shape[0]] = dotblas.dot(block, z)
+            z = None
+        else:
+            for first, block in blocks():
+                if i == 0:
+                    sumSpectrum += block.sum(axis=0, dtype=numpy.float64)
+                y += dotblas.dot(block.T, dotblas.dot(block, q))
+        y -= numpy.outer(sumSpectrum,
+                         dotblas.dot(sumSpectrum, q) / usedPixels)
+        y /= (usedPixels - 1)
+        if DEBUG:
+            print("Pass %d elapsed = %f" % (i, time.time() - t0))
+        if i < niter:
+            q = numpy.linalg.qr(y)[0].astype(dtype)
+
+    # Rayleigh-Ritz in the final subspace
+    t = dotblas.dot(q.T.astype(numpy.float64), y.astype(numpy.float64))
+    evalues, evectors = numpy.linalg.eigh(0.5 * (t + t.T))
+    order = numpy.argsort(evalues)[::-1][:ncomponents]
+    eigenvalues = evalues[order].astype(numpy.float32)
+    eigenvectors = dotblas.dot(q.astype(numpy.float64),
+                               evectors[:, order]).T.astype(numpy.float32)
+
+    # the projections
+    images = numpy.zeros((ncomponents, nPixels), numpy.float32)
+    vectors = eigenvectors.astype(dtype)
+    if index == 0:
+        for first, block in imageBlocks():
+            images += dotblas.dot(vectors[:, first:first + block.shape[0]],
+                                  block)
+    else:
+        for first, block in blocks():
+            images[:, first:first + block.shape[0]] = dotblas.dot(vectors,
+                                                                  block.T)
+    images.shape = [ncomponents] + imageShape
+    return images, eigenvalues, eigenvectors
+
+def randomizedPCAFloat32(stack, ncomponents=10, binning=None, mask=None,
+                         **kw):
+    return randomizedPCA(stack, ncomponents, binning=binning, mask=mask,
+                         dtype=numpy.float32, **kw)
+
 def numpyPCA(stack, ncomponents=10, binning=None, **kw):
     """
     This is a covariance method using numpy
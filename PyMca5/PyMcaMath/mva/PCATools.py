@@ -31,6 +31,8 @@ __contact__ = "sole@esrf.fr"
 __license__ = "MIT"
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 import sys
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numpy
 import numpy.linalg
 try:
@@ -41,6 +43,149 @@ except ImportError:
     dotblas = numpy
 
 DEBUG = 0
+# approximate number of bytes to be read at once from the stack
+BLOCK_SIZE = 64 * 1024 * 1024
+
+def iterateSpectraBlocks(data, index=-1, binning=1, blocksize=None,
+                         dtype=numpy.float64):
+    """
+    Generator reading the spectra of a stack by blocks.
+
+    Parameters:
+    -----------
+    data : 2D or 3D array like object
+        The stack. Any object supporting slicing can be used.
+    index : int
+        Index of the spectra axis. It must be 0 or the last one.
+    binning : int
+        Spectral sampling. Only one channel out of binning is kept.
+    blocksize : int
+        Approximate number of bytes to be read at once. Default BLOCK_SIZE.
+    dtype : numpy data type
+        Data type of the returned blocks
+
+    Returns:
+    --------
+    It yields tuples (first, block) where block is a (nSpectra, nChannels)
+    array with a copy of the spectra and first is the index of the first
+    of them when the pixels are numbered in C order.
+    """
+    shape = data.shape
+    ndim = len(shape)
+    if index < 0:
+        index = ndim + index
+    if index not in [0, ndim - 1]:
+        raise IndexError("1D index must be one of 0, -1 or %d" % (ndim - 1))
+    if blocksize is None:
+        blocksize = BLOCK_SIZE
+    if binning is None:
+        binning = 1
+    nChannels = int(shape[index] / binning)
+    channels = slice(0, nChannels * binning, binning)
+    if index == 0:
+        pixelAxis = 1
+    else:
+        pixelAxis = 0
+    # number of spectra in each element of the axis used to read
+    rowPixels = 1
+    for i in range(ndim):
+        if i not in [index, pixelAxis]:
+            rowPixels *= shape[i]
+    itemsize = max(numpy.dtype(dtype).itemsize,
+                   numpy.dtype(getattr(data, "dtype", dtype)).itemsize)
+    nRows = max(1, int(blocksize // (rowPixels * shape[index] * itemsize)))
+    chunks = getattr(data, "chunks", None)
+    if chunks:
+        chunk = chunks[pixelAxis]
+        nRows = max(chunk, chunk * int(nRows // chunk))
+    nRows = min(nRows, shape[pixelAxis])
+    for first in range(0, shape[pixelAxis], nRows):
+        last = min(first + nRows, shape[pixelAxis])
+        if index == 0:
+            if ndim == 3:
+                block = data[channels, first:last, :]
+            else:
+                block = data[channels, first:last]
+            block = numpy.array(block, dtype=dtype)
+            block.shape = nChannels, -1
+            block = block.T
+        else:
+            if ndim == 3:
+                block = data[first:last, :, channels]
+            else:
+                block = data[first:last, channels]
+            block = numpy.array(block, dtype=dtype)
+            block.shape = -1, nChannels
+        yield first * rowPixels, block
+
+def iterateImageBlocks(data, binning=1, blocksize=None, dtype=numpy.float64,
+                       stop=None):
+    """
+    Generator reading a stack with the spectra axis first by blocks of
+    complete images. Every image is read only once.
+
+    Parameters:
+    -----------
+    data : 2D or 3D array like object
+        The stack. Any object supporting slicing can be used.
+    binning : int
+        Spectral sampling. Only one image out of binning is kept.
+    blocksize : int
+        Approximate number of bytes to be read at once. Default BLOCK_SIZE.
+    dtype : numpy data type
+        Data type of the returned blocks
+    stop : int
+        Index, after binning, of the image at which the reading stops.
+        Default is to read all the images.
+
+    Returns:
+    --------
+    It yields tuples (first, block) where block is a (nImages, nPixels)
+    array with a copy of the images and first is the index of the first
+    of them after binning.
+    """
+    shape = data.shape
+    if blocksize is None:
+        blocksize = BLOCK_SIZE
+    if binning is None:
+        binning = 1
+    nChannels = int(shape[0] / binning)
+    nPixels = 1
+    for dim in shape[1:]:
+        nPixels *= dim
+    itemsize = max(numpy.dtype(dtype).itemsize,
+                   numpy.dtype(getattr(data, "dtype", dtype)).itemsize)
+    nImages = max(1, int(blocksize // (nPixels * itemsize)))
+    chunks = getattr(data, "chunks", None)
+    if chunks and (binning == 1):
+        chunk = chunks[0]
+        nImages = max(chunk, chunk * int(nImages // chunk))
+    nImages = min(nImages, nChannels)
+    if stop is None:
+        stop = nChannels
+    for first in range(0, min(stop, nChannels), nImages):
+        last = min(first + nImages, nChannels, stop)
+        if binning == 1:
+            block = data[first:last]
+        else:
+            block = data[(first * binning):(last * binning):binning]
+        block = numpy.array(block, dtype=dtype)
+        block.shape = last - first, nPixels
+        yield first, block
+
+def _iterateWeightedImages(data, binning, blocksize, dtype, weights,
+                           badPixels, stop=None):
+    #the images multiplied by their weights and with the bad pixels
+    #set to zero
+    for first, block in iterateImageBlocks(data,
+                                           binning=binning,
+                                           blocksize=blocksize,
+                                           dtype=dtype,
+                                           stop=stop):
+        block *= weights[0, first:first + block.shape[0]].reshape(-1, 1)
+        if badPixels is not None:
+            block[:, badPixels] = 0
+        yield first, block
 
 def getCovarianceMatrix(stack,
                         index=-1,
@@ -49,7 +194,9 @@ def getCovarianceMatrix(stack,
                         force=True,
                         center=True,
                         weights=None,
-                        spatial_mask=None):
+                        spatial_mask=None,
+                        blocksize=None,
+                        nthreads=None):
     #the 1D mask should correspond to the values, before or after
     #sampling?  it could be handled as weigths to be applied to the
     #spectra. That would allow two uses, as mask and as weights, at
@@ -60,6 +207,11 @@ def getCovarianceMatrix(stack,
     #non finite data (NaN, +inf, -inf, ...). The calling program
     #should set the mask.
 
+    #when force is True the data are read by blocks of about blocksize
+    #bytes and the products of each block are shared among nthreads
+    #threads (None means one and less than one means the number of CPUs)
+    #stacks of images (index 0) are read by blocks of complete images
+
     #recover the actual data to work with
     if hasattr(stack, "info") and hasattr(stack, "data"):
         #we are dealing with a PyMca data object
@@ -157,16 +309,24 @@ def getCovarianceMatrix(stack,
     #we are dealing with dynamically loaded data
     if DEBUG:
         print("DYNAMICALLY LOADED DATA")
+    if nthreads is None:
+        nthreads = 1
+    elif nthreads < 1:
+        nthreads = multiprocessing.cpu_count()
     #create the needed storage space for the covariance matrix
+    #each thread accumulates its own partial product
+    if actualIndex in [0]:
+        nMatrices = 1
+    else:
+        nMatrices = nthreads
     try:
-        covMatrix = numpy.zeros((eigenvectorLength, eigenvectorLength),
-                                dtype=dtype)
+        partialMatrices = [numpy.zeros((eigenvectorLength, eigenvectorLength),
+                                       dtype=dtype) for i in range(nMatrices)]
         sumSpectrum = numpy.zeros((eigenvectorLength,), numpy.float64)
     except:
         #make sure no reference to the original input data is kept
         cleanWeights = None
-        covMatrix = None
-        averageMatrix = None
+        partialMatrices = None
         data = None
         raise
 
@@ -188,308 +348,90 @@ def getCovarianceMatrix(stack,
         else:
             raise
 
-    if actualIndex in [0]:
-        #divider is used to decide the fraction of images to keep in memory
-        #in order to limit file access on dynamically loaded data.
-        #Since two chunks of the same size are used, the amount of memory
-        #needed is twice the data size divided by the divider.
-        #For instance, divider = 10 implies the data to be read 5.5 times
-        #from disk while having a memory footprint of about one fifth of
-        #the dataset size.
-        step = 0
-        divider = 10
-        while step < 1:
-            step = int(oldShape[index] / divider)
-            divider -= 2
-            if divider <= 0:
-                step = oldShape[index]
-                break
-        if DEBUG:
-            print("Reading chunks of %d images" % step)
-        nImagesRead = 0
-        if (binning == 1) and oldShape[index] >= step:
-            chunk1 = numpy.zeros((step, nPixels), numpy.float64)
-            chunk2 = numpy.zeros((nPixels, step), numpy.float64)
-            if spatial_mask is not None:
-                badMask.shape = -1
-                cleanMask.shape = -1
-            i = 0
-            while i < N:
-                iToRead = min(step, N - i)
-                #get step images for the first chunk
-                chunk1[0:iToRead] = data[i:i + iToRead].reshape(iToRead, -1)
-                if spatial_mask is not None:
-                    chunk1[0:iToRead, badMask] = 0
-                sumSpectrum[i:i + iToRead] = chunk1[0:iToRead].sum(axis=1)
-                if center:
-                    average = sumSpectrum[i:i + iToRead] / usedPixels
-                    average.shape = iToRead, 1
-                    chunk1[0:iToRead] -= average
-                if spatial_mask is not None:
-                    chunk1[0:iToRead, badMask] = 0
-                nImagesRead += iToRead
-                j = 0
-                while j <= i:
-                    #get step images for the second chunk
-                    if j == i:
-                        jToRead = iToRead
-                        if 0:
-                            for k in range(0, jToRead):
-                                chunk2[:, k] = chunk1[k]
-                        else:
-                            chunk2[:, 0:jToRead] = chunk1[0:jToRead, :].T
-                    else:
-                        #get step images for the second chunk
-                        jToRead = min(step, nChannels - j)
-
-                        #with loop:
-                        #for k in range(0, jToRead):
-                        #    chunk2[:,k] = data[(j+k):(j+k+1)].reshape(1,-1)
-                        #    if spatial_mask is not None:
-                        #        chunk2[badMask[(j+k):(j+k+1),k]] = 0
-                        #equivalent without loop:
-                        chunk2[:, 0:jToRead] =\
-                            data[j:(j + jToRead)].reshape(jToRead, -1).T
-                        if spatial_mask is not None:
-                            chunk2[badMask, 0:jToRead] = 0
-                        nImagesRead += jToRead
-                        if center:
-                            average = \
-                                chunk2[:, 0:jToRead].sum(axis=0) / usedPixels
-                            average.shape = 1, jToRead
-                            chunk2[:, 0:jToRead] -= average
-                            if spatial_mask is not None:
-                                chunk2[badMask, 0:jToRead] = 0
-
-                    #dot product
-                    if (iToRead != step) or (jToRead != step):
-                        covMatrix[i: (i + iToRead), j: (j + jToRead)] =\
-                                        dotblas.dot(chunk1[:iToRead, :nPixels],
-                                                    chunk2[:nPixels, :jToRead])
-                    else:
-                        covMatrix[i: (i + iToRead), j: (j + jToRead)] =\
-                                        dotblas.dot(chunk1, chunk2)
-
-                    if i != j:
-                        covMatrix[j: (j + jToRead), i: (i + iToRead)] =\
-                                covMatrix[i: (i + iToRead), j: (j + jToRead)].T
-
-                    #increment j
-                    j += jToRead
-                i += iToRead
-            chunk1 = None
-            chunk2 = None
-            if DEBUG:
-                print("totalImages Read = ", nImagesRead)
-        elif (binning > 1) and (oldShape[index] >= step):
-            chunk1 = numpy.zeros((step, nPixels), numpy.float64)
-            chunk2 = numpy.zeros((nPixels, step), numpy.float64)
-            #one by one reading till we fill the chunks
-            imagesToRead = numpy.arange(0, oldShape[index], binning)
-            i = int(imagesToRead[weights > 0][0])
-            spectrumIndex = 0
-            nImagesRead = 0
-            while i < N:
-                #fill chunk1
-                jj = 0
-                for iToRead in range(0, int(min(step * binning, N - i)),
-                                     binning):
-                    chunk1[jj] = data[i + iToRead].reshape(1, -1) * \
-                                 weights[i + iToRead]
-                    jj += 1
-                sumSpectrum[spectrumIndex:(spectrumIndex + jj)] = \
-                                                    chunk1[0:jj].sum(axis=1)
-                if center:
-                    average = \
-                        sumSpectrum[spectrumIndex:(spectrumIndex + jj)] / nPixels
-                    average.shape = jj, 1
-                    chunk1[0:jj] -= average
-                nImagesRead += jj
-                iToRead = jj
-                j = 0
-                while j <= i:
-                    #get step images for the second chunk
-                    if j == i:
-                        jToRead = iToRead
-                        chunk2[:, 0:jToRead] = chunk1[0:jToRead, :].T
-                    else:
-                        #get step images for the second chunk
-                        jj = 0
-                        for jToRead in range(0,
-                                             int(min(step * binning, N - j)),
-                                             binning):
-                            chunk2[:, jj] =\
-                                data[j + jToRead].reshape(1, -1)\
-                                * weights[j + jToRead]
-                            jj += 1
-                        nImagesRead += jj
-                        if center:
-                            average = chunk2[:, 0:jj].sum(axis=0) / nPixels
-                            average.shape = 1, jj
-                            chunk2 -= average
-                        jToRead = jj
-                    #dot product
-                    if (iToRead != step) or (jToRead != step):
-                        covMatrix[i:(i + iToRead), j:(j + jToRead)] =\
-                                dotblas.dot(chunk1[:iToRead, :nPixels],
-                                            chunk2[:nPixels, :jToRead])
-                    else:
-                        covMatrix[i:(i + iToRead), j:(j + jToRead)] =\
-                                dotblas.dot(chunk1, chunk2)
-
-                    if i != j:
-                        covMatrix[j:(j + jToRead), i:(i + iToRead)] =\
-                                covMatrix[i:(i + iToRead), j:(j + jToRead)].T
-
-                    #increment j
-                    j += jToRead * step
-                i += iToRead * step
-            chunk1 = None
-            chunk2 = None
-        else:
-            raise ValueError("Unhandled case")
-
-        #should one divide by N or by N-1 ??  if we use images, we
-        #assume the observables are the images, not the spectra!!!
-        #so, covMatrix /= nChannels is wrong and one has to use:
-        covMatrix /= usedPixels
+    if spatial_mask is not None:
+        badPixels = numpy.ravel(numpy.array(spatial_mask)) < 1
     else:
-        #the data are already arranged as (nPixels, nChannels) and we
-        #basically have to return data.T * data to get back the covariance
-        #matrix as (nChannels, nChannels)
-        #if someone had the bad idea to store the data in HDF5 with a chunk
-        #size based on the pixels and not on the spectra a loop based on
-        #reading spectrum per spectrum can be very slow
-        step = 0
-        divider = 10
-        while step < 1:
-            step = int(nPixels / divider)
-            divider -= 1
-            if divider <= 0:
-                step = nPixels
-                break
-        step = nPixels
-        if DEBUG:
-            print("Reading chunks of %d spectra" % step)
+        badPixels = None
+    cleanWeights = numpy.array(cleanWeights[:nChannels], dtype=dtype)
+    cleanWeights.shape = 1, -1
 
-        cleanWeights.shape = 1, -1
-        if len(data.shape) == 2:
-            if cleanMask is not None:
-                badMask.shape = -1
-            tmpData = numpy.zeros((step, nChannels), numpy.float64)
-            k = 0
-            while k < nPixels:
-                kToRead = min(step, nPixels - k)
-                tmpData[0:kToRead] = data[k: k + kToRead, ::binning]
-                if cleanMask is not None:
-                    tmpData[badMask[k: k + kToRead]] = 0
-                a = tmpData[0:kToRead] * cleanWeights
-                sumSpectrum += a.sum(axis=0)
-                covMatrix += dotblas.dot(a.T, a)
-                a = None
-                k += kToRead
-            tmpData = None
-        elif len(data.shape) == 3:
-            if oldShape[0] == 1:
-                #close to the previous case
-                tmpData = numpy.zeros((step, nChannels), numpy.float64)
-                if cleanMask is not None:
-                    badMask.shape = data.shape[0], data.shape[1]
-                for i in range(oldShape[0]):
-                    k = 0
-                    while k < oldShape[1]:
-                        kToRead = min(step, oldShape[1] - k)
-                        tmpData[0:kToRead] = data[i, k:k + kToRead, ::binning]\
-                                             * cleanWeights
-                        if cleanMask is not None:
-                            tmpData[0:kToRead][badMask[i, k: k + kToRead]] = 0
-                        a = tmpData[0:kToRead]
-                        sumSpectrum += a.sum(axis=0)
-                        covMatrix += dotblas.dot(a.T, a)
-                        a = None
-                        k += kToRead
-                tmpData = None
-            elif oldShape[1] == 1:
-                #almost identical to the previous case
-                tmpData = numpy.zeros((step, nChannels), numpy.float64)
-                if cleanMask is not None:
-                    badMask.shape = data.shape[0], data.shape[1]
-                for i in range(oldShape[1]):
-                    k = 0
-                    while k < oldShape[0]:
-                        kToRead = min(step, oldShape[0] - k)
-                        tmpData[0:kToRead] = data[k: k + kToRead, i, ::binning]\
-                                             * cleanWeights
-                        if cleanMask is not None:
-                            tmpData[0:kToRead][badMask[k: k + kToRead, i]] = 0
-                        a = tmpData[0:kToRead]
-                        sumSpectrum += a.sum(axis=0)
-                        covMatrix += dotblas.dot(a.T, a)
-                        a = None
-                        k += kToRead
-                tmpData = None
-            elif oldShape[0] < 21:
-                if step > oldShape[1]:
-                    step = oldShape[1]
-                tmpData = numpy.zeros((step, nChannels), numpy.float64)
-                if cleanMask is not None:
-                    badMask.shape = data.shape[0], data.shape[1]
-                for i in range(oldShape[0]):
-                    k = 0
-                    while k < oldShape[1]:
-                        kToRead = min(step, oldShape[1] - k)
-                        tmpData[0:kToRead] = data[i, k: k + kToRead, ::binning]\
-                                             * cleanWeights
-                        if cleanMask is not None:
-                            tmpData[0:kToRead][badMask[i, k: k + kToRead]] = 0
-                        a = tmpData[0:kToRead]
-                        sumSpectrum += a.sum(axis=0)
-                        covMatrix += dotblas.dot(a.T, a)
-                        a = None
-                        k += kToRead
-                tmpData = None
-            else:
-                #I should choose the sizes in terms of the size
-                #of the dataset
-                if oldShape[0] < 41:
-                    #divide by 10
-                    deltaRow = 4
-                elif oldShape[0] < 101:
-                    #divide by 10
-                    deltaRow = 10
+    if actualIndex in [0]:
+        #stacks of images are read by complete images because slicing them
+        #by rows would read every image once per block of rows. The
+        #products of the images of one block with those of the previous
+        #blocks are calculated reading those blocks again.
+        if blocksize is None:
+            blocksize = BLOCK_SIZE
+        covMatrix = partialMatrices[0]
+        for first, block in _iterateWeightedImages(data, binning,
+                                                   int(blocksize / 2), dtype,
+                                                   cleanWeights, badPixels):
+            last = first + block.shape[0]
+            sumSpectrum[first:last] = block.sum(axis=1, dtype=numpy.float64)
+            covMatrix[first:last, first:last] = dotblas.dot(block, block.T)
+            for first2, block2 in _iterateWeightedImages(data, binning,
+                                                int(blocksize / 2), dtype,
+                                                cleanWeights, badPixels,
+                                                stop=first):
+                last2 = first2 + block2.shape[0]
+                covMatrix[first:last, first2:last2] = dotblas.dot(block,
+                                                                  block2.T)
+                covMatrix[first2:last2, first:last] = \
+                                    covMatrix[first:last, first2:last2].T
+    else:
+        def accumulate(args):
+            # add the product of one slice of the block to a partial matrix
+            i, block = args
+            first = int((i * block.shape[0]) / nthreads)
+            last = int(((i + 1) * block.shape[0]) / nthreads)
+            if last > first:
+                a = block[first:last]
+                partialMatrices[i] += dotblas.dot(a.T, a)
+
+        if nthreads > 1:
+            pool = ThreadPool(nthreads)
+        else:
+            pool = None
+        pending = None
+        try:
+            #the next block is read while the previous one is being processed
+            for first, block in iterateSpectraBlocks(data,
+                                                     index=actualIndex,
+                                                     binning=binning,
+                                                     blocksize=blocksize,
+                                                     dtype=dtype):
+                block *= cleanWeights
+                if badPixels is not None:
+                    block[badPixels[first:first + block.shape[0]]] = 0
+                sumSpectrum += block.sum(axis=0, dtype=numpy.float64)
+                if pool is None:
+                    partialMatrices[0] += dotblas.dot(block.T, block)
                 else:
-                    #take pieces of one tenth
-                    deltaRow = int(oldShape[0] / 10)
-                deltaCol = oldShape[1]
-                tmpData = numpy.zeros((deltaRow, deltaCol, nChannels),
-                                      numpy.float64)
-                if cleanMask is not None:
-                    badMask.shape = data.shape[0], data.shape[1]
-                i = 0
-                while i < oldShape[0]:
-                    iToRead = min(deltaRow, oldShape[0] - i)
-                    kToRead = iToRead * oldShape[1]
-                    tmpData[:iToRead] = data[i:(i + iToRead), :, ::binning]
-                    if cleanMask is not None:
-                        tmpData[0:kToRead][badMask[i:(i + iToRead), :]] = 0
-                    a = tmpData[:iToRead]
-                    a.shape = kToRead, nChannels
-                    a *= cleanWeights
-                    if 0:
-                        #weight each spectrum
-                        a /= (a.sum(axis=1).reshape(-1, 1))
-                    sumSpectrum += a.sum(axis=0)
-                    covMatrix += dotblas.dot(a.T, a)
-                    a = None
-                    i += iToRead
-        #should one divide by N or by N-1 ??
-        covMatrix /= usedPixels - 1
-        if center:
-            #the n-1 appears again here
-            averageMatrix = numpy.outer(sumSpectrum, sumSpectrum)\
-                            / (usedPixels * (usedPixels - 1))
-            covMatrix -= averageMatrix
-            averageMatrix = None
+                    if pending is not None:
+                        pending.get()
+                    pending = pool.map_async(accumulate,
+                                        [(i, block) for i in range(nthreads)])
+            if pending is not None:
+                pending.get()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    #final reduction
+    covMatrix = partialMatrices[0]
+    for partialMatrix in partialMatrices[1:]:
+        covMatrix += partialMatrix
+    partialMatrices = None
+
+    #should one divide by N or by N-1 ??
+    covMatrix /= usedPixels - 1
+    if center:
+        #the n-1 appears again here
+        averageMatrix = numpy.outer(sumSpectrum, sumSpectrum)\
+                        / (usedPixels * (usedPixels - 1))
+        covMatrix -= averageMatrix
+        averageMatrix = None
     return covMatrix, sumSpectrum / usedPixels, usedPixels
 
 
@@ -560,7 +502,8 @@ def numpyPCA(stack, index=-1, ncomponents=10, binning=None,
                                                              binning=binning,
                                                              force=force,
                                                              center=center,
-                                                             spatial_mask=mask)
+                                                             spatial_mask=mask,
+                                             nthreads=kw.get("nthreads", None))
 
     #the total variance is the sum of the elements of the diagonal
     totalVariance = numpy.diag(cov)
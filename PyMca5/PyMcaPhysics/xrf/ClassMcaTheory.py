@@ -844,6 +844,7 @@ class McaTheory(object):
         self.NGLOBAL    = NGLOBAL
         self.PARAMETERS = PARAMETERS
         self.ESCAPE     = self.config['fit']['escapeflag']
+        self.__packPeaks()
         self.__SUM        = self.config['fit']['sumflag']
         self.__CONTINUUM     = CONTINUUM
         self.MAXITER    = self.config['fit']['maxiter']
@@ -1141,126 +1142,159 @@ class McaTheory(object):
         self.laststripanchorsflag     = self.config['fit']['stripanchorsflag']
         self.laststripanchorslist     = self.config['fit']['stripanchorslist']
 
+    def __packPeaks(self):
+        """
+        Keep the peaks of all the groups in a single buffer. The arrays in
+        PEAKSW become views of that buffer, so that all the peaks can be
+        updated and evaluated at once.
+        """
+        PEAKS0 = self.PEAKS0
+        PEAKSW = self.PEAKSW
+        groups = []
+        rates = []
+        energies = []
+        escape = []
+        parents = []
+        escapeRates = []
+        offset = 0
+        for i in range(len(PEAKSW)):
+            (r,c) = (PEAKS0[i]).shape
+            nrows = PEAKSW[i].shape[0]
+            groups.append(i * numpy.ones((nrows,), numpy.int32))
+            rates.append(PEAKS0[i][:,0])
+            energies.append(PEAKS0[i][:,1] * 1.0)
+            escape.append(numpy.zeros((r,), numpy.bool_))
+            if nrows > r:
+                #escape
+                rates.append(numpy.zeros((nrows - r,), numpy.float))
+                escape.append(numpy.ones((nrows - r,), numpy.bool_))
+                if OLDESCAPE:
+                    parents.append(offset + numpy.arange(r))
+                    escapeRates.append(PEAKS0[i][:,3])
+                    energies.append(PEAKS0[i][:,1] - \
+                                    self.config['detector']['detene'])
+                else:
+                    ii = 0
+                    for esc_group in self.PEAKS0ESCAPE[i]:
+                        for esc_line in esc_group:
+                            parents.append([offset + ii])
+                            escapeRates.append([esc_line[1]])
+                            energies.append([esc_line[0] * 1.0])
+                        ii = ii + 1
+            offset += nrows
+        if len(PEAKSW):
+            buffer = numpy.concatenate(PEAKSW[:])
+        else:
+            buffer = numpy.ones((0, 3 + 1 + 4 * (self.__HYPERMET > 0)),
+                                numpy.float)
+        offset = 0
+        for i in range(len(PEAKSW)):
+            nrows = PEAKSW[i].shape[0]
+            PEAKSW[i] = buffer[offset:offset + nrows]
+            offset += nrows
+        self.__peakBuffer = buffer
+        if len(PEAKSW):
+            self.__peakGroups = numpy.concatenate(groups)
+            self.__peakRates = numpy.concatenate(rates)
+            self.__peakEnergies = numpy.concatenate(energies).astype(numpy.float)
+            self.__peakEscape = numpy.nonzero(numpy.concatenate(escape))[0]
+        else:
+            self.__peakGroups = numpy.zeros((0,), numpy.int32)
+            self.__peakRates = numpy.zeros((0,), numpy.float)
+            self.__peakEnergies = numpy.zeros((0,), numpy.float)
+            self.__peakEscape = numpy.zeros((0,), numpy.int)
+        if len(parents):
+            self.__peakParents = numpy.concatenate(parents).astype(numpy.int)
+            self.__peakEscapeRates = numpy.concatenate(escapeRates).astype(numpy.float)
+        else:
+            self.__peakParents = numpy.zeros((0,), numpy.int)
+            self.__peakEscapeRates = numpy.zeros((0,), numpy.float)
+        # the width of escape peaks below zero energy is the detector noise
+        self.__peakWidthEnergies = self.__peakEnergies * 1.0
+        self.__peakWidthEnergies[self.__peakEscape] = \
+                (self.__peakEnergies[self.__peakEscape] > 0) * \
+                 self.__peakEnergies[self.__peakEscape]
+        self.__peakMatrixCache = None
+
+    def __fillPeaks(self, param, hypermet, areas=None, peaks=None):
+        """
+        Fill, for all the groups at once, the parameters of the peaks as
+        expected by SpecfitFuns.ahypermet or SpecfitFuns.apvoigt. If no
+        areas are given, all the groups have unit area.
+        """
+        PARAMETERS = self.PARAMETERS
+        gain = param[1]
+        noise= param[2] * param[2]
+        fano = param[3] * 2.3548*2.3548*0.00385
+        if peaks is None:
+            peaks = numpy.ones(self.__peakBuffer.shape, numpy.float)
+        escape = self.__peakEscape
+        if areas is None:
+            peaks[:,0] = self.__peakRates * 1.0 * gain
+        else:
+            peaks[:,0] = self.__peakRates * \
+                         numpy.take(areas, self.__peakGroups) * gain
+        if len(escape):
+            peaks[escape,0] = peaks[self.__peakParents,0] * \
+                              self.__peakEscapeRates
+        peaks[:,1] = self.__peakEnergies
+        peaks[:,2] = numpy.sqrt(noise + self.__peakWidthEnergies * fano)
+        if hypermet:
+            peaks[:,3] = param[PARAMETERS.index('ST AreaR')]
+            peaks[:,4] = param[PARAMETERS.index('ST SlopeR')]
+            peaks[:,5] = param[PARAMETERS.index('LT AreaR')]
+            peaks[:,6] = param[PARAMETERS.index('LT SlopeR')]
+            peaks[:,7] = param[PARAMETERS.index('STEP HeightR')]
+            #neglect tails in escape peaks
+            if len(escape):
+                peaks[escape,3] = 0.0
+                peaks[escape,5] = 0.0
+                peaks[escape,7] = 0.0
+        else:
+            #pseudo voigt
+            peaks[:,3] = param[PARAMETERS.index('Eta Factor')]
+        return peaks
+
+    def __getPeakMatrix(self, param, energy, hypermet, fast=0, areas=None):
+        """
+        Evaluate the contribution of each group at the given energies in a
+        single call. Each column corresponds to a group. If no areas are
+        given, all the groups have unit area.
+        """
+        ngroups = len(self.PEAKSW)
+        if not ngroups:
+            return numpy.zeros((len(energy), 0), numpy.float)
+        peaks = self.__fillPeaks(param, hypermet, areas=areas)
+        if hypermet:
+            return SpecfitFuns.ahypermetmatrix(peaks, energy,
+                                               self.__peakGroups, ngroups,
+                                               hypermet, fast)
+        else:
+            return SpecfitFuns.apvoigtmatrix(peaks, energy,
+                                             self.__peakGroups, ngroups)
+
     def getPeakMatrixContribution(self,param0,t0=None,hypermet=None,
                                   continuum=None,summing=None):
         """
-        For the time being a huge copy paste from mcatheory
+        Return the matrix of the contributions of each peak group. It has
+        one row per point and one column per group. When escape peaks are
+        considered the groups have unit area, otherwise their area is the
+        one given by the parameters.
         """
-        if continuum is None:
-            continuum = self.__CONTINUUM
         if hypermet is None:
             hypermet = self.__HYPERMET
-        if summing is None:
-            summing  = self.__SUM
         param= numpy.array(param0)
-        #param= numpy.ones(param.shape, numpy.float)
         if t0 is None:t0 = self.xdata
         x    = numpy.array(t0)
-        matrix = numpy.zeros((len(x),len(param)-self.NGLOBAL)).astype(numpy.float)
-
-        
         zero = param[0]
         gain = param[1]
         energy=zero + gain * x
-        #print energy
-        noise= param[2] * param[2]
-        fano = param[3] * 2.3548*2.3548*0.00385
-        #t=time.time()
-        PEAKS0 = self.PEAKS0
-        PEAKS0ESCAPE = self.PEAKS0ESCAPE
-        PEAKSW = self.PEAKSW
-        PARAMETERS = self.PARAMETERS
-        FASTER = 0
-        for i in range(len(param[self.NGLOBAL:])):
-            result = 0 * energy
-            if self.ESCAPE:
-                #area = param[NGLOBAL+i]
-                (r,c) = (PEAKS0[i]).shape
-                PEAKSW[i][0:r,0] = PEAKS0[i][:,0] * 1 * gain
-                PEAKSW[i][0:r,1] = PEAKS0[i][:,1] * 1.0
-                PEAKSW[i][0:r,2] = numpy.sqrt(noise + PEAKS0[i][:,1] * fano)
-                #escape
-                if OLDESCAPE:
-                    PEAKSW[i][r:,0] = PEAKSW[i][0:r,0] * PEAKS0[i][:,3]
-                    PEAKSW[i][r:,1] = PEAKS0[i][:,1] - self.config['detector']['detene']
-                    PEAKSW[i][r:,2] = numpy.sqrt(noise + \
-                                        (PEAKSW[i][r:,1]>0) * PEAKSW[i][r:,1] * fano)
-                else:
-                    ii=0
-                    j=0
-                    for esc_group in PEAKS0ESCAPE[i]:
-                        for esc_line in esc_group:
-                            esc_ene  = esc_line[0] * 1.0
-                            esc_rate = esc_line[1]
-                            PEAKSW[i][j+r,0] =  PEAKSW[i][ii,0] * esc_rate
-                            PEAKSW[i][j+r,1] =  esc_ene
-                            j = j + 1
-                        ii = ii + 1   
-                    PEAKSW[i][r:, 2] = numpy.sqrt(noise + \
-                                    (PEAKSW[i][r:,1]>0) * PEAKSW[i][r:,1] * fano)
-                (rw,cw) = (PEAKSW[i]).shape
-                if 0 and self.PARAMETERS[self.NGLOBAL+i] =='Fe K':
-                  for ii in range(rw):
-                    if ii < r:
-                        print(self.PARAMETERS[self.NGLOBAL+i],"PEAK ",ii,PEAKSW[i][ii])
-                    else:
-                        print(self.PARAMETERS[self.NGLOBAL+i],"PEAKesc ",ii,PEAKSW[i][ii])
-                #print PARAMETERS[self.NGLOBAL+i]
-                #print PEAKSW[i][:,1]
-                #print PEAKS0ESCAPE[i]
-                #for j in range(PEAKSW[i].shape[0]):
-                #    print "H = ", PEAKSW[i][j*r,0],"E = ",PEAKSW[i][j*r,1]
-                     
-                #if HYPERMET:
-                if hypermet:
-                    PEAKSW[i] [0:r,3] = param[PARAMETERS.index('ST AreaR')]
-                    PEAKSW[i] [:,4] = param[PARAMETERS.index('ST SlopeR')]
-                    PEAKSW[i] [0:r,5] = param[PARAMETERS.index('LT AreaR')]
-                    PEAKSW[i] [:,6] = param[PARAMETERS.index('LT SlopeR')]
-                    PEAKSW[i] [0:r,7] = param[PARAMETERS.index('STEP HeightR')]
-                    #neglect tails in escape peaks
-                    PEAKSW[i] [r:,3] = 0.0 
-                    PEAKSW[i] [r:,5] = 0.0 
-                    PEAKSW[i] [r:,7] = 0.0 
-                if not FASTER:
-                    #if HYPERMET:
-                    if hypermet:
-                        if i == 0:
-                            result = SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)
-                        else:
-                            result += SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)            
-                    else:
-                        if i == 0:
-                            result = SpecfitFuns.apvoigt(PEAKSW[i],energy)
-                        else:
-                            result += SpecfitFuns.apvoigt(PEAKSW[i],energy)            
-            else:
-                PEAKSW[i][:,0] = PEAKS0[i][:,0] * param[self.NGLOBAL+i] * gain
-                PEAKSW[i][:,1] = PEAKS0[i][:,1] * 1.0
-                PEAKSW[i][:,2] = numpy.sqrt(noise + PEAKS0[i][:,1] * fano)
-                if hypermet:
-                    PEAKSW[i] [:,3] = param[PARAMETERS.index('ST AreaR')]
-                    PEAKSW[i] [:,4] = param[PARAMETERS.index('ST SlopeR')]
-                    PEAKSW[i] [:,5] = param[PARAMETERS.index('LT AreaR')]
-                    PEAKSW[i] [:,6] = param[PARAMETERS.index('LT SlopeR')]
-                    PEAKSW[i] [:,7] = param[PARAMETERS.index('STEP HeightR')]
-                else:
-                    #pseudo voigt
-                    PEAKSW[i] [:,3] = param[PARAMETERS.index('Eta Factor')]
-                if not FASTER:
-                    if hypermet:
-                        if i == 0:
-                            result = SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)
-                        else:
-                            result += SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)            
-                    else:
-                        if i == 0:
-                            result = SpecfitFuns.apvoigt(PEAKSW[i],energy)
-                        else:
-                            result += SpecfitFuns.apvoigt(PEAKSW[i],energy)
-            #print "shape = ",result.shape
-            #print "matrix = ",matrix.shape
-            matrix[:,i] = result[:,0]
+        if self.ESCAPE:
+            areas = None
+        else:
+            areas = param[self.NGLOBAL:]
+        matrix = self.__getPeakMatrix(param, energy.reshape(-1), hypermet,
+                                      areas=areas)
         return matrix
 
     def linearMcaTheory(self, param0, t0, hypermet=None, continuum=None, summing=None):
@@ -1276,7 +1310,7 @@ class McaTheory(object):
         gain = param[1]
         #the loop in mcatheory is replaced by this single line
         if len(self.PEAKSW[:]):
-            result = numpy.sum(param[self.NGLOBAL:] * self.linearMatrix, 1)
+            result = numpy.dot(self.linearMatrix, param[self.NGLOBAL:])
         else:
             result = 0.0 * x
         if continuum:
@@ -1299,125 +1333,20 @@ class McaTheory(object):
         zero = param[0]
         gain = param[1]
         energy=zero + gain * x
-        #print energy
-        noise= param[2] * param[2]
-        fano = param[3] * 2.3548*2.3548*0.00385
-        #t=time.time()
-        PEAKS0 = self.PEAKS0
-        PEAKS0ESCAPE = self.PEAKS0ESCAPE
         PEAKSW = self.PEAKSW
-        PARAMETERS = self.PARAMETERS
-        FASTER = self.FASTER
-        for i in range(len(param[self.NGLOBAL:])):
-            if self.ESCAPE:
-                #area = param[NGLOBAL+i]
-                (r,c) = (PEAKS0[i]).shape
-                PEAKSW[i][0:r,0] = PEAKS0[i][:,0] * param[self.NGLOBAL+i] * gain
-                PEAKSW[i][0:r,1] = PEAKS0[i][:,1] * 1.0
-                PEAKSW[i][0:r,2] = numpy.sqrt(noise + PEAKS0[i][:,1] * fano)
-                #escape
-                if OLDESCAPE:
-                    PEAKSW[i][r:,0] = PEAKSW[i][0:r,0] * PEAKS0[i][:,3]
-                    PEAKSW[i][r:,1] = PEAKS0[i][:,1] - self.config['detector']['detene']
-                    PEAKSW[i][r:,2] = numpy.sqrt(noise + \
-                                        (PEAKSW[i][r:,1]>0) * PEAKSW[i][r:,1] * fano)
-                else:
-                    ii=0
-                    j=0
-                    for esc_group in PEAKS0ESCAPE[i]:
-                        for esc_line in esc_group:
-                            esc_ene  = esc_line[0] * 1.0
-                            esc_rate = esc_line[1]
-                            PEAKSW[i][j+r,0] =  PEAKSW[i][ii,0] * esc_rate
-                            PEAKSW[i][j+r,1] =  esc_ene
-                            j = j + 1
-                        ii = ii + 1   
-                    PEAKSW[i][r:, 2] = numpy.sqrt(noise + \
-                                    (PEAKSW[i][r:,1]>0) * PEAKSW[i][r:,1] * fano)
-                (rw,cw) = (PEAKSW[i]).shape
-                if 0 and self.PARAMETERS[self.NGLOBAL+i] =='Fe K':
-                  for ii in range(rw):
-                    if ii < r:
-                        print(self.PARAMETERS[self.NGLOBAL+i],"PEAK ",ii,PEAKSW[i][ii])
-                    else:
-                        print(self.PARAMETERS[self.NGLOBAL+i],"PEAKesc ",ii,PEAKSW[i][ii])
-                #print PARAMETERS[self.NGLOBAL+i]
-                #print PEAKSW[i][:,1]
-                #print PEAKS0ESCAPE[i]
-                #for j in range(PEAKSW[i].shape[0]):
-                #    print "H = ", PEAKSW[i][j*r,0],"E = ",PEAKSW[i][j*r,1]
-                     
-                #if HYPERMET:
-                if hypermet:
-                    PEAKSW[i] [0:r,3] = param[PARAMETERS.index('ST AreaR')]
-                    PEAKSW[i] [:,4] = param[PARAMETERS.index('ST SlopeR')]
-                    PEAKSW[i] [0:r,5] = param[PARAMETERS.index('LT AreaR')]
-                    PEAKSW[i] [:,6] = param[PARAMETERS.index('LT SlopeR')]
-                    PEAKSW[i] [0:r,7] = param[PARAMETERS.index('STEP HeightR')]
-                    #neglect tails in escape peaks
-                    PEAKSW[i] [r:,3] = 0.0 
-                    PEAKSW[i] [r:,5] = 0.0 
-                    PEAKSW[i] [r:,7] = 0.0
-                else:
-                    PEAKSW[i] [:,3] = param[PARAMETERS.index('Eta Factor')]                    
-                if not FASTER:
-                    print("not FASTER")
-                    #if HYPERMET:
-                    if hypermet:
-                        if i == 0:
-                            result = SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)
-                        else:
-                            result += SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)            
-                    else:
-                        if i == 0:
-                            result = SpecfitFuns.apvoigt(PEAKSW[i],energy)
-                        else:
-                            result += SpecfitFuns.apvoigt(PEAKSW[i],energy)            
-            else:
-                PEAKSW[i][:,0] = PEAKS0[i][:,0] * param[self.NGLOBAL+i] * gain
-                PEAKSW[i][:,1] = PEAKS0[i][:,1] * 1.0
-                PEAKSW[i][:,2] = numpy.sqrt(noise + PEAKS0[i][:,1] * fano)
-                if hypermet:
-                    PEAKSW[i] [:,3] = param[PARAMETERS.index('ST AreaR')]
-                    PEAKSW[i] [:,4] = param[PARAMETERS.index('ST SlopeR')]
-                    PEAKSW[i] [:,5] = param[PARAMETERS.index('LT AreaR')]
-                    PEAKSW[i] [:,6] = param[PARAMETERS.index('LT SlopeR')]
-                    PEAKSW[i] [:,7] = param[PARAMETERS.index('STEP HeightR')]
-                else:
-                    PEAKSW[i] [:,3] = param[PARAMETERS.index('Eta Factor')]
-                if not FASTER:
-                    if hypermet:
-                        if i == 0:
-                            result = SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)
-                        else:
-                            result += SpecfitFuns.ahypermet(PEAKSW[i],energy,hypermet)            
-                    else:
-                        if i == 0:
-                            result = SpecfitFuns.apvoigt(PEAKSW[i],energy)
-                        else:
-                            result += SpecfitFuns.apvoigt(PEAKSW[i],energy)
-        #print PARAMETERS[self.NGLOBAL+4]
-        #print self.PEAKS0NAMES[4]
-        #print PEAKSW[4]
-        #print "loop takes ",time.time()-t
-        #loop takes 0.006 seconds
-        #t=time.time()
-        if FASTER:
-            if len(PEAKSW[:]):
-                a=numpy.concatenate(PEAKSW[:])
-                #t=time.time()
-                #result = SpecfitFuns.agauss(a,energy)
-                #if HYPERMET:
-                if hypermet:
+        #all the peaks of all the groups are updated at once
+        if len(PEAKSW):
+            a = self.__fillPeaks(param, hypermet, areas=param[self.NGLOBAL:],
+                                 peaks=self.__peakBuffer)
+            if hypermet:
+                if self.FASTER:
                     result = SpecfitFuns.fastahypermet(a,energy,hypermet)
                 else:
-                    result = SpecfitFuns.apvoigt(a,energy)
+                    result = SpecfitFuns.ahypermet(a,energy,hypermet)
             else:
-                result = 0.0 * x
-            #print "eval = ",time.time()-t
-        #evaluation takes 0.058 seconds
-        #with less peaks 0.036
-        #with tabulated function 0.018
+                result = SpecfitFuns.apvoigt(a,energy)
+        else:
+            result = 0.0 * x
         if continuum:
             result += self.continuum(param,x)
         if summing:
@@ -1522,86 +1451,23 @@ class McaTheory(object):
         NGLOBAL = self.NGLOBAL
         HYPERMET = self.__HYPERMET
         PARAMETERS = self.PARAMETERS
-        ESCAPE = self.ESCAPE
-        PEAKS0 = self.PEAKS0
         if index > NGLOBAL-1:
-         param=numpy.array(param0)
-         x=numpy.array(t0)
-         zero = param[0]
-         gain = param[1] * 1.0
-         energy=zero + gain * x
-         #print energy
-         noise= param[2]*param[2]
-         fano = param[3]*2.3548*2.3548*0.00385
-         i=index-NGLOBAL
-         #for i in range(len(param[index-4]))):
-         if ESCAPE:
-            (r,c) = (PEAKS0[i]).shape
-            if OLDESCAPE:
-                if HYPERMET:
-                    dummy      = numpy.ones((2*r,3+5*(HYPERMET > 0)), numpy.float)
-                else:
-                    dummy      = numpy.ones((2*r,3+1), numpy.float)
-                dummy[0:r,0] = PEAKS0[i][:,0] * gain
-                dummy[0:r,1] = PEAKS0[i][:,1] * 1.0
-                dummy[0:r,2] = numpy.sqrt(noise+ PEAKS0[i][:,1] * fano)
-                dummy[r:,0] = PEAKS0[i][:,0] * gain * PEAKS0[i][:,3]
-                dummy[r:,1] = PEAKS0[i][:,1] - self.config['detector']['detene']
-                dummy[r:,2] = numpy.sqrt(noise + (dummy[r:,1]>0) * dummy[r:,1] * fano)
-            else:
-                n_escape_lines = self.PEAKSW[i].shape[0] - r
-                #if 1:print "nlines = ",r, "n escape lines =",n_escape_lines
-                if HYPERMET:
-                    dummy    = numpy.ones((r + n_escape_lines, 3+5*(HYPERMET > 0)), numpy.float)
-                else:
-                    dummy    = numpy.ones((r + n_escape_lines, 3+1), numpy.float)
-                dummy[0:r,0] = PEAKS0[i][:,0] * gain
-                dummy[0:r,1] = PEAKS0[i][:,1] * 1.0
-                dummy[0:r,2] = numpy.sqrt(noise+ PEAKS0[i][:,1] * fano)
-                ii=0
-                j=0
-                for esc_group in self.PEAKS0ESCAPE[i]:
-                    for esc_line in esc_group:
-                        esc_ene  = esc_line[0] * 1.0
-                        esc_rate = esc_line[1]
-                        dummy[j+r, 0] =  dummy[ii,0] * esc_rate
-                        dummy[j+r, 1] =  esc_ene
-                        j = j + 1
-                    ii = ii + 1
-                dummy[r:, 2] = numpy.sqrt(noise + (dummy[r:,1]>0) * dummy[r:,1] * fano)
-                #for jj in range(r+n_escape_lines):
-                #    print index, dummy[jj, 1], dummy[jj, 0], dummy[jj, 2]                
-         else:
-            (r,c) = (PEAKS0[i]).shape
-            if HYPERMET:
-                dummy      = numpy.ones((r,3+5*(HYPERMET > 0)),numpy.float)
-            else:
-                dummy      = numpy.ones((r,3+1),numpy.float)
-            dummy[0:r,0] = PEAKS0[i][:,0] * gain
-            dummy[0:r,1] = PEAKS0[i][:,1] * 1.0
-            dummy[0:r,2] = numpy.sqrt(noise + PEAKS0[i][:,1] * fano)
-         if HYPERMET:
-                dummy[0:r,3] = param[PARAMETERS.index('ST AreaR')]
-                dummy[r:,3]  = 0.0
-                dummy[:,4] = param[PARAMETERS.index('ST SlopeR')]
-                dummy[0:r,5] = param[PARAMETERS.index('LT AreaR')]
-                dummy[r:,5]  = 0.0
-                dummy[:,6] = param[PARAMETERS.index('LT SlopeR')]
-                dummy[0:r,7] = param[PARAMETERS.index('STEP HeightR')]
-                dummy[r:,7]  = 0.0
-         else:
-                dummy[0:,3] = param[PARAMETERS.index('Eta Factor')]             
-         if self.FASTER:
-            if HYPERMET:
-                return SpecfitFuns.fastahypermet(dummy,energy,HYPERMET)        
-            else:
-                return SpecfitFuns.apvoigt(dummy,energy)
-         else:
-            if HYPERMET:
-                return SpecfitFuns.ahypermet(dummy,energy,HYPERMET)        
-            else:
-                return SpecfitFuns.apvoigt(dummy,energy)
-
+            #the derivatives respect to all the areas are calculated at once
+            #and kept while the other parameters do not change
+            param=numpy.array(param0)
+            x=numpy.array(t0)
+            zero = param[0]
+            gain = param[1] * 1.0
+            energy=zero + gain * x
+            cache = self.__peakMatrixCache
+            if (cache is None) or \
+               (not numpy.array_equal(cache[0], param[:NGLOBAL])) or \
+               (not numpy.array_equal(cache[1], energy)):
+                matrix = self.__getPeakMatrix(param, energy.reshape(-1),
+                                              HYPERMET, fast=self.FASTER)
+                cache = (param[:NGLOBAL], energy, matrix)
+                self.__peakMatrixCache = cache
+            return cache[2][:, index-NGLOBAL].reshape(energy.shape)
         elif HYPERMET and  (PARAMETERS[index] == 'ST AreaR'):
           param=numpy.array(param0)
           x=numpy.array(t0)
@@ -2362,70 +2228,12 @@ class McaTheory(object):
             continuum = self.__CONTINUUM
         if hypermet is None:
             hypermet = self.__HYPERMET
-        # zero = param[0]
-        gain = param[1]
-        #energy=zero + gain * x
-        #print energy
-        noise= param[2] * param[2]
-        fano = param[3] * 2.3548*2.3548*0.00385
-        #t=time.time()
-        PEAKS0 = self.PEAKS0
-        PEAKS0ESCAPE = self.PEAKS0ESCAPE
-        PEAKSW = self.PEAKSW
-        PARAMETERS = self.PARAMETERS
-        for i in range(len(param[self.NGLOBAL:])):
-            if self.ESCAPE:
-                #area = param[NGLOBAL+i]
-                (r,c) = (PEAKS0[i]).shape
-                PEAKSW[i][0:r,0] = PEAKS0[i][:,0] * param[self.NGLOBAL+i] * gain
-                PEAKSW[i][0:r,1] = PEAKS0[i][:,1] * 1.0
-                PEAKSW[i][0:r,2] = numpy.sqrt(noise + PEAKS0[i][:,1] * fano)
-                #escape
-                if OLDESCAPE:
-                    PEAKSW[i][r:,0] = PEAKSW[i][0:r,0] * PEAKS0[i][:,3]
-                    PEAKSW[i][r:,1] = PEAKS0[i][:,1] - self.config['detector']['detene']
-                    PEAKSW[i][r:,2] = numpy.sqrt(noise + (PEAKSW[i][r:,1]>0) * PEAKSW[i][r:,1] * fano)
-                else:
-                    ii=0
-                    j=0
-                    for esc_group in PEAKS0ESCAPE[i]:
-                        for esc_line in esc_group:
-                            esc_ene  = esc_line[0] * 1.0
-                            esc_rate = esc_line[1]
-                            PEAKSW[i][j+r,0] =  PEAKSW[i][ii,0] * esc_rate
-                            PEAKSW[i][j+r,1] =  esc_ene
-                            j = j + 1
-                        ii = ii + 1   
-                    PEAKSW[i][r:, 2] = numpy.sqrt(noise + \
-                                    (PEAKSW[i][r:,1]>0) * PEAKSW[i][r:,1] * fano)
-                #if HYPERMET:
-                if hypermet:
-                    PEAKSW[i] [0:r,3] = param[PARAMETERS.index('ST AreaR')]
-                    PEAKSW[i] [:,4] = param[PARAMETERS.index('ST SlopeR')]
-                    PEAKSW[i] [0:r,5] = param[PARAMETERS.index('LT AreaR')]
-                    PEAKSW[i] [:,6] = param[PARAMETERS.index('LT SlopeR')]
-                    PEAKSW[i] [0:r,7] = param[PARAMETERS.index('STEP HeightR')]
-                    #neglect tails in escape peaks
-                    PEAKSW[i] [r:,3] = 0.0 
-                    PEAKSW[i] [r:,5] = 0.0 
-                    PEAKSW[i] [r:,7] = 0.0 
-            else:
-                # area = param[self.NGLOBAL + i]
-                PEAKSW[i][:,0] = PEAKS0[i][:,0] * param[self.NGLOBAL+i] * gain
-                PEAKSW[i][:,1] = PEAKS0[i][:,1] * 1.0
-                PEAKSW[i][:,2] = numpy.sqrt(noise + PEAKS0[i][:,1] * fano)
-                if hypermet:
-                    PEAKSW[i] [:,3] = param[PARAMETERS.index('ST AreaR')]
-                    PEAKSW[i] [:,4] = param[PARAMETERS.index('ST SlopeR')]
-                    PEAKSW[i] [:,5] = param[PARAMETERS.index('LT AreaR')]
-                    PEAKSW[i] [:,6] = param[PARAMETERS.index('LT SlopeR')]
-                    PEAKSW[i] [:,7] = param[PARAMETERS.index('STEP HeightR')]
-        return PEAKSW
+        self.__fillPeaks(param, hypermet, areas=param[self.NGLOBAL:],
+                         peaks=self.__peakBuffer)
+        return self.PEAKSW
 
     # UTILITIES #
     def roifit(self,x, y, background = None, width=None):
-        if width is None: width = 200.
-        if width > 10 : width = width / 1000.
         xw     = numpy.ravel(numpy.array(x))
         if background is not None:
             yw = numpy.ravel(numpy.array(y) - numpy.array(background))
@@ -2435,6 +2243,24 @@ class McaTheory(object):
         gain   = self.config['detector']['gain']
         energy = zero + gain * xw
         ddict={}
+        regions = self.getROIRegions(width=width)
+        for group in regions:
+            ddict[group] = {}
+            for roi in regions[group]:
+                emin, emax = regions[group][roi]
+                i1 = numpy.nonzero((energy >= emin) & (energy <= emax))[0]
+                ddict[group][roi] = numpy.sum(numpy.take(yw,i1))
+        return ddict    
+
+    def getROIRegions(self, width=None):
+        """
+        Return a dictionnary with the energy limits (emin, emax) of the
+        ROIs used by roifit. The keys are the fitted groups and, for each
+        group, the names of the ROIs.
+        """
+        if width is None: width = 200.
+        if width > 10 : width = width / 1000.
+        ddict={}
         for group in self.PARAMETERS[self.NGLOBAL:]:
             ele,shell = group.split()
             if ele not in Elements.Element.keys(): continue
@@ -2443,9 +2269,8 @@ class McaTheory(object):
             for line in lines:
                 emin = Elements.Element[ele][line]['energy'] - 0.5 * width 
                 emax = Elements.Element[ele][line]['energy'] + 0.5 * width 
-                i1 = numpy.nonzero((energy >= emin) & (energy <= emax))[0]
-                ddict[group][line + " ROI"] = numpy.sum(numpy.take(yw,i1))
-        return ddict    
+                ddict[group][line + " ROI"] = (emin, emax)
+        return ddict
             
         
     def __getlines(self, ele, shell, width, threshold = 0.010):
@@ -51,8 +51,8 @@ if not os.path.exists(ffile):
     if not os.path.exists(ffile):
         print("Cannot find file ", ffile)
         raise IOError("Cannot find file %s" % ffile)
-COEFFICIENTS = ConfigDict.ConfigDict()
-COEFFICIENTS.read(ffile)
+# read on first access
+COEFFICIENTS = ConfigDict.LazyConfigDict(ffile)
 KEVTOANG = 12.39852000
 R0 = 2.82E-13 #electron radius in cm
 
@@ -37,6 +37,8 @@ import numpy
 import re
 import weakref
 import types
+import threading
+from collections import OrderedDict
 from PyMca5.PyMcaIO import ConfigDict
 from . import CoherentScattering
 from . import IncoherentScattering
@@ -55,6 +57,11 @@ Avogadro constant               NA    6.022 141 79(30) x 10+23 mol-1 5.0 x 10-8
 """
 MINENERGY = 0.175
 AVOGADRO_NUMBER = 6.02214179E23
+# maximum number of (compound, energies) results kept by getmassattcoef
+MASS_ATTENUATION_CACHE_SIZE = 256
+# binary file holding the parsed XCOM tables of all the elements
+XCOM_BINARY_FILE = "attdata.npz"
+XCOM_TABLE_KEYS = ['energy', 'coherent', 'compton', 'photo', 'pair']
 #
 #   Symbol  Atomic Number   x y ( positions on table )
 #       name,  mass, density
@@ -2190,7 +2197,40 @@ def getmassattcoef(compound, energy=None):
 		ai = atomic weight of element zi
 
 	    Result in cm2/g
+
+        The last MASS_ATTENUATION_CACHE_SIZE results obtained at given
+        energies are kept in memory. They are discarded when updateDict is
+        called or when the EPDL97 binding energies are changed.
 	"""
+    if energy is None:
+        return _getmassattcoef(compound, energy)
+    _checkMassAttenuationCache()
+    key = (compound, tuple(numpy.ravel(energy).tolist()))
+    if key in _MASS_ATTENUATION_CACHE:
+        # mark it as the most recently used
+        ddict = _MASS_ATTENUATION_CACHE.pop(key)
+    else:
+        ddict = _getmassattcoef(compound, energy)
+        # the calculation itself may set the EPDL97 binding energies
+        _checkMassAttenuationCache()
+        while len(_MASS_ATTENUATION_CACHE) >= MASS_ATTENUATION_CACHE_SIZE:
+            _MASS_ATTENUATION_CACHE.popitem(last=False)
+    _MASS_ATTENUATION_CACHE[key] = ddict
+    # the cached lists must not be modified by the caller
+    return dict([(item, list(ddict[item])) for item in ddict])
+
+_MASS_ATTENUATION_CACHE = OrderedDict()
+_MASS_ATTENUATION_CACHE_UPDATES = [PyMcaEPDL97.BINDING_ENERGIES_UPDATES]
+
+def _checkMassAttenuationCache():
+    # below 1 keV the results depend on the EPDL97 binding energies
+    if _MASS_ATTENUATION_CACHE_UPDATES[0] != \
+                            PyMcaEPDL97.BINDING_ENERGIES_UPDATES:
+        _MASS_ATTENUATION_CACHE.clear()
+        _MASS_ATTENUATION_CACHE_UPDATES[0] = \
+                            PyMcaEPDL97.BINDING_ENERGIES_UPDATES
+
+def _getmassattcoef(compound, energy=None):
     #single element case
     if compound in Element.keys():
         return getelementmassattcoef(compound,energy)
@@ -2208,14 +2248,6 @@ def getmassattcoef(compound, energy=None):
     div      = sum(fraction)
     fraction = [x/div for x in fraction]
     #print "fraction = ",fraction
-    ddict={}
-    ddict['energy']   = []
-    ddict['coherent'] = []
-    ddict['compton']  = []
-    ddict['photo']    = []
-    ddict['pair']     = []
-    ddict['total']    = []
-    eltindex = 0
     if energy is None:
         energy=[]
         for ele in elts:
@@ -2225,73 +2257,27 @@ def getmassattcoef(compound, energy=None):
                     energy.append(ene)
         energy.sort()
 
-    for ele in elts:
-        xcom_data = getelementmassattcoef(ele,None)
-        #now I have to interpolate at the different energies
-        if not hasattr(energy, "__len__"):
-            energy =[energy]
-        eneindex = 0
-        for ene in energy:
-            if ene < 1.0:
-                if PyMcaEPDL97.EPDL97_DICT[ele]['original']:
-                    #make sure the binding energies are those used by this module and not EADL ones
-                    PyMcaEPDL97.setElementBindingEnergies(ele,
-                                                          Element[ele]['binding'])
-                tmpDict = PyMcaEPDL97.getElementCrossSections(ele, ene)
-                cohe  = tmpDict['coherent'][0]
-                comp  = tmpDict['compton'][0]
-                photo = tmpDict['photo'][0]
-                pair  = 0.0
-            else:
-                i0=max(numpy.nonzero(xcom_data['energy'] <= ene)[0])
-                i1=min(numpy.nonzero(xcom_data['energy'] >= ene)[0])
-                if (i1 == i0) or (i0>i1):
-                    cohe=xcom_data['coherent'][i1]
-                    comp=xcom_data['compton'][i1]
-                    photo=xcom_data['photo'][i1]
-                    pair=xcom_data['pair'][i1]
-                else:
-                    if LOGLOG:
-                        A=xcom_data['energylog10'][i0]
-                        B=xcom_data['energylog10'][i1]
-                        logene = numpy.log10(ene)
-                        c2=(logene-A)/(B-A)
-                        c1=(B-logene)/(B-A)
-                    else:
-                        A=xcom_data['energy'][i0]
-                        B=xcom_data['energy'][i1]
-                        c2=(ene-A)/(B-A)
-                        c1=(B-ene)/(B-A)
-                    cohe= pow(10.0,c2*xcom_data['coherentlog10'][i1]+\
-                                   c1*xcom_data['coherentlog10'][i0])
-                    comp= pow(10.0,c2*xcom_data['comptonlog10'][i1]+\
-                                   c1*xcom_data['comptonlog10'][i0])
-                    photo=pow(10.0,c2*xcom_data['photolog10'][i1]+\
-                                   c1*xcom_data['photolog10'][i0])
-                    if xcom_data['pair'][i1] > 0.0:
-                        c2 = c2*numpy.log10(xcom_data['pair'][i1])
-                        if xcom_data['pair'][i0] > 0.0:
-                            c1 = c1*numpy.log10(xcom_data['pair'][i0])
-                            pair = pow(10.0,c1+c2)
-                        else:
-                            pair =0.0
-                    else:
-                        pair =0.0
-            if eltindex == 0:
-                ddict['energy'].append(ene)
-                ddict['coherent'].append(cohe *fraction[eltindex])
-                ddict['compton'].append(comp *fraction[eltindex])
-                ddict['photo'].append(photo *fraction[eltindex])
-                ddict['pair'].append(pair*fraction[eltindex])
-                ddict['total'].append((cohe+comp+photo+pair)*fraction[eltindex])
-            else:
-                ddict['coherent'][eneindex] += cohe  *fraction[eltindex]
-                ddict['compton'] [eneindex] += comp  *fraction[eltindex]
-                ddict['photo']   [eneindex] += photo *fraction[eltindex]
-                ddict['pair']    [eneindex] += pair  *fraction[eltindex]
-                ddict['total']   [eneindex] += (cohe+comp+photo+pair) * fraction[eltindex]
-            eneindex += 1
-        eltindex += 1
+    if not hasattr(energy, "__len__"):
+        energy =[energy]
+    ddict={}
+    ddict['energy'] = [ene for ene in energy]
+    coherent = numpy.zeros((len(energy),), numpy.float)
+    compton = numpy.zeros((len(energy),), numpy.float)
+    photoelectric = numpy.zeros((len(energy),), numpy.float)
+    pairproduction = numpy.zeros((len(energy),), numpy.float)
+    total = numpy.zeros((len(energy),), numpy.float)
+    for eltindex, ele in enumerate(elts):
+        cohe, comp, photo, pair = _getElementCrossSectionsArrays(ele, energy)
+        coherent += cohe * fraction[eltindex]
+        compton += comp * fraction[eltindex]
+        photoelectric += photo * fraction[eltindex]
+        pairproduction += pair * fraction[eltindex]
+        total += (cohe + comp + photo + pair) * fraction[eltindex]
+    ddict['coherent'] = coherent.tolist()
+    ddict['compton'] = compton.tolist()
+    ddict['photo'] = photoelectric.tolist()
+    ddict['pair'] = pairproduction.tolist()
+    ddict['total'] = total.tolist()
     return ddict
 
 def __materialInCompoundList(lst):
@@ -2452,84 +2438,27 @@ def getMaterialMassAttenuationCoefficients(compoundList0, fractionList0, energy0
         energy.sort()
 
     #I have the energy grid, the elements and their fractions
+    if (type(energy) != type([])):
+        energy =[energy]
     dict={}
-    dict['energy']   = []
-    dict['coherent'] = []
-    dict['compton']  = []
-    dict['photo']    = []
-    dict['pair']     = []
-    dict['total']    = []
-    eltindex = 0
+    dict['energy'] = [ene for ene in energy]
+    coherent = numpy.zeros((len(energy),), numpy.float)
+    compton = numpy.zeros((len(energy),), numpy.float)
+    photoelectric = numpy.zeros((len(energy),), numpy.float)
+    pairproduction = numpy.zeros((len(energy),), numpy.float)
+    total = numpy.zeros((len(energy),), numpy.float)
     for ele in materialElements.keys():
-        if 'xcom' in Element[ele]:
-            xcom_data = Element[ele]['xcom']
-        else:
-            xcom_data = getelementmassattcoef(ele,None)
-        #now I have to interpolate at the different energies
-        if (type(energy) != type([])):
-            energy =[energy]
-        eneindex = 0
-        for ene in energy:
-            if ene < 1.0:
-                if PyMcaEPDL97.EPDL97_DICT[ele]['original']:
-                    #make sure the binding energies are those used by this module and not EADL ones
-                    PyMcaEPDL97.setElementBindingEnergies(ele,
-                                                          Element[ele]['binding'])
-                tmpDict = PyMcaEPDL97.getElementCrossSections(ele, ene)
-                cohe  = tmpDict['coherent'][0]
-                comp  = tmpDict['compton'][0]
-                photo = tmpDict['photo'][0]
-                pair  = 0.0
-            else:
-                i0=max(numpy.nonzero(xcom_data['energy'] <= ene)[0])
-                i1=min(numpy.nonzero(xcom_data['energy'] >= ene)[0])
-                if (i1 == i0) or (i0>i1):
-                    cohe=xcom_data['coherent'][i1]
-                    comp=xcom_data['compton'][i1]
-                    photo=xcom_data['photo'][i1]
-                    pair=xcom_data['pair'][i1]
-                else:
-                    if LOGLOG:
-                        A=xcom_data['energylog10'][i0]
-                        B=xcom_data['energylog10'][i1]
-                        logene = numpy.log10(ene)
-                        c2=(logene-A)/(B-A)
-                        c1=(B-logene)/(B-A)
-                    else:
-                        A=xcom_data['energy'][i0]
-                        B=xcom_data['energy'][i1]
-                        c2=(ene-A)/(B-A)
-                        c1=(B-ene)/(B-A)
-                    cohe= pow(10.0,c2*xcom_data['coherentlog10'][i1]+\
-                                   c1*xcom_data['coherentlog10'][i0])
-                    comp= pow(10.0,c2*xcom_data['comptonlog10'][i1]+\
-                                   c1*xcom_data['comptonlog10'][i0])
-                    photo=pow(10.0,c2*xcom_data['photolog10'][i1]+\
-                                   c1*xcom_data['photolog10'][i0])
-                    if xcom_data['pair'][i1] > 0.0:
-                        c2 = c2*numpy.log10(xcom_data['pair'][i1])
-                        if xcom_data['pair'][i0] > 0.0:
-                            c1 = c1*numpy.log10(xcom_data['pair'][i0])
-                            pair = pow(10.0,c1+c2)
-                        else:
-                            pair =0.0
-                    else:
-                        pair =0.0
-            if eltindex == 0:
-                dict['energy'].append(ene)
-                dict['coherent'].append(cohe * materialElements[ele])
-                dict['compton'].append(comp * materialElements[ele])
-                dict['photo'].append(photo * materialElements[ele])
-                dict['pair'].append(pair* materialElements[ele])
-                dict['total'].append((cohe+comp+photo+pair)* materialElements[ele])
-            else:
-                dict['coherent'][eneindex] += cohe  * materialElements[ele]
-                dict['compton'] [eneindex] += comp  * materialElements[ele]
-                dict['photo']   [eneindex] += photo * materialElements[ele]
-                dict['pair']    [eneindex] += pair  * materialElements[ele]
-                dict['total']   [eneindex] += (cohe+comp+photo+pair) *  materialElements[ele]
-            eneindex += 1
-        eltindex += 1
+        cohe, comp, photo, pair = _getElementCrossSectionsArrays(ele, energy)
+        coherent += cohe * materialElements[ele]
+        compton += comp * materialElements[ele]
+        photoelectric += photo * materialElements[ele]
+        pairproduction += pair * materialElements[ele]
+        total += (cohe + comp + photo + pair) * materialElements[ele]
+    dict['coherent'] = coherent.tolist()
+    dict['compton'] = compton.tolist()
+    dict['photo'] = photoelectric.tolist()
+    dict['pair'] = pairproduction.tolist()
+    dict['total'] = total.tolist()
     return dict
 
 
@@ -2621,185 +2550,303 @@ def getElementComptonDifferentialCrossSection(ele, theta, energy, p1=None):
           raise ValueError("Unknown element %s" % ele)
     return (value * 6.022142E23)/ Element[ele]['mass']
 
-def getelementmassattcoef(ele,energy=None):
+_XCOM_TABLES = None
+
+def _getXcomDirectory():
+    dirmod = PyMcaDataDir.PYMCA_DATA_DIR
+    xcomdir = os.path.join(dirmod, "attdata")
+    if not os.path.isdir(xcomdir):
+        #freeze does bad things with the path ...
+        dirmod = os.path.dirname(dirmod)
+        xcomdir = os.path.join(dirmod, "attdata")
+        if dirmod.lower().endswith(".zip"):
+            dirmod = os.path.dirname(dirmod)
+            xcomdir = os.path.join(dirmod, "attdata")
+    return xcomdir
+
+def _readXcomFile(xcomfile):
     """
-    Usage: getelementmassattcoef(element symbol, energy in kev)
-        It gets the info from files generated by XCOM
-        If energy is not given, it gives back a dictionary with the form:
-            dict['energy']     = [energies]
-            dict['coherent']   = [coherent scattering cross section(energies)]
-            dict['compton']    = [incoherent scattering cross section(energies)]
-            dict['photo']      = [photoelectic effect cross section(energies)]
-            dict['pair']       = [pair production cross section(energies)]
-            dict['total']      = [total cross section]
+    Parse an XCOM .mat file and return a dictionary with the energy (keV),
+    coherent, compton, photo and pair arrays sorted by increasing energy.
     """
-    if 'xcom' not in Element[ele].keys():
-        dirmod = PyMcaDataDir.PYMCA_DATA_DIR
-        #read xcom file
-        #print dirmod+"/"+ele+".mat"
-        xcomfile = os.path.join(dirmod, "attdata")
-        xcomfile = os.path.join(xcomfile, ele+".mat")
-        if not os.path.exists(xcomfile):
-            #freeze does bad things with the path ...
-            dirmod = os.path.dirname(dirmod)
-            xcomfile = os.path.join(dirmod, "attdata")
-            xcomfile = os.path.join(xcomfile, ele+".mat")
-            if dirmod.lower().endswith(".zip"):
-                dirmod = os.path.dirname(dirmod)
-                xcomfile = os.path.join(dirmod, "attdata")
-                xcomfile = os.path.join(xcomfile, ele+".mat")
-            if not os.path.exists(xcomfile):
-                print("Cannot find file ",xcomfile)
-                raise IOError("Cannot find %s" % xcomfile)
-        f = open(xcomfile, 'r')
+    if not os.path.exists(xcomfile):
+        print("Cannot find file ",xcomfile)
+        raise IOError("Cannot find %s" % xcomfile)
+    ddict = {}
+    ddict['energy']   =[]
+    ddict['coherent'] =[]
+    ddict['compton']  =[]
+    ddict['photo']    =[]
+    ddict['pair']     =[]
+    f = open(xcomfile, 'r')
+    try:
         line=f.readline()
         while (line.split('ENERGY')[0] == line):
             line = f.readline()
-        Element[ele]['xcom'] = {}
-        Element[ele]['xcom']['energy']   =[]
-        Element[ele]['xcom']['coherent'] =[]
-        Element[ele]['xcom']['compton']  =[]
-        Element[ele]['xcom']['photo']  =[]
-        Element[ele]['xcom']['pair']     =[]
-        Element[ele]['xcom']['total']    =[]
         line = f.readline()
         while (line.split('COHERENT')[0] == line):
             line = line.split()
             for value in line:
-                Element[ele]['xcom']['energy'].append(float(value)*1000.)
+                ddict['energy'].append(float(value)*1000.)
             line = f.readline()
-        Element[ele]['xcom']['energy']=numpy.array(Element[ele]['xcom']['energy'])
         line = f.readline()
         while (line.split('INCOHERENT')[0] == line):
             line = line.split()
             for value in line:
-                Element[ele]['xcom']['coherent'].append(float(value))
+                ddict['coherent'].append(float(value))
             line = f.readline()
-        Element[ele]['xcom']['coherent']=numpy.array(Element[ele]['xcom']['coherent'])
         line = f.readline()
         while (line.split('PHOTO')[0] == line):
             line = line.split()
             for value in line:
-                Element[ele]['xcom']['compton'].append(float(value))
+                ddict['compton'].append(float(value))
             line = f.readline()
-        Element[ele]['xcom']['compton']=numpy.array(Element[ele]['xcom']['compton'])
         line = f.readline()
         while (line.split('PAIR')[0] == line):
             line = line.split()
             for value in line:
-                Element[ele]['xcom']['photo'].append(float(value))
+                ddict['photo'].append(float(value))
             line = f.readline()
         line = f.readline()
         while (line.split('PAIR')[0] == line):
             line = line.split()
             for value in line:
-                Element[ele]['xcom']['pair'].append(float(value))
+                ddict['pair'].append(float(value))
             line = f.readline()
         i = 0
         line = f.readline()
         while (len(line)):
             line = line.split()
             for value in line:
-                Element[ele]['xcom']['pair'][i] += float(value)
+                ddict['pair'][i] += float(value)
                 i += 1
             line = f.readline()
-        if sys.version >= '3.0':
-            # next line gave problems under under windows
-            # just try numpy.argsort([1,1,1,1,1]) under linux and windows to see
-            # what I mean
-            # i1=numpy.argsort(Element[ele]['xcom']['energy']) did not work
-            # (uses quicksort and gives problems with Pb not passing tests)
-            i1=numpy.argsort(Element[ele]['xcom']['energy'], kind='mergesort')
+    finally:
+        f.close()
+    for key in XCOM_TABLE_KEYS:
+        ddict[key] = numpy.array(ddict[key])
+    if sys.version >= '3.0':
+        # next line gave problems under under windows
+        # just try numpy.argsort([1,1,1,1,1]) under linux and windows to see
+        # what I mean
+        # i1=numpy.argsort(ddict['energy']) did not work
+        # (uses quicksort and gives problems with Pb not passing tests)
+        i1=numpy.argsort(ddict['energy'], kind='mergesort')
+    else:
+        sset = map(None,ddict['energy'],range(len(ddict['energy'])))
+        sset.sort()
+        i1=numpy.array([x[1] for x in sset])
+    for key in XCOM_TABLE_KEYS:
+        ddict[key] = numpy.take(ddict[key], i1)
+    if ddict['coherent'][0] <= 0:
+       ddict['coherent'][0] = ddict['coherent'][1] * 1.0
+    return ddict
+
+def _getXcomSignature(xcomdir):
+    """
+    Return the sorted names of the .mat files and, for each of them, its
+    size and checksum.
+    """
+    names = [x for x in os.listdir(xcomdir) if x.endswith(".mat")]
+    names.sort()
+    signature = [PyMcaEPDL97._getFileSignature(os.path.join(xcomdir, x)) \
+                 for x in names]
+    return names, signature
+
+def _readXcomBinaryFile(fname, names, signature):
+    """
+    Read the XCOM tables from a .npz file written by _writeXcomBinaryFile.
+    Return None if the file was not generated from the given .mat files.
+    """
+    npz = numpy.load(fname)
+    try:
+        if npz['names'].tolist() != names:
+            return None
+        if npz['signature'].tolist() != signature:
+            return None
+        offsets = npz['offsets']
+        data = [npz[key] for key in XCOM_TABLE_KEYS]
+    finally:
+        npz.close()
+    tables = {}
+    for i, name in enumerate(names):
+        tables[name[:-4]] = dict([(key, data[j][offsets[i]:offsets[i + 1]]) \
+                                  for j, key in enumerate(XCOM_TABLE_KEYS)])
+    return tables
+
+def _writeXcomBinaryFile(fname, tables, names, signature):
+    """
+    Store all the XCOM tables in a single .npz file: the arrays of all the
+    elements are concatenated and the offsets of each element are kept.
+    """
+    offsets = numpy.zeros((len(names) + 1,), numpy.int64)
+    for i, name in enumerate(names):
+        offsets[i + 1] = offsets[i] + len(tables[name[:-4]]['energy'])
+    ddict = {}
+    ddict['names'] = numpy.array(names)
+    ddict['signature'] = numpy.array(signature, numpy.int64)
+    ddict['offsets'] = offsets
+    for key in XCOM_TABLE_KEYS:
+        ddict[key] = numpy.concatenate([tables[name[:-4]][key] \
+                                        for name in names])
+    PyMcaEPDL97._saveBinaryFile(fname, ddict)
+
+def _readXcomTables(xcomdir, names):
+    """
+    Parse the given .mat files of the XCOM directory.
+    """
+    tables = {}
+    for name in names:
+        tables[name[:-4]] = _readXcomFile(os.path.join(xcomdir, name))
+    return tables
+
+def _loadXcomTables():
+    """
+    Return a dictionary with the XCOM tables of all the elements.
+
+    The binary file is looked for in the data directory and in the user
+    cache directory, and built from the .mat files if needed. An empty
+    dictionary is returned when the cache cannot be used.
+    """
+    xcomdir = _getXcomDirectory()
+    try:
+        names, signature = _getXcomSignature(xcomdir)
+    except OSError:
+        return {}
+    if not len(names):
+        return {}
+    tables = PyMcaEPDL97._loadBinaryFile(XCOM_BINARY_FILE,
+                [PyMcaDataDir.PYMCA_DATA_DIR],
+                lambda fname: _readXcomBinaryFile(fname, names, signature),
+                build=lambda: _readXcomTables(xcomdir, names),
+                save=lambda fname, tables: \
+                        _writeXcomBinaryFile(fname, tables, names, signature))
+    if tables is None:
+        return {}
+    return tables
+
+def _getXcomTables():
+    global _XCOM_TABLES
+    if _XCOM_TABLES is None:
+        _XCOM_TABLES = _loadXcomTables()
+    return _XCOM_TABLES
+
+def getelementmassattcoef(ele,energy=None):
+    """
+    Usage: getelementmassattcoef(element symbol, energy in kev)
+        It gets the info from files generated by XCOM
+        If energy is not given, it gives back a dictionary with the form:
+            dict['energy']     = [energies]
+            dict['coherent']   = [coherent scattering cross section(energies)]
+            dict['compton']    = [incoherent scattering cross section(energies)]
+            dict['photo']      = [photoelectic effect cross section(energies)]
+            dict['pair']       = [pair production cross section(energies)]
+            dict['total']      = [total cross section]
+    """
+    if 'xcom' not in Element[ele].keys():
+        xcom_data = _getXcomTables().get(ele, None)
+        if xcom_data is None:
+            xcomfile = os.path.join(_getXcomDirectory(), ele+".mat")
+            xcom_data = _readXcomFile(xcomfile)
         else:
-            sset = map(None,Element[ele]['xcom']['energy'],range(len(Element[ele]['xcom']['energy'])))
-            sset.sort()
-            i1=numpy.array([x[1] for x in sset])
-        Element[ele]['xcom']['energy']=numpy.take(Element[ele]['xcom']['energy'],i1)
-        Element[ele]['xcom']['coherent']=numpy.take(Element[ele]['xcom']['coherent'],i1)
-        Element[ele]['xcom']['compton']=numpy.take(Element[ele]['xcom']['compton'],i1)
-        Element[ele]['xcom']['photo']=numpy.take(Element[ele]['xcom']['photo'],i1)
-        Element[ele]['xcom']['pair']=numpy.take(Element[ele]['xcom']['pair'],i1)
-        if Element[ele]['xcom']['coherent'][0] <= 0:
-           Element[ele]['xcom']['coherent'][0] = Element[ele]['xcom']['coherent'][1] * 1.0
+            xcom_data = dict([(key, xcom_data[key].copy()) \
+                              for key in XCOM_TABLE_KEYS])
+        Element[ele]['xcom'] = xcom_data
         try:
-            Element[ele]['xcom']['energylog10']=numpy.log10(Element[ele]['xcom']['energy'])
-            Element[ele]['xcom']['coherentlog10']=numpy.log10(Element[ele]['xcom']['coherent'])
-            Element[ele]['xcom']['comptonlog10']=numpy.log10(Element[ele]['xcom']['compton'])
-            Element[ele]['xcom']['photolog10']=numpy.log10(Element[ele]['xcom']['photo'])
+            xcom_data['energylog10']=numpy.log10(xcom_data['energy'])
+            xcom_data['coherentlog10']=numpy.log10(xcom_data['coherent'])
+            xcom_data['comptonlog10']=numpy.log10(xcom_data['compton'])
+            xcom_data['photolog10']=numpy.log10(xcom_data['photo'])
         except:
             raise ValueError("Problem calculating logaritm of %s.mat file data" % ele)
-        for i in range(0,len(Element[ele]['xcom']['energy'])):
-            Element[ele]['xcom']['total'].append(Element[ele]['xcom']['coherent'][i]+\
-                                                 Element[ele]['xcom']['compton'] [i]+\
-                                                 Element[ele]['xcom']['photo'] [i]+\
-                                                 Element[ele]['xcom']['pair'] [i])
+        xcom_data['total'] = (xcom_data['coherent'] + xcom_data['compton'] +\
+                              xcom_data['photo'] + xcom_data['pair']).tolist()
 
     if energy is None:
         return  Element[ele]['xcom']
-    ddict={}
-    ddict['energy']   = []
-    ddict['coherent'] = []
-    ddict['compton']  = []
-    ddict['photo']    = []
-    ddict['pair']     = []
-    ddict['total']    = []
     if not hasattr(energy, "__len__"):
         energy =[energy]
-    for ene in energy:
-        if ene < 1.0:
-            if PyMcaEPDL97.EPDL97_DICT[ele]['original']:
-                #make sure the binding energies are those used by this module and not EADL ones
-                PyMcaEPDL97.setElementBindingEnergies(ele,
-                                                      Element[ele]['binding'])
-            tmpDict = PyMcaEPDL97.getElementCrossSections(ele, ene)
-            cohe  = tmpDict['coherent'][0]
-            comp  = tmpDict['compton'][0]
-            photo = tmpDict['photo'][0]
-            pair  = 0.0
-        else:
-            i0=max(numpy.nonzero(Element[ele]['xcom']['energy'] <= ene)[0])
-            i1=min(numpy.nonzero(Element[ele]['xcom']['energy'] >= ene)[0])
-            if i1 <= i0:
-                cohe=Element[ele]['xcom']['coherent'][i1]
-                comp=Element[ele]['xcom']['compton'][i1]
-                photo=Element[ele]['xcom']['photo'][i1]
-                pair=Element[ele]['xcom']['pair'][i1]
-            else:
-                if LOGLOG:
-                    A=Element[ele]['xcom']['energylog10'][i0]
-                    B=Element[ele]['xcom']['energylog10'][i1]
-                    logene = numpy.log10(ene)
-                    c2=(logene-A)/(B-A)
-                    c1=(B-logene)/(B-A)
-                else:
-                    A=Element[ele]['xcom']['energy'][i0]
-                    B=Element[ele]['xcom']['energy'][i1]
-                    c2=(ene-A)/(B-A)
-                    c1=(B-ene)/(B-A)
-
-                cohe= pow(10.0,c2*Element[ele]['xcom']['coherentlog10'][i1]+\
-                               c1*Element[ele]['xcom']['coherentlog10'][i0])
-                comp= pow(10.0,c2*Element[ele]['xcom']['comptonlog10'][i1]+\
-                               c1*Element[ele]['xcom']['comptonlog10'][i0])
-                photo=pow(10.0,c2*Element[ele]['xcom']['photolog10'][i1]+\
-                               c1*Element[ele]['xcom']['photolog10'][i0])
-                if Element[ele]['xcom']['pair'][i1] > 0.0:
-                    c2 = c2*numpy.log10(Element[ele]['xcom']['pair'][i1])
-                    if Element[ele]['xcom']['pair'][i0] > 0.0:
-                        c1 = c1*numpy.log10(Element[ele]['xcom']['pair'][i0])
-                        pair = pow(10.0,c1+c2)
-                    else:
-                        pair =0.0
-                else:
-                    pair =0.0
-        ddict['energy'].append(ene)
-        ddict['coherent'].append(cohe)
-        ddict['compton'].append(comp)
-        ddict['photo'].append(photo)
-        ddict['pair'].append(pair)
-        ddict['total'].append(cohe+comp+photo+pair)
+    cohe, comp, photo, pair = _getElementCrossSectionsArrays(ele, energy)
+    ddict={}
+    ddict['energy']   = [ene for ene in energy]
+    ddict['coherent'] = cohe.tolist()
+    ddict['compton']  = comp.tolist()
+    ddict['photo']    = photo.tolist()
+    ddict['pair']     = pair.tolist()
+    ddict['total']    = (cohe + comp + photo + pair).tolist()
     return ddict
 
+def _getElementCrossSectionsArrays(ele, energy):
+    """
+    Return the coherent, compton, photoelectric and pair production mass
+    attenuation coefficients of the element at the given energies (keV) as
+    four arrays.
+
+    The XCOM tables are interpolated for all the energies at once. Below
+    1 keV the EPDL97 data are used instead.
+    """
+    xcom_data = getelementmassattcoef(ele, None)
+    energy = numpy.array(energy, dtype=numpy.float, copy=False).reshape(-1)
+    cohe  = numpy.zeros(energy.shape, numpy.float)
+    comp  = numpy.zeros(energy.shape, numpy.float)
+    photo = numpy.zeros(energy.shape, numpy.float)
+    pair  = numpy.zeros(energy.shape, numpy.float)
+
+    low = energy < 1.0
+    if low.any():
+        if PyMcaEPDL97.EPDL97_DICT[ele]['original']:
+            #make sure the binding energies are those used by this module and not EADL ones
+            PyMcaEPDL97.setElementBindingEnergies(ele,
+                                                  Element[ele]['binding'])
+        tmpDict = PyMcaEPDL97.getElementCrossSections(ele, energy[low])
+        cohe[low]  = tmpDict['coherent']
+        comp[low]  = tmpDict['compton']
+        photo[low] = tmpDict['photo']
+
+    high = numpy.logical_not(low)
+    if not high.any():
+        return cohe, comp, photo, pair
+    ene = energy[high]
+    # i0 is the last tabulated energy <= ene and i1 the first one >= ene
+    i1 = numpy.searchsorted(xcom_data['energy'], ene, side='left')
+    i0 = numpy.searchsorted(xcom_data['energy'], ene, side='right') - 1
+    if i1.max() >= xcom_data['energy'].size:
+        raise ValueError("Energy above the tabulated range for %s" % ele)
+    if i0.min() < 0:
+        raise ValueError("Energy below the tabulated range for %s" % ele)
+    exact = i1 <= i0
+    if LOGLOG:
+        A = xcom_data['energylog10'][i0]
+        B = xcom_data['energylog10'][i1]
+        x = numpy.log10(ene)
+    else:
+        A = xcom_data['energy'][i0]
+        B = xcom_data['energy'][i1]
+        x = ene
+    delta = B - A
+    delta[exact] = 1.0
+    c2 = (x - A) / delta
+    c1 = (B - x) / delta
+    i1exact = i1[exact]
+    for output, key in [(cohe, 'coherent'),
+                        (comp, 'compton'),
+                        (photo, 'photo')]:
+        values = pow(10.0, c2 * xcom_data[key + 'log10'][i1] + \
+                           c1 * xcom_data[key + 'log10'][i0])
+        values[exact] = xcom_data[key][i1exact]
+        output[high] = values
+    pair1 = xcom_data['pair'][i1]
+    pair0 = xcom_data['pair'][i0]
+    values = numpy.zeros(ene.shape, numpy.float)
+    valid = (pair1 > 0.0) & (pair0 > 0.0) & numpy.logical_not(exact)
+    if valid.any():
+        values[valid] = pow(10.0,
+                            c1[valid] * numpy.log10(pair0[valid]) + \
+                            c2[valid] * numpy.log10(pair1[valid]))
+    values[exact] = xcom_data['pair'][i1exact]
+    pair[high] = values
+    return cohe, comp, photo, pair
+
 def getElementLShellRates(symbol,energy=None,photoweights = None):
     """
     getElementLShellRates(symbol,energy=None, photoweights = None)
@@ -2986,8 +3033,9 @@ def _updateElementDict(symbol, dict, energy=None, minenergy=MINENERGY, minrate=0
     dict['buildparameters']['minrate']   = minrate
 
 def updateDict(energy=None, minenergy=MINENERGY, minrate=0.0010, cb=True):
-    for ele in ElementList:
-        _updateElementDict(ele, Element[ele], energy=energy, minenergy=minenergy, minrate=minrate)
+    # the elements are updated when accessed
+    Element.setParameters(energy=energy, minenergy=minenergy, minrate=minrate)
+    _MASS_ATTENUATION_CACHE.clear()
     if cb:
         _updateCallback()
     return
@@ -3011,8 +3059,8 @@ def _getMaterialDict():
         print("Cannot find file ", matdict)
         #raise IOError("Cannot find %s" % matdict)
         return {}
-    cDict.read(matdict)
-    return cDict
+    # read on first access
+    return ConfigDict.LazyConfigDict(matdict)
 
 class BoundMethodWeakref:
     """Helper class to get a weakref to a bound method"""
@@ -3068,45 +3116,121 @@ def _updateCallback():
             method()
 
 
-Element={}
-for ele in ElementList:
+def _getElementBaseDict(ele):
     z = getz(ele)
-    Element[ele]={}
-    Element[ele]['Z']       = z
-    Element[ele]['name']    = ElementsInfo[z-1][4]
-    Element[ele]['mass']    = ElementsInfo[z-1][5]
-    Element[ele]['density'] = ElementsInfo[z-1][6]/1000.
-    Element[ele]['binding'] = {}
+    ddict = {}
+    ddict['Z']       = z
+    ddict['name']    = ElementsInfo[z-1][4]
+    ddict['mass']    = ElementsInfo[z-1][5]
+    ddict['density'] = ElementsInfo[z-1][6]/1000.
+    ddict['binding'] = {}
     i=0
     for shell in ElementShells:
         i = i + 1
         if z > len(ElementBinding):
             #Give the bindings of the last element
-            Element[ele]['binding'][shell] = ElementBinding[-1][i]
+            ddict['binding'][shell] = ElementBinding[-1][i]
         else:
-            Element[ele]['binding'][shell] = ElementBinding[z-1][i]
+            ddict['binding'][shell] = ElementBinding[z-1][i]
     #fluorescence yields
-    Element[ele]['omegak']  = getomegak(ele)
-    Element[ele]['omegal1'] = getomegal1(ele)
-    Element[ele]['omegal2'] = getomegal2(ele)
-    Element[ele]['omegal3'] = getomegal3(ele)
-    Element[ele]['omegam1'] = getomegam1(ele)
-    Element[ele]['omegam2'] = getomegam2(ele)
-    Element[ele]['omegam3'] = getomegam3(ele)
-    Element[ele]['omegam4'] = getomegam4(ele)
-    Element[ele]['omegam5'] = getomegam5(ele)
-
+    ddict['omegak']  = getomegak(ele)
+    ddict['omegal1'] = getomegal1(ele)
+    ddict['omegal2'] = getomegal2(ele)
+    ddict['omegal3'] = getomegal3(ele)
+    ddict['omegam1'] = getomegam1(ele)
+    ddict['omegam2'] = getomegam2(ele)
+    ddict['omegam3'] = getomegam3(ele)
+    ddict['omegam4'] = getomegam4(ele)
+    ddict['omegam5'] = getomegam5(ele)
 
     #Coster-Kronig
-    Element[ele]['CosterKronig'] = {}
-    Element[ele]['CosterKronig']['L'] = getCosterKronig(ele)
-    Element[ele]['CosterKronig']['M'] = MShell.getCosterKronig(ele)
+    ddict['CosterKronig'] = {}
+    ddict['CosterKronig']['L'] = getCosterKronig(ele)
+    ddict['CosterKronig']['M'] = MShell.getCosterKronig(ele)
 
     #jump ratios
 
     #xrays
-    #Element[ele]['rays']=[]
-    #updateElementDict(ele, Element[ele], energy=None, minenergy=0.399, minrate=0.001,cb=False)
+    #ddict['rays']=[]
+    #updateElementDict(ele, ddict, energy=None, minenergy=0.399, minrate=0.001,cb=False)
+    return ddict
+
+class _ElementDict(dict):
+    """
+    Dictionary of element properties built on first access.
+
+    All the element symbols are present from the start. The dictionary of
+    an element is built and its x-ray lines are (re)computed with the last
+    parameters given to updateDict only when that element is requested.
+    """
+    def __init__(self, elementList):
+        dict.__init__(self)
+        for ele in elementList:
+            dict.__setitem__(self, ele, None)
+        self._lock = threading.RLock()
+        self._pending = set()
+        self._parameters = {}
+
+    def setParameters(self, **parameters):
+        with self._lock:
+            self._parameters = parameters
+            self._pending = set(dict.keys(self))
+
+    def __getitem__(self, key):
+        with self._lock:
+            ddict = dict.__getitem__(self, key)
+            if ddict is None:
+                ddict = _getElementBaseDict(key)
+                dict.__setitem__(self, key, ddict)
+            if key in self._pending:
+                self._pending.discard(key)
+                _updateElementDict(key, ddict, **self._parameters)
+        return ddict
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._pending.discard(key)
+            dict.__setitem__(self, key, value)
+
+    def __iter__(self):
+        # overriding it prevents dict(), update() and the like from
+        # reading the stored values instead of calling __getitem__
+        return iter(dict.keys(self))
+
+    def __eq__(self, other):
+        return self.copy() == other
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __reduce__(self):
+        # copy, deepcopy and pickle give a plain dictionary
+        return (dict, (self.copy(),))
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *var, **kw):
+        for key, value in dict(*var, **kw).items():
+            self[key] = value
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def copy(self):
+        return dict(self.items())
+
+Element = _ElementDict(ElementList)
 Material = _getMaterialDict()
 
 updateDict()
@@ -32,7 +32,13 @@ __license__ = "MIT"
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 import os
 import numpy
-from PyMca5.PyMcaMath.linalg import lstsq
+import multiprocessing
+try:
+    import h5py
+    HAS_H5PY = True
+except ImportError:
+    HAS_H5PY = False
+from PyMca5.PyMcaMath.linalg import lstsq, LstsqSolver
 from . import ClassMcaTheory
 from PyMca5.PyMcaMath.fitting import Gefit
 from . import ConcentrationsTool
@@ -42,6 +48,200 @@ import time
 
 DEBUG = 0
 
+def _stripBackground(spectra, filterWidth, snipWidth, anchorslist):
+    """
+    Subtract in place the SNIP background of the spectra stored as the
+    columns of the supplied 2D array. All the spectra are smoothed and
+    stripped with a single call to the compiled functions.
+    """
+    # obtain the smoothed spectra
+    background = SpecfitFuns.SavitskyGolay(spectra.T, filterWidth)
+    background = SpecfitFuns.snip1d(background, snipWidth, 0, 0, anchorslist)
+    spectra -= background.T
+
+def _fitRows(data, rowStart, rowEnd, iXMin, iXMax, derivatives,
+             results, uncertainties, stripParameters, sigma_b, weight, svd,
+             solver=None):
+    """
+    Fit the spectra of the rows rowStart to rowEnd - 1 of the stack and
+    store the fitted parameters and their uncertainties in the supplied
+    (nFree, nRows, nColumns) output arrays.
+
+    If a LstsqSolver instance is supplied, it is used instead of solving
+    the derivatives matrix for every chunk.
+
+    Each row is processed in chunks of (at most) 100 spectra, so the
+    calculation performed on a row does not depend on the rows fitted
+    before it.
+    """
+    jStep = min(100, data.shape[1])
+    chunk = numpy.zeros((derivatives.shape[0], jStep), numpy.float)
+    last_svd = None
+    for i in range(rowStart, rowEnd):
+        #chunks of nColumns spectra
+        jStart = 0
+        while jStart < data.shape[1]:
+            jEnd = min(jStart + jStep, data.shape[1])
+            chunk[:,:(jEnd - jStart)] = data[i, jStart:jEnd, iXMin:iXMax+1].T
+            if stripParameters is not None:
+                _stripBackground(chunk[:, :(jEnd - jStart)],
+                                 stripParameters[0],
+                                 stripParameters[1],
+                                 stripParameters[2])
+
+            # perform the multiple fit to all the spectra in the chunk
+            if solver is None:
+                ddict=lstsq(derivatives, chunk[:,:(jEnd - jStart)],
+                            sigma_b=sigma_b,
+                            weight=weight,
+                            digested_output=True,
+                            svd=svd,
+                            last_svd=last_svd)
+                last_svd = ddict.get('svd', None)
+                results[:, i, jStart:jEnd] = ddict['parameters']
+                uncertainties[:, i, jStart:jEnd] = ddict['uncertainties']
+            else:
+                results[:, i, jStart:jEnd] = \
+                        solver.solve(chunk[:,:(jEnd - jStart)])[0]
+                uncertainties[:, i, jStart:jEnd] = \
+                        solver.getUncertainties().reshape(-1, 1)
+            jStart = jEnd
+
+# state of the worker processes used by _fitRowsInPool
+_WORKER_STATE = {}
+
+def _getContext():
+    # The fit can run in a thread of the GUI process. Forking a process
+    # with running threads and open HDF5 files is unsafe, therefore the
+    # workers are started from scratch whenever the platform allows it.
+    if hasattr(multiprocessing, "get_context"):
+        return multiprocessing.get_context("spawn")
+    return multiprocessing
+
+def _sharedArray(context, shape, dtype):
+    dtype = numpy.dtype(dtype)
+    size = dtype.itemsize
+    for item in shape:
+        size *= item
+    buffer = context.RawArray('b', max(1, size))
+    array = numpy.frombuffer(buffer, dtype=dtype, count=size // dtype.itemsize)
+    return buffer, array.reshape(shape)
+
+def _getWorkerData(data):
+    """
+    Return what the worker processes need to access the stack data:
+    the array itself for in memory stacks, the file and dataset names for
+    HDF5 datasets (they are reopened by each worker) and None when the data
+    cannot be shared with other processes.
+    """
+    if isinstance(data, numpy.ndarray):
+        return data
+    if HAS_H5PY:
+        if isinstance(data, h5py.Dataset):
+            return (data.file.filename, data.name)
+    return None
+
+def _initWorker(state):
+    _WORKER_STATE.clear()
+    _WORKER_STATE.update(state)
+    if state['dataBuffer'] is not None:
+        # in memory stack copied once into shared memory
+        _WORKER_STATE['data'] = numpy.frombuffer(state['dataBuffer'],
+                                    dtype=state['dataType'],
+                                    count=state['dataSize']).reshape(\
+                                    state['dataShape'])
+    elif isinstance(state['data'], tuple):
+        # never use an HDF5 handle inherited from the parent process
+        fileName, dataName = state['data']
+        h5 = h5py.File(fileName, "r")
+        _WORKER_STATE['h5'] = h5
+        _WORKER_STATE['data'] = h5[dataName]
+    shape = state['shape']
+    size = 1
+    for item in shape:
+        size *= item
+    _WORKER_STATE['results'] = numpy.frombuffer(state['resultsBuffer'],
+                                    dtype=numpy.float32,
+                                    count=size).reshape(shape)
+    _WORKER_STATE['uncertainties'] = numpy.frombuffer(\
+                                    state['uncertaintiesBuffer'],
+                                    dtype=numpy.float32,
+                                    count=size).reshape(shape)
+
+def _fitRowsWorker(rows):
+    state = _WORKER_STATE
+    _fitRows(state['data'], rows[0], rows[1],
+             state['iXMin'], state['iXMax'],
+             state['derivatives'],
+             state['results'],
+             state['uncertainties'],
+             state['stripParameters'],
+             state['sigma_b'],
+             state['weight'],
+             state['svd'],
+             state['solver'])
+    return rows
+
+def _fitRowsInPool(nworkers, data, iXMin, iXMax, derivatives,
+                   stripParameters, sigma_b, weight, svd, solver=None):
+    """
+    Distribute blocks of rows among nworkers processes. The workers receive
+    the derivatives matrix once at startup and write their results directly
+    into shared memory. Returns the results and uncertainties arrays.
+
+    data has to be a numpy array or an HDF5 dataset (see _getWorkerData).
+    A numpy array is copied once into shared memory instead of being sent
+    to every worker.
+    """
+    context = _getContext()
+    nRows = data.shape[0]
+    shape = (derivatives.shape[1], nRows, data.shape[1])
+    resultsBuffer, results = _sharedArray(context, shape, numpy.float32)
+    uncertaintiesBuffer, uncertainties = _sharedArray(context, shape,
+                                                      numpy.float32)
+    workerData = _getWorkerData(data)
+    dataBuffer = None
+    if isinstance(workerData, numpy.ndarray):
+        dataBuffer, sharedData = _sharedArray(context, data.shape, data.dtype)
+        for i in range(nRows):
+            sharedData[i] = data[i]
+        sharedData = None
+        workerData = None
+    state = {'data': workerData,
+             'dataBuffer': dataBuffer,
+             'dataType': data.dtype.str,
+             'dataShape': data.shape,
+             'dataSize': data.size,
+             'shape': shape,
+             'iXMin': iXMin,
+             'iXMax': iXMax,
+             'derivatives': derivatives,
+             'resultsBuffer': resultsBuffer,
+             'uncertaintiesBuffer': uncertaintiesBuffer,
+             'stripParameters': stripParameters,
+             'sigma_b': sigma_b,
+             'weight': weight,
+             'svd': svd,
+             'solver': solver}
+    # several blocks per worker to balance the load
+    blockSize = max(1, nRows // (4 * nworkers))
+    blocks = [(rowStart, min(rowStart + blockSize, nRows)) \
+              for rowStart in range(0, nRows, blockSize)]
+    pool = context.Pool(processes=nworkers,
+                        initializer=_initWorker,
+                        initargs=(state,))
+    try:
+        for rows in pool.imap_unordered(_fitRowsWorker, blocks):
+            if DEBUG:
+                print("Fitted rows %d to %d" % (rows[0], rows[1] - 1))
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return results, uncertainties
+
 class FastXRFLinearFit(object):
     def __init__(self, mcafit=None):
         self._config = None
@@ -62,7 +262,17 @@ class FastXRFLinearFit(object):
 
     def fitMultipleSpectra(self, x=None, y=None, xmin=None, xmax=None,
                            configuration=None, concentrations=False,
-                           ysum=None, weight=None):
+                           ysum=None, weight=None, nworkers=None):
+        """
+        Fit all the spectra of a three dimensional stack.
+
+        nworkers: Number of processes the stack rows are distributed among.
+                  The default (None or 1) performs the fit in the calling
+                  process, 0 uses all the available CPUs. The results do not
+                  depend on the number of processes used. Only stacks held in
+                  numpy arrays or HDF5 datasets are shared among processes,
+                  other stacks are always fitted in the calling process.
+        """
         if y is None:
             raise RuntimeError("y keyword argument is mandatory!")
 
@@ -242,16 +452,10 @@ class FastXRFLinearFit(object):
         dummySpectrum = firstSpectrum[iXMin:iXMax+1].reshape(-1, 1)
         # print("dummy = ", dummySpectrum.shape)
 
-        # allocate the output buffer
-        results = numpy.zeros((nFree, nRows, nColumns), numpy.float32)
-        uncertainties = numpy.zeros((nFree, nRows, nColumns), numpy.float32)
-
         #perform the initial fit
         if DEBUG:
             print("Configuration elapsed = %f"  % (time.time() - t0))
             t0 = time.time()
-        totalSpectra = data.shape[0] * data.shape[1]
-        jStep = min(100, data.shape[1])
         if weightPolicy == 2:
             SVD = False
             sigma_b = None
@@ -262,53 +466,45 @@ class FastXRFLinearFit(object):
         else:
             SVD = True
             sigma_b = None
-        last_svd = None
-        for i in range(0, data.shape[0]):
-            #print(i)
-            #chunks of nColumns spectra
-            if i == 0:
-                chunk = numpy.zeros((dummySpectrum.shape[0],
-                                     jStep),
-                                     numpy.float)
-            jStart = 0
-            while jStart < data.shape[1]:
-                jEnd = min(jStart + jStep, data.shape[1])
-                chunk[:,:(jEnd - jStart)] = data[i, jStart:jEnd, iXMin:iXMax+1].T
-                if config['fit']['stripflag']:
-                    for k in range(jStep):
-                        # obtain the smoothed spectrum
-                        background=SpecfitFuns.SavitskyGolay(chunk[:, k], 
-                                                config['fit']['stripfilterwidth'])
-                        lastAnchor = 0
-                        for anchor in anchorslist:
-                            if (anchor > lastAnchor) and (anchor < background.size):
-                                background[lastAnchor:anchor] =\
-                                        SpecfitFuns.snip1d(background[lastAnchor:anchor],
-                                                           config['fit']['snipwidth'],
-                                                           0)
-                                lastAnchor = anchor
-                        if lastAnchor < background.size:
-                            background[lastAnchor:] =\
-                                    SpecfitFuns.snip1d(background[lastAnchor:],
-                                                       config['fit']['snipwidth'],
-                                                       0)
-                        chunk[:, k] -= background
-
-                # perform the multiple fit to all the spectra in the chunk
-                #print("SHAPES")
-                #print(derivatives.shape)
-                #print(chunk[:,:(jEnd - jStart)].shape)
-                ddict=lstsq(derivatives, chunk[:,:(jEnd - jStart)],
-                            sigma_b=sigma_b,
-                            weight=weight,
-                            digested_output=True,
-                            svd=SVD,
-                            last_svd=last_svd)
-                last_svd = ddict.get('svd', None)
-                parameters = ddict['parameters'] 
-                results[:, i, jStart:jEnd] = parameters
-                uncertainties[:, i, jStart:jEnd] = ddict['uncertainties']
-                jStart = jEnd
+        if weightPolicy == 2:
+            # the weights change from pixel to pixel
+            solver = None
+        elif weight:
+            # the design matrix is common to all pixels, factorize it once
+            solver = LstsqSolver(derivatives, sigma_b=sigma_b)
+        else:
+            solver = LstsqSolver(derivatives)
+        if config['fit']['stripflag']:
+            stripParameters = (config['fit']['stripfilterwidth'],
+                               config['fit']['snipwidth'],
+                               anchorslist)
+        else:
+            stripParameters = None
+        if nworkers is None:
+            nworkers = 1
+        elif nworkers < 1:
+            nworkers = multiprocessing.cpu_count()
+        nworkers = min(nworkers, nRows)
+        if (nworkers > 1) and (_getWorkerData(data) is None):
+            # only arrays and HDF5 datasets can be given to other processes
+            if DEBUG:
+                print("Stack data cannot be shared, fitting in one process")
+            nworkers = 1
+        if nworkers < 2:
+            # allocate the output buffer
+            results = numpy.zeros((nFree, nRows, nColumns), numpy.float32)
+            uncertainties = numpy.zeros((nFree, nRows, nColumns),
+                                        numpy.float32)
+            _fitRows(data, 0, nRows, iXMin, iXMax,
+                     derivatives, results, uncertainties,
+                     stripParameters, sigma_b, weight, SVD, solver)
+        else:
+            results, uncertainties = _fitRowsInPool(nworkers, data,
+                                                    iXMin, iXMax,
+                                                    derivatives,
+                                                    stripParameters,
+                                                    sigma_b, weight, SVD,
+                                                    solver)
         if DEBUG:
             t = time.time() - t0
             print("First fit elapsed = %f" % t)
@@ -377,29 +573,21 @@ class FastXRFLinearFit(object):
                 spectra = spectra.T
                 # 
                 if config['fit']['stripflag']:
-                    for k in range(spectra.shape[1]):
-                        # obtain the smoothed spectrum
-                        background=SpecfitFuns.SavitskyGolay(spectra[:, k], 
-                                                config['fit']['stripfilterwidth'])
-                        lastAnchor = 0
-                        for anchor in anchorslist:
-                            if (anchor > lastAnchor) and (anchor < background.size):
-                                background[lastAnchor:anchor] =\
-                                        SpecfitFuns.snip1d(background[lastAnchor:anchor],
-                                                           config['fit']['snipwidth'],
-                                                           0)
-                                lastAnchor = anchor
-                        if lastAnchor < background.size:
-                            background[lastAnchor:] =\
-                                    SpecfitFuns.snip1d(background[lastAnchor:],
-                                                       config['fit']['snipwidth'],
-                                                       0)
-                    spectra[:, k] -= background
-                ddict = lstsq(A, spectra,
-                              sigma_b=sigma_b,
-                              weight=weight,
-                              digested_output=True,
-                              svd=SVD)
+                    _stripBackground(spectra,
+                                     config['fit']['stripfilterwidth'],
+                                     config['fit']['snipwidth'],
+                                     anchorslist)
+                if solver is None:
+                    ddict = lstsq(A, spectra,
+                                  sigma_b=sigma_b,
+                                  weight=weight,
+                                  digested_output=True,
+                                  svd=SVD)
+                else:
+                    ddict = LstsqSolver(A, sigma_b=sigma_b if weight else None)\
+                                .solve(spectra,
+                                       uncertainties=True,
+                                       digested_output=True)
                 idx = 0
                 for i in range(nFree):
                     if i in badParameters:
@@ -62,12 +62,20 @@ if not os.path.exists(ffile):
         print("Cannot find file ", ffile)
         raise IOError("Cannot find file %s" % ffile)
 
-COEFFICIENTS = ConfigDict.ConfigDict()
-COEFFICIENTS.read(ffile)
-xvalues = COEFFICIENTS['ISCADT']['XSVAL']
-svalues = numpy.reshape(COEFFICIENTS['ISCADT']['SCATF'], (100, len(xvalues)))
-#svalues = COEFFICIENTS['ISCADT']['SCATF']
-#print svalues[100:110]
+# read on first access
+COEFFICIENTS = ConfigDict.LazyConfigDict(ffile)
+_TABLES = None
+
+def _getScatteringTables():
+    global _TABLES
+    if _TABLES is None:
+        xvalues = COEFFICIENTS['ISCADT']['XSVAL']
+        svalues = numpy.reshape(COEFFICIENTS['ISCADT']['SCATF'],
+                                (100, len(xvalues)))
+        #svalues = COEFFICIENTS['ISCADT']['SCATF']
+        #print svalues[100:110]
+        _TABLES = xvalues, svalues
+    return _TABLES
 KEVTOANG = 12.39852000
 R0 = 2.82E-13 #electron radius in cm
 
@@ -101,6 +109,7 @@ def getElementIncoherentScatteringFunction(ele, theta, energy):
         z = getZ(ele)
     else:
         z = float(ele)
+    xvalues, svalues = _getScatteringTables()
     wavelength = KEVTOANG / energy
     sinhalftheta = numpy.sin(theta * (numpy.pi / 360.0))
     #Hubbel just give this term
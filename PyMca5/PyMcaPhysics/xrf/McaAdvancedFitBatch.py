@@ -32,14 +32,18 @@ __license__ = "MIT"
 __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 import sys
 import os
+import multiprocessing
+import collections
 import numpy
 from . import ClassMcaTheory
 from PyMca5.PyMcaCore import SpecFileLayer
 from PyMca5.PyMcaCore import EdfFileLayer
 from PyMca5.PyMcaIO import EdfFile
 from PyMca5.PyMcaIO import LuciaMap
+from PyMca5.PyMcaCore import StackROIImages
 from PyMca5.PyMcaIO import AifiraMap
 from PyMca5.PyMcaIO import EDFStack
+from PyMca5.PyMcaIO import ArraySave
 try:
     import h5py
     from PyMca5.PyMcaIO import HDF5Stack1D
@@ -49,6 +53,30 @@ except ImportError:
 from PyMca5 import ConfigDict
 from . import ConcentrationsTool
 
+# state of the worker processes used when fitting with nworkers > 1
+_WORKER_STATE = {}
+
+def _initWorker(kw):
+    _WORKER_STATE.clear()
+    batch = McaAdvancedFitBatch(**kw)
+    batch.mcafit.enableOptimizedLinearFit()
+    _WORKER_STATE['batch'] = batch
+
+def _fitMcaWorker(task):
+    return _WORKER_STATE['batch']._fitMcaTask(task)
+
+def _getPool(nworkers, kw):
+    # The batch can run in a thread of the GUI process (PyMcaBatch). Forking
+    # a process with running threads is unsafe, therefore the workers are
+    # started from scratch whenever the platform allows it.
+    if hasattr(multiprocessing, "get_context"):
+        context = multiprocessing.get_context("spawn")
+    else:
+        context = multiprocessing
+    return context.Pool(processes=nworkers,
+                        initializer=_initWorker,
+                        initargs=(kw,))
+
 
 class McaAdvancedFitBatch(object):
     def __init__(self,initdict,filelist=None,outputdir=None,
@@ -57,13 +85,16 @@ class McaAdvancedFitBatch(object):
                     concentrations=0, fitfiles=1, fitimages=1,
                     filebeginoffset = 0, fileendoffset=0,
                     mcaoffset=0, chunk = None,
-                    selection=None, lock=None):
+                    selection=None, lock=None, nworkers=None,
+                    hdf5output=0, hdf5compression=None):
         #for the time being the concentrations are bound to the .fit files
         #that is not necessary, but it will be correctly implemented in
         #future releases
         self._lock = lock
         self.fitFiles = fitfiles
         self._concentrations = concentrations
+        self.__initDict = initdict
+        self.__configIndex = mcaoffset
         if type(initdict) == type([]):
             self.mcafit = ClassMcaTheory.McaTheory(initdict[mcaoffset])
             self.__configList = initdict
@@ -96,6 +127,22 @@ class McaAdvancedFitBatch(object):
         self.mcaOffset = mcaoffset
         self.chunk     = chunk
         self.selection = selection
+        # number of processes sharing the fits, each one with its own
+        # configured McaTheory instance. Values below 1 mean all the cpus.
+        if nworkers is None:
+            nworkers = 1
+        elif nworkers < 1:
+            nworkers = multiprocessing.cpu_count()
+        self.nworkers = nworkers
+        self._pool = None
+        self.__pending = collections.deque()
+        # all the output images in a single HDF5 file instead of EDF files
+        if hdf5output and not ArraySave.HDF5:
+            raise IOError('h5py does not seem to be installed in your system')
+        self.hdf5Output = hdf5output
+        self.hdf5Compression = hdf5compression
+        self.hdf5File = None
+        self.__hdf5 = None
 
         
     def setFileList(self,filelist=None):
@@ -153,13 +200,52 @@ class McaAdvancedFitBatch(object):
         self.counter =  0
         self.__row   = self.fileBeginOffset - 1
         self.__stack = None
+        self.__pending = collections.deque()
+        if (self.nworkers > 1) and (not self.roiFit):
+            self._pool = _getPool(self.nworkers,
+                                  self.__getWorkerArguments())
+        try:
+            try:
+                self.__processFiles()
+                if self._pool is not None:
+                    self.__storePendingResults()
+                    if self.pleaseBreak:
+                        self._pool.terminate()
+                    else:
+                        self._pool.close()
+            except:
+                if self._pool is not None:
+                    self._pool.terminate()
+                raise
+            finally:
+                if self._pool is not None:
+                    self._pool.join()
+                    self._pool = None
+                self.__pending = collections.deque()
+            if self.counter:
+                if not self.roiFit: 
+                    if self.fitFiles:
+                        self.listfile.write(']\n')
+                        self.listfile.close()
+                if self.__ncols is not None:
+                    if self.__ncols:self.saveImage()
+        finally:
+            # the HDF5 output is normally closed by saveImage but it has
+            # to be released as well on errors
+            if self.__hdf5 is not None:
+                self.__closeHDF5Output()
+        self.onEnd()
+
+    def __processFiles(self):
         for i in range(0+self.fileBeginOffset,
                        len(self._filelist)-self.fileEndOffset,
                        self.fileStep):
             if not self.roiFit:
                 if self.__configList is not None:
                     if i != 0:
-                        self.mcafit = ClassMcaTheory.McaTheory(self.__configList[i])
+                        self.__configIndex = i
+                        if self._pool is None:
+                            self.mcafit = ClassMcaTheory.McaTheory(self.__configList[i])
             self.mcafit.enableOptimizedLinearFit()
             inputfile   = self._filelist[i]
             self.__row += 1 #should be plus fileStep?
@@ -180,14 +266,15 @@ class McaAdvancedFitBatch(object):
                     break
             else:
                 self.__processOneFile()
-        if self.counter:
-            if not self.roiFit: 
-                if self.fitFiles:
-                    self.listfile.write(']\n')
-                    self.listfile.close()
-            if self.__ncols is not None:
-                if self.__ncols:self.saveImage()
-        self.onEnd()
+
+    def __getWorkerArguments(self):
+        return {'initdict': self.__initDict,
+                'filelist': self._filelist,
+                'outputdir': self._outputdir,
+                'overwrite': not self.useExistingFiles,
+                'concentrations': self._concentrations,
+                'fitfiles': self.fitFiles,
+                'mcaoffset': self.__configIndex}
 
     def getFileHandle(self,inputfile):
         try:
@@ -196,8 +283,11 @@ class McaAdvancedFitBatch(object):
                 if h5py.is_hdf5(inputfile):
                     self._HDF5 = True
                     try:
+                        # the stack is fitted row by row, there is no
+                        # need to load it into memory
                         return HDF5Stack1D.HDF5Stack1D(self._filelist,
-                                                      self.selection)
+                                                      self.selection,
+                                                      virtual=True)
                     except:
                         raise
             ffile = self.__tryEdf(inputfile)
@@ -312,6 +402,22 @@ class McaAdvancedFitBatch(object):
                 print(sys.exc_info())
                 print("Batch resumed")
                 continue
+            if self.roiFit:
+                mcaList = list(colsToIter)
+                if xStack is None:
+                    if 'MCA start ch' in info:
+                        xmin = float(info['MCA start ch'])
+                    else:
+                        xmin = 0.0
+                    x = numpy.arange(cache_data.shape[-1])*1.0 + xmin
+                else:
+                    x = xStack
+                filename = os.path.basename(info['SourceName'][0])
+                keyList = ["%s.%04d" % (keylist[i], mca) for mca in mcaList]
+                self.__processROIBlock(x, cache_data, mcaList, mcaList,
+                                       numberofmca, filename, keyList,
+                                       info['SourceName'])
+                continue
             for mca in colsToIter:
                 if self.pleaseBreak: break
                 self.__col = mca
@@ -332,10 +438,8 @@ class McaAdvancedFitBatch(object):
                 infoDict = {}
                 infoDict['SourceName'] = info['SourceName']
                 infoDict['Key']        = key
-                self.__processOneMca(x,y0,filename,key,info=infoDict)
-                self.onMca(mca, numberofmca, filename=filename,
-                                            key=key,
-                                            info=infoDict)
+                self.__processMca(x, y0, filename, key, infoDict,
+                                  mca, numberofmca)
                 
     def __processOneFile(self):
         ffile=self.file
@@ -353,6 +457,22 @@ class McaAdvancedFitBatch(object):
                     numberofmca  = ncols
                     self.__ncols = len(range(0+self.mcaOffset,numberofmca,self.mcaStep))
                     self.__col  = -1
+                    if self.roiFit:
+                        mcaList = list(range(0+self.mcaOffset,numberofmca,
+                                             self.mcaStep))
+                        if 'MCA start ch' in info:
+                            xmin = float(info['MCA start ch'])
+                        else:
+                            xmin = 0.0
+                        x = numpy.arange(data.shape[-1])*1.0 + xmin
+                        filename = os.path.basename(info['SourceName'])
+                        keyList = ["%s.%s.%04d" % (scan,order,mca) \
+                                   for mca in mcaList]
+                        self.__processROIBlock(x, data, mcaList,
+                                               list(range(len(mcaList))),
+                                               numberofmca, filename,
+                                               keyList, info['SourceName'])
+                        continue
                     for mca_index in range(self.__ncols):
                         mca = 0 + self.mcaOffset + mca_index * self.mcaStep
                         if self.pleaseBreak: break
@@ -369,10 +489,8 @@ class McaAdvancedFitBatch(object):
                         infoDict = {}
                         infoDict['SourceName'] = info['SourceName']
                         infoDict['Key']        = key
-                        self.__processOneMca(x,y0,filename,key,info=infoDict)
-                        self.onMca(mca, numberofmca, filename=filename,
-                                                    key=key,
-                                                    info=infoDict)
+                        self.__processMca(x, y0, filename, key, infoDict,
+                                          mca, numberofmca)
                 else:
                     if info['NbMca'] > 0:
                         self.fitImages = True
@@ -413,10 +531,8 @@ class McaAdvancedFitBatch(object):
                             infoDict = {}
                             infoDict['SourceName'] = info['SourceName']
                             infoDict['Key']        = key
-                            self.__processOneMca(x,y0,filename,key,info=infoDict)
-                            self.onMca(i, info['NbMca'],filename=filename,
-                                                    key=key,
-                                                    info=infoDict)
+                            self.__processMca(x, y0, filename, key, infoDict,
+                                              i, info['NbMca'])
                             #print "remaining = ",(time.time()-e0) * (info['NbMca'] - i)
 
     def __getFitFile(self, filename, key):
@@ -447,320 +563,513 @@ class McaAdvancedFitBatch(object):
                                            a.decode('latin-1'))
         return outfile
 
+    def __processMca(self, x, y, filename, key, info, mca, nmca):
+        if self._pool is None:
+            self.__processOneMca(x, y, filename, key, info=info)
+            self.onMca(mca, nmca, filename=filename, key=key, info=info)
+            return
+        # the spectrum is fitted by the first free worker but the results
+        # are stored in the same order the spectra were read
+        task = (self.__configIndex, x, y, filename, key, info)
+        self.__pending.append((self._pool.apply_async(_fitMcaWorker, (task,)),
+                               self.__row, self.__col,
+                               filename, key, info, mca, nmca))
+        while len(self.__pending) > 16 * self.nworkers:
+            self.__storeNextResult()
+
+    def __storeNextResult(self):
+        asyncResult, row, col, filename, key, info, mca, nmca = \
+                                                    self.__pending.popleft()
+        output = asyncResult.get()
+        if output is not None:
+            result, concentrations, outfile = output
+            self.__storeOneMcaResult(row, col, filename, key,
+                                     result, concentrations, outfile)
+        self.onMca(mca, nmca, filename=filename, key=key, info=info)
+
+    def __storePendingResults(self):
+        while len(self.__pending) and (not self.pleaseBreak):
+            self.__storeNextResult()
+
+    def _fitMcaTask(self, task):
+        """
+        Fit one spectrum in a worker process. Only the information needed
+        to fill the output images is sent back to the main process.
+        """
+        configIndex, x, y, filename, key, info = task
+        if (self.__configList is not None) and \
+           (configIndex != self.__configIndex):
+            self.mcafit = ClassMcaTheory.McaTheory(self.__configList[configIndex])
+            self.mcafit.enableOptimizedLinearFit()
+            self.__configIndex = configIndex
+        output = self.__fitOneMca(x, y, filename, key, info=info)
+        if output is None:
+            return None
+        result, concentrations, outfile = output
+        imagingResult = {'groups': result['groups']}
+        if 'chisq' in result:
+            imagingResult['chisq'] = result['chisq']
+        for group in result['groups']:
+            imagingResult[group] = {}
+            for item in ['fitarea', 'sigmaarea']:
+                if item in result[group]:
+                    imagingResult[group][item] = result[group][item]
+        return imagingResult, concentrations, outfile
+
     def __processOneMca(self,x,y,filename,key,info=None):
         self._concentrationsAsAscii = ""
         if not self.roiFit:
-            result = None
-            concentrationsdone = 0
-            concentrations = None
-            outfile=self.os_path_join(self._outputdir, filename)
-            fitfile = self.__getFitFile(filename,key)
-            if self.chunk is not None:
-                con_extension = "_%06d_partial_concentrations.txt" % self.chunk
-            else:
-                con_extension = "_concentrations.txt"
-            self._concentrationsFile = self.os_path_join(self._outputdir,
-                                    self._rootname+ con_extension)
-            #                        self._rootname+"_concentrationsNEW.txt")
-            if self.counter == 0:
-                if os.path.exists(self._concentrationsFile):
-                    try:
-                        os.remove(self._concentrationsFile)
-                    except:
-                        print("I could not delete existing concentrations file %s" %\
-                              self._concentrationsFile)
-            #print "self._concentrationsFile", self._concentrationsFile
-            if self.useExistingFiles and os.path.exists(fitfile):
-                useExistingResult = 1
-                try:
-                    dict = ConfigDict.ConfigDict()
-                    dict.read(fitfile)
-                    result = dict['result']
-                    if 'concentrations' in dict:
-                        concentrationsdone = 1
-                except:
-                    print("Error trying to use result file %s" % fitfile)
-                    print("Please, consider deleting it.")
-                    print(sys.exc_info())
-                    return
-            else:
-                useExistingResult = 0
-                try:
-                    #I make sure I take the fit limits configuration
-                    self.mcafit.config['fit']['use_limit'] = 1
-                    self.mcafit.setData(x,y)
-                except:
-                    print("Error entering data of file with output = %s" %\
-                          filename)
-                    return
-                try:
-                    self.mcafit.estimate()
-                    if self.fitFiles:
-                        fitresult, result = self.mcafit.startfit(digest=1)
-                    elif self._concentrations and (self.mcafit._fluoRates is None):
-                        fitresult, result = self.mcafit.startfit(digest=1)
-                    elif self._concentrations:
-                        fitresult = self.mcafit.startfit(digest=0)
+            output = self.__fitOneMca(x, y, filename, key, info=info)
+            if output is None:
+                return
+            result, concentrations, outfile = output
+            self.__storeOneMcaResult(self.__row, self.__col, filename, key,
+                                     result, concentrations, outfile)
+        else:
+                dict=self.mcafit.roifit(x,y,width=self.roiWidth)
+                #this only works with EDF
+                if self.__ncols is not None:
+                    if not self.counter:
+                        if not self.__initROIImages(dict):
+                            return
+                                
+                if not hasattr(self, "_ROIimages"):
+                    print("ROI fitting only supported on EDF")
+                for group in self.__ROIpeaks:
+                    for roi in self._ROIimages[group].keys():
                         try:
-                            fitresult0 = {}
-                            fitresult0['fitresult'] = fitresult
-                            fitresult0['result'] = self.mcafit.imagingDigestResult()
-                            fitresult0['result']['config'] = self.mcafit.config
-                            conf = self.mcafit.configure()
-                            tconf = self._tool.configure()
-                            if 'concentrations' in conf:
-                                tconf.update(conf['concentrations'])
-                            else:
-                                #what to do?
-                                pass
-                            concentrations = self._tool.processFitResult(config=tconf,
-                                            fitresult=fitresult0,
-                                            elementsfrommatrix=False,
-                                            fluorates = self.mcafit._fluoRates)
+                            self._ROIimages[group][roi][self.__row, self.__col] = dict[group][roi]
                         except:
-                            print("error in concentrations")
-                            print(sys.exc_info()[0:-1])
-                        concentrationsdone = True
-                    else:
-                        #just images
-                        fitresult = self.mcafit.startfit(digest=0)
-                except:
-                    print("Error fitting file with output = %s: %s)" %\
-                          (filename, sys.exc_info()[1]))
-                    return
-            if self._concentrations:
-                if concentrationsdone == 0:
-                    if not ('concentrations' in result):
-                        if useExistingResult:
-                            fitresult0={}
-                            fitresult0['result'] = result
-                            conf = result['config']
-                        else:
-                            fitresult0={}
-                            if result is None:
-                                result = self.mcafit.digestresult()
-                            fitresult0['result']    = result
-                            fitresult0['fitresult'] = fitresult
-                            conf = self.mcafit.configure()
+                            print("error on (row,col) = %d,%d" %\
+                                  (self.__row, self.__col))
+                            print("File = %s" % filename)
+                            pass
+
+                #update counter
+                self.counter += 1
+
+    def __initROIImages(self, roiDict):
+        imgdir = self.os_path_join(self._outputdir,"IMAGES")
+        if not os.path.exists(imgdir):
+            try:
+                os.mkdir(imgdir)
+            except:
+                print("I could not create directory %s" %\
+                      imgdir)
+                return False
+        elif not os.path.isdir(imgdir):
+            print("%s does not seem to be a valid directory" %\
+                  imgdir)
+        self.imgDir = imgdir
+        self.__ROIpeaks  = []
+        self._ROIimages = {}
+        if not self.__stack:
+            self.__nrows   = len(self._filelist)
+        for group in roiDict.keys():
+            self.__ROIpeaks.append(group)
+            self._ROIimages[group]={}
+            for roi in roiDict[group].keys():
+                self._ROIimages[group][roi]=numpy.zeros((self.__nrows,
+                                                   self.__ncols),
+                                                   numpy.float)
+        return True
+
+    def __processROIBlock(self, x, data, mcaList, colList, nmca,
+                          filename, keyList, sourceName):
+        """
+        ROI fit of the spectra data[mcaList], all sharing the same x values,
+        to be stored in the columns colList of the current row.
+        All the ROI sums are obtained in a single pass over the data.
+        """
+        regions = self.mcafit.getROIRegions(width=self.roiWidth)
+        if not self.counter:
+            if not self.__initROIImages(regions):
+                return
+        zero = self.mcafit.config['detector']['zero']
+        gain = self.mcafit.config['detector']['gain']
+        energy = zero + gain * numpy.ravel(numpy.array(x))
+        rois = []
+        names = []
+        for group in self.__ROIpeaks:
+            for roi in self._ROIimages[group].keys():
+                emin, emax = regions[group][roi]
+                idx = numpy.nonzero((energy >= emin) & (energy <= emax))[0]
+                if len(idx):
+                    rois.append((idx.min(), idx.max() + 1))
+                    names.append((group, roi))
+        spectra = numpy.asarray(data)[mcaList]
+        imageList = StackROIImages.calculateROIImages(\
+                                        spectra[numpy.newaxis, :, :],
+                                        rois, mcaindex=2, sumonly=True)
+        for (group, roi), imageDict in zip(names, imageList):
+            self._ROIimages[group][roi][self.__row, colList] = \
+                                                    imageDict['ROI'][0]
+        for mca, key in zip(mcaList, keyList):
+            self.counter += 1
+            infoDict = {}
+            infoDict['SourceName'] = sourceName
+            infoDict['Key']        = key
+            self.onMca(mca, nmca, filename=filename, key=key, info=infoDict)
+
+    def __fitOneMca(self, x, y, filename, key, info=None):
+        """
+        Fit the spectrum and write the .fit file if requested.
+        Returns None on error or the tuple (result, concentrations, outfile)
+        """
+        result = None
+        concentrationsdone = 0
+        concentrations = None
+        outfile=self.os_path_join(self._outputdir, filename)
+        fitfile = self.__getFitFile(filename,key)
+        if self.useExistingFiles and os.path.exists(fitfile):
+            useExistingResult = 1
+            try:
+                dict = ConfigDict.ConfigDict()
+                dict.read(fitfile)
+                result = dict['result']
+                if 'concentrations' in dict:
+                    concentrationsdone = 1
+            except:
+                print("Error trying to use result file %s" % fitfile)
+                print("Please, consider deleting it.")
+                print(sys.exc_info())
+                return
+        else:
+            useExistingResult = 0
+            try:
+                #I make sure I take the fit limits configuration
+                self.mcafit.config['fit']['use_limit'] = 1
+                self.mcafit.setData(x,y)
+            except:
+                print("Error entering data of file with output = %s" %\
+                      filename)
+                return
+            try:
+                self.mcafit.estimate()
+                if self.fitFiles:
+                    fitresult, result = self.mcafit.startfit(digest=1)
+                elif self._concentrations and (self.mcafit._fluoRates is None):
+                    fitresult, result = self.mcafit.startfit(digest=1)
+                elif self._concentrations:
+                    fitresult = self.mcafit.startfit(digest=0)
+                    try:
+                        fitresult0 = {}
+                        fitresult0['fitresult'] = fitresult
+                        fitresult0['result'] = self.mcafit.imagingDigestResult()
+                        fitresult0['result']['config'] = self.mcafit.config
+                        conf = self.mcafit.configure()
                         tconf = self._tool.configure()
                         if 'concentrations' in conf:
                             tconf.update(conf['concentrations'])
                         else:
+                            #what to do?
                             pass
-                            #print "Concentrations not calculated"
-                            #print "Is your fit configuration file correct?"
-                            #return                      
-                        try:
-                            concentrations = self._tool.processFitResult(config=tconf,
-                                            fitresult=fitresult0,
-                                            elementsfrommatrix=False)
-                        except:
-                            print("error in concentrations")
-                            print(sys.exc_info()[0:-1])
-                            #return
-                self._concentrationsAsAscii=self._toolConversion.getConcentrationsAsAscii(concentrations)
-                if len(self._concentrationsAsAscii) > 1:
-                    text  = ""
-                    text += "SOURCE: "+ filename +"\n"
-                    text += "KEY: "+key+"\n"
-                    text += self._concentrationsAsAscii + "\n"
-                    f=open(self._concentrationsFile,"a")
-                    f.write(text)
-                    f.close()
-
-            #output options
-            # .FIT files
-            if self.fitFiles:
-                fitdir = self.os_path_join(self._outputdir,"FIT")
-                if not os.path.exists(fitdir):
-                    try:
-                        os.mkdir(fitdir)
+                        concentrations = self._tool.processFitResult(config=tconf,
+                                        fitresult=fitresult0,
+                                        elementsfrommatrix=False,
+                                        fluorates = self.mcafit._fluoRates)
                     except:
-                        print("I could not create directory %s" % fitdir)
-                        return
-                fitdir = self.os_path_join(fitdir,filename+"_FITDIR")
-                if not os.path.exists(fitdir):
-                    try:
-                        os.mkdir(fitdir)
-                    except:
-                        print("I could not create directory %s" % fitdir)
-                        return
-                if not os.path.isdir(fitdir):
-                    print("%s does not seem to be a valid directory" % fitdir)
+                        print("error in concentrations")
+                        print(sys.exc_info()[0:-1])
+                    concentrationsdone = True
                 else:
-                    outfile = filename +"_"+key+".fit" 
-                    outfile = self.os_path_join(fitdir,  outfile)
-                if not useExistingResult:
-                    result = self.mcafit.digestresult(outfile=outfile,
-                                                      info=info)
-                if concentrations is not None:
+                    #just images
+                    fitresult = self.mcafit.startfit(digest=0)
+            except:
+                print("Error fitting file with output = %s: %s)" %\
+                      (filename, sys.exc_info()[1]))
+                return
+        if self._concentrations:
+            if concentrationsdone == 0:
+                if not ('concentrations' in result):
+                    if useExistingResult:
+                        fitresult0={}
+                        fitresult0['result'] = result
+                        conf = result['config']
+                    else:
+                        fitresult0={}
+                        if result is None:
+                            result = self.mcafit.digestresult()
+                        fitresult0['result']    = result
+                        fitresult0['fitresult'] = fitresult
+                        conf = self.mcafit.configure()
+                    tconf = self._tool.configure()
+                    if 'concentrations' in conf:
+                        tconf.update(conf['concentrations'])
+                    else:
+                        pass
+                        #print "Concentrations not calculated"
+                        #print "Is your fit configuration file correct?"
+                        #return                      
                     try:
-                        f=ConfigDict.ConfigDict()
-                        f.read(outfile)
-                        f['concentrations'] = concentrations
-                        try:
-                            os.remove(outfile)
-                        except:
-                            print("error deleting fit file")
-                        f.write(outfile)
+                        concentrations = self._tool.processFitResult(config=tconf,
+                                        fitresult=fitresult0,
+                                        elementsfrommatrix=False)
                     except:
-                        print("Error writing concentrations to fit file")
-                        print(sys.exc_info())
+                        print("error in concentrations")
+                        print(sys.exc_info()[0:-1])
+                        #return
 
-                #python like output list
-                if not self.counter:
-                    name = os.path.splitext(self._rootname)[0]+"_fitfilelist.py"
-                    name = self.os_path_join(self._outputdir,name)
-                    try:
-                        os.remove(name)
-                    except:
-                        pass
-                    self.listfile=open(name,"w+")
-                    self.listfile.write("fitfilelist = [")
-                    self.listfile.write('\n'+outfile)
-                else: 
-                    self.listfile.write(',\n'+outfile)
+        #output options
+        # .FIT files
+        if self.fitFiles:
+            fitdir = self.os_path_join(self._outputdir,"FIT")
+            if not self.__makeDirectory(fitdir):
+                return
+            fitdir = self.os_path_join(fitdir,filename+"_FITDIR")
+            if not self.__makeDirectory(fitdir):
+                return
+            if not os.path.isdir(fitdir):
+                print("%s does not seem to be a valid directory" % fitdir)
             else:
-                if not useExistingResult:
-                    if 0:
-                        #this is very slow and not needed just for imaging
-                        if result is None:result = self.mcafit.digestresult()
-                    else:
-                        if result is None:result = self.mcafit.imagingDigestResult()
-
-            #IMAGES
-            if self.fitImages:
-                #this only works with EDF
-                if self.__ncols is not None:
-                    if not self.counter:
-                        imgdir = self.os_path_join(self._outputdir,"IMAGES")
-                        if not os.path.exists(imgdir):
-                            try:
-                                os.mkdir(imgdir)
-                            except:
-                                print("I could not create directory %s" %\
-                                      imgdir)
-                                return
-                        elif not os.path.isdir(imgdir):
-                            print("%s does not seem to be a valid directory" %\
-                                  imgdir)
-                        self.imgDir = imgdir
-                        self.__peaks  = []
-                        self.__images = {}
-                        self.__sigmas = {}
-                        if not self.__stack:
-                            self.__nrows   = len(range(0,len(self._filelist),self.fileStep))
-                        for group in result['groups']:
-                            self.__peaks.append(group)
-                            self.__images[group]= numpy.zeros((self.__nrows,
-                                                               self.__ncols),
-                                                               numpy.float)
-                            self.__sigmas[group]= numpy.zeros((self.__nrows,
-                                                               self.__ncols),
-                                                               numpy.float)
-                        self.__images['chisq']  = numpy.zeros((self.__nrows,
-                                                               self.__ncols),
-                                                               numpy.float) - 1.
-                        if self._concentrations:
-                            layerlist = concentrations['layerlist']
-                            if 'mmolar' in concentrations:
-                                self.__conLabel = " mM"
-                                self.__conKey   = "mmolar"
-                            else:
-                                self.__conLabel = " mass fraction"
-                                self.__conKey   = "mass fraction"
-                            for group in concentrations['groups']:
-                                key = group+self.__conLabel
-                                self.__concentrationsKeys.append(key)
-                                self.__images[key] = numpy.zeros((self.__nrows,
-                                                                  self.__ncols),
-                                                                  numpy.float)
-                                if len(layerlist) > 1:
-                                    for layer in layerlist:
-                                        key = group+" "+layer
-                                        self.__concentrationsKeys.append(key)                                        
-                                        self.__images[key] = numpy.zeros((self.__nrows,
-                                                                    self.__ncols),
-                                                                    numpy.float)
-                for peak in self.__peaks:
+                outfile = filename +"_"+key+".fit" 
+                outfile = self.os_path_join(fitdir,  outfile)
+            if not useExistingResult:
+                result = self.mcafit.digestresult(outfile=outfile,
+                                                  info=info)
+            if concentrations is not None:
+                try:
+                    f=ConfigDict.ConfigDict()
+                    f.read(outfile)
+                    f['concentrations'] = concentrations
                     try:
-                        self.__images[peak][self.__row, self.__col] = result[peak]['fitarea']
-                        self.__sigmas[peak][self.__row, self.__col] = result[peak]['sigmaarea']
+                        os.remove(outfile)
                     except:
-                        pass
-                if self._concentrations:
-                    layerlist = concentrations['layerlist']
-                    for group in concentrations['groups']:
-                        self.__images[group+self.__conLabel][self.__row, self.__col] = \
-                                              concentrations[self.__conKey][group]
-                        if len(layerlist) > 1:
-                            for layer in layerlist:
-                                self.__images[group+" "+layer] [self.__row, self.__col] = \
-                                              concentrations[layer][self.__conKey][group]
+                        print("error deleting fit file")
+                    f.write(outfile)
+                except:
+                    print("Error writing concentrations to fit file")
+                    print(sys.exc_info())
+        else:
+            if not useExistingResult:
+                if 0:
+                    #this is very slow and not needed just for imaging
+                    if result is None:result = self.mcafit.digestresult()
+                else:
+                    if result is None:result = self.mcafit.imagingDigestResult()
+        return result, concentrations, outfile
+
+    def __makeDirectory(self, dirname):
+        if not os.path.exists(dirname):
+            try:
+                os.mkdir(dirname)
+            except:
+                # it may have been created by another worker
+                if not os.path.isdir(dirname):
+                    print("I could not create directory %s" % dirname)
+                    return False
+        return True
+
+    def __storeOneMcaResult(self, row, col, filename, key,
+                            result, concentrations, outfile):
+        if self.chunk is not None:
+            con_extension = "_%06d_partial_concentrations.txt" % self.chunk
+        else:
+            con_extension = "_concentrations.txt"
+        self._concentrationsFile = self.os_path_join(self._outputdir,
+                                self._rootname+ con_extension)
+        #                        self._rootname+"_concentrationsNEW.txt")
+        if self.counter == 0:
+            if os.path.exists(self._concentrationsFile):
                 try:
-                    self.__images['chisq'][self.__row, self.__col] = result['chisq']
+                    os.remove(self._concentrationsFile)
+                except:
+                    print("I could not delete existing concentrations file %s" %\
+                          self._concentrationsFile)
+        #print "self._concentrationsFile", self._concentrationsFile
+        if self._concentrations and not self.hdf5Output:
+            # with HDF5 output the concentrations are stored as images
+            self._concentrationsAsAscii=self._toolConversion.getConcentrationsAsAscii(concentrations)
+            if len(self._concentrationsAsAscii) > 1:
+                text  = ""
+                text += "SOURCE: "+ filename +"\n"
+                text += "KEY: "+key+"\n"
+                text += self._concentrationsAsAscii + "\n"
+                f=open(self._concentrationsFile,"a")
+                f.write(text)
+                f.close()
+
+        if self.fitFiles:
+            #python like output list
+            if not self.counter:
+                name = os.path.splitext(self._rootname)[0]+"_fitfilelist.py"
+                name = self.os_path_join(self._outputdir,name)
+                try:
+                    os.remove(name)
                 except:
-                    print("Error on chisq row %d col %d" %\
-                          (self.__row, self.__col))
-                    print("File = %s\n" % filename)
                     pass
+                self.listfile=open(name,"w+")
+                self.listfile.write("fitfilelist = [")
+                self.listfile.write('\n'+outfile)
+            else: 
+                self.listfile.write(',\n'+outfile)
 
-        else:
-                dict=self.mcafit.roifit(x,y,width=self.roiWidth)
-                #this only works with EDF
-                if self.__ncols is not None:
-                    if not self.counter:
-                        imgdir = self.os_path_join(self._outputdir,"IMAGES")
-                        if not os.path.exists(imgdir):
-                            try:
-                                os.mkdir(imgdir)
-                            except:
-                                print("I could not create directory %s" %\
-                                      imgdir)
-                                return
-                        elif not os.path.isdir(imgdir):
-                            print("%s does not seem to be a valid directory" %\
-                                  imgdir)
-                        self.imgDir = imgdir
-                        self.__ROIpeaks  = []
-                        self._ROIimages = {}
-                        if not self.__stack:
-                            self.__nrows   = len(self._filelist)
-                        for group in dict.keys():
-                            self.__ROIpeaks.append(group)
-                            self._ROIimages[group]={}
-                            for roi in dict[group].keys():
-                                self._ROIimages[group][roi]=numpy.zeros((self.__nrows,
-                                                                   self.__ncols),
-                                                                   numpy.float)
-                                
-                if not hasattr(self, "_ROIimages"):
-                    print("ROI fitting only supported on EDF")
-                for group in self.__ROIpeaks:
-                    for roi in self._ROIimages[group].keys():
+        #IMAGES
+        if self.fitImages:
+            #this only works with EDF
+            if self.__ncols is not None:
+                if not self.counter:
+                    imgdir = self.os_path_join(self._outputdir,"IMAGES")
+                    if not os.path.exists(imgdir):
                         try:
-                            self._ROIimages[group][roi][self.__row, self.__col] = dict[group][roi]
+                            os.mkdir(imgdir)
                         except:
-                            print("error on (row,col) = %d,%d" %\
-                                  (self.__row, self.__col))
-                            print("File = %s" % filename)
-                            pass
+                            print("I could not create directory %s" %\
+                                  imgdir)
+                            return
+                    elif not os.path.isdir(imgdir):
+                        print("%s does not seem to be a valid directory" %\
+                              imgdir)
+                    self.imgDir = imgdir
+                    self.__peaks  = []
+                    self.__images = {}
+                    self.__sigmas = {}
+                    if not self.__stack:
+                        self.__nrows   = len(range(0,len(self._filelist),self.fileStep))
+                    for group in result['groups']:
+                        self.__peaks.append(group)
+                        self.__images[group]= numpy.zeros((self.__nrows,
+                                                           self.__ncols),
+                                                           numpy.float)
+                        self.__sigmas[group]= numpy.zeros((self.__nrows,
+                                                           self.__ncols),
+                                                           numpy.float)
+                    self.__images['chisq']  = numpy.zeros((self.__nrows,
+                                                           self.__ncols),
+                                                           numpy.float) - 1.
+                    if self._concentrations:
+                        layerlist = concentrations['layerlist']
+                        if 'mmolar' in concentrations:
+                            self.__conLabel = " mM"
+                            self.__conKey   = "mmolar"
+                        else:
+                            self.__conLabel = " mass fraction"
+                            self.__conKey   = "mass fraction"
+                        for group in concentrations['groups']:
+                            key = group+self.__conLabel
+                            self.__concentrationsKeys.append(key)
+                            self.__images[key] = numpy.zeros((self.__nrows,
+                                                              self.__ncols),
+                                                              numpy.float)
+                            if len(layerlist) > 1:
+                                for layer in layerlist:
+                                    key = group+" "+layer
+                                    self.__concentrationsKeys.append(key)                                        
+                                    self.__images[key] = numpy.zeros((self.__nrows,
+                                                                self.__ncols),
+                                                                numpy.float)
+                    if self.hdf5Output:
+                        self.__openHDF5Output()
+            for peak in self.__peaks:
+                try:
+                    self.__images[peak][row, col] = result[peak]['fitarea']
+                    self.__sigmas[peak][row, col] = result[peak]['sigmaarea']
+                except:
+                    pass
+            if self._concentrations:
+                layerlist = concentrations['layerlist']
+                for group in concentrations['groups']:
+                    self.__images[group+self.__conLabel][row, col] = \
+                                          concentrations[self.__conKey][group]
+                    if len(layerlist) > 1:
+                        for layer in layerlist:
+                            self.__images[group+" "+layer] [row, col] = \
+                                          concentrations[layer][self.__conKey][group]
+            try:
+                self.__images['chisq'][row, col] = result['chisq']
+            except:
+                print("Error on chisq row %d col %d" %\
+                      (row, col))
+                print("File = %s\n" % filename)
+                pass
+            if self.__hdf5 is not None:
+                # write each row as soon as the next one is started
+                if (self.__hdf5Row is not None) and (row != self.__hdf5Row):
+                    self.__writeHDF5Row(self.__hdf5Row)
+                self.__hdf5Row = row
 
         #update counter
         self.counter += 1
 
-            
+    def __getTrailing(self):
+        if (self.fileStep > 1) or (self.mcaStep > 1):
+            trailing = "_filestep_%02d_mcastep_%02d" % ( self.fileStep,
+                                                         self.mcaStep )
+        else:
+            trailing = ""
+        return trailing
+
+    def __getOutputImages(self):
+        labels = []
+        images = []
+        for peak in self.__peaks:
+            labels.append(peak)
+            images.append(self.__images[peak])
+        for peak in self.__peaks:
+            labels.append("s(%s)" % peak)
+            images.append(self.__sigmas[peak])
+        labels.append('chisq')
+        images.append(self.__images['chisq'])
+        if self._concentrations:
+            for key in self.__concentrationsKeys:
+                labels.append(key)
+                images.append(self.__images[key])
+        return labels, images
+
+    def __openHDF5Output(self):
+        labels, images = self.__getOutputImages()
+        ffile = os.path.splitext(self._rootname)[0] + self.__getTrailing()
+        if self.chunk is None:
+            ffile += ".h5"
+        else:
+            ffile += "_%06d_partial.h5" % self.chunk
+        self.hdf5File = self.os_path_join(self.imgDir, ffile)
+        # one chunk per image row, the rows are written as they are completed
+        shape = (len(labels), self.__nrows, self.__ncols)
+        self.__hdf5, data = ArraySave.getHDF5FileInstanceAndBuffer(\
+                                        self.hdf5File,
+                                        shape,
+                                        buffername="images",
+                                        dtype=numpy.float64,
+                                        interpretation="image",
+                                        compression=self.hdf5Compression,
+                                        chunks=(1, 1, self.__ncols))
+        data.parent['labels'] = [label.encode('utf-8') for label in labels]
+        self.__hdf5Data = data
+        self.__hdf5Images = images
+        self.__hdf5Row = None
+        self.__hdf5Written = numpy.zeros((self.__nrows,), dtype=numpy.bool_)
+
+    def __writeHDF5Row(self, row):
+        self.__hdf5Data[:, row, :] = numpy.array([image[row] \
+                                            for image in self.__hdf5Images])
+        self.__hdf5Written[row] = True
+
+    def __closeHDF5Output(self):
+        try:
+            if self.__hdf5Row is not None:
+                self.__writeHDF5Row(self.__hdf5Row)
+            # the rows without a fitted spectrum still have to be written
+            for row in range(self.__nrows):
+                if not self.__hdf5Written[row]:
+                    self.__writeHDF5Row(row)
+            self.__hdf5.flush()
+        finally:
+            self.__hdf5.close()
+            self.__hdf5 = None
+            self.__hdf5Data = None
+            self.__hdf5Images = None
+
     def saveImage(self,ffile=None):
         self.savedImages=[]
         if ffile is None:
             ffile = os.path.splitext(self._rootname)[0]
             ffile = self.os_path_join(self.imgDir,ffile)
         if not self.roiFit:
-            if (self.fileStep > 1) or (self.mcaStep > 1):
-                trailing = "_filestep_%02d_mcastep_%02d" % ( self.fileStep,
-                                                             self.mcaStep )
-            else:
-                trailing = ""
+            if self.__hdf5 is not None:
+                self.__closeHDF5Output()
+                return
+            trailing = self.__getTrailing()
             #speclabel = "#L row  column"
             speclabel = "row  column"
             if self.chunk is None:
@@ -868,12 +1177,15 @@ class McaAdvancedFitBatch(object):
 if __name__ == "__main__":
     import getopt
     options     = 'f'
-    longoptions = ['cfg=','pkm=','outdir=','roifit=','roi=','roiwidth=']
+    longoptions = ['cfg=','pkm=','outdir=','roifit=','roi=','roiwidth=',
+                   'nworkers=', 'hdf5=']
     filelist = None
     outdir   = None
     cfg      = None
     roifit   = 0
     roiwidth = 250.
+    nworkers = None
+    hdf5output = 0
     opts, args = getopt.getopt(
                     sys.argv[1:],
                     options,
@@ -887,10 +1199,15 @@ if __name__ == "__main__":
             roifit   = int(arg)
         elif opt in ('--roiwidth'):
             roiwidth = float(arg)
+        elif opt in ('--nworkers'):
+            nworkers = int(arg)
+        elif opt in ('--hdf5'):
+            hdf5output = int(arg)
     filelist=args
     if len(filelist) == 0:
         print("No input files, run GUI")
         sys.exit(0)
     
-    b = McaAdvancedFitBatch(cfg,filelist,outdir,roifit,roiwidth)
+    b = McaAdvancedFitBatch(cfg,filelist,outdir,roifit,roiwidth,
+                            nworkers=nworkers, hdf5output=hdf5output)
     b.processList()
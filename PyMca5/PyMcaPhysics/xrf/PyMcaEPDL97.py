@@ -33,6 +33,7 @@ __copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
 __doc__= "Interface to the PyMca EPDL97 description" 
 import os
 import sys
+import zlib
 try:
     from PyMca5.PyMcaIO import specfile
 except ImportError:
@@ -95,15 +96,245 @@ for element in ElementList:
     EPDL97_DICT[element]['EPDL97']  = {}
     EPDL97_DICT[element]['original'] = True
 
-#fill the dictionnary with the binding energies
-def _initializeBindingEnergies():
-    #read the specfile data
-    sf = specfile.Specfile(EADL97_FILE)
+# binary snapshot of the EPDL97 and EADL97 files
+EPDL97_BINARY_FILE = "EPDL97_CrossSections.npz"
+_EPDL97_TABLES = None
+
+def _getFileSignature(fname):
+    """
+    Return the size and the CRC-32 checksum of the contents of a file.
+    """
+    f = open(fname, 'rb')
+    try:
+        checksum = zlib.crc32(f.read()) & 0xffffffff
+    finally:
+        f.close()
+    return [os.path.getsize(fname), checksum]
+
+def _saveBinaryFile(fname, ddict):
+    """
+    Write the arrays of ddict to a .npz file.
+
+    The file is written under a temporary name and then renamed, so that
+    concurrent readers never find a partially written file.
+    """
+    tmpname = fname + ".%d.tmp" % os.getpid()
+    f = open(tmpname, 'wb')
+    try:
+        numpy.savez(f, **ddict)
+    finally:
+        f.close()
+    try:
+        os.rename(tmpname, fname)
+    except OSError:
+        # windows does not allow to rename into an existing file
+        if os.path.exists(fname):
+            os.remove(fname)
+        os.rename(tmpname, fname)
+
+def _loadBinaryFile(name, directories, read, build=None, save=None):
+    """
+    Common lookup of the binary snapshots of the text data files.
+
+    Return the tables obtained with read(fname) from the first file called
+    name found in the given directories or in the user cache directory.
+    read must return None when the file does not match the text files.
+    Otherwise, if build is given, the tables are obtained with build() and
+    stored in the cache directory with save(fname, tables).
+    None is returned when no file is accepted and the tables cannot be
+    cached.
+    """
+    cachedir = PyMcaDataDir.PYMCA_CACHE_DIR
+    candidates = [os.path.join(x, name) for x in directories]
+    candidates.append(os.path.join(cachedir, name))
+    for fname in candidates:
+        if os.path.exists(fname):
+            try:
+                tables = read(fname)
+            except:
+                # corrupted or incompatible file
+                tables = None
+            if tables is not None:
+                return tables
+    if build is None:
+        return None
+    # parsing the text files is only worth it if the result can be kept
+    try:
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+    except OSError:
+        return None
+    if not os.access(cachedir, os.W_OK):
+        return None
+    try:
+        tables = build()
+        save(candidates[-1], tables)
+    except:
+        return None
+    return tables
+
+def _getEPDL97Signature():
+    """
+    Return the size and the checksum of the EPDL97 and EADL97 files.
+    """
+    return [_getFileSignature(EPDL97_FILE), _getFileSignature(EADL97_FILE)]
+
+def _readBindingEnergiesFile(fname):
+    """
+    Return the labels and the data of the EADL97 binding energies file.
+    """
+    sf = specfile.Specfile(fname)
     scan = sf[0]
     labels = scan.alllabels()
     data = scan.data()
     scan = None
     sf = None
+    return labels, data
+
+def _readScanTables(sf, scan_index):
+    """
+    Return a dictionnary with the columns of the given EPDL97 scan
+    translated to the PyMca keys.
+    """
+    scan = sf[scan_index]
+    labels = scan.alllabels()
+    data = scan.data()
+    scan = None
+    ddict = {}
+    i = -1
+    for label0 in labels:
+        i += 1
+        label = label0.lower()
+        #translate the label to the PyMca keys
+        if ('coherent' in label) and ('incoherent' not in label):
+            key = 'coherent'
+        elif ('incoherent' in label) and ('plus' not in label):
+            key = 'compton'
+        elif 'allother' in label:
+            key = 'all other'
+        else:
+            label = label.replace(" ","").split("(")[0]
+            if 'energy' in label:
+                key = 'energy'
+            elif 'photoelectric' in label:
+                key = 'photoelectric'
+            elif 'total' in label:
+                key = 'total'
+            elif label[0].upper() in ['K', 'L', 'M']:
+                #for the time being I do not use the other shells in PyMca
+                key = label.upper()
+            else:
+                continue
+        ddict[key] = data[i, :]
+        ddict[key].shape = -1
+    return ddict
+
+def _readEPDL97BinaryFile(fname, signature):
+    """
+    Read the EPDL97 and EADL97 tables from a .npz file written by
+    _writeEPDL97BinaryFile.
+    Return None if the file was not generated from files with the given
+    signature.
+    """
+    npz = numpy.load(fname)
+    try:
+        if npz['signature'].tolist() != signature:
+            return None
+        keys = npz['keys'].tolist()
+        offsets = npz['offsets']
+        data = npz['data']
+        tables = {}
+        tables['binding_labels'] = npz['binding_labels'].tolist()
+        tables['binding'] = npz['binding']
+    finally:
+        npz.close()
+    tables['scans'] = []
+    for i in range(len(offsets) - 1):
+        tables['scans'].append(dict([(key, data[j, offsets[i]:offsets[i + 1]]) \
+                                      for j, key in enumerate(keys)]))
+    return tables
+
+def _writeEPDL97BinaryFile(fname, tables, signature):
+    """
+    Store all the EPDL97 scans and the EADL97 binding energies in a single
+    .npz file: the columns of all the scans are concatenated and the offsets
+    of each scan are kept.
+    """
+    keys = sorted(tables['scans'][0].keys())
+    offsets = numpy.zeros((len(tables['scans']) + 1,), numpy.int64)
+    for i, scan in enumerate(tables['scans']):
+        if sorted(scan.keys()) != keys:
+            raise ValueError("EPDL97 scans with different columns")
+        offsets[i + 1] = offsets[i] + len(scan['energy'])
+    ddict = {}
+    ddict['signature'] = numpy.array(signature, numpy.int64)
+    ddict['keys'] = numpy.array(keys)
+    ddict['offsets'] = offsets
+    ddict['data'] = numpy.array([numpy.concatenate([scan[key] \
+                                    for scan in tables['scans']]) \
+                                    for key in keys], numpy.float64)
+    ddict['binding_labels'] = numpy.array(tables['binding_labels'])
+    ddict['binding'] = tables['binding']
+    _saveBinaryFile(fname, ddict)
+
+def _buildEPDL97Tables():
+    """
+    Parse the EPDL97 and EADL97 text files.
+    """
+    tables = {}
+    labels, data = _readBindingEnergiesFile(EADL97_FILE)
+    tables['binding_labels'] = labels
+    tables['binding'] = data
+    sf = specfile.Specfile(EPDL97_FILE)
+    tables['scans'] = [_readScanTables(sf, i) \
+                       for i in range(min(sf.scanno(), 100))]
+    sf = None
+    return tables
+
+def _loadEPDL97Tables(build=True):
+    """
+    Return a dictionnary with the binding energies and the cross sections
+    of all the EPDL97 scans, or None if no binary file can be used.
+
+    The binary file is looked for next to the EPDL97 file and in the user
+    cache directory. It is only built from the text files if build is True.
+    """
+    try:
+        signature = _getEPDL97Signature()
+    except (IOError, OSError):
+        return None
+    if build:
+        builder = _buildEPDL97Tables
+    else:
+        builder = None
+    return _loadBinaryFile(EPDL97_BINARY_FILE,
+                [os.path.dirname(EPDL97_FILE)],
+                lambda fname: _readEPDL97BinaryFile(fname, signature),
+                build=builder,
+                save=lambda fname, tables: \
+                        _writeEPDL97BinaryFile(fname, tables, signature))
+
+def _getEPDL97Tables():
+    global _EPDL97_TABLES
+    if _EPDL97_TABLES is None:
+        _EPDL97_TABLES = _loadEPDL97Tables()
+        if _EPDL97_TABLES is None:
+            # do not try again
+            _EPDL97_TABLES = {}
+    return _EPDL97_TABLES
+
+#fill the dictionnary with the binding energies
+def _initializeBindingEnergies():
+    global _EPDL97_TABLES
+    #use the binary file if already there
+    tables = _loadEPDL97Tables(build=False)
+    if tables is None:
+        #read the specfile data
+        labels, data = _readBindingEnergiesFile(EADL97_FILE)
+    else:
+        _EPDL97_TABLES = tables
+        labels = tables['binding_labels']
+        data = tables['binding']
     i = -1
     for element in ElementList:
         if element == 'Md':
@@ -119,6 +350,10 @@ def _initializeBindingEnergies():
 
 _initializeBindingEnergies()
 
+# number of calls to setElementBindingEnergies, allows the users of the
+# cross sections to know when results calculated with them are outdated
+BINDING_ENERGIES_UPDATES = 0
+
 def setElementBindingEnergies(element, ddict):
     """
     Allows replacement of the element internal binding energies by a different
@@ -128,6 +363,8 @@ def setElementBindingEnergies(element, ddict):
     """
     if len(EPDL97_DICT[element]['EPDL97'].keys()) < 2:
         _initializeElement(element)
+    global BINDING_ENERGIES_UPDATES
+    BINDING_ENERGIES_UPDATES += 1
     EPDL97_DICT[element]['original'] = False
     EPDL97_DICT[element]['binding']={}
     if 'binding' in ddict:
@@ -139,60 +376,31 @@ def _initializeElement(element):
     """
     _initializeElement(element)
     Supposed to be of internal use.
-    Reads the file and loads all the relevant element information contained
-    int the EPDL97 file into the internal dictionnary.
+    Loads all the relevant element information contained in the EPDL97
+    file into the internal dictionnary. The binary version of the file is
+    used when available.
     """
-    #read the specfile data
-    sf = specfile.Specfile(EPDL97_FILE)
     scan_index = ElementList.index(element)
     if scan_index > 99:
         #just to avoid a crash
         #I do not expect any fluorescent analysis of these elements ...
         scan_index = 99
-    scan = sf[scan_index]
-    labels = scan.alllabels()
-    data = scan.data()
-    scan = None
+    tables = _getEPDL97Tables()
+    if tables and (scan_index < len(tables['scans'])):
+        #binary file arrays are shared, work on copies
+        ddict = dict([(key, value.copy()) \
+                      for key, value in tables['scans'][scan_index].items()])
+    else:
+        #read the specfile data
+        sf = specfile.Specfile(EPDL97_FILE)
+        ddict = _readScanTables(sf, scan_index)
+        sf = None
 
     #fill the information into the dictionnary
-    i = -1
-    for label0 in labels:
-        i += 1
-        label = label0.lower()
-        #translate the label to the PyMca keys
-        if ('coherent' in label) and ('incoherent' not in label):
-            EPDL97_DICT[element]['EPDL97']['coherent'] = data[i, :]
-            EPDL97_DICT[element]['EPDL97']['coherent'].shape = -1
-            continue
-        if ('incoherent' in label) and ('plus' not in label):
-            EPDL97_DICT[element]['EPDL97']['compton'] = data[i, :]
-            EPDL97_DICT[element]['EPDL97']['compton'].shape = -1
-            continue
-        if 'allother' in label:
-            EPDL97_DICT[element]['EPDL97']['all other'] = data[i, :]
-            EPDL97_DICT[element]['EPDL97']['all other'].shape = -1
-            continue
-        label = label.replace(" ","").split("(")[0]
-        if 'energy' in label:
-            EPDL97_DICT[element]['EPDL97']['energy'] = data[i, :]
-            EPDL97_DICT[element]['EPDL97']['energy'].shape = -1
-            continue
-        if 'photoelectric' in label:
-            EPDL97_DICT[element]['EPDL97']['photo'] = data[i, :]
-            EPDL97_DICT[element]['EPDL97']['photo'].shape = -1
-            #a reference should not be expensive ...
-            EPDL97_DICT[element]['EPDL97']['photoelectric'] =\
-                                EPDL97_DICT[element]['EPDL97']['photo']
-            continue
-        if 'total' in label:
-            EPDL97_DICT[element]['EPDL97']['total'] = data[i, :]
-            EPDL97_DICT[element]['EPDL97']['total'].shape = -1
-            continue
-        if label[0].upper() in ['K', 'L', 'M']:
-            #for the time being I do not use the other shells in PyMca
-            EPDL97_DICT[element]['EPDL97'][label.upper()] = data[i, :]
-            EPDL97_DICT[element]['EPDL97'][label.upper()].shape = -1
-            continue
+    EPDL97_DICT[element]['EPDL97'].update(ddict)
+    if 'photoelectric' in ddict:
+        #a reference should not be expensive ...
+        EPDL97_DICT[element]['EPDL97']['photo'] = ddict['photoelectric']
     EPDL97_DICT[element]['EPDL97']['pair'] = 0.0 *\
                                              EPDL97_DICT[element]['EPDL97']['energy']
     EPDL97_DICT[element]['EPDL97']['photo'] = \
@@ -265,79 +473,83 @@ def getElementCrossSections(element, energy=None, forced_shells=None):
     for key in atomic_shells:
         ddict[key] = 0.0 * energy
 
-    #find interpolation point
-    len_energy = len(energy)
-    for i in range(len_energy):
-        x = energy[i]
-        if x > wdata['energy'][-2]:
-            #take last value or extrapolate?
-            print("Warning: Extrapolating data at the end")
-            j1 = len(wdata['energy']) - 1 
-            j0 = j1 - 1
-        elif x <= wdata['energy'][0]:
-            #take first value or extrapolate?
-            print("Warning: Extrapolating data at the beginning")
-            j1 = 1 
-            j0 = 0
+    #find interpolation points
+    xdata = wdata['energy']
+    n = len(xdata)
+    j0 = numpy.searchsorted(xdata, energy, side='left') - 1
+    end = energy > xdata[-2]
+    beginning = (energy <= xdata[0]) & (~end)
+    if end.any():
+        #take last value or extrapolate?
+        print("Warning: Extrapolating data at the end")
+        j0[end] = n - 2
+    if beginning.any():
+        #take first value or extrapolate?
+        print("Warning: Extrapolating data at the beginning")
+        j0[beginning] = 0
+    j1 = j0 + 1
+    #at a repeated energy (an edge) take the values above the edge
+    shift = (energy == xdata[j1]) & (j1 + 1 < n)
+    shift[shift] = xdata[j1[shift] + 1] == xdata[j1[shift]]
+    j0[shift] = j1[shift]
+    j1[shift] += 1
+    x0 = xdata[j0]
+    x1 = xdata[j1]
+    direct = ((x1 - x0) < 5.E-10) | ((x1 - energy) < 5.E-10)
+    interpolate = ~direct
+
+    def loglog(y0, y1, idx):
+        x = energy[idx]
+        return exp((log(y0) * log(x1[idx]/x) +\
+                    log(y1) * log(x/x0[idx]))/log(x1[idx]/x0[idx]))
+
+    #coherent and incoherent
+    for key in ['coherent', 'compton', 'pair', 'all other']:
+        y0 = wdata[key][j0]
+        y1 = wdata[key][j1]
+        ddict[key][direct] = y1[direct]
+        idx = interpolate & (y0 > 0) & (y1 > 0)
+        ddict[key][idx] = loglog(y0[idx], y1[idx], idx)
+        idx = interpolate & (y0 <= 0) & (y1 > 0) & ((energy - x0) > 1.E-5)
+        if idx.any():
+            x = energy[idx]
+            ddict[key][idx] = exp((log(y1[idx]) * log(x/x0[idx]))/\
+                                  log(x1[idx]/x0[idx]))
+
+    #partial cross sections
+    for key in atomic_shells:
+        y0 = wdata[key][j0]
+        y1 = wdata[key][j1]
+        excited = energy >= binding[key]
+        standard = (y0 > 0.0) & excited
+        idx = standard & direct
+        ddict[key][idx] = y1[idx]
+        idx = standard & interpolate
+        ddict[key][idx] = loglog(y0[idx], y1[idx], idx)
+        if key in forced_shells:
+            idx = ~standard
         else:
-            j0 = numpy.max(numpy.nonzero(wdata['energy'] < x), axis=1)
-            j1 = j0 + 1
-        x0 = wdata['energy'][j0]
-        x1 = wdata['energy'][j1]
-        if x == x1:
-            if (j1 + 1 ) < len(wdata['energy']):
-                if x1 == wdata['energy'][j1 + 1]:
-                    j0 = j1
-                    j1 += 1
-                    x0 = wdata['energy'][j0]
-                    x1 = wdata['energy'][j1]
-
-        #coherent and incoherent
-        for key in ['coherent', 'compton', 'pair', 'all other']:
-            if (j0 == j1) or ((x1 - x0) < 5.E-10) or ((x1 - x) < 5.E-10) :
-                ddict[key][i] =  wdata[key][j1]
-            else:
-                y0 = wdata[key][j0]
-                y1 = wdata[key][j1]
-                if (y0 > 0) and (y1 > 0):
-                    ddict[key][i] = exp((log(y0) * log(x1/x) +\
-                                     log(y1) * log(x/x0))/log(x1/x0))
-                elif (y1 > 0) and ((x-x0) > 1.E-5):
-                    ddict[key][i] = exp((log(y1) * log(x/x0))/log(x1/x0))
-            
-
-        #partial cross sections
-        for key in atomic_shells:
-            y0 = wdata[key][j0]
-            if (y0 > 0.0) and (x >= binding[key]):
-                #standard way
-                y1 = wdata[key][j1]
-                if (((x1 - x0) < 5.E-10) or ((x1 - x) < 5.E-10)):
-                    # no interpolation needed
-                    ddict[key][i] = y1
-                else:
-                    ddict[key][i] = exp((log(y0) * log(x1/x) +\
-                                 log(y1) * log(x/x0))/log(x1/x0))
-            elif (forced_shells == []) and (x < binding[key]):
-                continue
-            elif (key in forced_shells) or (x >= binding[key]):
-                l = numpy.nonzero(wdata[key] > 0.0)
-                if not len(l[0]):
-                    continue
-                j00 = numpy.min(l)
-                j01 = j00 + 1
-                x00 = wdata['energy'][j00]
-                x01 = wdata['energy'][j01]
-                y0 = wdata[key][j00]
-                y1 = wdata[key][j01]
-                ddict[key][i] = exp((log(y0) * log(x01/x) +\
-                                 log(y1) * log(x/x00))/log(x01/x00))
-                                    
-        for key in ['all other'] + atomic_shells:            
-            ddict['photo'][i] += ddict[key][i]
-
-        for key in ['coherent', 'compton', 'photo']:
-            ddict['total'][i] += ddict[key][i]
+            idx = (~standard) & excited
+        if not idx.any():
+            continue
+        l = numpy.nonzero(wdata[key] > 0.0)
+        if not len(l[0]):
+            continue
+        j00 = numpy.min(l)
+        j01 = j00 + 1
+        x00 = xdata[j00]
+        x01 = xdata[j01]
+        y0 = wdata[key][j00]
+        y1 = wdata[key][j01]
+        x = energy[idx]
+        ddict[key][idx] = exp((log(y0) * log(x01/x) +\
+                               log(y1) * log(x/x00))/log(x01/x00))
+
+    for key in ['all other'] + atomic_shells:
+        ddict['photo'] += ddict[key]
+
+    for key in ['coherent', 'compton', 'photo']:
+        ddict['total'] += ddict[key]
     for key in ddict.keys():
         ddict[key] = ddict[key].tolist()
     return ddict        
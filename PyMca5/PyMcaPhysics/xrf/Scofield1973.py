@@ -35,7 +35,6 @@ import os
 from PyMca5.PyMcaIO import ConfigDict
 from PyMca5 import PyMcaDataDir
 
-dict = ConfigDict.ConfigDict()
 dirmod = PyMcaDataDir.PYMCA_DATA_DIR 
 dictfile = os.path.join(dirmod, "Scofield1973.dict")
 if not os.path.exists(dictfile):
@@ -48,6 +47,7 @@ if not os.path.exists(dictfile):
 if not os.path.exists(dictfile):
     print("Cannot find file ", dictfile)
     raise IOError("Cannot find file %s " % dictfile)
-dict.read(dictfile)
+# read on first access
+dict = ConfigDict.LazyConfigDict(dictfile)
 
 
@@ -69,9 +69,13 @@ class ROIStackPlugin(StackPluginBase.StackPluginBase):
         StackPluginBase.StackPluginBase.__init__(self, stackWindow, **kw)
         self.methodDict = {'Show':[self._showWidget,
                                    "Show ROIs",
-                                   PyMca_Icons.brushselect]}
-        self.__methodKeys = ['Show']
+                                   PyMca_Icons.brushselect],
+                           'Show All':[self._showAllWidget,
+                                   "Show the images of all the MCA ROIs",
+                                   None]}
+        self.__methodKeys = ['Show', 'Show All']
         self.roiWindow = None
+        self._showAll = False
 
     def stackUpdated(self):
         if DEBUG:
@@ -80,7 +84,10 @@ class ROIStackPlugin(StackPluginBase.StackPluginBase):
             return
         if self.roiWindow.isHidden():
             return
-        images, names = self.getStackROIImagesAndNames()
+        if self._showAll:
+            images, names = self.getMcaROIImagesAndNames()
+        else:
+            images, names = self.getStackROIImagesAndNames()
         self.roiWindow.setImageList(images, imagenames=names, dynamic=False)
         mask = self.getStackSelectionMask()
         self.roiWindow.setSelectionMask(mask)
@@ -123,7 +130,32 @@ class ROIStackPlugin(StackPluginBase.StackPluginBase):
     def applyMethod(self, name):
         return self.methodDict[name][0]()
 
+    def getMcaROIImagesAndNames(self):
+        """
+        Calculate in a single pass over the stack the images of all the
+        ROIs defined in the MCA window.
+        """
+        roiList = self.getStackMcaROIDictList()
+        imageDictList = self.calculateStackMultipleROIImages(roiList,
+                                                             sumonly=True)
+        images = []
+        names = []
+        for roi, imageDict in zip(roiList, imageDictList):
+            if imageDict is None:
+                continue
+            images.append(imageDict['ROI'])
+            names.append(roi['name'])
+        return images, names
+
+    def _showAllWidget(self):
+        self._showAll = True
+        self.__showWidget()
+
     def _showWidget(self):
+        self._showAll = False
+        self.__showWidget()
+
+    def __showWidget(self):
         if self.roiWindow is None:
             self.roiWindow = StackROIWindow.StackROIWindow(parent=None,
                                                         crop=False,
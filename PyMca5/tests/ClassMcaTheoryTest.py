@@ -0,0 +1,181 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import numpy
+
+class testClassMcaTheory(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaPhysics.xrf import ClassMcaTheory
+            self._module = ClassMcaTheory
+        except:
+            self._module = None
+
+    def getFit(self, escape, hypermet):
+        fit = self._module.McaTheory()
+        config = fit.configure()
+        config['peaks'] = {'Fe': 'K', 'Ca': 'K', 'Pb': ['L', 'M']}
+        config['fit']['energy'] = [20.0]
+        config['fit']['energyweight'] = [1.0]
+        config['fit']['energyflag'] = [1]
+        config['fit']['energyscatter'] = [1]
+        config['fit']['scatterflag'] = 1
+        config['fit']['escapeflag'] = escape
+        config['fit']['hypermetflag'] = hypermet
+        fit.configure(config)
+        x = numpy.arange(1200.)
+        y = 100 + 1000 * numpy.exp(-0.5 * ((x - 370) / 6.) ** 2) + \
+                   500 * numpy.exp(-0.5 * ((x - 600) / 7.) ** 2)
+        fit.setData(x, y, xmin=83, xmax=1130)
+        fit.estimate()
+        return fit
+
+    def getReferencePeaks(self, fit, i, param, hypermet, area):
+        """
+        Build the peaks of group i one by one, as done before all the groups
+        were kept in a single buffer.
+        """
+        PARAMETERS = fit.PARAMETERS
+        gain = param[1]
+        noise = param[2] * param[2]
+        fano = param[3] * 2.3548 * 2.3548 * 0.00385
+        rows = []
+        for rate, energy in fit.PEAKS0[i][:, 0:2]:
+            rows.append([rate * area * gain, energy,
+                         numpy.sqrt(noise + energy * fano)])
+        r = len(rows)
+        if fit.ESCAPE:
+            for ii, escGroup in enumerate(fit.PEAKS0ESCAPE[i]):
+                for escLine in escGroup:
+                    energy = escLine[0] * 1.0
+                    rows.append([rows[ii][0] * escLine[1], energy,
+                                 numpy.sqrt(noise + (energy > 0) * energy * fano)])
+        if hypermet:
+            peaks = numpy.zeros((len(rows), 8), numpy.float64)
+            peaks[:, 0:3] = rows
+            peaks[0:r, 3] = param[PARAMETERS.index('ST AreaR')]
+            peaks[:, 4] = param[PARAMETERS.index('ST SlopeR')]
+            peaks[0:r, 5] = param[PARAMETERS.index('LT AreaR')]
+            peaks[:, 6] = param[PARAMETERS.index('LT SlopeR')]
+            peaks[0:r, 7] = param[PARAMETERS.index('STEP HeightR')]
+        else:
+            peaks = numpy.zeros((len(rows), 4), numpy.float64)
+            peaks[:, 0:3] = rows
+            peaks[:, 3] = param[PARAMETERS.index('Eta Factor')]
+        return peaks
+
+    def evaluate(self, peaks, energy, hypermet, fast=False):
+        SpecfitFuns = self._module.SpecfitFuns
+        if not hypermet:
+            result = SpecfitFuns.apvoigt(peaks, energy)
+        elif fast:
+            result = SpecfitFuns.fastahypermet(peaks, energy, hypermet)
+        else:
+            result = SpecfitFuns.ahypermet(peaks, energy, hypermet)
+        return numpy.ravel(result)
+
+    def assertClose(self, data, reference, msg):
+        self.assertTrue(numpy.allclose(data, reference, rtol=1.0e-10,
+                                       atol=1.0e-10 * abs(reference).max()),
+                        msg)
+
+    def testClassMcaTheoryImport(self):
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful ClassMcaTheory import")
+
+    def testPeakMatrixContribution(self):
+        self.testClassMcaTheoryImport()
+        for escape in [1, 0]:
+            for hypermet in [15, 0]:
+                fit = self.getFit(escape, hypermet)
+                param = numpy.array(fit.parameters)
+                areas = param[fit.NGLOBAL:]
+                energy = param[0] + param[1] * numpy.ravel(fit.xdata)
+                matrix = fit.getPeakMatrixContribution(param)
+                self.assertEqual(matrix.shape, (energy.size, len(fit.PEAKS0)))
+                for i in range(len(fit.PEAKS0)):
+                    if escape:
+                        # unit area
+                        area = 1.0
+                    else:
+                        area = areas[i]
+                    peaks = self.getReferencePeaks(fit, i, param, hypermet,
+                                                   area)
+                    reference = self.evaluate(peaks, energy, hypermet)
+                    self.assertClose(matrix[:, i], reference,
+                        "escape = %d hypermet = %d group %s" % \
+                        (escape, hypermet, fit.PARAMETERS[fit.NGLOBAL + i]))
+
+    def testPackedPeaks(self):
+        self.testClassMcaTheoryImport()
+        for escape in [1, 0]:
+            for hypermet in [15, 0]:
+                fit = self.getFit(escape, hypermet)
+                param = numpy.array(fit.parameters)
+                areas = param[fit.NGLOBAL:]
+                energy = param[0] + param[1] * numpy.ravel(fit.xdata)
+                # the default configuration has no continuum
+                result = numpy.ravel(fit.mcatheory(param, fit.xdata))
+                reference = numpy.zeros(energy.shape, numpy.float64)
+                for i in range(len(fit.PEAKS0)):
+                    peaks = self.getReferencePeaks(fit, i, param, hypermet,
+                                                   areas[i])
+                    # the peaks of each group are a view of the packed ones
+                    self.assertClose(fit.PEAKSW[i], peaks,
+                        "escape = %d hypermet = %d group %s" % \
+                        (escape, hypermet, fit.PARAMETERS[fit.NGLOBAL + i]))
+                    reference += self.evaluate(peaks, energy, hypermet,
+                                               fast=fit.FASTER)
+                self.assertClose(result, reference,
+                        "escape = %d hypermet = %d" % (escape, hypermet))
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testClassMcaTheory))
+    else:
+        # use a predefined order
+        testSuite.addTest(testClassMcaTheory("testClassMcaTheoryImport"))
+        testSuite.addTest(testClassMcaTheory("testPeakMatrixContribution"))
+        testSuite.addTest(testClassMcaTheory("testPackedPeaks"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
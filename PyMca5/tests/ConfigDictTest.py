@@ -111,6 +111,59 @@ class testConfigDict(unittest.TestCase):
                 self.assertTrue( read == original,
                             "Read <%s> instead of <%s>" % (read, original))
 
+    def testLazyConfigDict(self):
+        from PyMca5.PyMcaIO import ConfigDict
+        testDict = {}
+        testDict['section'] = {'float': 1.0, 'list': [1, 2, 3]}
+        tmpFile = tempfile.mkstemp(text=False)
+        os.close(tmpFile[0])
+        self._tmpFileName = tmpFile[1]
+        ConfigDict.ConfigDict(initdict=testDict).write(self._tmpFileName)
+
+        lazyInstance = ConfigDict.LazyConfigDict(self._tmpFileName)
+        # nothing is read before the first access
+        self.assertTrue(lazyInstance._pendingFileList is not None)
+        self.assertTrue(dict.__len__(lazyInstance) == 0)
+        self.assertTrue('section' in lazyInstance)
+        self.assertTrue(lazyInstance._pendingFileList is None)
+        self.assertEqual(lazyInstance['section']['float'], 1.0)
+        self.assertEqual(lazyInstance['section']['list'], [1, 2, 3])
+        self.assertEqual(list(lazyInstance.keys()), ['section'])
+
+        # the methods not going through the dictionary access
+        lazyInstance = ConfigDict.LazyConfigDict(self._tmpFileName)
+        self.assertEqual(lazyInstance.getfiles(),
+                         [[self._tmpFileName, None]])
+        self.assertEqual(lazyInstance.getlastfile(),
+                         [self._tmpFileName, None])
+
+        lazyInstance = ConfigDict.LazyConfigDict(self._tmpFileName)
+        lazyInstance.clear()
+        self.assertEqual(len(lazyInstance), 0)
+        self.assertFalse('section' in lazyInstance)
+        self.assertEqual(lazyInstance.getfiles(), [])
+
+        lazyInstance = ConfigDict.LazyConfigDict(self._tmpFileName)
+        lazyInstance.reset()
+        self.assertEqual(len(lazyInstance), 0)
+        self.assertEqual(lazyInstance.getfiles(), [])
+
+        # files read explicitly come after the pending ones
+        otherDict = {'section': {'float': 2.0}}
+        tmpFile = tempfile.mkstemp(text=False)
+        os.close(tmpFile[0])
+        otherFileName = tmpFile[1]
+        try:
+            ConfigDict.ConfigDict(initdict=otherDict).write(otherFileName)
+            lazyInstance = ConfigDict.LazyConfigDict(self._tmpFileName)
+            lazyInstance.read(otherFileName)
+            self.assertEqual(lazyInstance['section']['float'], 2.0)
+            self.assertEqual(lazyInstance['section']['list'], [1, 2, 3])
+            self.assertEqual([x[0] for x in lazyInstance.getfiles()],
+                             [self._tmpFileName, otherFileName])
+        finally:
+            os.remove(otherFileName)
+
 def getSuite(auto=True):
     testSuite = unittest.TestSuite()
     if auto:
@@ -120,6 +173,7 @@ def getSuite(auto=True):
         # use a predefined order
         testSuite.addTest(testConfigDict("testConfigDictImport"))
         testSuite.addTest(testConfigDict("testConfigDictIO"))
+        testSuite.addTest(testConfigDict("testLazyConfigDict"))
     return testSuite
 
 def test(auto=False):
@@ -116,6 +116,53 @@ class testEdfFile(unittest.TestCase):
         edf =None
         gc.collect()
 
+    def testEdfFileMemoryMap(self):
+        self.assertTrue(self.fileClass is not None)
+        data = numpy.arange(24000).astype(numpy.float64)
+        data.shape = 20, 30, 40
+        edf = self.fileClass(self.fname, 'wb+')
+        edf.WriteImage({'Title': "native"}, data)
+        edf.WriteImage({'Title': "swapped"}, data.astype(numpy.int32),
+                       Append=1, ByteOrder="HighByteFirst")
+        edf = None
+
+        edf = self.fileClass(self.fname, 'rb', memmap=True)
+        readData = edf.GetData(0)
+        self.assertTrue(isinstance(readData, numpy.memmap))
+        self.assertTrue(numpy.array_equal(readData, data))
+        readData = edf.GetData(1)
+        self.assertTrue(isinstance(readData, numpy.memmap))
+        self.assertTrue(numpy.array_equal(readData, data))
+        region = edf.GetData(1, Pos=(5, 3, 2), Size=(10, 0, 4))
+        self.assertTrue(numpy.array_equal(region, data[2:6, 3:, 5:15]))
+        region = edf.GetData(0, DataType="SignedInteger",
+                             Pos=(5, 3, 2), Size=(10, 0, 4))
+        self.assertEqual(region.dtype, numpy.int32)
+        self.assertTrue(numpy.array_equal(region, data[2:6, 3:, 5:15]))
+        readData = None
+        region = None
+        edf = None
+
+        # region reads without memmap give ordinary native arrays
+        edf = self.fileClass(self.fname, 'rb')
+        region = edf.GetData(1, Pos=(5, 3, 2), Size=(10, 0, 4))
+        self.assertFalse(isinstance(region, numpy.memmap))
+        self.assertTrue(region.dtype.isnative)
+        self.assertTrue(numpy.array_equal(region, data[2:6, 3:, 5:15]))
+        edf = None
+
+        # a mapped stack in the byte order of another platform
+        from PyMca5.PyMcaIO import EDFStack
+        edf = self.fileClass(self.fname, 'wb+')
+        edf.WriteImage({'Title': "swapped"}, data.astype(numpy.int32),
+                       ByteOrder="HighByteFirst")
+        edf = None
+        stack = EDFStack.EDFStack(self.fname)
+        self.assertTrue(stack.data.dtype.isnative)
+        self.assertTrue(numpy.array_equal(stack.data, data))
+        stack = None
+        gc.collect()
+
 def getSuite(auto=True):
     testSuite = unittest.TestSuite()
     if auto:
@@ -125,6 +172,7 @@ def getSuite(auto=True):
         # use a predefined order
         testSuite.addTest(testEdfFile("testEdfFileImport"))
         testSuite.addTest(testEdfFile("testEdfFileReadWrite"))
+        testSuite.addTest(testEdfFile("testEdfFileMemoryMap"))
     return testSuite
 
 def test(auto=False):
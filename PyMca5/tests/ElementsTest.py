@@ -238,6 +238,171 @@ class testElements(unittest.TestCase):
                     self.assertTrue((100.0 * abs(yTest-yRef)/yRef) < 0.01)
                 energyIndex += 1
 
+    def testMassAttenuationCache(self):
+        if DEBUG:
+            print()
+            print("Testing Mass Attenuation Coefficients Cache")
+        energyList = [1.5, 3.33, 10., 20.4, 30.6, 90.33]
+        reference = self._elements.getmassattcoef('Ca1C1O3', energyList)
+        # modifying the output must not affect subsequent calls
+        reference['total'][0] = 0.0
+        data = self._elements.getmassattcoef('Ca1C1O3', energyList)
+        self.assertTrue(data['total'][0] > 0.0)
+        # a single energy gives the same value as an energy list
+        for i in range(len(energyList)):
+            single = self._elements.getmassattcoef('Ca1C1O3', energyList[i])
+            for key in ['coherent', 'compton', 'photo', 'pair', 'total']:
+                self.assertEqual(len(single[key]), 1)
+                self.assertAlmostEqual(single[key][0], data[key][i])
+        # the cache is bounded
+        for i in range(self._elements.MASS_ATTENUATION_CACHE_SIZE + 10):
+            self._elements.getmassattcoef('Fe', 1.0 + 0.1 * i)
+        self.assertTrue(len(self._elements._MASS_ATTENUATION_CACHE) <= \
+                        self._elements.MASS_ATTENUATION_CACHE_SIZE)
+        # and it is discarded when the element data are updated
+        self._elements.updateDict()
+        self.assertEqual(len(self._elements._MASS_ATTENUATION_CACHE), 0)
+        # the low energy values follow the EPDL97 binding energies
+        epdl = self._elements.PyMcaEPDL97
+        binding = self._elements.Element['Fe']['binding']
+        reference = self._elements.getmassattcoef('Fe', 0.75)['photo'][0]
+        newBinding = dict(binding)
+        newBinding['L3'] = 0.8
+        try:
+            epdl.setElementBindingEnergies('Fe', newBinding)
+            data = self._elements.getmassattcoef('Fe', 0.75)['photo'][0]
+        finally:
+            epdl.setElementBindingEnergies('Fe', binding)
+        self.assertTrue(data < reference)
+        self.assertEqual(self._elements.getmassattcoef('Fe', 0.75)['photo'][0],
+                         reference)
+        # energies below the XCOM tables are not silently extrapolated
+        xcom = self._elements.getelementmassattcoef('Fe', None)
+        if xcom['energy'][0] > 1.0:
+            self.assertRaises(ValueError,
+                              self._elements._getElementCrossSectionsArrays,
+                              'Fe', [0.5 * (1.0 + xcom['energy'][0])])
+
+    def testLazyElementUpdate(self):
+        if DEBUG:
+            print()
+            print("Testing Lazy Element Update")
+        elements = self._elements
+        try:
+            elements.updateDict(energy=10.0)
+            # the x-ray lines are computed on access
+            self.assertTrue(dict.__getitem__(elements.Element, 'Pb') is None or
+                            'Pb' in elements.Element._pending)
+            ddict = elements.Element['Pb']
+            self.assertEqual(ddict['buildparameters']['energy'], 10.0)
+            self.assertTrue(elements.Element['Pb'] is ddict)
+            reference = {}
+            elements._updateElementDict('Pb', reference, energy=10.0)
+            for key in reference:
+                self.assertEqual(repr(ddict[key]), repr(reference[key]))
+            # the copies do not bypass the update
+            import copy
+            import pickle
+            def update(x):
+                ddict = {}
+                ddict.update(x)
+                return ddict
+            for ele, method in [('Fe', dict),
+                                ('Cu', lambda x: dict(**x)),
+                                ('Zn', update),
+                                ('Ca', copy.copy),
+                                ('Ni', copy.deepcopy),
+                                ('Ti', lambda x: pickle.loads(pickle.dumps(x))),
+                                ('Cr', lambda x: x.copy()),
+                                ('Mn', lambda x: dict(x.items()))]:
+                self.assertTrue(ele in elements.Element._pending)
+                result = method(elements.Element)
+                self.assertEqual(sorted(result.keys()),
+                                 sorted(elements.Element.keys()))
+                self.assertEqual(result[ele]['buildparameters']['energy'],
+                                 10.0)
+                self.assertTrue(ele not in elements.Element._pending)
+                elements.updateDict(energy=10.0)
+            self.assertTrue(None not in elements.Element.values())
+            self.assertEqual(elements.Element, elements.Element.copy())
+        finally:
+            elements.updateDict()
+        self.assertTrue(elements.Element['Pb']['buildparameters']['energy'] \
+                        is None)
+
+    def testXcomBinaryCache(self):
+        if DEBUG:
+            print()
+            print("Testing XCOM Binary Cache")
+        import tempfile
+        import shutil
+        elements = self._elements
+        xcomdir = elements._getXcomDirectory()
+        names = elements._getXcomSignature(xcomdir)[0]
+        names = [name for name in names if name in ["H.mat", "Fe.mat", "Pb.mat"]]
+        getFileSignature = elements.PyMcaEPDL97._getFileSignature
+        signature = [getFileSignature(os.path.join(xcomdir, name)) \
+                     for name in names]
+        tables = {}
+        for name in names:
+            tables[name[:-4]] = elements._readXcomFile(os.path.join(xcomdir,
+                                                                    name))
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, elements.XCOM_BINARY_FILE)
+            elements._writeXcomBinaryFile(fname, tables, names, signature)
+            data = elements._readXcomBinaryFile(fname, names, signature)
+            # a file generated from different .mat files is not used
+            # even if they have the same size
+            signature[0][1] += 1
+            self.assertTrue(elements._readXcomBinaryFile(fname, names,
+                                                         signature) is None)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(sorted(data.keys()), sorted(tables.keys()))
+        for ele in tables:
+            for key in elements.XCOM_TABLE_KEYS:
+                self.assertTrue(numpy.array_equal(data[ele][key],
+                                                  tables[ele][key]))
+
+    def testEPDL97BinaryCache(self):
+        if DEBUG:
+            print()
+            print("Testing EPDL97 Binary Cache")
+        import tempfile
+        import shutil
+        from PyMca5.PyMcaIO import specfile
+        epdl = self._elements.PyMcaEPDL97
+        signature = epdl._getEPDL97Signature()
+        tables = {}
+        labels, data = epdl._readBindingEnergiesFile(epdl.EADL97_FILE)
+        tables['binding_labels'] = labels
+        tables['binding'] = data
+        sf = specfile.Specfile(epdl.EPDL97_FILE)
+        tables['scans'] = [epdl._readScanTables(sf, i) for i in [0, 25, 81]]
+        sf = None
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, epdl.EPDL97_BINARY_FILE)
+            epdl._writeEPDL97BinaryFile(fname, tables, signature)
+            read = epdl._readEPDL97BinaryFile(fname, signature)
+            # a file generated from different files is not used
+            # even if they have the same size
+            signature[0][1] += 1
+            self.assertTrue(epdl._readEPDL97BinaryFile(fname,
+                                                       signature) is None)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(read['binding_labels'], list(labels))
+        self.assertTrue(numpy.array_equal(read['binding'], data))
+        self.assertEqual(len(read['scans']), 3)
+        for i in range(3):
+            self.assertEqual(sorted(read['scans'][i].keys()),
+                             sorted(tables['scans'][i].keys()))
+            for key in tables['scans'][i]:
+                self.assertTrue(numpy.array_equal(read['scans'][i][key],
+                                                  tables['scans'][i][key]))
+
     def testMaterialCrossSectionsCalculation(self):
         if DEBUG:
             print()
@@ -306,6 +471,10 @@ def getSuite(auto=True):
         testSuite.addTest(testElements("testElementCrossSectionsReadout"))
         testSuite.addTest(testElements("testElementCrossSectionsCalculation"))
         testSuite.addTest(testElements("testMaterialCrossSectionsCalculation"))
+        testSuite.addTest(testElements("testMassAttenuationCache"))
+        testSuite.addTest(testElements("testXcomBinaryCache"))
+        testSuite.addTest(testElements("testLazyElementUpdate"))
+        testSuite.addTest(testElements("testEPDL97BinaryCache"))
     return testSuite
 
 def test(auto=False):
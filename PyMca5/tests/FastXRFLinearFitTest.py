@@ -0,0 +1,134 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import gc
+import shutil
+import tempfile
+import numpy
+try:
+    import h5py
+    HAS_H5PY = True
+except ImportError:
+    HAS_H5PY = False
+
+class testFastXRFLinearFit(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module and create a small stack of spectra
+        """
+        try:
+            from PyMca5.PyMcaPhysics.xrf import FastXRFLinearFit
+            self._module = FastXRFLinearFit
+        except:
+            self._module = None
+        self._tmpDir = tempfile.mkdtemp()
+        if self._module is None:
+            return
+        from PyMca5.PyMcaPhysics.xrf import ClassMcaTheory
+        fit = ClassMcaTheory.McaTheory()
+        config = fit.configure()
+        config['peaks'] = {'Fe': 'K', 'Ca': 'K'}
+        config['fit']['energy'] = [20.0]
+        config['fit']['energyweight'] = [1.0]
+        config['fit']['energyflag'] = [1]
+        config['fit']['energyscatter'] = [1]
+        config['fit']['scatterflag'] = 0
+        config['fit']['stripflag'] = 1
+        config['fit']['stripalgorithm'] = 1
+        self._config = config
+        # Fe Ka at channel 370, Ca Ka at channel 210
+        numpy.random.seed(10)
+        x = numpy.arange(1200.)
+        fe = numpy.exp(-0.5 * ((x - 370) / 6.) ** 2)
+        ca = numpy.exp(-0.5 * ((x - 210) / 5.) ** 2)
+        areas = numpy.random.randint(100, 1000, (6, 5, 2))
+        data = 10 + areas[:, :, 0:1] * fe + areas[:, :, 1:2] * ca
+        self._data = numpy.random.poisson(data).astype(numpy.float64)
+        self._x = x
+
+    def tearDown(self):
+        gc.collect()
+        shutil.rmtree(self._tmpDir)
+
+    def testFastXRFLinearFitImport(self):
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful FastXRFLinearFit import")
+
+    def testFitInWorkers(self):
+        self.testFastXRFLinearFitImport()
+        stacks = [self._data]
+        if HAS_H5PY:
+            fileName = os.path.join(self._tmpDir, "stack.h5")
+            h5 = h5py.File(fileName, "w")
+            h5["/data"] = self._data
+            h5.close()
+            h5 = h5py.File(fileName, "r")
+            stacks.append(h5["/data"])
+        try:
+            for stack in stacks:
+                results = []
+                for nworkers in [1, 2]:
+                    fastFit = self._module.FastXRFLinearFit()
+                    results.append(fastFit.fitMultipleSpectra(x=self._x,
+                                          y=stack,
+                                          configuration=self._config,
+                                          nworkers=nworkers))
+                self.assertEqual(results[0]['names'], results[1]['names'])
+                for key in ['parameters', 'uncertainties']:
+                    self.assertEqual(results[0][key].shape,
+                                     (len(results[0]['names']), 6, 5))
+                    self.assertTrue(numpy.allclose(results[0][key],
+                                                   results[1][key]),
+                                    "Different %s using 2 workers" % key)
+        finally:
+            stacks = None
+            if HAS_H5PY:
+                h5.close()
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testFastXRFLinearFit))
+    else:
+        # use a predefined order
+        testSuite.addTest(testFastXRFLinearFit("testFastXRFLinearFitImport"))
+        testSuite.addTest(testFastXRFLinearFit("testFitInWorkers"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
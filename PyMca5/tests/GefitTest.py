@@ -70,6 +70,42 @@ class testGefit(unittest.TestCase):
         for i in range(len(originalParameters)):
             self.assertTrue(abs(fittedpar[i] - originalParameters[i]) < 0.01)
 
+    def testGefitConstrainedLeastSquares(self):
+        self.testGefitImport()
+        x = numpy.arange(500.)
+        originalParameters = numpy.array([10.5, 2, 1000.0, 200., 100],
+                                         numpy.float)
+        fitFunction = self.gaussianPlusLinearBackground
+        y = fitFunction(originalParameters, x)
+
+        startingParameters = [5.0 ,1.0,900.0, 180., 100.]
+        constraints = [[self.gefit.CPOSITIVE, self.gefit.CFREE,
+                        self.gefit.CFREE, self.gefit.CQUOTED,
+                        self.gefit.CFIXED],
+                       [0, 0, 0, 150., 0],
+                       [0, 0, 0, 250., 0]]
+        fittedpar, chisq, sigmapar =self.gefit.LeastSquaresFit(fitFunction,
+                                                     startingParameters,
+                                                     constrains=constraints,
+                                                     xdata=x,
+                                                     ydata=y,
+                                                     sigmadata=None)
+        for i in range(len(originalParameters)):
+            self.assertTrue(abs(fittedpar[i] - originalParameters[i]) < 0.01)
+        # a parameter defined as a factor of another one follows it
+        constraints[0][4] = self.gefit.CFACTOR
+        constraints[1][4] = 3
+        constraints[2][4] = 0.5
+        fittedpar, chisq, sigmapar =self.gefit.LeastSquaresFit(fitFunction,
+                                                     startingParameters,
+                                                     constrains=constraints,
+                                                     xdata=x,
+                                                     ydata=y,
+                                                     sigmadata=None)
+        for i in range(len(originalParameters)):
+            self.assertTrue(abs(fittedpar[i] - originalParameters[i]) < 0.01)
+        self.assertAlmostEqual(sigmapar[4], 0.5 * sigmapar[3])
+
 def getSuite(auto=True):
     testSuite = unittest.TestSuite()
     if auto:
@@ -79,6 +115,7 @@ def getSuite(auto=True):
         # use a predefined order
         testSuite.addTest(testGefit("testGefitImport"))
         testSuite.addTest(testGefit("testGefitLeastSquares"))
+        testSuite.addTest(testGefit("testGefitConstrainedLeastSquares"))
     return testSuite
 
 def test(auto=False):
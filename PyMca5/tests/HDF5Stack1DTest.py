@@ -0,0 +1,121 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import gc
+import shutil
+import tempfile
+import numpy
+try:
+    import h5py
+    HAS_H5PY = True
+except ImportError:
+    HAS_H5PY = False
+
+class testHDF5Stack1D(unittest.TestCase):
+    def setUp(self):
+        self._tmpDir = tempfile.mkdtemp()
+        self._fileList = []
+        numpy.random.seed(10)
+        spectra = []
+        for i in range(3):
+            y = numpy.random.randint(0, 100, (4, 5, 16)).astype(numpy.int32)
+            monitor = numpy.random.randint(1, 10, (4, 5)).astype(numpy.float64)
+            fileName = os.path.join(self._tmpDir, "stack_%02d.h5" % i)
+            h5 = h5py.File(fileName, "w")
+            h5["/entry/data"] = y
+            h5["/entry/monitor"] = monitor
+            h5.close()
+            self._fileList.append(fileName)
+            spectra.append(y / monitor[:, :, numpy.newaxis])
+        self._expected = numpy.array(spectra).reshape(3, 20, 16)
+
+    def tearDown(self):
+        gc.collect()
+        shutil.rmtree(self._tmpDir)
+
+    def testHDF5Stack1DImport(self):
+        from PyMca5.PyMcaIO import HDF5Stack1D
+
+    def testHDF5Stack1DLoading(self):
+        from PyMca5.PyMcaIO import HDF5Stack1D
+        selection = {'x': None, 'y': '/data', 'm': '/monitor'}
+        for kw in [{}, {'nworkers': 2}, {'virtual': True}]:
+            stack = HDF5Stack1D.HDF5Stack1D(self._fileList, selection, **kw)
+            self.assertEqual(stack.info["McaIndex"], 2)
+            self.assertEqual(stack.data.shape, self._expected.shape)
+            self.assertTrue(numpy.allclose(stack.data[:], self._expected),
+                            "Wrong data using %s" % kw)
+            if kw.get('virtual', False):
+                self.assertTrue(isinstance(stack.data,
+                                           HDF5Stack1D.HDF5VirtualStack))
+                self.assertTrue(numpy.allclose(stack.data[1, 3:17:2, 5],
+                                               self._expected[1, 3:17:2, 5]))
+                self.assertTrue(numpy.allclose(stack.data[:, [2, 9]],
+                                               self._expected[:, [2, 9]]))
+                # the virtual stack keeps using the files
+                self.assertEqual(self._getFileUsers(), [1] * len(self._fileList))
+            else:
+                self.assertEqual(self._getFileUsers(), [0] * len(self._fileList))
+            stack = None
+            gc.collect()
+            self.assertEqual(self._getFileUsers(), [0] * len(self._fileList))
+
+    def _getFileUsers(self):
+        # the number of users of the pooled handles of the files
+        from PyMca5.PyMcaCore import NexusDataSource
+        pool = NexusDataSource.getFilePool()
+        users = []
+        for name in self._fileList:
+            item = pool._itemDict.get(os.path.abspath(name), None)
+            users.append(0 if item is None else item['users'])
+        return users
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if not HAS_H5PY:
+        print("HDF5Stack1DTest skipped: h5py not available")
+    elif auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testHDF5Stack1D))
+    else:
+        # use a predefined order
+        testSuite.addTest(testHDF5Stack1D("testHDF5Stack1DImport"))
+        testSuite.addTest(testHDF5Stack1D("testHDF5Stack1DLoading"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
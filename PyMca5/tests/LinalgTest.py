@@ -0,0 +1,110 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2014 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V.A. Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import numpy
+
+class testLinalg(unittest.TestCase):
+    def setUp(self):
+        # straight line data from linalg.test2
+        data = [0, 0.8214, 0.1, 1, 2.8471, 0.3, 2, 4.852, 0.5,
+                3, 7.5347, 0.7, 4, 10.2464, 0.9, 5, 10.2707, 1.1,
+                6, 12.8011, 1.3, 7, 13.7108, 1.5, 8, 17.8501, 1.7,
+                9, 15.3667, 1.9, 10, 19.3933, 2.1]
+        self.data = numpy.array(data, numpy.float)
+        self.data.shape = -1, 3
+        self.model = numpy.ones((self.data.shape[0], 2), numpy.float)
+        self.model[:, 1] = self.data[:, 0]
+
+    def testLinalgImport(self):
+        from PyMca5.PyMcaMath import linalg
+
+    def testLstsqSolverUnweighted(self):
+        from PyMca5.PyMcaMath import linalg
+        y = numpy.outer(self.data[:, 1], numpy.arange(1., 11.))
+        solver = linalg.LstsqSolver(self.model)
+        parameters, uncertainties = solver.solve(y, uncertainties=True)
+        expectedParameters, expectedUncertainties = \
+                    linalg.lstsq(self.model, y, weight=False)
+        self.assertTrue(numpy.allclose(parameters, expectedParameters),
+                        "Incorrect unweighted parameters")
+        self.assertTrue(numpy.allclose(uncertainties, expectedUncertainties),
+                        "Incorrect unweighted uncertainties")
+        # Mathematica results
+        self.assertTrue(abs(parameters[0, 0] - 1.57043) < 1.0e-5)
+        self.assertTrue(abs(parameters[1, 0] - 1.78945) < 1.0e-5)
+
+        # one dimensional data
+        parameters = solver.solve(self.data[:, 1])[0]
+        self.assertEqual(parameters.shape, (2,))
+        self.assertTrue(numpy.allclose(parameters, expectedParameters[:, 0]))
+
+    def testLstsqSolverWeighted(self):
+        from PyMca5.PyMcaMath import linalg
+        y = numpy.outer(self.data[:, 1], numpy.ones((5,)))
+        solver = linalg.LstsqSolver(self.model, sigma_b=self.data[:, 2])
+        ddict = solver.solve(y, uncertainties=True, digested_output=True)
+        # Gefit results
+        for i in range(y.shape[1]):
+            self.assertTrue(abs(ddict['parameters'][0, i] - 0.843827) < 1.0e-5)
+            self.assertTrue(abs(ddict['parameters'][1, i] - 1.979823) < 1.0e-5)
+            self.assertTrue(\
+                abs(ddict['uncertainties'][0, i] - 0.095732) < 1.0e-5)
+            self.assertTrue(\
+                abs(ddict['uncertainties'][1, i] - 0.075205) < 1.0e-5)
+
+        # same uncertainties for all the data go through the fastest path
+        expectedParameters, expectedUncertainties = \
+                    linalg.lstsq(self.model, y, sigma_b=self.data[:, 2],
+                                 weight=True)
+        self.assertTrue(numpy.allclose(ddict['parameters'],
+                                       expectedParameters))
+        self.assertTrue(numpy.allclose(ddict['uncertainties'],
+                                       expectedUncertainties))
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testLinalg))
+    else:
+        # use a predefined order
+        testSuite.addTest(testLinalg("testLinalgImport"))
+        testSuite.addTest(testLinalg("testLstsqSolverUnweighted"))
+        testSuite.addTest(testLinalg("testLstsqSolverWeighted"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
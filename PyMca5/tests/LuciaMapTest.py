@@ -0,0 +1,111 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import gc
+import tempfile
+import numpy
+
+class testLuciaMap(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaIO import LuciaMap
+            self._module = LuciaMap
+        except:
+            self._module = None
+        fd, self._fileName = tempfile.mkstemp(suffix=".mca")
+        os.close(fd)
+        numpy.random.seed(10)
+        self._spectra = numpy.random.randint(-20, 1000,
+                                    (12, 16)).astype(numpy.float32) / 4.
+
+    def tearDown(self):
+        gc.collect()
+        if os.path.exists(self._fileName):
+            os.remove(self._fileName)
+
+    def writeMap(self, labels=False):
+        lines = ["#\tDate: 2014\n", "#\tLucia map\n", "\n"]
+        for k, spectrum in enumerate(self._spectra):
+            if labels:
+                lines.append("Point %d\n" % k)
+            for i in range(0, len(spectrum), 4):
+                lines.append(" ".join(["%g" % value \
+                                       for value in spectrum[i:i + 4]]) + "\n")
+            lines.append("-----------\n")
+        f = open(self._fileName, "w")
+        f.write("".join(lines))
+        f.close()
+
+    def testLuciaMapImport(self):
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful LuciaMap import")
+
+    def testLuciaMapRead(self):
+        self.testLuciaMapImport()
+        for labels in [False, True]:
+            self.writeMap(labels=labels)
+            stack = self._module.LuciaMap(self._fileName)
+            expected = self._spectra
+            if labels:
+                # all the numbers of the block belong to the spectrum
+                index = numpy.arange(len(expected), dtype=numpy.float32)
+                expected = numpy.hstack((index[:, numpy.newaxis], expected))
+            expected = expected.reshape(expected.shape[0], 1, -1)
+            self.assertEqual(stack.header, "#\tDate: 2014\n#\tLucia map")
+            self.assertEqual(stack.data.shape, expected.shape)
+            self.assertEqual(stack.data.dtype, numpy.float32)
+            self.assertTrue(numpy.array_equal(stack.data, expected),
+                            "Wrong map data using labels = %s" % labels)
+            self.assertEqual(stack.info["Dim_1"], expected.shape[0])
+            stack = None
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testLuciaMap))
+    else:
+        # use a predefined order
+        testSuite.addTest(testLuciaMap("testLuciaMapImport"))
+        testSuite.addTest(testLuciaMap("testLuciaMapRead"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
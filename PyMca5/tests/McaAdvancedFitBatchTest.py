@@ -0,0 +1,264 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import gc
+import shutil
+import tempfile
+import numpy
+try:
+    import h5py
+    HAS_H5PY = True
+except ImportError:
+    HAS_H5PY = False
+
+class testMcaAdvancedFitBatch(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module and create a small set of EDF files
+        """
+        try:
+            from PyMca5.PyMcaPhysics.xrf import McaAdvancedFitBatch
+            self._module = McaAdvancedFitBatch
+        except:
+            self._module = None
+        self._tmpDir = tempfile.mkdtemp()
+        self._fileList = []
+        self._configFile = None
+        if self._module is None:
+            return
+        from PyMca5.PyMcaIO import EdfFile
+        from PyMca5.PyMcaPhysics.xrf import ClassMcaTheory
+        fit = ClassMcaTheory.McaTheory()
+        config = fit.configure()
+        config['peaks'] = {'Fe': 'K', 'Ca': 'K'}
+        config['fit']['energy'] = [20.0]
+        config['fit']['energyweight'] = [1.0]
+        config['fit']['energyflag'] = [1]
+        config['fit']['energyscatter'] = [1]
+        config['fit']['scatterflag'] = 0
+        config['fit']['stripflag'] = 0
+        self._configFile = os.path.join(self._tmpDir, "fit.cfg")
+        config.write(self._configFile)
+        # Fe Ka at channel 370, Ca Ka at channel 210
+        numpy.random.seed(10)
+        x = numpy.arange(1200.)
+        fe = numpy.exp(-0.5 * ((x - 370) / 6.) ** 2)
+        ca = numpy.exp(-0.5 * ((x - 210) / 5.) ** 2)
+        for i in range(2):
+            areas = numpy.random.randint(100, 1000, (4, 2))
+            data = 10 + areas[:, 0:1] * fe + areas[:, 1:2] * ca
+            data = numpy.random.poisson(data).astype(numpy.float64)
+            fileName = os.path.join(self._tmpDir, "data_%02d.edf" % i)
+            edf = EdfFile.EdfFile(fileName, access='wb')
+            edf.WriteImage({}, data)
+            edf = None
+            self._fileList.append(fileName)
+
+    def tearDown(self):
+        gc.collect()
+        shutil.rmtree(self._tmpDir)
+
+    def getOutputImages(self, outputDir):
+        from PyMca5.PyMcaIO import EdfFile
+        images = {}
+        imgDir = os.path.join(outputDir, "IMAGES")
+        for name in os.listdir(imgDir):
+            if name.endswith(".edf"):
+                edf = EdfFile.EdfFile(os.path.join(imgDir, name), access='rb')
+                images[name] = edf.GetData(0)
+                edf = None
+        return images
+
+    def getHDF5OutputImages(self, fileName):
+        datasets = []
+        def visit(name, item):
+            if isinstance(item, h5py.Dataset) and \
+               (name.split("/")[-1] == "images"):
+                datasets.append(item)
+        h5 = h5py.File(fileName, "r")
+        try:
+            h5.visititems(visit)
+            self.assertEqual(len(datasets), 1)
+            images = datasets[0][()]
+            labels = datasets[0].parent['labels'][()]
+        finally:
+            h5.close()
+        labels = [label.decode('utf-8') for label in labels]
+        return dict(zip(labels, images))
+
+    def testMcaAdvancedFitBatchImport(self):
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful McaAdvancedFitBatch import")
+
+    def testFitInWorkers(self):
+        self.testMcaAdvancedFitBatchImport()
+        results = []
+        for nworkers in [1, 2]:
+            outputDir = os.path.join(self._tmpDir, "output_%d" % nworkers)
+            os.mkdir(outputDir)
+            batch = self._module.McaAdvancedFitBatch(self._configFile,
+                                                     filelist=self._fileList,
+                                                     outputdir=outputDir,
+                                                     fitfiles=0,
+                                                     nworkers=nworkers)
+            batch.processList()
+            self.assertTrue(batch._pool is None,
+                            "Pool not released using %d workers" % nworkers)
+            results.append(self.getOutputImages(outputDir))
+        self.assertTrue(len(results[0]) > 0, "No output images")
+        self.assertEqual(sorted(results[0].keys()), sorted(results[1].keys()))
+        for key in results[0]:
+            self.assertEqual(results[0][key].shape, (2, 4))
+            self.assertTrue(numpy.allclose(results[0][key], results[1][key]),
+                            "Different %s using 2 workers" % key)
+
+    def testHDF5Output(self):
+        self.testMcaAdvancedFitBatchImport()
+        if not HAS_H5PY:
+            print("skipping HDF5 output test, h5py not installed")
+            return
+        outputDir = os.path.join(self._tmpDir, "edf")
+        os.mkdir(outputDir)
+        batch = self._module.McaAdvancedFitBatch(self._configFile,
+                                                 filelist=self._fileList,
+                                                 outputdir=outputDir,
+                                                 fitfiles=0)
+        batch.processList()
+        edfImages = self.getOutputImages(outputDir)
+        outputDir = os.path.join(self._tmpDir, "hdf5")
+        os.mkdir(outputDir)
+        batch = self._module.McaAdvancedFitBatch(self._configFile,
+                                                 filelist=self._fileList,
+                                                 outputdir=outputDir,
+                                                 fitfiles=0,
+                                                 hdf5output=1)
+        batch.processList()
+        self.assertTrue(batch.hdf5File is not None, "No HDF5 output file")
+        images = self.getHDF5OutputImages(batch.hdf5File)
+        self.assertTrue("chisq" in images)
+        for label in images:
+            self.assertEqual(images[label].shape, (2, 4))
+            if label.startswith("s("):
+                # the uncertainties are not saved as EDF
+                continue
+            edfName = [name for name in edfImages \
+                       if name.endswith("_%s.edf" % label.replace(" ", "_"))]
+            self.assertEqual(len(edfName), 1, "No EDF image for %s" % label)
+            self.assertTrue(numpy.allclose(images[label],
+                                           edfImages[edfName[0]]),
+                            "Different %s in the HDF5 output" % label)
+
+        # the output file has to be closed when the batch is interrupted
+        class FailingBatch(self._module.McaAdvancedFitBatch):
+            def onMca(self, mca, nmca, filename=None, key=None, info=None):
+                if self.counter > 2:
+                    raise RuntimeError("Batch interrupted")
+        outputDir = os.path.join(self._tmpDir, "failed")
+        os.mkdir(outputDir)
+        batch = FailingBatch(self._configFile,
+                             filelist=self._fileList,
+                             outputdir=outputDir,
+                             fitfiles=0,
+                             hdf5output=1)
+        self.assertRaises(RuntimeError, batch.processList)
+        self.assertTrue(batch.hdf5File is not None, "No HDF5 output file")
+        # it can only be opened for writing if nobody else keeps it open
+        h5 = h5py.File(batch.hdf5File, "a")
+        h5.close()
+        images = self.getHDF5OutputImages(batch.hdf5File)
+        chisq = [edfImages[name] for name in edfImages \
+                 if name.endswith("_chisq.edf")][0]
+        self.assertTrue(numpy.allclose(images["chisq"][0, :3], chisq[0, :3]),
+                        "Fitted spectra not saved")
+
+    def testROIFit(self):
+        self.testMcaAdvancedFitBatchImport()
+        from PyMca5.PyMcaIO import EdfFile
+        from PyMca5.PyMcaPhysics.xrf import ClassMcaTheory
+        outputDir = os.path.join(self._tmpDir, "roi")
+        os.mkdir(outputDir)
+        batch = self._module.McaAdvancedFitBatch(self._configFile,
+                                                 filelist=self._fileList,
+                                                 outputdir=outputDir,
+                                                 roifit=1,
+                                                 roiwidth=100.)
+        batch.processList()
+        self.assertEqual(batch.counter, 8)
+        images = {}
+        for fileName in batch.savedImages:
+            edf = EdfFile.EdfFile(fileName, access='rb')
+            for i in range(edf.GetNumImages()):
+                images[edf.GetHeader(i)['Title']] = edf.GetData(i)
+            edf = None
+        self.assertTrue(len(images) > 0, "No ROI images")
+        # the ROIs of each spectrum as calculated by McaTheory
+        fit = ClassMcaTheory.McaTheory(self._configFile)
+        fit.enableOptimizedLinearFit()
+        nImages = 0
+        for row, fileName in enumerate(self._fileList):
+            edf = EdfFile.EdfFile(fileName, access='rb')
+            data = edf.GetData(0)
+            edf = None
+            x = numpy.arange(data.shape[-1]) * 1.0
+            for col, y in enumerate(data):
+                result = fit.roifit(x, y, width=100.)
+                for group in result:
+                    for roi in result[group]:
+                        image = images[group + " " + roi]
+                        self.assertEqual(image.shape, (2, 4))
+                        self.assertTrue(abs(image[row, col] - \
+                                            result[group][roi]) < 1.0e-6,
+                                        "Wrong %s %s at (%d, %d)" % \
+                                        (group, roi, row, col))
+                        nImages += 1
+        self.assertEqual(nImages, 8 * len(images))
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testMcaAdvancedFitBatch))
+    else:
+        # use a predefined order
+        testSuite.addTest(testMcaAdvancedFitBatch("testMcaAdvancedFitBatchImport"))
+        testSuite.addTest(testMcaAdvancedFitBatch("testFitInWorkers"))
+        testSuite.addTest(testMcaAdvancedFitBatch("testHDF5Output"))
+        testSuite.addTest(testMcaAdvancedFitBatch("testROIFit"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
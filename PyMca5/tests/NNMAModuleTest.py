@@ -0,0 +1,111 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import numpy
+
+class testNNMAModule(unittest.TestCase):
+    def testNNMAModuleImport(self):
+        from PyMca5.PyMcaMath.mva import NNMAModule
+
+    def testNNMAModuleMiniBatch(self):
+        from PyMca5.PyMcaMath.mva import NNMAModule
+        # a map of 40 x 50 pixels with three gaussian components
+        numpy.random.seed(100)
+        nChannels = 60
+        channels = numpy.arange(nChannels)
+        spectra = numpy.zeros((3, nChannels), numpy.float64)
+        for i, position in enumerate([10, 30, 45]):
+            spectra[i] = 100. * numpy.exp(-0.5 * ((channels - position) / 3.) ** 2)
+        weights = numpy.random.random((40 * 50, 3))
+        data = numpy.dot(weights, spectra) + numpy.random.random((40 * 50, nChannels))
+        data.shape = 40, 50, nChannels
+
+        A, X, obj, count, converged, intensity = \
+                NNMAModule.miniBatchNNMA(data, 3, eps=1.0e-3, maxcount=200,
+                                         batchsize=300, blocksize=100000)
+        self.assertTrue(converged)
+        self.assertTrue(count < 200)
+        self.assertTrue(numpy.allclose(intensity, data.sum()))
+        self.assertTrue(A.min() >= 0)
+        self.assertTrue(X.min() >= 0)
+
+        # the data are properly reconstructed
+        residual = data.reshape(-1, nChannels) - numpy.dot(A, X)
+        error = (residual * residual).sum() / (data * data).sum()
+        self.assertTrue(error < 1.0e-3)
+
+        # and the components found
+        positions = sorted([numpy.argmax(x) for x in X])
+        self.assertEqual(positions, [10, 30, 45])
+
+        # through the common interface
+        images, values, vectors = NNMAModule.nnma(data, 3,
+                                                  function='MiniBatch',
+                                                  eps=1.0e-3, maxcount=200)
+        self.assertTrue(images.shape == (3, 40, 50))
+        self.assertTrue(vectors.shape == (3, nChannels))
+
+        if NNMAModule.MDP:
+            # the k-means labels of a 3D stack as an additional image
+            images, values, vectors = NNMAModule.nnma(data, 3,
+                                                      function='MiniBatch',
+                                                      eps=1.0e-3,
+                                                      maxcount=200,
+                                                      kmeans=True)
+            self.assertTrue(images.shape == (4, 40, 50))
+            labels = images[-1]
+            self.assertTrue(labels.min() >= 0)
+            self.assertTrue(labels.max() < 3)
+            # pixels dominated by one component get its label
+            for i in range(3):
+                dominant = weights[:, i].reshape(40, 50) > 0.9
+                dominant &= (weights.sum(axis=1) - weights[:, i]).reshape(40, 50) < 0.2
+                if dominant.sum() > 1:
+                    self.assertEqual(len(numpy.unique(labels[dominant])), 1)
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testNNMAModule))
+    else:
+        # use a predefined order
+        testSuite.addTest(testNNMAModule("testNNMAModuleImport"))
+        testSuite.addTest(testNNMAModule("testNNMAModuleMiniBatch"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
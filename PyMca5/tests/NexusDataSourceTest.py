@@ -0,0 +1,169 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import gc
+import shutil
+import tempfile
+import numpy
+try:
+    import h5py
+    HAS_H5PY = True
+except ImportError:
+    HAS_H5PY = False
+
+class testNexusDataSource(unittest.TestCase):
+    def setUp(self):
+        self._tmpDir = tempfile.mkdtemp()
+        self._fileName = os.path.join(self._tmpDir, "scans.h5")
+        self._appendEntries([3, 1, 2])
+
+    def tearDown(self):
+        gc.collect()
+        shutil.rmtree(self._tmpDir)
+
+    def _appendEntries(self, numbers):
+        h5 = h5py.File(self._fileName, "a")
+        for i in numbers:
+            h5["/entry%d/start_time" % i] = "2015-01-%02d" % i
+            h5["/entry%d/data" % i] = numpy.arange(10.) * i
+        h5.close()
+
+    def testNexusDataSourceImport(self):
+        from PyMca5.PyMcaCore import NexusDataSource
+
+    def testNexusDataSourceFilePool(self):
+        from PyMca5.PyMcaCore import NexusDataSource
+        pool = NexusDataSource.HDF5FilePool(maxfiles=2)
+        source = NexusDataSource.NexusDataSource(self._fileName, pool=pool)
+        h5 = source._sourceObjectList[0]
+        self.assertTrue(pool.isPooled(h5))
+        self.assertEqual(source.getSourceInfo()["KeyList"],
+                         ["1.1", "1.2", "1.3"])
+        self.assertEqual(pool.getSortedEntryNames(h5),
+                         ["entry1", "entry2", "entry3"])
+        self.assertEqual(pool.getEntryIndex(h5, "entry2"), 1)
+
+        # the handle is shared and kept while the file is not modified
+        other = NexusDataSource.NexusDataSource(self._fileName, pool=pool)
+        self.assertTrue(other._sourceObjectList[0] is h5)
+        source.refresh()
+        self.assertTrue(source._sourceObjectList[0] is h5)
+        self.assertFalse(source.isUpdated(self._fileName, "1.1"))
+
+        # a growing file
+        source.close()
+        other.close()
+        source = None
+        other = None
+        h5 = None
+        gc.collect()
+        self._appendEntries([0])
+        source = NexusDataSource.NexusDataSource(self._fileName, pool=pool)
+        h5 = source._sourceObjectList[0]
+        self.assertEqual(source.getSourceInfo()["KeyList"],
+                         ["1.1", "1.2", "1.3", "1.4"])
+        self.assertEqual(pool.getSortedEntryNames(h5),
+                         ["entry0", "entry1", "entry2", "entry3"])
+        source.close()
+        h5 = None
+
+    def testNexusDataSourceModifiedSharedFile(self):
+        from PyMca5.PyMcaCore import NexusDataSource
+        pool = NexusDataSource.HDF5FilePool(maxfiles=1)
+        source = NexusDataSource.NexusDataSource(self._fileName, pool=pool)
+        other = NexusDataSource.NexusDataSource(self._fileName, pool=pool)
+        h5 = other._sourceObjectList[0]
+        self.assertTrue(source._sourceObjectList[0] is h5)
+        self.assertFalse(hasattr(h5, "_sourceName"))
+        dataset = h5["/entry2/data"]
+
+        # replace the file while it is in use
+        newName = os.path.join(self._tmpDir, "new.h5")
+        shutil.copy(self._fileName, newName)
+        h5new = h5py.File(newName, "a")
+        h5new["/entry4/start_time"] = "2015-01-04"
+        h5new["/entry4/data"] = numpy.arange(10.) * 4
+        h5new.close()
+        os.rename(newName, self._fileName)
+        source.refresh()
+        self.assertFalse(source._sourceObjectList[0] is h5)
+        self.assertEqual(source.getSourceInfo()["KeyList"],
+                         ["1.1", "1.2", "1.3", "1.4"])
+
+        # the other source keeps working with the previous handle
+        self.assertTrue(pool.isPooled(h5))
+        self.assertEqual(other.getSourceInfo()["KeyList"],
+                         ["1.1", "1.2", "1.3"])
+        self.assertTrue(numpy.allclose(dataset[()], numpy.arange(10.) * 2))
+
+        # a file dropped from a full pool is also kept while in use
+        otherName = os.path.join(self._tmpDir, "other.h5")
+        shutil.copy(self._fileName, otherName)
+        third = NexusDataSource.NexusDataSource(otherName, pool=pool)
+        self.assertTrue(pool.isPooled(source._sourceObjectList[0]))
+        self.assertEqual(source.getSourceInfo()["KeyList"],
+                         ["1.1", "1.2", "1.3", "1.4"])
+        third.close()
+        source.close()
+
+        # the handle is closed on the last release
+        other.close()
+        self.assertFalse(pool.isPooled(h5))
+        self.assertFalse(bool(h5.id.valid))
+        other = None
+        source = None
+        third = None
+        dataset = None
+        h5 = None
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if not HAS_H5PY:
+        print("NexusDataSourceTest skipped: h5py not available")
+    elif auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testNexusDataSource))
+    else:
+        # use a predefined order
+        testSuite.addTest(testNexusDataSource("testNexusDataSourceImport"))
+        testSuite.addTest(testNexusDataSource("testNexusDataSourceFilePool"))
+        testSuite.addTest(\
+            testNexusDataSource("testNexusDataSourceModifiedSharedFile"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,132 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import gc
+import struct
+import tempfile
+import numpy
+
+class testOmnicMap(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module and write a small map
+        """
+        try:
+            from PyMca5.PyMcaIO import OmnicMap
+            self._module = OmnicMap
+        except:
+            self._module = None
+        fd, self._fileName = tempfile.mkstemp(suffix=".map")
+        os.close(fd)
+        self.nChannels = 50
+        self.nX = 4
+        self.nY = 3
+        numpy.random.seed(10)
+        spectra = numpy.random.random((self.nY * self.nX,
+                                       self.nChannels)).astype(numpy.float32)
+        spectra[3, 7] = numpy.nan
+        spectra[10, 0] = numpy.inf
+        self._spectra = spectra
+        # the header with the acquisition information
+        header = numpy.zeros((1000,), numpy.uint8)
+        infoBlockIndex = 100
+        header[372:376] = numpy.frombuffer(\
+                            struct.pack("I", 204 + 4 * infoBlockIndex),
+                            numpy.uint8)
+        offset = infoBlockIndex * 4
+        header[offset:offset + 4] = numpy.frombuffer(\
+                            struct.pack("I", self.nChannels), numpy.uint8)
+        offset = (infoBlockIndex + 3) * 4
+        header[offset:offset + 8] = numpy.frombuffer(\
+                            struct.pack("2f", 1049.0, 1000.0), numpy.uint8)
+        header[610:634] = numpy.frombuffer(\
+                            struct.pack("6f", 0.0, 2.0, 1.0, 0.0, 3.0, 1.0),
+                            numpy.uint8)
+        header[700:708] = numpy.frombuffer(b"Position", numpy.uint8)
+        header[766:774] = numpy.frombuffer(b"Position", numpy.uint8)
+        content = [header.tobytes()]
+        for k in range(self.nX * self.nY):
+            text = "Spectrum %d of %d, X = %f, Y = %f" % \
+                   (k + 1, self.nX * self.nY, k % self.nX, k // self.nX)
+            text = text.encode("utf-8")
+            content.append(b"\1" * 16 + text + b" " * (84 - len(text)) + \
+                           spectra[k].tobytes())
+        f = open(self._fileName, "wb")
+        f.write(b"".join(content))
+        f.close()
+
+    def tearDown(self):
+        gc.collect()
+        if os.path.exists(self._fileName):
+            os.remove(self._fileName)
+
+    def testOmnicMapImport(self):
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful OmnicMap import")
+
+    def testOmnicMapRead(self):
+        self.testOmnicMapImport()
+        stack = self._module.OmnicMap(self._fileName)
+        expected = self._spectra.copy()
+        expected[~numpy.isfinite(expected)] = 0.0
+        expected.shape = self.nY, self.nX, self.nChannels
+        self.assertEqual(stack.data.shape, expected.shape)
+        self.assertEqual(stack.data.dtype, numpy.float32)
+        self.assertTrue(numpy.array_equal(stack.data, expected),
+                        "Wrong map data")
+        self.assertEqual(stack.info["McaCalib"], [1000.0, 1.0, 0.0])
+        info = stack.getOmnicInfo()
+        self.assertEqual(info["Number of points"], self.nChannels)
+        self.assertEqual(info["Number of spectra"], self.nX * self.nY)
+        self.assertEqual(info["Last map location"], [3.0, 2.0])
+        stack = None
+        # the file is not kept open
+        os.remove(self._fileName)
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testOmnicMap))
+    else:
+        # use a predefined order
+        testSuite.addTest(testOmnicMap("testOmnicMapImport"))
+        testSuite.addTest(testOmnicMap("testOmnicMapRead"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
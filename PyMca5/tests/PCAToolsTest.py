@@ -90,6 +90,63 @@ class testPCATools(unittest.TestCase):
             self.assertTrue(numpy.allclose(numpyAvg, pymcaAvg))
             self.assertTrue(nData == nSpectra)
 
+        # blocked accumulation using several threads and a spatial mask
+        numpy.random.seed(100)
+        x = numpy.random.random((12, 17, 30)) * 10.
+        mask = numpy.random.random((12, 17)) > 0.3
+        numpyCov = numpy.cov(x[mask].T)
+        for dtype in [numpy.float64, numpy.float32]:
+            pymcaCov, pymcaAvg, nData = getCovarianceMatrix(x,
+                                                            force=True,
+                                                            center=True,
+                                                            spatial_mask=mask,
+                                                            dtype=dtype,
+                                                            blocksize=3000,
+                                                            nthreads=3)
+            self.assertTrue(numpy.allclose(numpyCov, pymcaCov, atol=1.0e-4))
+            self.assertTrue(numpy.allclose(x[mask].mean(axis=0), pymcaAvg))
+            self.assertTrue(nData == mask.sum())
+
+        # the same stack of images read by blocks of complete images
+        class ImageStack(object):
+            def __init__(self, data):
+                self.data = data
+                self.shape = data.shape
+                self.dtype = data.dtype
+                self.nImagesRead = 0
+
+            def __getitem__(self, item):
+                result = self.data[item]
+                self.nImagesRead += result.shape[0]
+                return result
+
+        stack = ImageStack(numpy.transpose(x, (2, 0, 1)).copy())
+        weights = numpy.random.random(30)
+        numpyCov = numpy.cov((x[mask] * weights)[:, ::2].T)
+        for blocksize in [None, 10000]:
+            stack.nImagesRead = 0
+            pymcaCov, pymcaAvg, nData = getCovarianceMatrix(stack,
+                                                            index=0,
+                                                            binning=2,
+                                                            force=True,
+                                                            center=True,
+                                                            spatial_mask=mask,
+                                                            weights=weights,
+                                                            blocksize=blocksize)
+            self.assertTrue(numpy.allclose(numpyCov, pymcaCov))
+            self.assertTrue(numpy.allclose(\
+                                (x[mask] * weights)[:, ::2].mean(axis=0),
+                                pymcaAvg))
+            self.assertTrue(nData == mask.sum())
+            # the first image is also read once to check the data access
+            if blocksize is None:
+                # all the images fit in one block
+                self.assertEqual(stack.nImagesRead, 1 + 15)
+            else:
+                # 15 images in 5 blocks of 3 images
+                self.assertEqual(stack.nImagesRead,
+                                 1 + 3 * (5 + 4 + 3 + 2 + 1))
+
     def testPCAToolsPCA(self):
         from PyMca5.PyMcaMath.mva.PCATools import numpyPCA
         x = numpy.array([[0.0,  2.0,  3.0],
@@ -131,6 +188,59 @@ class testPCATools(unittest.TestCase):
             self.assertTrue(numpy.allclose(eigenvalues, numpyEigenvalues))
             self.assertTrue(numpy.allclose(eigenvectors, numpyEigenvectors))
 
+    def testPCAToolsRandomizedPCA(self):
+        from PyMca5.PyMcaMath.mva.PCATools import numpyPCA
+        from PyMca5.PyMcaMath.mva.PCAModule import randomizedPCA
+        # a map of 30 x 40 pixels with 3 components of 50 channels
+        numpy.random.seed(100)
+        spectra = numpy.random.random((3, 50)) * 100.
+        weights = numpy.random.random((30 * 40, 3)) * [10., 5., 2.]
+        x = numpy.dot(weights, spectra) + numpy.random.random((30 * 40, 50))
+        x.shape = 30, 40, 50
+        images0, eigenvalues0, eigenvectors0 = numpyPCA(x.copy(),
+                                                        ncomponents=3,
+                                                        force=False)
+
+        # a stack of images read through an object counting the reads
+        class ImageStack(object):
+            def __init__(self, data):
+                self.data = data
+                self.shape = data.shape
+                self.dtype = data.dtype
+                self.nImagesRead = 0
+
+            def __getitem__(self, item):
+                result = self.data[item]
+                self.nImagesRead += result.shape[0]
+                return result
+
+        stack = ImageStack(numpy.transpose(x, (2, 0, 1)).copy())
+
+        # read the data by small blocks with both accumulation types
+        for dtype, data, index in [(numpy.float64, x, -1),
+                                   (numpy.float32, x, -1),
+                                   (numpy.float64, stack, 0)]:
+            images, eigenvalues, eigenvectors = randomizedPCA(data,
+                                                        ncomponents=3,
+                                                        dtype=dtype,
+                                                        index=index,
+                                                        blocksize=20000)
+            self.assertTrue(images.shape == (3, 30, 40))
+            self.assertTrue(numpy.allclose(eigenvalues, eigenvalues0,
+                                           rtol=1.0e-3))
+            for i in range(3):
+                # the eigenvectors can be multiplied by -1
+                sign = numpy.sign(numpy.dot(eigenvectors[i],
+                                            eigenvectors0[i]))
+                self.assertTrue(numpy.allclose(sign * eigenvectors[i],
+                                               eigenvectors0[i],
+                                               atol=1.0e-3))
+                self.assertTrue(numpy.allclose(sign * images[i],
+                                               images0[i],
+                                               rtol=1.0e-3, atol=1.0e-2))
+        # two passes per iteration plus the projection
+        self.assertEqual(stack.nImagesRead, (2 * (2 + 1) + 1) * 50)
+
     if MDP:
         def testPCAToolsMDP(self):
             from PyMca5.PyMcaMath.mva.PCATools import getCovarianceMatrix, numpyPCA
@@ -176,6 +286,7 @@ def getSuite(auto=True):
         testSuite.addTest(testPCATools("testPCAToolsImport"))
         testSuite.addTest(testPCATools("testPCAToolsCovariance"))
         testSuite.addTest(testPCATools("testPCAToolsPCA"))
+        testSuite.addTest(testPCATools("testPCAToolsRandomizedPCA"))
         if MDP:
             testSuite.addTest(testPCATools("testPCAToolsMDP"))
     return testSuite
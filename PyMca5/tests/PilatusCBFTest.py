@@ -0,0 +1,121 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import numpy
+
+def encodeByteOffset(data):
+    """
+    Reference CBF byte-offset encoder of a one dimensional integer array
+    """
+    output = []
+    previous = 0
+    for value in data:
+        delta = int(value) - previous
+        previous = int(value)
+        if -127 <= delta <= 127:
+            output.append(numpy.array([delta], numpy.int8).tobytes())
+            continue
+        output.append(numpy.array([-128], numpy.int8).tobytes())
+        if -32767 <= delta <= 32767:
+            output.append(numpy.array([delta], '<i2').tobytes())
+            continue
+        output.append(numpy.array([-32768], '<i2').tobytes())
+        if -2147483647 <= delta <= 2147483647:
+            output.append(numpy.array([delta], '<i4').tobytes())
+            continue
+        output.append(numpy.array([-2147483648], '<i4').tobytes())
+        output.append(numpy.array([delta], '<i8').tobytes())
+    return b"".join(output)
+
+class testPilatusCBF(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaIO import PyMcaIOHelper
+            self._module = PyMcaIOHelper
+        except:
+            self._module = None
+
+    def testPyMcaIOHelperImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful PyMca5.PyMcaIO.PyMcaIOHelper import")
+
+    def testDecodeByteOffset(self):
+        # values requiring 8, 16, 32 and 64 bit differences
+        data = numpy.array([0, 1, -5, 127, -1, 300, -32000, 40000,
+                            2000000000, -2000000000, 7, 2000000000,
+                            -3, 0], numpy.int64)
+        stream = encodeByteOffset(data)
+        decoded = self._module.decodeByteOffset(stream, data.size)
+        self.assertEqual(decoded.dtype, numpy.int32)
+        self.assertTrue(numpy.alltrue(decoded == data.astype(numpy.int32)),
+                        "Wrongly decoded byte offset stream")
+
+        # random data
+        numpy.random.seed(100)
+        data = numpy.random.randint(-70000, 70000, 5000).astype(numpy.int64)
+        data[::7] = 0
+        stream = encodeByteOffset(data)
+        decoded = self._module.decodeByteOffset(stream, data.size)
+        self.assertTrue(numpy.alltrue(decoded == data),
+                        "Wrongly decoded random byte offset stream")
+
+        # trailing bytes are ignored, missing ones are an error
+        decoded = self._module.decodeByteOffset(stream, data.size - 10)
+        self.assertTrue(numpy.alltrue(decoded == data[:-10]))
+        self.assertRaises(self._module.Error,
+                          self._module.decodeByteOffset,
+                          stream, data.size + 1)
+        self.assertRaises(self._module.Error,
+                          self._module.decodeByteOffset,
+                          stream[:-1], data.size)
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testPilatusCBF))
+    else:
+        # use a predefined order
+        testSuite.addTest(testPilatusCBF("testPyMcaIOHelperImport"))
+        testSuite.addTest(testPilatusCBF("testDecodeByteOffset"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,134 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import numpy
+
+class testSpecfitFuns(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaMath.fitting import SpecfitFuns
+            self.specfit = SpecfitFuns
+        except:
+            self.specfit = None
+
+    def getPeaks(self, npars):
+        # 12 peaks distributed among 4 groups, the last group is empty
+        numpy.random.seed(100)
+        npeaks = 12
+        peaks = numpy.zeros((npeaks, npars), numpy.float64)
+        peaks[:, 0] = 100. * numpy.random.random(npeaks)
+        peaks[:, 1] = 1.0 + 15.0 * numpy.random.random(npeaks)
+        peaks[:, 2] = 0.1 + 0.1 * numpy.random.random(npeaks)
+        if npars == 8:
+            peaks[:, 3] = 0.05
+            peaks[:, 4] = 0.5
+            peaks[:, 5] = 0.02
+            peaks[:, 6] = 5.0
+            peaks[:, 7] = 0.001
+            # neglect tails as done for escape peaks
+            peaks[::3, 3] = 0.0
+            peaks[::3, 5] = 0.0
+            peaks[::3, 7] = 0.0
+        else:
+            peaks[:, 3] = numpy.random.random(npeaks)
+        groups = numpy.array([0, 2, 1, 0, 0, 2, 1, 1, 0, 2, 0, 1], numpy.int32)
+        return peaks, groups, 4
+
+    def testSpecfitFunsImport(self):
+        self.assertTrue(self.specfit is not None,
+                        "Unsuccessful SpecfitFuns import")
+
+    def testAhypermetMatrix(self):
+        self.testSpecfitFunsImport()
+        peaks, groups, ngroups = self.getPeaks(8)
+        energy = numpy.linspace(0.5, 18.0, 2000)
+        for hypermet in [1, 3, 15]:
+            for fast in [0, 1]:
+                matrix = self.specfit.ahypermetmatrix(peaks, energy, groups,
+                                                      ngroups, hypermet, fast)
+                self.assertEqual(matrix.shape, (energy.size, ngroups))
+                for i in range(ngroups):
+                    groupPeaks = peaks[groups == i]
+                    if not len(groupPeaks):
+                        self.assertTrue(numpy.all(matrix[:, i] == 0.0))
+                        continue
+                    if fast:
+                        reference = self.specfit.fastahypermet(groupPeaks,
+                                                               energy,
+                                                               hypermet)
+                    else:
+                        reference = self.specfit.ahypermet(groupPeaks,
+                                                           energy,
+                                                           hypermet)
+                    reference = numpy.ravel(reference)
+                    self.assertTrue(numpy.allclose(matrix[:, i], reference,
+                                    rtol=1.0e-12, atol=1.0e-12 * reference.max()),
+                                    "hypermet = %d fast = %d group = %d" % \
+                                    (hypermet, fast, i))
+
+    def testApvoigtMatrix(self):
+        self.testSpecfitFunsImport()
+        peaks, groups, ngroups = self.getPeaks(4)
+        energy = numpy.linspace(0.5, 18.0, 2000)
+        matrix = self.specfit.apvoigtmatrix(peaks, energy, groups, ngroups)
+        self.assertEqual(matrix.shape, (energy.size, ngroups))
+        for i in range(ngroups):
+            groupPeaks = peaks[groups == i]
+            if not len(groupPeaks):
+                self.assertTrue(numpy.all(matrix[:, i] == 0.0))
+                continue
+            reference = numpy.ravel(self.specfit.apvoigt(groupPeaks, energy))
+            self.assertTrue(numpy.allclose(matrix[:, i], reference,
+                                    rtol=1.0e-12, atol=1.0e-12 * reference.max()),
+                            "group = %d" % i)
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testSpecfitFuns))
+    else:
+        # use a predefined order
+        testSuite.addTest(testSpecfitFuns("testSpecfitFunsImport"))
+        testSuite.addTest(testSpecfitFuns("testAhypermetMatrix"))
+        testSuite.addTest(testSpecfitFuns("testApvoigtMatrix"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
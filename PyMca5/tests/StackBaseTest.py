@@ -117,6 +117,17 @@ class testStackBase(unittest.TestCase):
                 self.assertTrue(numpy.allclose(mcaDataObject.y[0], maskedMca),
                                         "Incorrect %smca from mask calculation" % dynamic)
 
+                # modify the mask as a brush stroke would do
+                mask2 = mask.copy()
+                mask2[25:35, 40:45] = 1
+                mask2[20:22, 15:20] = 0
+                for newMask in [mask2, 1 - mask2, mask]:
+                    stackBase.setSelectionMask(newMask)
+                    mcaDataObject = stackBase.calculateMcaDataObject()
+                    self.assertTrue(numpy.allclose(mcaDataObject.y[0],
+                                    referenceData[newMask>0, :].sum(axis=0)),
+                            "Incorrect %smca from mask update" % dynamic)
+
                 #get image from roi
                 i0 = 100
                 imiddle = 200
@@ -131,6 +142,26 @@ class testStackBase(unittest.TestCase):
                         "Incorrect Right image from %sROI calculation"  % dynamic)
                 self.assertTrue(numpy.allclose(imageDict['Middle'], data[:,:,imiddle]),
                         "Incorrect Middle image from %sROI calculation" % dynamic)
+                if dynamic:
+                    # the extremes are given as energies in both cases
+                    for key in ['Maximum', 'Minimum', 'Background']:
+                        self.assertTrue(numpy.allclose(imageDict[key],
+                                                       referenceDict[key]),
+                            "Incorrect %s image from %sROI calculation" % \
+                            (key, dynamic))
+                else:
+                    referenceDict = imageDict
+
+                # several ROIs in one go
+                roiList = [(i0, i1), (10, 20), (i1, i0 + 1)]
+                imageDictList = stackBase.calculateMultipleROIImages(roiList)
+                for roi, imageDict in zip(roiList, imageDictList):
+                    j0, j1 = min(roi), max(roi)
+                    self.assertTrue(numpy.allclose(imageDict['ROI'],
+                                            data[:,:,j0:j1].sum(axis=-1)),
+                        "Incorrect ROI image from %smultiple ROI calculation" % dynamic)
+                    self.assertTrue(numpy.allclose(imageDict['Left'], data[:,:,j0]),
+                        "Incorrect Left image from %smultiple ROI calculation" % dynamic)
         stackBase = None
         data = None
         dummyArray = None
@@ -195,6 +226,25 @@ class testStackBase(unittest.TestCase):
                         "Incorrect Right image from %sROI calculation"  % dynamic)
                 self.assertTrue(numpy.allclose(imageDict['Middle'], data[imiddle,:,:]),
                         "Incorrect Middle image from %sROI calculation" % dynamic)
+                if dynamic:
+                    # the extremes are given as energies in both cases
+                    for key in ['Maximum', 'Minimum', 'Background']:
+                        self.assertTrue(numpy.allclose(imageDict[key],
+                                                       referenceDict[key]),
+                            "Incorrect %s image from %sROI calculation" % \
+                            (key, dynamic))
+                else:
+                    referenceDict = imageDict
+
+                # several ROIs in one go
+                roiList = [(i0, i1), (10, 20), (i1, i0 + 1)]
+                imageDictList = stackBase.calculateMultipleROIImages(roiList,
+                                                                sumonly=True)
+                for roi, imageDict in zip(roiList, imageDictList):
+                    j0, j1 = min(roi), max(roi)
+                    self.assertTrue(numpy.allclose(imageDict['ROI'],
+                                            data[j0:j1,:,:].sum(axis=0)),
+                        "Incorrect ROI image from %smultiple ROI calculation" % dynamic)
         stackBase = None
         data = None
         dummyArray = None
@@ -0,0 +1,168 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import gc
+import tempfile
+import numpy
+try:
+    import h5py
+    HAS_H5PY = True
+except ImportError:
+    HAS_H5PY = False
+
+class testStackROIImages(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaCore import StackROIImages
+            self._module = StackROIImages
+        except:
+            self._module = None
+        # integer values to have repeated extremes
+        numpy.random.seed(10)
+        self._data = numpy.random.randint(0, 5, (12, 9, 40)).astype(numpy.float32)
+        self._rois = [(3, 17, 5), (0, 40), (16, 17), (30, 39, 31)]
+        self._fileName = None
+
+    def tearDown(self):
+        gc.collect()
+        if self._fileName is not None:
+            if os.path.exists(self._fileName):
+                os.remove(self._fileName)
+
+    def getReference(self, data, roi):
+        i1, i2 = roi[0], roi[1]
+        if len(roi) > 2:
+            imiddle = roi[2]
+        else:
+            imiddle = int(0.5 * (i1 + i2))
+        roiData = data[..., i1:i2]
+        ddict = {}
+        ddict['ROI'] = roiData.sum(axis=-1, dtype=numpy.float64)
+        # the channel of the first occurrence of the extremes
+        ddict['Maximum'] = roiData.argmax(axis=-1) + i1
+        ddict['Minimum'] = roiData.argmin(axis=-1) + i1
+        ddict['Left'] = data[..., i1]
+        ddict['Middle'] = data[..., imiddle]
+        ddict['Right'] = data[..., i2 - 1]
+        ddict['Background'] = 0.5 * (i2 - i1) * (ddict['Left'] + \
+                                                 ddict['Right'])
+        return ddict
+
+    def checkImages(self, imageList, sumonly=False, msg=""):
+        self.assertEqual(len(imageList), len(self._rois))
+        for roi, imageDict in zip(self._rois, imageList):
+            reference = self.getReference(self._data, roi)
+            if sumonly:
+                self.assertEqual(list(imageDict.keys()), ['ROI'])
+            else:
+                self.assertEqual(sorted(imageDict.keys()),
+                                 sorted(self._module.ROI_KEYS))
+            for key in imageDict:
+                self.assertEqual(imageDict[key].shape, reference[key].shape)
+                self.assertTrue(numpy.allclose(imageDict[key],
+                                               reference[key]),
+                                "Incorrect %s image for ROI %s %s" % \
+                                (key, roi, msg))
+
+    def testStackROIImagesImport(self):
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful StackROIImages import")
+
+    def testCalculateROIImages(self):
+        self.testStackROIImagesImport()
+        # the spectra axis at each position, read in several blocks
+        for mcaindex in [2, 1, 0]:
+            data = numpy.rollaxis(self._data, 2, mcaindex).copy()
+            for blocksize in [None, 200, 1]:
+                for nthreads in [None, 2]:
+                    for sumonly in [False, True]:
+                        imageList = self._module.calculateROIImages(data,
+                                                self._rois,
+                                                mcaindex=mcaindex,
+                                                blocksize=blocksize,
+                                                nthreads=nthreads,
+                                                sumonly=sumonly)
+                        self.checkImages(imageList, sumonly=sumonly,
+                            msg="mcaindex = %d blocksize = %s nthreads = %s" \
+                                % (mcaindex, blocksize, nthreads))
+        self.assertEqual(self._module.calculateROIImages(self._data, []), [])
+        for roi in [(5, 5), (-1, 4), (10, 41)]:
+            self.assertRaises(ValueError,
+                              self._module.calculateROIImages,
+                              self._data, [roi])
+
+    def testCalculateROIImagesHDF5(self):
+        self.testStackROIImagesImport()
+        if not HAS_H5PY:
+            print("skipping HDF5 ROI images test, h5py not installed")
+            return
+        fd, self._fileName = tempfile.mkstemp(suffix=".h5")
+        os.close(fd)
+        h5 = h5py.File(self._fileName, "w")
+        try:
+            for mcaindex in [2, 0]:
+                data = numpy.rollaxis(self._data, 2, mcaindex)
+                name = "data_%d" % mcaindex
+                # chunks not aligned with the ROIs
+                h5.create_dataset(name, data=data,
+                                  chunks=(5,) + data.shape[1:])
+                imageList = self._module.calculateROIImages(h5[name],
+                                            self._rois,
+                                            mcaindex=mcaindex,
+                                            blocksize=200)
+                self.checkImages(imageList,
+                                 msg="HDF5 mcaindex = %d" % mcaindex)
+        finally:
+            h5.close()
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testStackROIImages))
+    else:
+        # use a predefined order
+        testSuite.addTest(testStackROIImages("testStackROIImagesImport"))
+        testSuite.addTest(testStackROIImages("testCalculateROIImages"))
+        testSuite.addTest(testStackROIImages("testCalculateROIImagesHDF5"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,291 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import threading
+import gc
+import struct
+import tempfile
+import numpy
+
+def encodePackBits(data):
+    """
+    Simple PackBits encoder of a bytes string
+    """
+    output = []
+    data = numpy.frombuffer(data, numpy.uint8)
+    i = 0
+    while i < data.size:
+        n = 1
+        while (i + n < data.size) and (n < 128) and (data[i + n] == data[i]):
+            n += 1
+        if n > 1:
+            output.append(struct.pack("bB", 1 - n, data[i]))
+        else:
+            n = min(128, data.size - i)
+            output.append(struct.pack("b", n - 1))
+            output.append(data[i:i + n].tobytes())
+        i += n
+    return b"".join(output)
+
+def writePackBitsTiff(fileName, image, rowsPerStrip):
+    """
+    Write a little endian, uint16, PackBits compressed multiple strip TIFF
+    """
+    nRows, nColumns = image.shape
+    image = image.astype('<u2')
+    strips = []
+    for row in range(0, nRows, rowsPerStrip):
+        strips.append(encodePackBits(image[row:row + rowsPerStrip].tobytes()))
+    nStrips = len(strips)
+    nEntries = 9
+    offsetsPosition = 8 + 2 + 12 * nEntries + 4
+    countsPosition = offsetsPosition + 4 * nStrips
+    position = countsPosition + 4 * nStrips
+    stripOffsets = []
+    for strip in strips:
+        stripOffsets.append(position)
+        position += len(strip)
+    entries = [(256, 4, 1, nColumns),
+               (257, 4, 1, nRows),
+               (258, 3, 1, 16),
+               (259, 3, 1, 32773),
+               (262, 3, 1, 1),
+               (273, 4, nStrips, offsetsPosition),
+               (278, 4, 1, rowsPerStrip),
+               (279, 4, nStrips, countsPosition),
+               (339, 3, 1, 1)]
+    fd = open(fileName, 'wb')
+    fd.write(b"II" + struct.pack("<HI", 42, 8))
+    fd.write(struct.pack("<H", nEntries))
+    for entry in entries:
+        fd.write(struct.pack("<HHII", *entry))
+    fd.write(struct.pack("<I", 0))
+    fd.write(struct.pack("<%dI" % nStrips, *stripOffsets))
+    fd.write(struct.pack("<%dI" % nStrips, *[len(x) for x in strips]))
+    for strip in strips:
+        fd.write(strip)
+    fd.close()
+
+class testTiffIO(unittest.TestCase):
+    def setUp(self):
+        """
+        import the module
+        """
+        try:
+            from PyMca5.PyMcaIO import TiffIO
+            self._module = TiffIO
+        except:
+            self._module = None
+        self._tmpFileNames = []
+
+    def tearDown(self):
+        """clean up any possible files"""
+        gc.collect()
+        for fileName in self._tmpFileNames:
+            if os.path.exists(fileName):
+                os.remove(fileName)
+
+    def _getTemporaryFileName(self):
+        tmpFile = tempfile.mkstemp(suffix=".tif", text=False)
+        os.close(tmpFile[0])
+        self._tmpFileNames.append(tmpFile[1])
+        return tmpFile[1]
+
+    def testTiffIOImport(self):
+        #"""Test successful import"""
+        self.assertTrue(self._module is not None,
+                        "Unsuccessful PyMca5.PyMcaIO.TiffIO import")
+
+    def testDecodePackBits(self):
+        data = numpy.array([0, 0, 0, 0, 1, 2, 3, 4, 4, 200, 200, 200],
+                           numpy.uint8).tobytes()
+        # explicit no operation byte in the middle
+        stream = encodePackBits(data[:4]) + b"\x80" + encodePackBits(data[4:])
+        output = numpy.zeros((len(data),), numpy.uint8)
+        n = self._module.decodePackBits(stream, output)
+        self.assertEqual(n, len(data))
+        self.assertEqual(output.tobytes(), data)
+        output = numpy.zeros((len(data) - 1,), numpy.uint8)
+        self.assertRaises(Exception,
+                          self._module.decodePackBits, stream, output)
+
+    def testPackBitsStrips(self):
+        fileName = self._getTemporaryFileName()
+        nRows, nColumns = 37, 23
+        image = numpy.arange(nRows * nColumns).reshape(nRows, nColumns)
+        image[5:12, :] = 7
+        image[20, 3:] = 1000
+        writePackBitsTiff(fileName, image, 5)
+        tif = self._module.TiffIO(fileName)
+        data = tif.getImage(0)
+        self.assertEqual(data.dtype, numpy.uint16)
+        self.assertTrue(numpy.alltrue(data == image),
+                        "Wrong data read from multiple PackBits strips")
+        tif = self._module.TiffIO(fileName, cache_length=0)
+        data = tif.getData(0, rowMin=8, rowMax=21)
+        self.assertTrue(numpy.alltrue(data[8:22] == image[8:22]),
+                        "Wrong row selection from multiple PackBits strips")
+        tif = None
+
+    def testMemoryMap(self):
+        fileName = self._getTemporaryFileName()
+        image = numpy.arange(30 * 40, dtype=numpy.float32).reshape(30, 40)
+        tif = self._module.TiffIO(fileName, mode="wb+")
+        tif.writeImage(image, info={"Title": "1"})
+        tif = None
+        tif = self._module.TiffIO(fileName, memmap=True)
+        data = tif.getImage(0)
+        self.assertTrue(isinstance(data, numpy.memmap))
+        self.assertTrue(numpy.alltrue(data == image))
+        data = None
+        tif = None
+
+    def testTiffArray(self):
+        from PyMca5.PyMcaIO import TiffStack
+        stack = numpy.arange(8 * 5 * 6, dtype=numpy.float32).reshape(8, 5, 6)
+        fileList = []
+        for i in range(4):
+            fileName = self._getTemporaryFileName()
+            tif = self._module.TiffIO(fileName, mode="wb+")
+            tif.writeImage(stack[2 * i], info={"Title": "1"})
+            tif = None
+            tif = self._module.TiffIO(fileName, mode="rb+")
+            tif.writeImage(stack[2 * i + 1], info={"Title": "2"})
+            tif = None
+            fileList.append(fileName)
+        selections = [3, -1, slice(None, None, -3), (slice(1, 7, 2), 2),
+                      (Ellipsis, 4), (slice(2, 4), slice(None), [0, 5]),
+                      (5, 3, 4), [6, 1, 2], (slice(4, 4),)]
+        # a cache smaller than the stack to exercise the frame eviction
+        for imagestack in [True, False]:
+            if imagestack:
+                reference = stack
+            else:
+                reference = numpy.transpose(stack, (1, 2, 0))
+            data = TiffStack.TiffArray(fileList,
+                                       reference.shape,
+                                       reference.dtype,
+                                       imagestack=imagestack,
+                                       cache_size=3 * 5 * 6 * 4)
+            for selection in selections:
+                if not imagestack:
+                    # move the image index to the last position
+                    if not isinstance(selection, tuple):
+                        selection = (selection,)
+                    if selection[0] is Ellipsis:
+                        selection = (slice(None),) * (4 - len(selection)) + \
+                                    selection[1:]
+                    selection = selection + \
+                                (slice(None),) * (3 - len(selection))
+                    selection = selection[1:] + selection[:1]
+                read = data[selection]
+                expected = reference[selection]
+                self.assertEqual(read.shape, expected.shape,
+                                 "Wrong shape for selection %s" % (selection,))
+                self.assertTrue(numpy.alltrue(read == expected),
+                                "Wrong data for selection %s" % (selection,))
+            # modifying the returned data does not modify the cached frames
+            if imagestack:
+                selection = 3
+            else:
+                selection = (Ellipsis, 3)
+            read = data[selection]
+            read[:] = -1
+            self.assertTrue(numpy.alltrue(data[selection] == \
+                                          reference[selection]),
+                            "Cached frame modified")
+        data = None
+
+        # row wise access to a stack larger than the cache only reads
+        # the requested rows
+        readRows = []
+        getData = self._module.TiffIO.getData
+        # the frames prefetched for the previous arrays are not counted
+        oldThreads = [thread for thread in threading.enumerate() \
+                      if thread is not threading.current_thread()]
+        def countingGetData(instance, nImage, **kw):
+            if threading.current_thread() in oldThreads:
+                return getData(instance, nImage, **kw)
+            rowMin = kw.get('rowMin', None)
+            rowMax = kw.get('rowMax', None)
+            if rowMin is None:
+                readRows.append(stack.shape[1])
+            else:
+                readRows.append(rowMax - rowMin + 1)
+            return getData(instance, nImage, **kw)
+        self._module.TiffIO.getData = countingGetData
+        try:
+            for imagestack in [True, False]:
+                if imagestack:
+                    reference = stack
+                else:
+                    reference = numpy.transpose(stack, (1, 2, 0))
+                data = TiffStack.TiffArray(fileList,
+                                           reference.shape,
+                                           reference.dtype,
+                                           imagestack=imagestack,
+                                           cache_size=3 * 5 * 6 * 4)
+                del readRows[:]
+                for row in range(stack.shape[1]):
+                    if imagestack:
+                        selection = (slice(None), row)
+                    else:
+                        selection = (row,)
+                    self.assertTrue(numpy.alltrue(data[selection] == \
+                                                  reference[selection]))
+                self.assertEqual(readRows, [1] * stack.shape[0] * \
+                                                 stack.shape[1])
+                data = None
+        finally:
+            self._module.TiffIO.getData = getData
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testTiffIO))
+    else:
+        # use a predefined order
+        testSuite.addTest(testTiffIO("testTiffIOImport"))
+        testSuite.addTest(testTiffIO("testDecodePackBits"))
+        testSuite.addTest(testTiffIO("testPackBitsStrips"))
+        testSuite.addTest(testTiffIO("testMemoryMap"))
+        testSuite.addTest(testTiffIO("testTiffArray"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,158 @@
+#/*##########################################################################
+#
+# The PyMca X-Ray Fluorescence Toolkit
+#
+# Copyright (c) 2004-2015 European Synchrotron Radiation Facility
+#
+# This file is part of the PyMca X-ray Fluorescence Toolkit developed at
+# the ESRF by the Software group.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+#############################################################################*/
+__author__ = "V. Armando Sole - ESRF Data Analysis"
+__contact__ = "sole@esrf.fr"
+__license__ = "MIT"
+__copyright__ = "European Synchrotron Radiation Facility, Grenoble, France"
+import unittest
+import os
+import gc
+import shutil
+import tempfile
+import numpy
+
+class testXiaEdf(unittest.TestCase):
+    def setUp(self):
+        from PyMca5.PyMcaIO import EdfFile
+        self._tmpDir = tempfile.mkdtemp()
+        numpy.random.seed(1)
+        self._detList = [0, 1, 2, 3]
+        nDet = len(self._detList)
+        nPoints = 30
+        stat = numpy.zeros((nPoints, nDet * 6), numpy.int32)
+        for i, det in enumerate(self._detList):
+            stat[:, i * 6] = det
+            stat[:, i * 6 + 2] = numpy.random.randint(1000, 2000, nPoints)
+            stat[:, i * 6 + 3] = numpy.random.randint(500, 1000, nPoints)
+            stat[:, i * 6 + 4] = numpy.random.randint(900, 1100, nPoints)
+        # null output count rates and livetimes
+        stat[5, 1 * 6 + 3] = 0
+        stat[0, 2 * 6 + 4] = 0
+        stat[10:12, 3 * 6 + 2] = 0
+        self._statFile = os.path.join(self._tmpDir,
+                                      "test_xiast_0000_0000.edf")
+        edf = EdfFile.EdfFile(self._statFile, "wb")
+        edf.WriteImage({"xnb": nDet,
+                        "xdet": " ".join([str(x) for x in self._detList])},
+                       stat)
+        edf = None
+        self._detFiles = []
+        for det in self._detList:
+            fileName = os.path.join(self._tmpDir,
+                                    "test_xia%02d_0000_0000.edf" % det)
+            edf = EdfFile.EdfFile(fileName, "wb")
+            edf.WriteImage({"xdet": det},
+                   numpy.random.randint(0, 100, (nPoints, 64)).astype(numpy.int32))
+            edf = None
+            self._detFiles.append(fileName)
+
+    def tearDown(self):
+        gc.collect()
+        shutil.rmtree(self._tmpDir)
+
+    def testXiaEdfImport(self):
+        from PyMca5.PyMcaCore import XiaEdf
+
+    def testXiaEdfScanFileCorrectArray(self):
+        from PyMca5.PyMcaCore import XiaEdf
+        for deadtime, livetime in [(1, 0), (0, 1), (1, 1)]:
+            xia = XiaEdf.XiaEdfScanFile(self._statFile, self._detFiles)
+            data, headers, message = xia.correctArray(None, deadtime, livetime)
+            self.assertEqual(data.shape, (4, 30, 64))
+            # the same results as correcting the detectors one by one
+            expectedMessage = []
+            for i, det in enumerate(self._detList):
+                xia = XiaEdf.XiaEdfScanFile(self._statFile, self._detFiles)
+                expectedMessage += xia.correct(det, deadtime, livetime)
+                self.assertTrue(numpy.allclose(data[i], xia.data),
+                                "Wrong correction of detector %d" % det)
+            self.assertEqual(message, expectedMessage)
+
+        xia = XiaEdf.XiaEdfScanFile(self._statFile, self._detFiles)
+        sums = [[1, 3], []]
+        data, headers, message = xia.sumArray(sums, 1, 1, 1)
+        for i in range(len(sums)):
+            xia = XiaEdf.XiaEdfScanFile(self._statFile, self._detFiles)
+            xia.sum(sums[i], 1, 1, 1)
+            self.assertTrue(numpy.allclose(data[i], xia.data))
+            self.assertEqual(headers[i]["xdet"], xia.header["xdet"])
+
+    def testXiaCorrectSums(self):
+        from PyMca5.PyMcaIO import EdfFile
+        from PyMca5.PyMcaCore import XiaCorrect
+        # a detector already deadtime corrected
+        edf = EdfFile.EdfFile(self._detFiles[3], "rb")
+        data = edf.GetData(0)
+        edf = None
+        os.remove(self._detFiles[3])
+        edf = EdfFile.EdfFile(self._detFiles[3], "wb")
+        edf.WriteImage({"xdet": 3, "xcorr": 1}, data)
+        edf = None
+        from PyMca5.PyMcaCore import XiaEdf
+        group = [XiaEdf.XiaFilename(name) for name in self._detFiles]
+        group.append(XiaEdf.XiaFilename(self._statFile))
+        outdir = os.path.join(self._tmpDir, "output")
+        os.mkdir(outdir)
+        writer = XiaCorrect.XiaOutputWriter()
+        try:
+            logs, saved, errors = XiaCorrect.correctGroup(group, writer,
+                                        deadtime=1, livetime=0,
+                                        sums=[[1, 3], [0, 1], [2]],
+                                        outdir=outdir)
+        finally:
+            self.assertEqual(writer.close(), [])
+        # only the sum with the corrected detector is not saved
+        self.assertEqual(errors, 1)
+        self.assertEqual(saved, 2)
+        names = sorted(os.listdir(outdir))
+        self.assertEqual(len(names), 2)
+        self.assertTrue("xiaS2" in names[0])
+        self.assertTrue("xiaS3" in names[1])
+        edf = EdfFile.EdfFile(os.path.join(outdir, names[0]), "rb")
+        header = edf.GetHeader(0)
+        edf = None
+        self.assertEqual(header["xdet"], "0 1")
+
+def getSuite(auto=True):
+    testSuite = unittest.TestSuite()
+    if auto:
+        testSuite.addTest(\
+            unittest.TestLoader().loadTestsFromTestCase(testXiaEdf))
+    else:
+        # use a predefined order
+        testSuite.addTest(testXiaEdf("testXiaEdfImport"))
+        testSuite.addTest(testXiaEdf("testXiaEdfScanFileCorrectArray"))
+        testSuite.addTest(testXiaEdf("testXiaCorrectSums"))
+    return testSuite
+
+def test(auto=False):
+    unittest.TextTestRunner(verbosity=2).run(getSuite(auto=auto))
+
+if __name__ == '__main__':
+    test()